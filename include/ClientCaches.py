@@ -10,14 +10,17 @@ import HydrusFileHandling
 import HydrusImageHandling
 import HydrusPaths
 import HydrusSessions
+import heapq
 import itertools
 import os
+import psutil
 import random
 import Queue
 import shutil
 import threading
 import time
 import urllib
+import weakref
 import wx
 import HydrusData
 import ClientData
@@ -28,52 +31,6 @@ import HydrusTags
 import itertools
 import traceback
 
-# important thing here, and reason why it is recursive, is because we want to preserve the parent-grandparent interleaving
-def BuildServiceKeysToChildrenToParents( service_keys_to_simple_children_to_parents ):
-    
-    def AddParents( simple_children_to_parents, children_to_parents, child, parents ):
-        
-        for parent in parents:
-            
-            if parent not in children_to_parents[ child ]:
-                
-                children_to_parents[ child ].append( parent )
-                
-            
-            if parent in simple_children_to_parents:
-                
-                grandparents = simple_children_to_parents[ parent ]
-                
-                AddParents( simple_children_to_parents, children_to_parents, child, grandparents )
-                
-            
-        
-    
-    service_keys_to_children_to_parents = collections.defaultdict( HydrusData.default_dict_list )
-    
-    for ( service_key, simple_children_to_parents ) in service_keys_to_simple_children_to_parents.items():
-        
-        children_to_parents = service_keys_to_children_to_parents[ service_key ]
-        
-        for ( child, parents ) in simple_children_to_parents.items():
-            
-            AddParents( simple_children_to_parents, children_to_parents, child, parents )
-            
-        
-    
-    return service_keys_to_children_to_parents
-    
-def BuildServiceKeysToSimpleChildrenToParents( service_keys_to_pairs_flat ):
-    
-    service_keys_to_simple_children_to_parents = collections.defaultdict( HydrusData.default_dict_set )
-    
-    for ( service_key, pairs ) in service_keys_to_pairs_flat.items():
-        
-        service_keys_to_simple_children_to_parents[ service_key ] = BuildSimpleChildrenToParents( pairs )
-        
-    
-    return service_keys_to_simple_children_to_parents
-    
 def BuildSimpleChildrenToParents( pairs ):
     
     simple_children_to_parents = HydrusData.default_dict_set()
@@ -165,6 +122,37 @@ def CombineTagSiblingPairs( service_keys_to_statuses_to_pairs ):
     
     return processed_siblings
     
+def GetTransitiveParents( simple_children_to_parents, child ):
+    
+    # important thing here, and reason why it is recursive, is because we want to preserve the parent-grandparent interleaving
+    
+    parents = []
+    seen_parents = set()
+    
+    def AddParents( tag ):
+        
+        if tag not in simple_children_to_parents:
+            
+            return
+            
+        
+        for parent in simple_children_to_parents[ tag ]:
+            
+            if parent not in seen_parents:
+                
+                seen_parents.add( parent )
+                
+                parents.append( parent )
+                
+                AddParents( parent )
+                
+            
+        
+    
+    AddParents( child )
+    
+    return parents
+    
 def LoopInSimpleChildrenToParents( simple_children_to_parents, child, parent ):
     
     potential_loop_paths = { parent }
@@ -185,6 +173,174 @@ def LoopInSimpleChildrenToParents( simple_children_to_parents, child, parent ):
     
     return False
     
+class AutocompleteCountsCache( object ):
+    
+    # this lives in the db and caches the tags and counts for non-exact autocomplete searches
+    # keys are ( tag_service_id, file_service_id, there_was_a_namespace, add_namespaceless ), and then the search text
+    # it is read from the db read connections and written to from the main db connection, so the db tells it when a write transaction finishes
+    
+    def __init__( self, max_num_rows ):
+        
+        self._max_num_rows = max_num_rows
+        
+        self._keys_to_results = collections.OrderedDict()
+        self._num_rows = 0
+        
+        self._generation = 0
+        self._transaction_dirty = False
+        
+        self._lock = threading.Lock()
+        
+    
+    def _DeleteResults( self, key ):
+        
+        ( namespace_id_tag_ids, tag_ids, ids_to_tags_and_counts ) = self._keys_to_results[ key ]
+        
+        del self._keys_to_results[ key ]
+        
+        self._num_rows -= len( ids_to_tags_and_counts )
+        
+    
+    def _Invalidate( self, should_delete_callable ):
+        
+        keys_to_delete = [ key for ( key, results ) in self._keys_to_results.items() if should_delete_callable( key, results ) ]
+        
+        for key in keys_to_delete:
+            
+            self._DeleteResults( key )
+            
+        
+        # any search running right now may have seen the db before this write, so it must not be cached
+        
+        self._generation += 1
+        self._transaction_dirty = True
+        
+    
+    def AddResults( self, search_key, search_text, namespace_id_tag_ids, ids_to_tags_and_counts, generation ):
+        
+        with self._lock:
+            
+            if generation != self._generation or self._transaction_dirty:
+                
+                return
+                
+            
+            key = ( search_key, search_text )
+            
+            if key in self._keys_to_results:
+                
+                self._DeleteResults( key )
+                
+            
+            tag_ids = { tag_id for ( namespace_id, tag_id ) in namespace_id_tag_ids }
+            
+            self._keys_to_results[ key ] = ( frozenset( namespace_id_tag_ids ), tag_ids, ids_to_tags_and_counts )
+            
+            self._num_rows += len( ids_to_tags_and_counts )
+            
+            while self._num_rows > self._max_num_rows and len( self._keys_to_results ) > 1:
+                
+                oldest_key = next( iter( self._keys_to_results ) )
+                
+                self._DeleteResults( oldest_key )
+                
+            
+        
+    
+    def Clear( self ):
+        
+        with self._lock:
+            
+            self._keys_to_results = collections.OrderedDict()
+            self._num_rows = 0
+            
+            self._generation += 1
+            self._transaction_dirty = True
+            
+        
+    
+    def GetGeneration( self ):
+        
+        with self._lock:
+            
+            return self._generation
+            
+        
+    
+    def GetTagsAndCounts( self, search_key, search_text, namespace_id_tag_ids, null_namespace_id ):
+        
+        with self._lock:
+            
+            # a longer search text matches a subset of what a shorter one did, so the longest cached prefix that covers all our ids will do
+            
+            for i in range( len( search_text ), 0, -1 ):
+                
+                key = ( search_key, search_text[ : i ] )
+                
+                if key not in self._keys_to_results:
+                    
+                    continue
+                    
+                
+                results = self._keys_to_results[ key ]
+                
+                ( cached_namespace_id_tag_ids, cached_tag_ids, ids_to_tags_and_counts ) = results
+                
+                if not cached_namespace_id_tag_ids.issuperset( namespace_id_tag_ids ):
+                    
+                    continue
+                    
+                
+                # move to the end of the lru order
+                
+                del self._keys_to_results[ key ]
+                
+                self._keys_to_results[ key ] = results
+                
+                if i == len( search_text ):
+                    
+                    return ids_to_tags_and_counts.values()
+                    
+                
+                # namespaceless counts are not in the ids, so let them through on their tag_id
+                
+                tag_ids = { tag_id for ( namespace_id, tag_id ) in namespace_id_tag_ids }
+                
+                return [ tag_and_counts for ( ( namespace_id, tag_id ), tag_and_counts ) in ids_to_tags_and_counts.items() if ( namespace_id, tag_id ) in namespace_id_tag_ids or ( namespace_id == null_namespace_id and tag_id in tag_ids ) ]
+                
+            
+            return None
+            
+        
+    
+    def InvalidateFileService( self, file_service_id ):
+        
+        with self._lock:
+            
+            self._Invalidate( lambda key, results: key[0][1] == file_service_id )
+            
+        
+    
+    def InvalidateTagIds( self, tag_ids ):
+        
+        with self._lock:
+            
+            self._Invalidate( lambda key, results: not results[1].isdisjoint( tag_ids ) )
+            
+        
+    
+    def TransactionFinished( self ):
+        
+        with self._lock:
+            
+            if self._transaction_dirty:
+                
+                self._generation += 1
+                self._transaction_dirty = False
+                
+            
+        
+    
 class ClientFilesManager( object ):
     
     def __init__( self, controller ):
@@ -195,11 +351,50 @@ class ClientFilesManager( object ):
         
         self._prefixes_to_locations = {}
         
+        self._pack_resized_thumbnails = self._controller.GetNewOptions().GetBoolean( 'pack_resized_thumbnails' )
+        
+        self._prefixes_to_packed_thumbnail_stores = {}
+        
         self._bad_error_occured = False
         
         self._Reinit()
         
     
+    def _ClosePackedThumbnailStores( self ):
+        
+        for store in self._prefixes_to_packed_thumbnail_stores.values():
+            
+            store.Close()
+            
+        
+        self._prefixes_to_packed_thumbnail_stores = {}
+        
+    
+    def _DeleteResizedThumbnail( self, hash ):
+        
+        resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
+        
+        HydrusPaths.DeletePath( resized_path )
+        
+        # even with packing off, the store may not have been unpacked yet
+        
+        store = self._GetPackedThumbnailStore( self._GetResizedThumbnailPrefix( hash ) )
+        
+        store.DeleteThumbnails( ( hash, ) )
+        
+    
+    def _FilterOrphanPaths( self, test_type, hashes_and_paths ):
+        
+        if len( hashes_and_paths ) == 0:
+            
+            return []
+            
+        
+        orphan_hashes = set( HydrusGlobals.client_controller.Read( 'filter_orphans', test_type, [ hash for ( hash, path ) in hashes_and_paths ] ) )
+        
+        return [ path for ( hash, path ) in hashes_and_paths if hash in orphan_hashes ]
+        
+    
     def _GenerateExpectedFilePath( self, hash, mime ):
         
         hash_encoded = hash.encode( 'hex' )
@@ -230,7 +425,7 @@ class ClientFilesManager( object ):
         
         hash_encoded = hash.encode( 'hex' )
         
-        prefix = 'r' + hash_encoded[:2]
+        prefix = self._GetResizedThumbnailPrefix( hash )
         
         location = self._prefixes_to_locations[ prefix ]
         
@@ -306,22 +501,22 @@ class ClientFilesManager( object ):
             thumbnail_resized = HydrusFileHandling.GenerateThumbnail( full_size_path, thumbnail_dimensions )
             
         
-        resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
+        self._SaveResizedThumbnail( hash, thumbnail_resized )
         
-        try:
-            
-            with open( resized_path, 'wb' ) as f:
-                
-                f.write( thumbnail_resized )
-                
-            
-        except Exception as e:
+        return thumbnail_resized
+        
+    
+    def _GetPackedThumbnailStore( self, prefix ):
+        
+        if prefix not in self._prefixes_to_packed_thumbnail_stores:
             
-            HydrusData.ShowException( e )
+            location = self._prefixes_to_locations[ prefix ]
             
-            raise HydrusExceptions.FileMissingException( 'The thumbnail for file ' + hash.encode( 'hex' ) + ' was found, but the resized version would not save to disk. This event suggests that hydrus does not have permission to write to its thumbnail folder. Please check everything is ok.' )
+            self._prefixes_to_packed_thumbnail_stores[ prefix ] = ClientFiles.PackedThumbnailStore( os.path.join( location, prefix ) )
             
         
+        return self._prefixes_to_packed_thumbnail_stores[ prefix ]
+        
     
     def _GetRecoverTuple( self ):
         
@@ -487,6 +682,11 @@ class ClientFilesManager( object ):
         return None
         
     
+    def _GetResizedThumbnailPrefix( self, hash ):
+        
+        return 'r' + hash.encode( 'hex' )[:2]
+        
+    
     def _IterateAllFilePaths( self ):
         
         for ( prefix, location ) in self._prefixes_to_locations.items():
@@ -517,6 +717,11 @@ class ClientFilesManager( object ):
                 
                 for filename in filenames:
                     
+                    if filename.endswith( ClientFiles.PackedThumbnailStore.DATA_EXT ) or filename.endswith( ClientFiles.PackedThumbnailStore.INDEX_EXT ):
+                        
+                        continue
+                        
+                    
                     yield os.path.join( dir, filename )
                     
                 
@@ -538,8 +743,60 @@ class ClientFilesManager( object ):
         raise HydrusExceptions.FileMissingException( 'File for ' + hash.encode( 'hex' ) + ' not found!' )
         
     
+    def _PackLooseResizedThumbnails( self, store, hashes_and_thumbnails, loose_paths ):
+        
+        store.AddThumbnails( hashes_and_thumbnails )
+        
+        for path in loose_paths:
+            
+            HydrusPaths.DeletePath( path )
+            
+        
+    
+    def _ReadResizedThumbnail( self, hash ):
+        
+        resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
+        
+        if self._pack_resized_thumbnails:
+            
+            store = self._GetPackedThumbnailStore( self._GetResizedThumbnailPrefix( hash ) )
+            
+            thumbnail = store.GetThumbnail( hash )
+            
+            if thumbnail is None and os.path.exists( resized_path ):
+                
+                # migrate the old loose file as we come across it
+                
+                with open( resized_path, 'rb' ) as f:
+                    
+                    thumbnail = f.read()
+                    
+                
+                store.AddThumbnails( ( ( hash, thumbnail ), ) )
+                
+                HydrusPaths.DeletePath( resized_path )
+                
+            
+            return thumbnail
+            
+        else:
+            
+            if os.path.exists( resized_path ):
+                
+                with open( resized_path, 'rb' ) as f:
+                    
+                    return f.read()
+                    
+                
+            
+            return None
+            
+        
+    
     def _Reinit( self ):
         
+        self._ClosePackedThumbnailStores()
+        
         self._prefixes_to_locations = self._controller.Read( 'client_files_locations' )
         
         missing = set()
@@ -578,6 +835,36 @@ class ClientFilesManager( object ):
             
         
     
+    def _SaveResizedThumbnail( self, hash, thumbnail ):
+        
+        resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
+        
+        try:
+            
+            if self._pack_resized_thumbnails:
+                
+                store = self._GetPackedThumbnailStore( self._GetResizedThumbnailPrefix( hash ) )
+                
+                store.AddThumbnails( ( ( hash, thumbnail ), ) )
+                
+                HydrusPaths.DeletePath( resized_path )
+                
+            else:
+                
+                with open( resized_path, 'wb' ) as f:
+                    
+                    f.write( thumbnail )
+                    
+                
+            
+        except Exception as e:
+            
+            HydrusData.ShowException( e )
+            
+            raise HydrusExceptions.FileMissingException( 'The thumbnail for file ' + hash.encode( 'hex' ) + ' was found, but the resized version would not save to disk. This event suggests that hydrus does not have permission to write to its thumbnail folder. Please check everything is ok.' )
+            
+        
+    
     def LocklessAddFile( self, hash, mime, source_path ):
         
         dest_path = self._GenerateExpectedFilePath( hash, mime )
@@ -630,6 +917,8 @@ class ClientFilesManager( object ):
             orphan_paths = []
             orphan_thumbnails = []
             
+            hashes_and_paths = []
+            
             for ( i, path ) in enumerate( self._IterateAllFilePaths() ):
                 
                 ( i_paused, should_quit ) = job_key.WaitIfNeeded()
@@ -648,29 +937,35 @@ class ClientFilesManager( object ):
                 
                 try:
                     
-                    is_an_orphan = False
-                    
                     ( directory, filename ) = os.path.split( path )
                     
                     should_be_a_hex_hash = filename[:64]
                     
                     hash = should_be_a_hex_hash.decode( 'hex' )
                     
-                    is_an_orphan = HydrusGlobals.client_controller.Read( 'is_an_orphan', 'file', hash )
-                    
                 except:
                     
-                    is_an_orphan = True
+                    orphan_paths.append( path )
+                    
+                    continue
                     
                 
-                if is_an_orphan:
+                hashes_and_paths.append( ( hash, path ) )
+                
+                if len( hashes_and_paths ) >= 256:
                     
-                    orphan_paths.append( path )
+                    orphan_paths.extend( self._FilterOrphanPaths( 'file', hashes_and_paths ) )
+                    
+                    hashes_and_paths = []
                     
                 
             
+            orphan_paths.extend( self._FilterOrphanPaths( 'file', hashes_and_paths ) )
+            
             time.sleep( 2 )
             
+            hashes_and_paths = []
+            
             for ( i, path ) in enumerate( self._IterateAllThumbnailPaths() ):
                 
                 ( i_paused, should_quit ) = job_key.WaitIfNeeded()
@@ -689,27 +984,54 @@ class ClientFilesManager( object ):
                 
                 try:
                     
-                    is_an_orphan = False
-                    
                     ( directory, filename ) = os.path.split( path )
                     
                     should_be_a_hex_hash = filename[:64]
                     
                     hash = should_be_a_hex_hash.decode( 'hex' )
                     
-                    is_an_orphan = HydrusGlobals.client_controller.Read( 'is_an_orphan', 'thumbnail', hash )
-                    
                 except:
                     
-                    is_an_orphan = True
+                    orphan_thumbnails.append( path )
+                    
+                    continue
                     
                 
-                if is_an_orphan:
+                hashes_and_paths.append( ( hash, path ) )
+                
+                if len( hashes_and_paths ) >= 256:
                     
-                    orphan_thumbnails.append( path )
+                    orphan_thumbnails.extend( self._FilterOrphanPaths( 'thumbnail', hashes_and_paths ) )
+                    
+                    hashes_and_paths = []
+                    
+                
+            
+            orphan_thumbnails.extend( self._FilterOrphanPaths( 'thumbnail', hashes_and_paths ) )
+            
+            prefixes_to_orphan_packed_hashes = collections.defaultdict( list )
+            
+            resized_prefixes = [ prefix for prefix in self._prefixes_to_locations if prefix.startswith( 'r' ) ]
+            
+            for prefix in resized_prefixes:
+                
+                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                
+                if should_quit:
+                    
+                    return
+                    
+                
+                store = self._GetPackedThumbnailStore( prefix )
+                
+                for hashes in HydrusData.SplitListIntoChunks( list( store.GetHashes() ), 256 ):
+                    
+                    prefixes_to_orphan_packed_hashes[ prefix ].extend( HydrusGlobals.client_controller.Read( 'filter_orphans', 'thumbnail', hashes ) )
                     
                 
             
+            num_orphan_packed_thumbnails = sum( ( len( hashes ) for hashes in prefixes_to_orphan_packed_hashes.values() ) )
+            
             time.sleep( 2 )
             
             if len( orphan_paths ) > 0:
@@ -801,13 +1123,29 @@ class ClientFilesManager( object ):
                     
                 
             
-            if len( orphan_paths ) == 0 and len( orphan_thumbnails ) == 0:
+            if num_orphan_packed_thumbnails > 0:
+                
+                status = 'found ' + HydrusData.ConvertIntToPrettyString( num_orphan_packed_thumbnails ) + ' orphan packed thumbnails, now deleting'
+                
+                job_key.SetVariable( 'popup_text_1', status )
+                
+                for ( prefix, hashes ) in prefixes_to_orphan_packed_hashes.items():
+                    
+                    HydrusData.Print( 'Deleting ' + HydrusData.ConvertIntToPrettyString( len( hashes ) ) + ' orphan packed thumbnails from ' + prefix )
+                    
+                    self._GetPackedThumbnailStore( prefix ).DeleteThumbnails( hashes )
+                    
+                
+            
+            num_orphan_thumbnails = len( orphan_thumbnails ) + num_orphan_packed_thumbnails
+            
+            if len( orphan_paths ) == 0 and num_orphan_thumbnails == 0:
                 
                 final_text = 'no orphans found!'
                 
             else:
                 
-                final_text = HydrusData.ConvertIntToPrettyString( len( orphan_paths ) ) + ' orphan files and ' + HydrusData.ConvertIntToPrettyString( len( orphan_thumbnails ) ) + ' orphan thumbnails cleared!'
+                final_text = HydrusData.ConvertIntToPrettyString( len( orphan_paths ) ) + ' orphan files and ' + HydrusData.ConvertIntToPrettyString( num_orphan_thumbnails ) + ' orphan thumbnails cleared!'
                 
             
             job_key.SetVariable( 'popup_text_1', final_text )
@@ -848,10 +1186,10 @@ class ClientFilesManager( object ):
             for hash in hashes:
                 
                 path = self._GenerateExpectedFullSizeThumbnailPath( hash )
-                resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
                 
                 HydrusPaths.DeletePath( path )
-                HydrusPaths.DeletePath( resized_path )
+                
+                self._DeleteResizedThumbnail( hash )
                 
             
         
@@ -864,11 +1202,29 @@ class ClientFilesManager( object ):
             
         
     
-    def ImportFile( self, *args, **kwargs ):
+    def ImportFile( self, file_import_job ):
+        
+        self.ImportFiles( ( file_import_job, ) )
+        
+        return file_import_job.GetResult()
+        
+    
+    def ImportFiles( self, file_import_jobs ):
+        
+        # the cpu work is done in parallel before we take the lock, so the db only has to do the quick inserts, all in one go
+        
+        ClientFiles.PrepareFileImportJobs( file_import_jobs )
+        
+        file_import_jobs = [ file_import_job for file_import_job in file_import_jobs if not file_import_job.Failed() ]
+        
+        if len( file_import_jobs ) == 0:
+            
+            return
+            
         
         with self._lock:
             
-            return self._controller.WriteSynchronous( 'import_file', *args, **kwargs )
+            self._controller.WriteSynchronous( 'import_files', file_import_jobs )
             
         
     
@@ -913,18 +1269,54 @@ class ClientFilesManager( object ):
             
         
     
-    def GetResizedThumbnailPath( self, hash ):
+    def GetResizedThumbnail( self, hash ):
         
         with self._lock:
             
-            path = self._GenerateExpectedResizedThumbnailPath( hash )
+            thumbnail = self._ReadResizedThumbnail( hash )
             
-            if not os.path.exists( path ):
+            if thumbnail is None:
                 
-                self._GenerateResizedThumbnail( hash )
+                thumbnail = self._GenerateResizedThumbnail( hash )
                 
             
-            return path
+            return thumbnail
+            
+        
+    
+    def GetResizedThumbnails( self, hashes ):
+        
+        # this only fetches what is already on disk, so a whole page can come out of the packs in one sweep
+        # anything missing is left for GetResizedThumbnail to generate
+        
+        with self._lock:
+            
+            hashes_to_thumbnails = {}
+            
+            if self._pack_resized_thumbnails:
+                
+                prefixes_to_hashes = HydrusData.BuildKeyToListDict( ( ( self._GetResizedThumbnailPrefix( hash ), hash ) for hash in hashes ) )
+                
+                for ( prefix, prefix_hashes ) in prefixes_to_hashes.items():
+                    
+                    hashes_to_thumbnails.update( self._GetPackedThumbnailStore( prefix ).GetThumbnails( prefix_hashes ) )
+                    
+                
+            
+            for hash in hashes:
+                
+                if hash not in hashes_to_thumbnails:
+                    
+                    thumbnail = self._ReadResizedThumbnail( hash )
+                    
+                    if thumbnail is not None:
+                        
+                        hashes_to_thumbnails[ hash ] = thumbnail
+                        
+                    
+                
+            
+            return hashes_to_thumbnails
             
         
     
@@ -938,6 +1330,136 @@ class ClientFilesManager( object ):
             
         
     
+    def MaintainResizedThumbnails( self, partial = True, stop_time = None ):
+        
+        # with packing on, this moves old loose resized thumbnails into the packs and compacts them
+        # with it off, it unpacks them back to loose files
+        
+        if self._bad_error_occured:
+            
+            return
+            
+        
+        with self._lock:
+            
+            resized_prefixes = [ prefix for prefix in self._prefixes_to_locations if prefix.startswith( 'r' ) ]
+            
+            resized_prefixes.sort()
+            
+            for prefix in resized_prefixes:
+                
+                if stop_time is not None and HydrusData.TimeHasPassed( stop_time ):
+                    
+                    return
+                    
+                
+                store = self._GetPackedThumbnailStore( prefix )
+                
+                dir = os.path.join( self._prefixes_to_locations[ prefix ], prefix )
+                
+                did_work = False
+                
+                if self._pack_resized_thumbnails:
+                    
+                    # the loose thumbnails go in a few hundred at a time, so a big directory is never all in memory at once
+                    
+                    hashes_and_thumbnails = []
+                    loose_paths = []
+                    num_bytes = 0
+                    
+                    for filename in os.listdir( dir ):
+                        
+                        if not filename.endswith( '.thumbnail.resized' ):
+                            
+                            continue
+                            
+                        
+                        path = os.path.join( dir, filename )
+                        
+                        try:
+                            
+                            hash = filename[:64].decode( 'hex' )
+                            
+                            with open( path, 'rb' ) as f:
+                                
+                                thumbnail = f.read()
+                                
+                            
+                        except:
+                            
+                            continue
+                            
+                        
+                        hashes_and_thumbnails.append( ( hash, thumbnail ) )
+                        loose_paths.append( path )
+                        num_bytes += len( thumbnail )
+                        
+                        if len( hashes_and_thumbnails ) >= 256 or num_bytes >= 16 * 1048576:
+                            
+                            self._PackLooseResizedThumbnails( store, hashes_and_thumbnails, loose_paths )
+                            
+                            hashes_and_thumbnails = []
+                            loose_paths = []
+                            num_bytes = 0
+                            
+                            did_work = True
+                            
+                        
+                    
+                    if len( hashes_and_thumbnails ) > 0:
+                        
+                        self._PackLooseResizedThumbnails( store, hashes_and_thumbnails, loose_paths )
+                        
+                        did_work = True
+                        
+                    
+                    if store.NeedsCompaction():
+                        
+                        store.Compact()
+                        
+                        did_work = True
+                        
+                    
+                else:
+                    
+                    hashes = store.GetHashes()
+                    
+                    if len( hashes ) > 0:
+                        
+                        hashes_to_thumbnails = store.GetThumbnails( hashes )
+                        
+                        for ( hash, thumbnail ) in hashes_to_thumbnails.items():
+                            
+                            resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
+                            
+                            if not os.path.exists( resized_path ):
+                                
+                                with open( resized_path, 'wb' ) as f:
+                                    
+                                    f.write( thumbnail )
+                                    
+                                
+                            
+                        
+                        did_work = True
+                        
+                    
+                    store.DeleteStore()
+                    
+                
+                if did_work:
+                    
+                    HydrusData.Print( 'Maintained the resized thumbnails in ' + dir )
+                    
+                    if partial:
+                        
+                        return
+                        
+                    
+                
+            
+        
+    
     def Rebalance( self, partial = True, stop_time = None ):
         
         if self._bad_error_occured:
@@ -965,6 +1487,8 @@ class ClientFilesManager( object ):
                     HydrusData.ShowText( text )
                     
                 
+                self._ClosePackedThumbnailStores()
+                
                 # these two lines can cause a deadlock because the db sometimes calls stuff in here.
                 self._controller.Write( 'relocate_client_files', prefix, overweight_location, underweight_location )
                 
@@ -1004,6 +1528,8 @@ class ClientFilesManager( object ):
                 recoverable_path = os.path.join( recoverable_location, prefix )
                 correct_path = os.path.join( correct_location, prefix )
                 
+                self._ClosePackedThumbnailStores()
+                
                 HydrusPaths.MergeTree( recoverable_path, correct_path )
                 
                 if partial:
@@ -1030,7 +1556,7 @@ class ClientFilesManager( object ):
         
         with self._lock:
             
-            self._GenerateResizedThumbnail( hash )
+            return self._GenerateResizedThumbnail( hash )
             
         
     
@@ -1086,12 +1612,7 @@ class ClientFilesManager( object ):
                         
                         self._GenerateFullSizeThumbnail( hash )
                         
-                        thumbnail_resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
-                        
-                        if os.path.exists( thumbnail_resized_path ):
-                            
-                            HydrusPaths.DeletePath( thumbnail_resized_path )
-                            
+                        self._DeleteResizedThumbnail( hash )
                         
                     
                 except:
@@ -1120,15 +1641,28 @@ class ClientFilesManager( object ):
     
 class DataCache( object ):
     
-    def __init__( self, controller, cache_size ):
+    # an lru keyed on insertion order, so touching, adding and evicting are all o(1)
+    # the segmented variant splits the cache into a probationary part for things seen once and a protected part for things seen again, so one long scroll through new files cannot push out everything you keep coming back to
+    
+    PROTECTED_FRACTION = 0.8
+    
+    def __init__( self, controller, cache_size, segmented = False ):
         
         self._controller = controller
         self._cache_size = cache_size
+        self._segmented = segmented
+        
+        # key -> ( data, estimated_memory_footprint, last_access_time )
         
-        self._keys_to_data = {}
-        self._keys_fifo = []
+        self._probationary = collections.OrderedDict()
+        self._protected = collections.OrderedDict()
         
         self._total_estimated_memory_footprint = 0
+        self._protected_estimated_memory_footprint = 0
+        
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
         
         self._lock = threading.Lock()
         
@@ -1137,80 +1671,115 @@ class DataCache( object ):
     
     def _DeleteItem( self ):
         
-        ( deletee_key, last_access_time ) = self._keys_fifo.pop( 0 )
-        
-        deletee_data = self._keys_to_data[ deletee_key ]
+        if len( self._probationary ) > 0:
+            
+            ( deletee_key, ( deletee_data, size, last_access_time ) ) = self._probationary.popitem( last = False )
+            
+        else:
+            
+            ( deletee_key, ( deletee_data, size, last_access_time ) ) = self._protected.popitem( last = False )
+            
+            self._protected_estimated_memory_footprint -= size
+            
         
-        del self._keys_to_data[ deletee_key ]
+        self._total_estimated_memory_footprint -= size
         
-        self._RecalcMemoryUsage()
+        self._evictions += 1
         
     
-    def _RecalcMemoryUsage( self ):
+    def _GetData( self, key ):
         
-        self._total_estimated_memory_footprint = sum( ( data.GetEstimatedMemoryFootprint() for data in self._keys_to_data.values() ) )
+        now = HydrusData.GetNow()
         
-    
-    def _TouchKey( self, key ):
-    
-        for ( i, ( fifo_key, last_access_time ) ) in enumerate( self._keys_fifo ):
+        if key in self._protected:
+            
+            ( data, size, last_access_time ) = self._protected.pop( key )
             
-            if fifo_key == key:
+            self._protected[ key ] = ( data, size, now )
+            
+        else:
+            
+            ( data, size, last_access_time ) = self._probationary.pop( key )
+            
+            if self._segmented:
+                
+                self._protected[ key ] = ( data, size, now )
+                
+                self._protected_estimated_memory_footprint += size
+                
+                max_protected_size = self._cache_size * self.PROTECTED_FRACTION
+                
+                while self._protected_estimated_memory_footprint > max_protected_size and len( self._protected ) > 1:
+                    
+                    ( demotee_key, demotee_value ) = self._protected.popitem( last = False )
+                    
+                    self._probationary[ demotee_key ] = demotee_value
+                    
+                    ( demotee_data, demotee_size, demotee_last_access_time ) = demotee_value
+                    
+                    self._protected_estimated_memory_footprint -= demotee_size
+                    
                 
-                del self._keys_fifo[ i ]
+            else:
                 
-                break
+                self._probationary[ key ] = ( data, size, now )
                 
             
         
-        self._keys_fifo.append( ( key, HydrusData.GetNow() ) )
+        return data
         
     
-    def Clear( self ):
+    def _HasData( self, key ):
         
-        with self._lock:
-            
-            self._keys_to_data = {}
-            self._keys_fifo = []
-            
-            self._total_estimated_memory_footprint = 0
-            
+        return key in self._probationary or key in self._protected
         
     
     def AddData( self, key, data ):
         
         with self._lock:
             
-            if key not in self._keys_to_data:
+            if not self._HasData( key ):
                 
-                options = self._controller.GetOptions()
+                size = data.GetEstimatedMemoryFootprint()
                 
-                while self._total_estimated_memory_footprint > self._cache_size:
+                while self._total_estimated_memory_footprint + size > self._cache_size and self._total_estimated_memory_footprint > 0:
                     
                     self._DeleteItem()
                     
                 
-                self._keys_to_data[ key ] = data
+                self._probationary[ key ] = ( data, size, HydrusData.GetNow() )
                 
-                self._keys_fifo.append( ( key, HydrusData.GetNow() ) )
-                
-                self._RecalcMemoryUsage()
+                self._total_estimated_memory_footprint += size
                 
             
         
     
+    def Clear( self ):
+        
+        with self._lock:
+            
+            self._probationary = collections.OrderedDict()
+            self._protected = collections.OrderedDict()
+            
+            self._total_estimated_memory_footprint = 0
+            self._protected_estimated_memory_footprint = 0
+            
+        
+    
     def GetData( self, key ):
         
         with self._lock:
             
-            if key not in self._keys_to_data:
+            if not self._HasData( key ):
+                
+                self._misses += 1
                 
                 raise Exception( 'Cache error! Looking for ' + HydrusData.ToUnicode( key ) + ', but it was missing.' )
                 
             
-            self._TouchKey( key )
+            self._hits += 1
             
-            return self._keys_to_data[ key ]
+            return self._GetData( key )
             
         
     
@@ -1218,24 +1787,36 @@ class DataCache( object ):
         
         with self._lock:
             
-            if key in self._keys_to_data:
+            if self._HasData( key ):
                 
-                self._TouchKey( key )
+                self._hits += 1
                 
-                return self._keys_to_data[ key ]
+                return self._GetData( key )
                 
             else:
                 
+                self._misses += 1
+                
                 return None
                 
             
         
     
+    def GetStats( self ):
+        
+        with self._lock:
+            
+            num_items = len( self._probationary ) + len( self._protected )
+            
+            return ( num_items, self._total_estimated_memory_footprint, self._hits, self._misses, self._evictions )
+            
+        
+    
     def HasData( self, key ):
         
         with self._lock:
             
-            return key in self._keys_to_data
+            return self._HasData( key )
             
         
     
@@ -1243,19 +1824,24 @@ class DataCache( object ):
         
         with self._lock:
             
-            while True:
+            for segment in ( self._probationary, self._protected ):
                 
-                if len( self._keys_fifo ) == 0:
-                    
-                    break
-                    
-                else:
+                while len( segment ) > 0:
                     
-                    ( key, last_access_time ) = self._keys_fifo[ 0 ]
+                    ( key, ( data, size, last_access_time ) ) = next( segment.iteritems() )
                     
                     if HydrusData.TimeHasPassed( last_access_time + 1200 ):
                         
-                        self._DeleteItem()
+                        del segment[ key ]
+                        
+                        if segment is self._protected:
+                            
+                            self._protected_estimated_memory_footprint -= size
+                            
+                        
+                        self._total_estimated_memory_footprint -= size
+                        
+                        self._evictions += 1
                         
                     else:
                         
@@ -1268,44 +1854,125 @@ class DataCache( object ):
         wx.CallLater( 60 * 1000, self.MaintainCache )
         
     
-class LocalBooruCache( object ):
+class IdsToStringsCache( object ):
     
-    def __init__( self, controller ):
-        
-        self._controller = controller
-        
-        self._lock = threading.Lock()
-        
-        self._RefreshShares()
-        
-        self._controller.sub( self, 'RefreshShares', 'refresh_local_booru_shares' )
-        self._controller.sub( self, 'RefreshShares', 'restart_booru' )
-        
+    # this lives in the db and remembers what namespace and tag ids mean, so media results do not have to join against the master tables every time
+    # ids never change meaning once committed, but an id made in a transaction that is rolled back can be reused, so those are not cached until the transaction is done
     
-    def _CheckDataUsage( self ):
+    def __init__( self, max_num_strings ):
         
-        info = self._local_booru_service.GetInfo()
+        self._max_num_strings = max_num_strings
         
-        max_monthly_data = info[ 'max_monthly_data' ]
-        used_monthly_data = info[ 'used_monthly_data' ]
+        self._ids_to_strings = {}
+        self._uncommitted_ids = set()
         
-        if max_monthly_data is not None and used_monthly_data > max_monthly_data: raise HydrusExceptions.ForbiddenException( 'This booru has used all its monthly data. Please try again next month.' )
+        self._lock = threading.Lock()
         
     
-    def _CheckFileAuthorised( self, share_key, hash ):
+    def AddStrings( self, ids_to_strings ):
         
-        self._CheckShareAuthorised( share_key )
+        with self._lock:
+            
+            if len( self._ids_to_strings ) + len( ids_to_strings ) > self._max_num_strings:
+                
+                self._ids_to_strings = {}
+                
+            
+            for ( id, string ) in ids_to_strings.items():
+                
+                if id not in self._uncommitted_ids:
+                    
+                    self._ids_to_strings[ id ] = string
+                    
+                
+            
         
-        info = self._GetInfo( share_key )
+    
+    def Clear( self ):
         
-        if hash not in info[ 'hashes_set' ]: raise HydrusExceptions.NotFoundException( 'That file was not found in that share.' )
+        with self._lock:
+            
+            self._ids_to_strings = {}
+            
         
     
-    def _CheckShareAuthorised( self, share_key ):
+    def GetStrings( self, ids ):
         
-        self._CheckDataUsage()
+        ids_to_strings = {}
+        missing_ids = set()
         
-        info = self._GetInfo( share_key )
+        with self._lock:
+            
+            for id in ids:
+                
+                if id in self._ids_to_strings:
+                    
+                    ids_to_strings[ id ] = self._ids_to_strings[ id ]
+                    
+                else:
+                    
+                    missing_ids.add( id )
+                    
+                
+            
+        
+        return ( ids_to_strings, missing_ids )
+        
+    
+    def IdCreated( self, id ):
+        
+        with self._lock:
+            
+            self._uncommitted_ids.add( id )
+            
+        
+    
+    def TransactionFinished( self ):
+        
+        with self._lock:
+            
+            self._uncommitted_ids = set()
+            
+        
+    
+class LocalBooruCache( object ):
+    
+    def __init__( self, controller ):
+        
+        self._controller = controller
+        
+        self._lock = threading.Lock()
+        
+        self._RefreshShares()
+        
+        self._controller.sub( self, 'RefreshShares', 'refresh_local_booru_shares' )
+        self._controller.sub( self, 'RefreshShares', 'restart_booru' )
+        
+    
+    def _CheckDataUsage( self ):
+        
+        info = self._local_booru_service.GetInfo()
+        
+        max_monthly_data = info[ 'max_monthly_data' ]
+        used_monthly_data = info[ 'used_monthly_data' ]
+        
+        if max_monthly_data is not None and used_monthly_data > max_monthly_data: raise HydrusExceptions.ForbiddenException( 'This booru has used all its monthly data. Please try again next month.' )
+        
+    
+    def _CheckFileAuthorised( self, share_key, hash ):
+        
+        self._CheckShareAuthorised( share_key )
+        
+        info = self._GetInfo( share_key )
+        
+        if hash not in info[ 'hashes_set' ]: raise HydrusExceptions.NotFoundException( 'That file was not found in that share.' )
+        
+    
+    def _CheckShareAuthorised( self, share_key ):
+        
+        self._CheckDataUsage()
+        
+        info = self._GetInfo( share_key )
         
         timeout = info[ 'timeout' ]
         
@@ -1473,6 +2140,231 @@ class HydrusSessionManager( object ):
             
         
     
+class MediaResultCache( object ):
+    
+    # this lives in the db and hands out the same media result for a file to every page and search that asks for it
+    # only weak references are kept, so a media result is forgotten as soon as nothing is looking at it
+    # the shared results are kept up to date here, once per update, rather than once per page
+    # anything the db writes that the pubsubs may not describe marks the files stale when the transaction is done, so the next read rebuilds them in place
+    
+    def __init__( self, controller ):
+        
+        self._controller = controller
+        
+        self._hash_ids_to_media_results = weakref.WeakValueDictionary()
+        self._hashes_to_media_results = weakref.WeakValueDictionary()
+        
+        self._stale_hashes = set()
+        
+        self._pending_stale_hashes = set()
+        self._pending_invalidate_all = False
+        self._pending_new_generation = False
+        
+        # bumped whenever files go stale, so a read that started before then knows its rows may be older than what is cached
+        
+        self._generation = 0
+        
+        self._lock = threading.Lock()
+        
+        self._controller.sub( self, 'ProcessContentUpdates', 'content_updates_data' )
+        self._controller.sub( self, 'ProcessServiceUpdates', 'service_updates_data' )
+        
+    
+    def AddMediaResults( self, generation, hash_ids_to_media_results ):
+        
+        with self._lock:
+            
+            read_is_current = generation == self._generation
+            
+            hash_ids_to_canonical_media_results = {}
+            
+            for ( hash_id, media_result ) in hash_ids_to_media_results.items():
+                
+                hash = media_result.GetHash()
+                
+                existing_media_result = self._hash_ids_to_media_results.get( hash_id )
+                
+                if existing_media_result is None:
+                    
+                    self._hash_ids_to_media_results[ hash_id ] = media_result
+                    self._hashes_to_media_results[ hash ] = media_result
+                    
+                    if read_is_current:
+                        
+                        self._stale_hashes.discard( hash )
+                        
+                    else:
+                        
+                        self._stale_hashes.add( hash )
+                        
+                    
+                    hash_ids_to_canonical_media_results[ hash_id ] = media_result
+                    
+                else:
+                    
+                    if read_is_current and hash in self._stale_hashes:
+                        
+                        existing_media_result.Refresh( media_result )
+                        
+                        self._stale_hashes.discard( hash )
+                        
+                    
+                    hash_ids_to_canonical_media_results[ hash_id ] = existing_media_result
+                    
+                
+            
+            return hash_ids_to_canonical_media_results
+            
+        
+    
+    def ContentUpdated( self, service_keys_to_content_updates, will_be_published = False ):
+        
+        # published updates come back through content_updates_data and are applied to the cached files in place, so only the generation has to move on
+        
+        with self._lock:
+            
+            for content_updates in service_keys_to_content_updates.values():
+                
+                for content_update in content_updates:
+                    
+                    ( data_type, action, row ) = content_update.ToTuple()
+                    
+                    hashes = content_update.GetHashes()
+                    
+                    if len( hashes ) == 0 and data_type in ( HC.CONTENT_TYPE_FILES, HC.CONTENT_TYPE_MAPPINGS ):
+                        
+                        # an advanced update that touches who knows which files
+                        
+                        self._pending_invalidate_all = True
+                        
+                    elif will_be_published:
+                        
+                        self._pending_new_generation = True
+                        
+                    else:
+                        
+                        self._pending_stale_hashes.update( hashes )
+                        
+                    
+                
+            
+        
+    
+    def GetGeneration( self ):
+        
+        with self._lock:
+            
+            return self._generation
+            
+        
+    
+    def GetMediaResults( self, hash_ids ):
+        
+        hash_ids_to_media_results = {}
+        missing_hash_ids = set()
+        
+        with self._lock:
+            
+            for hash_id in hash_ids:
+                
+                media_result = self._hash_ids_to_media_results.get( hash_id )
+                
+                if media_result is None or media_result.GetHash() in self._stale_hashes:
+                    
+                    missing_hash_ids.add( hash_id )
+                    
+                else:
+                    
+                    hash_ids_to_media_results[ hash_id ] = media_result
+                    
+                
+            
+        
+        return ( hash_ids_to_media_results, missing_hash_ids )
+        
+    
+    def InvalidateAll( self ):
+        
+        with self._lock:
+            
+            self._pending_invalidate_all = True
+            
+        
+    
+    def ProcessContentUpdates( self, service_keys_to_content_updates ):
+        
+        with self._lock:
+            
+            for ( service_key, content_updates ) in service_keys_to_content_updates.items():
+                
+                for content_update in content_updates:
+                    
+                    for hash in content_update.GetHashes():
+                        
+                        media_result = self._hashes_to_media_results.get( hash )
+                        
+                        if media_result is not None:
+                            
+                            media_result.ProcessContentUpdate( service_key, content_update )
+                            
+                        
+                    
+                
+            
+        
+    
+    def ProcessServiceUpdates( self, service_keys_to_service_updates ):
+        
+        with self._lock:
+            
+            for ( service_key, service_updates ) in service_keys_to_service_updates.items():
+                
+                for service_update in service_updates:
+                    
+                    ( action, row ) = service_update.ToTuple()
+                    
+                    if action == HC.SERVICE_UPDATE_DELETE_PENDING:
+                        
+                        for media_result in self._hashes_to_media_results.values(): media_result.DeletePending( service_key )
+                        
+                    elif action == HC.SERVICE_UPDATE_RESET:
+                        
+                        for media_result in self._hashes_to_media_results.values(): media_result.ResetService( service_key )
+                        
+                    
+                
+            
+        
+    
+    def TransactionFinished( self ):
+        
+        with self._lock:
+            
+            if self._pending_invalidate_all:
+                
+                self._stale_hashes = set( self._hashes_to_media_results.keys() )
+                
+                self._generation += 1
+                
+            elif len( self._pending_stale_hashes ) > 0:
+                
+                self._stale_hashes = { hash for hash in self._stale_hashes if hash in self._hashes_to_media_results }
+                
+                self._stale_hashes.update( ( hash for hash in self._pending_stale_hashes if hash in self._hashes_to_media_results ) )
+                
+                self._generation += 1
+                
+            elif self._pending_new_generation:
+                
+                self._generation += 1
+                
+            
+            self._pending_stale_hashes = set()
+            self._pending_invalidate_all = False
+            self._pending_new_generation = False
+            
+        
+    
 class MenuEventIdToActionCache( object ):
     
     def __init__( self ):
@@ -1578,7 +2470,9 @@ class RenderedImageCache( object ):
         
         cache_size = options[ 'fullscreen_cache_size' ]
         
-        self._data_cache = DataCache( self._controller, cache_size )
+        segmented = self._controller.GetNewOptions().GetBoolean( 'segmented_media_caches' )
+        
+        self._data_cache = DataCache( self._controller, cache_size, segmented = segmented )
         
     
     def Clear( self ): self._data_cache.Clear()
@@ -1622,6 +2516,11 @@ class RenderedImageCache( object ):
         return image_container
         
     
+    def GetStats( self ):
+        
+        return self._data_cache.GetStats()
+        
+    
     def HasImage( self, hash, target_resolution ):
         
         key = ( hash, target_resolution )
@@ -1631,6 +2530,8 @@ class RenderedImageCache( object ):
     
 class ThumbnailCache( object ):
     
+    WATERFALL_BATCH_SIZE = 8
+    
     def __init__( self, controller ):
         
         self._controller = controller
@@ -1639,42 +2540,46 @@ class ThumbnailCache( object ):
         
         cache_size = options[ 'thumbnail_cache_size' ]
         
-        self._data_cache = DataCache( self._controller, cache_size )
+        segmented = self._controller.GetNewOptions().GetBoolean( 'segmented_media_caches' )
+        
+        self._data_cache = DataCache( self._controller, cache_size, segmented = segmented )
         self._client_files_manager = self._controller.GetClientFilesManager()
         
         self._lock = threading.Lock()
         
-        self._waterfall_queue_quick = set()
-        self._waterfall_queue_random = []
+        # a heap of [ priority, newest call first, random, ( page_key, media ) ] entries
+        # cancelling just forgets the entry, and the workers skip anything no longer in the dict when they pop it
         
-        self._waterfall_event = threading.Event()
+        self._waterfall_queue = []
+        self._waterfall_queue_entries = {}
+        self._waterfall_call_index = 0
+        
+        self._waterfall_condition = threading.Condition( self._lock )
         
         self._special_thumbs = {}
         
         self.Clear()
         
-        threading.Thread( target = self.DAEMONWaterfall, name = 'Waterfall Daemon' ).start()
+        # decoding and lz4 do their work with the gil released, so plain threads get us the extra cores
         
-        self._controller.sub( self, 'Clear', 'thumbnail_resize' )
+        num_workers = max( 1, psutil.cpu_count() - 1 )
         
-    
-    def _GetResizedHydrusBitmapFromHardDrive( self, display_media ):
+        for i in range( num_workers ):
+            
+            threading.Thread( target = self.DAEMONWaterfall, name = 'Waterfall Daemon' ).start()
+            
         
-        options = self._controller.GetOptions()
+        self._controller.sub( self, 'Clear', 'thumbnail_resize' )
         
-        thumbnail_dimensions = options[ 'thumbnail_dimensions' ]
+    
+    def _GetResizedHydrusBitmapFromHardDrive( self, display_media, thumbnail = None ):
         
-        if tuple( thumbnail_dimensions ) == HC.UNSCALED_THUMBNAIL_DIMENSIONS:
-            
-            full_size = True
-            
-        else:
-            
-            full_size = False
-            
+        full_size = self._UsingFullSizeThumbnails()
         
         hash = display_media.GetHash()
         
+        path = None
+        
         locations_manager = display_media.GetLocationsManager()
         
         if locations_manager.HasLocal():
@@ -1685,9 +2590,9 @@ class ThumbnailCache( object ):
                     
                     path = self._client_files_manager.GetFullSizeThumbnailPath( hash )
                     
-                else:
+                elif thumbnail is None:
                     
-                    path = self._client_files_manager.GetResizedThumbnailPath( hash )
+                    thumbnail = self._client_files_manager.GetResizedThumbnail( hash )
                     
                 
             except HydrusExceptions.FileMissingException as e:
@@ -1705,9 +2610,9 @@ class ThumbnailCache( object ):
                     
                     path = self._client_files_manager.GetFullSizeThumbnailPath( hash )
                     
-                else:
+                elif thumbnail is None:
                     
-                    path = self._client_files_manager.GetResizedThumbnailPath( hash )
+                    thumbnail = self._client_files_manager.GetResizedThumbnail( hash )
                     
                 
             except HydrusExceptions.FileMissingException:
@@ -1718,7 +2623,7 @@ class ThumbnailCache( object ):
         
         try:
             
-            hydrus_bitmap = ClientRendering.GenerateHydrusBitmap( path )
+            hydrus_bitmap = self._LoadHydrusBitmap( path, thumbnail )
             
         except Exception as e:
             
@@ -1726,11 +2631,16 @@ class ThumbnailCache( object ):
             
             try:
                 
-                self._client_files_manager.RegenerateResizedThumbnail( hash )
+                thumbnail_resized = self._client_files_manager.RegenerateResizedThumbnail( hash )
+                
+                if not full_size:
+                    
+                    thumbnail = thumbnail_resized
+                    
                 
                 try:
                     
-                    hydrus_bitmap = ClientRendering.GenerateHydrusBitmap( path )
+                    hydrus_bitmap = self._LoadHydrusBitmap( path, thumbnail )
                     
                 except Exception as e:
                     
@@ -1761,50 +2671,132 @@ class ThumbnailCache( object ):
         
         if too_large or ( too_small and not small_original_image ):
             
-            self._client_files_manager.RegenerateResizedThumbnail( hash )
+            thumbnail_resized = self._client_files_manager.RegenerateResizedThumbnail( hash )
             
-            hydrus_bitmap = ClientRendering.GenerateHydrusBitmap( path )
+            if not full_size:
+                
+                thumbnail = thumbnail_resized
+                
+            
+            hydrus_bitmap = self._LoadHydrusBitmap( path, thumbnail )
             
         
         return hydrus_bitmap
         
     
-    def _RecalcWaterfallQueueRandom( self ):
-    
-        self._waterfall_queue_random = list( self._waterfall_queue_quick )
-        
-        random.shuffle( self._waterfall_queue_random )
-        
-    
-    def CancelWaterfall( self, page_key, medias ):
+    def _LoadHydrusBitmap( self, path, thumbnail ):
         
-        with self._lock:
+        if thumbnail is None:
+            
+            return ClientRendering.GenerateHydrusBitmap( path )
             
-            self._waterfall_queue_quick.difference_update( ( ( page_key, media ) for media in medias ) )
+        else:
             
-            self._RecalcWaterfallQueueRandom()
+            return ClientRendering.GenerateHydrusBitmapFromBytes( thumbnail )
             
         
     
-    def Clear( self ):
+    def _PreloadThumbnails( self, medias ):
         
-        with self._lock:
-            
-            self._data_cache.Clear()
+        # fetch every uncached resized thumbnail in the batch at once, so packed thumbnails come off the disk in one sweep
+        
+        if self._UsingFullSizeThumbnails():
             
-            self._special_thumbs = {}
+            return
             
-            names = [ 'hydrus', 'flash', 'pdf', 'audio', 'video' ]
+        
+        hashes_to_display_medias = {}
+        
+        for media in medias:
             
-            ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+            display_media = media.GetDisplayMedia()
             
-            try:
+            if display_media.GetLocationsManager().ShouldHaveThumbnail() and display_media.GetMime() in HC.MIMES_WITH_THUMBNAILS:
                 
-                for name in names:
+                hash = display_media.GetHash()
+                
+                if not self._data_cache.HasData( hash ):
                     
-                    path = os.path.join( HC.STATIC_DIR, name + '.png' )
+                    hashes_to_display_medias[ hash ] = display_media
                     
-                    options = self._controller.GetOptions()
+                
+            
+        
+        if len( hashes_to_display_medias ) < 2:
+            
+            return
+            
+        
+        hashes_to_thumbnails = self._client_files_manager.GetResizedThumbnails( hashes_to_display_medias.keys() )
+        
+        for ( hash, thumbnail ) in hashes_to_thumbnails.items():
+            
+            hydrus_bitmap = self._GetResizedHydrusBitmapFromHardDrive( hashes_to_display_medias[ hash ], thumbnail = thumbnail )
+            
+            self._data_cache.AddData( hash, hydrus_bitmap )
+            
+        
+    
+    def _PopWaterfallBatch( self ):
+        
+        results = []
+        
+        while len( self._waterfall_queue ) > 0 and len( results ) < self.WATERFALL_BATCH_SIZE:
+            
+            entry = heapq.heappop( self._waterfall_queue )
+            
+            result = entry[ -1 ]
+            
+            if self._waterfall_queue_entries.get( result ) is entry:
+                
+                del self._waterfall_queue_entries[ result ]
+                
+                results.append( result )
+                
+            
+        
+        return results
+        
+    
+    def CancelWaterfall( self, page_key, medias ):
+        
+        with self._lock:
+            
+            for media in medias:
+                
+                self._waterfall_queue_entries.pop( ( page_key, media ), None )
+                
+            
+            # don't let a lot of scrolling fill the heap with dead entries
+            
+            if len( self._waterfall_queue ) > 1024 and len( self._waterfall_queue ) > 2 * len( self._waterfall_queue_entries ):
+                
+                self._waterfall_queue = self._waterfall_queue_entries.values()
+                
+                heapq.heapify( self._waterfall_queue )
+                
+            
+        
+    
+    def Clear( self ):
+        
+        with self._lock:
+            
+            self._data_cache.Clear()
+            
+            self._special_thumbs = {}
+            
+            names = [ 'hydrus', 'flash', 'pdf', 'audio', 'video' ]
+            
+            ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+            
+            try:
+                
+                for name in names:
+                    
+                    path = os.path.join( HC.STATIC_DIR, name + '.png' )
+                    
+                    options = self._controller.GetOptions()
                     
                     thumbnail = HydrusFileHandling.GenerateThumbnail( path, options[ 'thumbnail_dimensions' ] )
                     
@@ -1861,6 +2853,11 @@ class ThumbnailCache( object ):
             
         
     
+    def GetStats( self ):
+        
+        return self._data_cache.GetStats()
+        
+    
     def HasThumbnailCached( self, media ):
         
         display_media = media.GetDisplayMedia()
@@ -1879,16 +2876,41 @@ class ThumbnailCache( object ):
             
         
     
-    def Waterfall( self, page_key, medias ):
+    def _UsingFullSizeThumbnails( self ):
+        
+        options = self._controller.GetOptions()
+        
+        thumbnail_dimensions = options[ 'thumbnail_dimensions' ]
+        
+        return tuple( thumbnail_dimensions ) == HC.UNSCALED_THUMBNAIL_DIMENSIONS
+        
+    
+    def Waterfall( self, page_key, medias, priority = CC.WATERFALL_PRIORITY_VISIBLE ):
         
         with self._lock:
             
-            self._waterfall_queue_quick.update( ( ( page_key, media ) for media in medias ) )
+            self._waterfall_call_index += 1
             
-            self._RecalcWaterfallQueueRandom()
+            for media in medias:
+                
+                result = ( page_key, media )
+                
+                if result in self._waterfall_queue_entries and self._waterfall_queue_entries[ result ][ 0 ] <= priority:
+                    
+                    continue
+                    
+                
+                # within a priority, the most recent call goes first, and random order within that keeps the nice fade in
+                
+                entry = [ priority, - self._waterfall_call_index, random.random(), result ]
+                
+                self._waterfall_queue_entries[ result ] = entry
+                
+                heapq.heappush( self._waterfall_queue, entry )
+                
+            
+            self._waterfall_condition.notify_all()
             
-        
-        self._waterfall_event.set()
         
     
     def DAEMONWaterfall( self ):
@@ -1899,50 +2921,46 @@ class ThumbnailCache( object ):
             
             with self._lock:
                 
-                do_wait = len( self._waterfall_queue_random ) == 0
-                
-            
-            if do_wait:
-                
-                self._waterfall_event.wait( 1 )
-                
-                self._waterfall_event.clear()
-                
-                last_paused = HydrusData.GetNowPrecise()
-                
-            
-            with self._lock:
+                results = self._PopWaterfallBatch()
                 
-                if len( self._waterfall_queue_random ) == 0:
-                    
-                    continue
-                    
-                else:
+                if len( results ) == 0:
                     
-                    result = self._waterfall_queue_random.pop( 0 )
+                    self._waterfall_condition.wait( 1 )
                     
-                    self._waterfall_queue_quick.discard( result )
+                    last_paused = HydrusData.GetNowPrecise()
                     
-                    ( page_key, media ) = result
+                    continue
                     
                 
             
             try:
                 
-                self.GetThumbnail( media ) # to load it
+                self._PreloadThumbnails( [ media for ( page_key, media ) in results ] )
+                
+            except Exception as e:
+                
+                HydrusData.ShowException( e )
                 
-                self._controller.pub( 'waterfall_thumbnail', page_key, media )
+            
+            for ( page_key, media ) in results:
                 
-                if HydrusData.GetNowPrecise() - last_paused > 0.005:
+                try:
                     
-                    time.sleep( 0.00001 )
+                    self.GetThumbnail( media ) # to load it
                     
-                    last_paused = HydrusData.GetNowPrecise()
+                    self._controller.pub( 'waterfall_thumbnail', page_key, media )
+                    
+                    if HydrusData.GetNowPrecise() - last_paused > 0.005:
+                        
+                        time.sleep( 0.00001 )
+                        
+                        last_paused = HydrusData.GetNowPrecise()
+                        
+                    
+                except Exception as e:
+                    
+                    HydrusData.ShowException( e )
                     
-                
-            except Exception as e:
-                
-                HydrusData.ShowException( e )
                 
             
         
@@ -2138,391 +3156,839 @@ class TagCensorshipManager( object ):
         return tags
         
     
-class TagParentsManager( object ):
+class TagParentsGraph( object ):
     
-    def __init__( self, controller ):
-        
-        self._controller = controller
-        
-        self._service_keys_to_children_to_parents = collections.defaultdict( HydrusData.default_dict_list )
-        
-        self._RefreshParents()
-        
-        self._lock = threading.Lock()
-        
-        self._controller.sub( self, 'RefreshParents', 'notify_new_parents' )
-        
+    # one service's parent pairs, after sibling collapse, along with every child's full list of ancestors
+    # several raw pairs can collapse to the same pair, so pairs are counted and only drop out with their last raw pair
+    # the ancestor lists are replaced, never edited, so readers can use them without the lock
     
-    def _RefreshParents( self ):
-        
-        service_keys_to_statuses_to_pairs = self._controller.Read( 'tag_parents' )
+    def __init__( self, pairs = None ):
         
-        # first collapse siblings
+        self._pair_counts = collections.Counter()
+        self._rejected_pairs = set()
         
-        sibling_manager = self._controller.GetManager( 'tag_siblings' )
+        self._simple_children_to_parents = HydrusData.default_dict_set()
+        self._simple_parents_to_children = HydrusData.default_dict_set()
         
-        collapsed_service_keys_to_statuses_to_pairs = collections.defaultdict( HydrusData.default_dict_set )
+        self._children_to_parents = {}
         
-        for ( service_key, statuses_to_pairs ) in service_keys_to_statuses_to_pairs.items():
+        if pairs is not None:
             
-            if service_key == CC.COMBINED_TAG_SERVICE_KEY: continue
-            
-            for ( status, pairs ) in statuses_to_pairs.items():
+            for pair in pairs:
+                
+                self._pair_counts[ pair ] += 1
+                
+                if self._pair_counts[ pair ] == 1:
+                    
+                    self._AcceptPair( pair )
+                    
                 
-                pairs = sibling_manager.CollapsePairs( pairs )
+            
+            for child in self._simple_children_to_parents.keys():
                 
-                collapsed_service_keys_to_statuses_to_pairs[ service_key ][ status ] = pairs
+                self._children_to_parents[ child ] = GetTransitiveParents( self._simple_children_to_parents, child )
                 
             
         
-        # now collapse current and pending
+    
+    def _AcceptPair( self, pair ):
         
-        service_keys_to_pairs_flat = HydrusData.default_dict_set()
+        ( child, parent ) = pair
         
-        for ( service_key, statuses_to_pairs ) in collapsed_service_keys_to_statuses_to_pairs.items():
+        if child == parent:
             
-            pairs_flat = statuses_to_pairs[ HC.CURRENT ].union( statuses_to_pairs[ HC.PENDING ] )
-            
-            service_keys_to_pairs_flat[ service_key ] = pairs_flat
+            return False
             
         
-        # now create the combined tag service
-        
-        combined_pairs_flat = set()
-        
-        for pairs_flat in service_keys_to_pairs_flat.values():
+        if self._PairMakesLoop( pair ):
             
-            combined_pairs_flat.update( pairs_flat )
+            self._rejected_pairs.add( pair )
+            
+            return False
             
         
-        service_keys_to_pairs_flat[ CC.COMBINED_TAG_SERVICE_KEY ] = combined_pairs_flat
-        
-        #
-        
-        service_keys_to_simple_children_to_parents = BuildServiceKeysToSimpleChildrenToParents( service_keys_to_pairs_flat )
+        self._simple_children_to_parents[ child ].add( parent )
+        self._simple_parents_to_children[ parent ].add( child )
         
-        self._service_keys_to_children_to_parents = BuildServiceKeysToChildrenToParents( service_keys_to_simple_children_to_parents )
+        return True
         
     
-    def ExpandPredicates( self, service_key, predicates ):
+    def _PairMakesLoop( self, pair ):
         
-        new_options = self._controller.GetNewOptions()
+        ( child, parent ) = pair
         
-        if new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
-            
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
-            
+        # the pair makes a loop if the child is already the parent or one of its ancestors
         
-        results = []
+        seen_tags = set()
+        next_tags = { parent }
         
-        with self._lock:
+        while len( next_tags ) > 0:
             
-            for predicate in predicates:
+            if child in next_tags:
                 
-                results.append( predicate )
+                return True
                 
-                if predicate.GetType() == HC.PREDICATE_TYPE_TAG:
-                    
-                    tag = predicate.GetValue()
-                    
-                    parents = self._service_keys_to_children_to_parents[ service_key ][ tag ]
+            
+            seen_tags.update( next_tags )
+            
+            ancestors = set()
+            
+            for tag in next_tags:
+                
+                if tag in self._simple_children_to_parents:
                     
-                    for parent in parents:
-                        
-                        parent_predicate = ClientSearch.Predicate( HC.PREDICATE_TYPE_PARENT, parent )
-                        
-                        results.append( parent_predicate )
-                        
+                    ancestors.update( self._simple_children_to_parents[ tag ] )
                     
                 
             
-            return results
+            next_tags = ancestors.difference( seen_tags )
             
         
+        return False
+        
     
-    def ExpandTags( self, service_key, tags ):
+    def _RecalcParents( self, child ):
         
-        new_options = self._controller.GetNewOptions()
+        # the child and everything below it have new ancestors
         
-        if new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
+        tags = set()
+        next_tags = { child }
+        
+        while len( next_tags ) > 0:
             
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
+            tags.update( next_tags )
+            
+            descendants = set()
+            
+            for tag in next_tags:
+                
+                if tag in self._simple_parents_to_children:
+                    
+                    descendants.update( self._simple_parents_to_children[ tag ] )
+                    
+                
+            
+            next_tags = descendants.difference( tags )
             
         
-        with self._lock:
+        for tag in tags:
             
-            tags_results = set( tags )
+            parents = GetTransitiveParents( self._simple_children_to_parents, tag )
             
-            for tag in tags:
+            if len( parents ) > 0:
                 
-                tags_results.update( self._service_keys_to_children_to_parents[ service_key ][ tag ] )
+                self._children_to_parents[ tag ] = parents
                 
+            elif tag in self._children_to_parents:
+                
+                del self._children_to_parents[ tag ]
+                
+            
+        
+    
+    def AddPair( self, pair ):
+        
+        self._pair_counts[ pair ] += 1
+        
+        if self._pair_counts[ pair ] == 1 and self._AcceptPair( pair ):
+            
+            ( child, parent ) = pair
             
-            return tags_results
+            self._RecalcParents( child )
             
         
     
-    def GetParents( self, service_key, tag ):
+    def GetParents( self, child ):
         
-        new_options = self._controller.GetNewOptions()
+        return self._children_to_parents.get( child, [] )
         
-        if new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
+    
+    def RemovePair( self, pair ):
+        
+        if pair not in self._pair_counts:
             
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
+            return
             
         
-        with self._lock:
+        self._pair_counts[ pair ] -= 1
+        
+        if self._pair_counts[ pair ] > 0:
             
-            return self._service_keys_to_children_to_parents[ service_key ][ tag ]
+            return
             
         
-    
-    def RefreshParents( self ):
+        del self._pair_counts[ pair ]
         
-        with self._lock:
+        if pair in self._rejected_pairs:
             
-            self._RefreshParents()
+            self._rejected_pairs.discard( pair )
+            
+            return
+            
+        
+        ( child, parent ) = pair
+        
+        if child == parent:
+            
+            return
+            
+        
+        self._simple_children_to_parents[ child ].discard( parent )
+        
+        if len( self._simple_children_to_parents[ child ] ) == 0:
+            
+            del self._simple_children_to_parents[ child ]
+            
+        
+        self._simple_parents_to_children[ parent ].discard( child )
+        
+        if len( self._simple_parents_to_children[ parent ] ) == 0:
+            
+            del self._simple_parents_to_children[ parent ]
+            
+        
+        # a pair that was turned away for making a loop may not make one any more
+        
+        for rejected_pair in list( self._rejected_pairs ):
+            
+            self._rejected_pairs.discard( rejected_pair )
+            
+            if self._AcceptPair( rejected_pair ):
+                
+                ( rejected_child, rejected_parent ) = rejected_pair
+                
+                self._RecalcParents( rejected_child )
+                
             
         
+        self._RecalcParents( child )
+        
     
-class TagSiblingsManager( object ):
+class TagParentsManager( object ):
     
     def __init__( self, controller ):
         
         self._controller = controller
         
-        self._RefreshSiblings()
+        # the lock only stops two writes overlapping--reads do not take it, as a write swaps each tag's ancestors in one go
         
         self._lock = threading.Lock()
         
-        self._controller.sub( self, 'RefreshSiblings', 'notify_new_siblings_data' )
+        self._RefreshParents()
+        
+        self._controller.sub( self, 'RefreshParents', 'notify_new_parents' )
+        self._controller.sub( self, 'ApplyParentsDelta', 'notify_new_parents_delta' )
+        self._controller.sub( self, 'RecollapseTags', 'notify_new_sibling_chains' )
         
     
-    def _CollapseTags( self, tags ):
+    def _AddRawPair( self, service_key, pair ):
         
-        return { self._siblings[ tag ] if tag in self._siblings else tag for tag in tags }
+        ( child, parent ) = pair
         
-    
-    def _RefreshSiblings( self ):
+        sibling_manager = self._controller.GetManager( 'tag_siblings' )
         
-        service_keys_to_statuses_to_pairs = self._controller.Read( 'tag_siblings' )
+        ( collapsed_pair, ) = sibling_manager.CollapsePairs( ( pair, ) )
         
-        processed_siblings = CombineTagSiblingPairs( service_keys_to_statuses_to_pairs )
+        self._service_keys_to_raw_children_to_parents[ service_key ][ child ].add( parent )
+        self._service_keys_to_raw_pairs_to_collapsed_pairs[ service_key ][ pair ] = collapsed_pair
         
-        ( self._siblings, self._reverse_lookup ) = CollapseTagSiblingChains( processed_siblings )
+        self._tags_to_raw_pairs[ child ].add( ( service_key, pair ) )
+        self._tags_to_raw_pairs[ parent ].add( ( service_key, pair ) )
         
-        self._controller.pub( 'new_siblings_gui' )
+        self._service_keys_to_parents_graphs[ service_key ].AddPair( collapsed_pair )
+        self._service_keys_to_parents_graphs[ CC.COMBINED_TAG_SERVICE_KEY ].AddPair( collapsed_pair )
         
     
-    def GetAutocompleteSiblings( self, search_text, exact_match = False ):
+    def _GetParentsGraph( self, service_key ):
         
-        with self._lock:
+        new_options = self._controller.GetNewOptions()
+        
+        if new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
             
-            if exact_match:
-                
-                key_based_matching_values = set()
-                
-                if search_text in self._siblings:
-                    
-                    key_based_matching_values = { self._siblings[ search_text ] }
-                    
-                else:
-                    
-                    key_based_matching_values = set()
-                    
-                
-                value_based_matching_values = { value for value in self._siblings.values() if value == search_text }
-                
-            else:
+            service_key = CC.COMBINED_TAG_SERVICE_KEY
+            
+        
+        parents_graph = self._service_keys_to_parents_graphs.get( service_key, None )
+        
+        if parents_graph is None:
+            
+            parents_graph = TagParentsGraph()
+            
+        
+        return parents_graph
+        
+    
+    def _RefreshParents( self ):
+        
+        service_keys_to_statuses_to_pairs = self._controller.Read( 'tag_parents' )
+        
+        # the raw pairs are kept, so later changes can be applied to just the pairs they touch
+        
+        self._service_keys_to_raw_children_to_parents = collections.defaultdict( HydrusData.default_dict_set )
+        self._service_keys_to_raw_pairs_to_collapsed_pairs = collections.defaultdict( dict )
+        self._tags_to_raw_pairs = HydrusData.default_dict_set()
+        
+        # first collapse siblings
+        
+        sibling_manager = self._controller.GetManager( 'tag_siblings' )
+        
+        service_keys_to_collapsed_pairs = collections.defaultdict( list )
+        
+        for ( service_key, statuses_to_pairs ) in service_keys_to_statuses_to_pairs.items():
+            
+            if service_key == CC.COMBINED_TAG_SERVICE_KEY: continue
+            
+            # now collapse current and pending
+            
+            pairs_flat = statuses_to_pairs[ HC.CURRENT ].union( statuses_to_pairs[ HC.PENDING ] )
+            
+            for pair in pairs_flat:
+                
+                ( child, parent ) = pair
                 
-                matching_keys = ClientSearch.FilterTagsBySearchEntry( search_text, self._siblings.keys(), search_siblings = False )
+                ( collapsed_pair, ) = sibling_manager.CollapsePairs( ( pair, ) )
                 
-                key_based_matching_values = { self._siblings[ key ] for key in matching_keys }
+                self._service_keys_to_raw_children_to_parents[ service_key ][ child ].add( parent )
+                self._service_keys_to_raw_pairs_to_collapsed_pairs[ service_key ][ pair ] = collapsed_pair
                 
-                value_based_matching_values = ClientSearch.FilterTagsBySearchEntry( search_text, self._siblings.values(), search_siblings = False )
+                self._tags_to_raw_pairs[ child ].add( ( service_key, pair ) )
+                self._tags_to_raw_pairs[ parent ].add( ( service_key, pair ) )
+                
+                service_keys_to_collapsed_pairs[ service_key ].append( collapsed_pair )
+                service_keys_to_collapsed_pairs[ CC.COMBINED_TAG_SERVICE_KEY ].append( collapsed_pair )
                 
             
-            matching_values = key_based_matching_values.union( value_based_matching_values )
+        
+        service_keys_to_parents_graphs = collections.defaultdict( TagParentsGraph )
+        
+        for ( service_key, collapsed_pairs ) in service_keys_to_collapsed_pairs.items():
             
-            # all the matching values have a matching sibling somewhere in their network
-            # so now fetch the networks
+            service_keys_to_parents_graphs[ service_key ] = TagParentsGraph( collapsed_pairs )
+            
+        
+        self._service_keys_to_parents_graphs = service_keys_to_parents_graphs
+        
+    
+    def _RemoveRawPair( self, service_key, pair ):
+        
+        ( child, parent ) = pair
+        
+        raw_children_to_parents = self._service_keys_to_raw_children_to_parents[ service_key ]
+        
+        raw_children_to_parents[ child ].discard( parent )
+        
+        if len( raw_children_to_parents[ child ] ) == 0:
             
-            lists_of_matching_keys = [ self._reverse_lookup[ value ] for value in matching_values ]
+            del raw_children_to_parents[ child ]
             
-            matching_keys = itertools.chain.from_iterable( lists_of_matching_keys )
+        
+        collapsed_pair = self._service_keys_to_raw_pairs_to_collapsed_pairs[ service_key ].pop( pair )
+        
+        for tag in ( child, parent ):
             
-            matches = matching_values.union( matching_keys )
+            self._tags_to_raw_pairs[ tag ].discard( ( service_key, pair ) )
             
-            return matches
+            if len( self._tags_to_raw_pairs[ tag ] ) == 0:
+                
+                del self._tags_to_raw_pairs[ tag ]
+                
             
         
+        self._service_keys_to_parents_graphs[ service_key ].RemovePair( collapsed_pair )
+        self._service_keys_to_parents_graphs[ CC.COMBINED_TAG_SERVICE_KEY ].RemovePair( collapsed_pair )
+        
     
-    def GetSibling( self, tag ):
+    def ApplyParentsDelta( self, service_keys_to_children_to_parents ):
+        
+        # the db sends the current and pending parents of every child it changed
         
         with self._lock:
             
-            if tag in self._siblings: return self._siblings[ tag ]
-            else: return None
+            for ( service_key, children_to_parents ) in service_keys_to_children_to_parents.items():
+                
+                if service_key == CC.COMBINED_TAG_SERVICE_KEY: continue
+                
+                raw_children_to_parents = self._service_keys_to_raw_children_to_parents[ service_key ]
+                
+                for ( child, parents ) in children_to_parents.items():
+                    
+                    existing_parents = set( raw_children_to_parents.get( child, set() ) )
+                    
+                    for parent in existing_parents.difference( parents ):
+                        
+                        self._RemoveRawPair( service_key, ( child, parent ) )
+                        
+                    
+                    for parent in set( parents ).difference( existing_parents ):
+                        
+                        self._AddRawPair( service_key, ( child, parent ) )
+                        
+                    
+                
             
         
     
-    def GetAllSiblings( self, tag ):
+    def ExpandPredicates( self, service_key, predicates ):
         
-        with self._lock:
+        parents_graph = self._GetParentsGraph( service_key )
+        
+        results = []
+        
+        for predicate in predicates:
+            
+            results.append( predicate )
             
-            if tag in self._siblings:
+            if predicate.GetType() == HC.PREDICATE_TYPE_TAG:
                 
-                new_tag = self._siblings[ tag ]
+                tag = predicate.GetValue()
+                
+                parents = parents_graph.GetParents( tag )
+                
+                for parent in parents:
+                    
+                    parent_predicate = ClientSearch.Predicate( HC.PREDICATE_TYPE_PARENT, parent )
+                    
+                    results.append( parent_predicate )
+                    
                 
-            elif tag in self._reverse_lookup: new_tag = tag
-            else: return [ tag ]
-            
-            all_siblings = list( self._reverse_lookup[ new_tag ] )
             
-            all_siblings.append( new_tag )
+        
+        return results
+        
+    
+    def ExpandTags( self, service_key, tags ):
+        
+        parents_graph = self._GetParentsGraph( service_key )
+        
+        tags_results = set( tags )
+        
+        for tag in tags:
             
-            return all_siblings
+            tags_results.update( parents_graph.GetParents( tag ) )
             
         
+        return tags_results
+        
     
-    def RefreshSiblings( self ):
+    def GetParents( self, service_key, tag ):
         
-        with self._lock: self._RefreshSiblings()
+        parents_graph = self._GetParentsGraph( service_key )
+        
+        return parents_graph.GetParents( tag )
         
     
-    def CollapseNamespacedTags( self, namespace, tags ):
+    def RecollapseTags( self, tags ):
+        
+        # the siblings of these tags have changed, so any pair that uses them may collapse differently
         
         with self._lock:
             
-            results = set()
+            sibling_manager = self._controller.GetManager( 'tag_siblings' )
             
             for tag in tags:
                 
-                full_tag = namespace + ':' + tag
+                if tag not in self._tags_to_raw_pairs:
+                    
+                    continue
+                    
                 
-                if full_tag in self._siblings:
+                for ( service_key, pair ) in list( self._tags_to_raw_pairs[ tag ] ):
                     
-                    sibling = self._siblings[ full_tag ]
+                    ( collapsed_pair, ) = sibling_manager.CollapsePairs( ( pair, ) )
                     
-                    if ':' in sibling: sibling = sibling.split( ':', 1 )[1]
+                    if collapsed_pair != self._service_keys_to_raw_pairs_to_collapsed_pairs[ service_key ][ pair ]:
+                        
+                        self._RemoveRawPair( service_key, pair )
+                        self._AddRawPair( service_key, pair )
+                        
                     
-                    results.add( sibling )
+                
+            
+        
+    
+    def RefreshParents( self ):
+        
+        with self._lock:
+            
+            self._RefreshParents()
+            
+        
+    
+class TagSiblingsManager( object ):
+    
+    def __init__( self, controller ):
+        
+        self._controller = controller
+        
+        # the lock only stops two writes overlapping--reads do not take it, as a write swaps each tag's entry in one go
+        
+        self._lock = threading.Lock()
+        
+        self._RefreshSiblings()
+        
+        self._controller.sub( self, 'RefreshSiblings', 'notify_new_siblings_data' )
+        self._controller.sub( self, 'ApplySiblingsDelta', 'notify_new_siblings_delta' )
+        
+    
+    def _CollapseTags( self, tags ):
+        
+        siblings = self._siblings
+        
+        return { siblings.get( tag, tag ) for tag in tags }
+        
+    
+    def _GetLinkedTags( self, tags ):
+        
+        # everything joined to these tags by a pair, in either direction, on any service
+        
+        linked_tags = set()
+        next_tags = set( tags )
+        
+        while len( next_tags ) > 0:
+            
+            linked_tags.update( next_tags )
+            
+            neighbours = set()
+            
+            for tags_to_tags in itertools.chain( self._service_keys_to_old_tags_to_new_tags.values(), self._service_keys_to_new_tags_to_old_tags.values() ):
+                
+                for tag in next_tags:
+                    
+                    if tag in tags_to_tags:
+                        
+                        neighbours.update( tags_to_tags[ tag ] )
+                        
                     
-                else: results.add( tag )
                 
             
-            return results
+            next_tags = neighbours.difference( linked_tags )
             
         
+        return linked_tags
+        
     
-    def CollapsePredicates( self, predicates ):
+    def _RecalcSiblings( self, tags ):
         
-        with self._lock:
+        # these tags are all the tags linked to one another, so their chains can be worked out without looking at anything else
+        
+        service_keys_to_statuses_to_pairs = collections.defaultdict( HydrusData.default_dict_set )
+        
+        for ( service_key, old_tags_to_new_tags ) in self._service_keys_to_old_tags_to_new_tags.items():
             
-            results = [ predicate for predicate in predicates if predicate.GetType() != HC.PREDICATE_TYPE_TAG ]
+            pairs = { ( old_tag, new_tag ) for old_tag in tags if old_tag in old_tags_to_new_tags for new_tag in old_tags_to_new_tags[ old_tag ] }
             
-            tag_predicates = [ predicate for predicate in predicates if predicate.GetType() == HC.PREDICATE_TYPE_TAG ]
+            if len( pairs ) > 0:
+                
+                service_keys_to_statuses_to_pairs[ service_key ][ HC.CURRENT ] = pairs
+                
             
-            tags_to_predicates = { predicate.GetValue() : predicate for predicate in predicates if predicate.GetType() == HC.PREDICATE_TYPE_TAG }
+        
+        processed_siblings = CombineTagSiblingPairs( service_keys_to_statuses_to_pairs )
+        
+        ( siblings, reverse_lookup ) = CollapseTagSiblingChains( processed_siblings )
+        
+        self._siblings.update( siblings )
+        self._reverse_lookup.update( reverse_lookup )
+        
+        for tag in tags:
             
-            tags = tags_to_predicates.keys()
+            if tag in self._siblings and tag not in siblings:
+                
+                del self._siblings[ tag ]
+                
             
-            tags_to_include_in_results = set()
+            if tag in self._reverse_lookup and tag not in reverse_lookup:
+                
+                del self._reverse_lookup[ tag ]
+                
             
-            for tag in tags:
+        
+    
+    def _RefreshSiblings( self ):
+        
+        service_keys_to_statuses_to_pairs = self._controller.Read( 'tag_siblings' )
+        
+        # the raw pairs are kept, so later changes only have to redo the chains they touch
+        
+        self._service_keys_to_old_tags_to_new_tags = collections.defaultdict( HydrusData.default_dict_set )
+        self._service_keys_to_new_tags_to_old_tags = collections.defaultdict( HydrusData.default_dict_set )
+        
+        for ( service_key, statuses_to_pairs ) in service_keys_to_statuses_to_pairs.items():
+            
+            for ( old_tag, new_tag ) in statuses_to_pairs[ HC.CURRENT ].union( statuses_to_pairs[ HC.PENDING ] ):
+                
+                self._service_keys_to_old_tags_to_new_tags[ service_key ][ old_tag ].add( new_tag )
+                self._service_keys_to_new_tags_to_old_tags[ service_key ][ new_tag ].add( old_tag )
                 
-                if tag in self._siblings:
+            
+        
+        processed_siblings = CombineTagSiblingPairs( service_keys_to_statuses_to_pairs )
+        
+        ( siblings, reverse_lookup ) = CollapseTagSiblingChains( processed_siblings )
+        
+        ( self._siblings, self._reverse_lookup ) = ( siblings, dict( reverse_lookup ) )
+        
+        self._controller.pub( 'new_siblings_gui' )
+        
+    
+    def ApplySiblingsDelta( self, service_keys_to_old_tags_to_new_tags ):
+        
+        # the db sends the current and pending siblings of every old tag it changed
+        
+        with self._lock:
+            
+            changed_tags = set()
+            
+            for ( service_key, old_tags_to_new_tags ) in service_keys_to_old_tags_to_new_tags.items():
+                
+                my_old_tags_to_new_tags = self._service_keys_to_old_tags_to_new_tags[ service_key ]
+                my_new_tags_to_old_tags = self._service_keys_to_new_tags_to_old_tags[ service_key ]
+                
+                for ( old_tag, new_tags ) in old_tags_to_new_tags.items():
                     
-                    old_tag = tag
-                    old_predicate = tags_to_predicates[ old_tag ]
+                    new_tags = set( new_tags )
                     
-                    new_tag = self._siblings[ old_tag ]
+                    existing_new_tags = set( my_old_tags_to_new_tags.get( old_tag, set() ) )
                     
-                    if new_tag not in tags_to_predicates:
+                    changed_tags.add( old_tag )
+                    changed_tags.update( existing_new_tags )
+                    changed_tags.update( new_tags )
+                    
+                    for new_tag in existing_new_tags.difference( new_tags ):
                         
-                        ( old_pred_type, old_value, old_inclusive ) = old_predicate.GetInfo()
+                        my_new_tags_to_old_tags[ new_tag ].discard( old_tag )
                         
-                        new_predicate = ClientSearch.Predicate( old_pred_type, new_tag, old_inclusive )
+                        if len( my_new_tags_to_old_tags[ new_tag ] ) == 0:
+                            
+                            del my_new_tags_to_old_tags[ new_tag ]
+                            
                         
-                        tags_to_predicates[ new_tag ] = new_predicate
+                    
+                    for new_tag in new_tags.difference( existing_new_tags ):
                         
-                        tags_to_include_in_results.add( new_tag )
+                        my_new_tags_to_old_tags[ new_tag ].add( old_tag )
                         
                     
-                    new_predicate = tags_to_predicates[ new_tag ]
-                    
-                    new_predicate.AddCounts( old_predicate )
-                    
-                else:
-                    
-                    tags_to_include_in_results.add( tag )
+                    if len( new_tags ) > 0:
+                        
+                        my_old_tags_to_new_tags[ old_tag ] = new_tags
+                        
+                    elif old_tag in my_old_tags_to_new_tags:
+                        
+                        del my_old_tags_to_new_tags[ old_tag ]
+                        
                     
                 
             
-            results.extend( [ tags_to_predicates[ tag ] for tag in tags_to_include_in_results ] )
+            # a removed pair can split a group of linked tags in two, but both halves are still linked to the pair's tags
             
-            return results
+            linked_tags = self._GetLinkedTags( changed_tags )
+            
+            self._RecalcSiblings( linked_tags )
             
         
+        self._controller.pub( 'notify_new_sibling_chains', linked_tags )
+        self._controller.pub( 'new_siblings_gui' )
+        
     
-    def CollapsePairs( self, pairs ):
+    def GetAutocompleteSiblings( self, search_text, exact_match = False ):
         
-        with self._lock:
+        siblings = self._siblings
+        reverse_lookup = self._reverse_lookup
+        
+        if exact_match:
             
-            result = set()
+            sibling = siblings.get( search_text, None )
             
-            for ( a, b ) in pairs:
+            if sibling is not None:
+                
+                key_based_matching_values = { sibling }
+                
+            else:
+                
+                key_based_matching_values = set()
+                
+            
+            if search_text in reverse_lookup:
+                
+                value_based_matching_values = { search_text }
                 
-                if a in self._siblings: a = self._siblings[ a ]
-                if b in self._siblings: b = self._siblings[ b ]
+            else:
                 
-                result.add( ( a, b ) )
+                value_based_matching_values = set()
                 
             
-            return result
+        else:
+            
+            matching_keys = ClientSearch.FilterTagsBySearchEntry( search_text, siblings.keys(), search_siblings = False )
+            
+            key_based_matching_values = { siblings.get( key, key ) for key in matching_keys }
+            
+            value_based_matching_values = ClientSearch.FilterTagsBySearchEntry( search_text, siblings.values(), search_siblings = False )
             
         
+        matching_values = key_based_matching_values.union( value_based_matching_values )
+        
+        # all the matching values have a matching sibling somewhere in their network
+        # so now fetch the networks
+        
+        lists_of_matching_keys = [ reverse_lookup.get( value, [] ) for value in matching_values ]
+        
+        matching_keys = itertools.chain.from_iterable( lists_of_matching_keys )
+        
+        matches = matching_values.union( matching_keys )
+        
+        return matches
+        
     
-    def CollapseStatusesToTags( self, statuses_to_tags ):
+    def GetSibling( self, tag ):
         
-        with self._lock:
+        return self._siblings.get( tag, None )
+        
+    
+    def GetAllSiblings( self, tag ):
+        
+        new_tag = self._siblings.get( tag, tag )
+        
+        old_tags = self._reverse_lookup.get( new_tag, None )
+        
+        if old_tags is None: return [ tag ]
+        
+        all_siblings = list( old_tags )
+        
+        all_siblings.append( new_tag )
+        
+        return all_siblings
+        
+    
+    def RefreshSiblings( self ):
+        
+        with self._lock: self._RefreshSiblings()
+        
+    
+    def CollapseNamespacedTags( self, namespace, tags ):
+        
+        siblings = self._siblings
+        
+        results = set()
+        
+        for tag in tags:
             
-            statuses = statuses_to_tags.keys()
+            full_tag = namespace + ':' + tag
             
-            new_statuses_to_tags = HydrusData.default_dict_set()
+            sibling = siblings.get( full_tag, None )
             
-            for status in statuses:
+            if sibling is not None:
+                
+                if ':' in sibling: sibling = sibling.split( ':', 1 )[1]
                 
-                new_statuses_to_tags[ status ] = self._CollapseTags( statuses_to_tags[ status ] )
+                results.add( sibling )
                 
+            else: results.add( tag )
             
-            return new_statuses_to_tags
+        
+        return results
+        
+    
+    def CollapsePredicates( self, predicates ):
+        
+        siblings = self._siblings
+        
+        results = [ predicate for predicate in predicates if predicate.GetType() != HC.PREDICATE_TYPE_TAG ]
+        
+        tag_predicates = [ predicate for predicate in predicates if predicate.GetType() == HC.PREDICATE_TYPE_TAG ]
+        
+        tags_to_predicates = { predicate.GetValue() : predicate for predicate in predicates if predicate.GetType() == HC.PREDICATE_TYPE_TAG }
+        
+        tags = tags_to_predicates.keys()
+        
+        tags_to_include_in_results = set()
+        
+        for tag in tags:
             
+            new_tag = siblings.get( tag, None )
+            
+            if new_tag is not None:
+                
+                old_tag = tag
+                old_predicate = tags_to_predicates[ old_tag ]
+                
+                if new_tag not in tags_to_predicates:
+                    
+                    ( old_pred_type, old_value, old_inclusive ) = old_predicate.GetInfo()
+                    
+                    new_predicate = ClientSearch.Predicate( old_pred_type, new_tag, old_inclusive )
+                    
+                    tags_to_predicates[ new_tag ] = new_predicate
+                    
+                    tags_to_include_in_results.add( new_tag )
+                    
+                
+                new_predicate = tags_to_predicates[ new_tag ]
+                
+                new_predicate.AddCounts( old_predicate )
+                
+            else:
+                
+                tags_to_include_in_results.add( tag )
+                
+            
+        
+        results.extend( [ tags_to_predicates[ tag ] for tag in tags_to_include_in_results ] )
+        
+        return results
         
     
-    def CollapseTags( self, tags ):
+    def CollapsePairs( self, pairs ):
         
-        with self._lock:
+        siblings = self._siblings
+        
+        result = set()
+        
+        for ( a, b ) in pairs:
+            
+            a = siblings.get( a, a )
+            b = siblings.get( b, b )
             
-            return self._CollapseTags( tags )
+            result.add( ( a, b ) )
             
         
+        return result
+        
     
-    def CollapseTagsToCount( self, tags_to_count ):
+    def CollapseStatusesToTags( self, statuses_to_tags ):
         
-        with self._lock:
+        statuses = statuses_to_tags.keys()
+        
+        new_statuses_to_tags = HydrusData.default_dict_set()
+        
+        for status in statuses:
             
-            results = collections.Counter()
+            new_statuses_to_tags[ status ] = self._CollapseTags( statuses_to_tags[ status ] )
             
-            for ( tag, count ) in tags_to_count.items():
-                
-                if tag in self._siblings: tag = self._siblings[ tag ]
-                
-                results[ tag ] += count
-                
+        
+        return new_statuses_to_tags
+        
+    
+    def CollapseTags( self, tags ):
+        
+        return self._CollapseTags( tags )
+        
+    
+    def CollapseTagsToCount( self, tags_to_count ):
+        
+        siblings = self._siblings
+        
+        results = collections.Counter()
+        
+        for ( tag, count ) in tags_to_count.items():
             
-            return results
+            tag = siblings.get( tag, tag )
             
+            results[ tag ] += count
+            
+        
+        return results
         
     
 class UndoManager( object ):
@@ -304,6 +304,9 @@ status_string_lookup[ STATUS_SKIPPED ] = 'skipped'
 THUMBNAIL_MARGIN = 2
 THUMBNAIL_BORDER = 1
 
+WATERFALL_PRIORITY_VISIBLE = 0
+WATERFALL_PRIORITY_PREFETCH = 1
+
 wxk_code_string_lookup = {
     wx.WXK_SPACE: 'space',
     wx.WXK_BACK: 'backspace',
@@ -384,6 +384,8 @@ class Controller( HydrusController.HydrusController ):
         
         self._client_files_manager.Rebalance( partial = False, stop_time = stop_time )
         
+        self._client_files_manager.MaintainResizedThumbnails( partial = False, stop_time = stop_time )
+        
         self.MaintainDB( stop_time = stop_time )
         
         if not self._options[ 'pause_repo_sync' ]:
@@ -655,6 +657,26 @@ class Controller( HydrusController.HydrusController ):
         
         self.WriteInterruptable( 'analyze', stop_time = stop_time )
         
+        if stop_time is None or not HydrusData.TimeHasPassed( stop_time ):
+            
+            self.WriteInterruptable( 'maintain_similar_files_tree', stop_time = stop_time )
+            
+        
+        if stop_time is None or not HydrusData.TimeHasPassed( stop_time ):
+            
+            self.WriteInterruptable( 'maintain_tag_posting_lists', stop_time = stop_time )
+            
+        
+        similar_files_duplicate_pairs_search_distance = self._new_options.GetNoneableInteger( 'similar_files_duplicate_pairs_search_distance' )
+        
+        if similar_files_duplicate_pairs_search_distance is not None:
+            
+            if stop_time is None or not HydrusData.TimeHasPassed( stop_time ):
+                
+                self.WriteInterruptable( 'maintain_similar_files_duplicate_pairs', similar_files_duplicate_pairs_search_distance, stop_time = stop_time )
+                
+            
+        
         if stop_time is None or not HydrusData.TimeHasPassed( stop_time ):
             
             if HydrusData.TimeHasPassed( self._timestamps[ 'last_service_info_cache_fatten' ] + ( 60 * 20 ) ):
@@ -979,9 +1001,9 @@ class Controller( HydrusController.HydrusController ):
         HydrusController.HydrusController.ShutdownView( self )
         
     
-    def StartFileQuery( self, query_key, search_context ):
+    def StartFileQuery( self, query_key, search_context, sort_by = None ):
         
-        self.CallToThread( self.THREADDoFileQuery, query_key, search_context )
+        self.CallToThread( self.THREADDoFileQuery, query_key, search_context, sort_by )
         
     
     def SystemBusy( self ):
@@ -1044,9 +1066,25 @@ class Controller( HydrusController.HydrusController ):
         return False
         
     
-    def THREADDoFileQuery( self, query_key, search_context ):
+    def THREADDoFileQuery( self, query_key, search_context, sort_by = None ):
         
-        query_hash_ids = self.Read( 'file_query_ids', search_context )
+        try:
+            
+            query_hash_ids = self.Read( 'file_query_ids', search_context, sort_by = sort_by, query_key = query_key )
+            
+        except HydrusExceptions.DBException:
+            
+            # the db interrupts a cancelled query, which can occasionally spoil its transaction
+            
+            if query_key.IsCancelled():
+                
+                return
+                
+            else:
+                
+                raise
+                
+            
         
         media_results = []
         
@@ -1058,6 +1096,10 @@ class Controller( HydrusController.HydrusController ):
             
             media_results.extend( more_media_results )
             
+            # the ids come back in sort order, so a page that is streaming can put each batch up as it arrives
+            
+            self.pub( 'add_media_results_from_query', query_key, more_media_results )
+            
             self.pub( 'set_num_query_results', len( media_results ), len( query_hash_ids ) )
             
             self.WaitUntilPubSubsEmpty()
@@ -1,11 +1,15 @@
+import ClientCaches
 import ClientData
 import ClientDefaults
 import ClientFiles
 import ClientImporting
 import ClientMedia
+import ClientPostingLists
 import ClientRatings
 import ClientThreading
+import ClientVPTree
 import collections
+import distutils.version
 import hashlib
 import httplib
 import itertools
@@ -116,7 +120,9 @@ class MessageDB( object ):
                         
                         with open( temp_path, 'wb' ) as f: f.write( file )
                         
-                        ( result, hash ) = self._ImportFile( temp_path, override_deleted = True ) # what if the file fails?
+                        file_import_job = ClientFiles.FileImportJob( temp_path, override_deleted = True )
+                        
+                        ( result, hash ) = self._ImportFile( file_import_job ) # what if the file fails?
                         
                         attachment_hashes.append( hash )
                         
@@ -1025,10 +1031,45 @@ def GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id ):
     
     return ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name )
     
+def GenerateTrigrams( text ):
+    
+    text = text.lower()
+    
+    return { text[ i : i + 3 ] for i in range( len( text ) - 2 ) }
+    
 class DB( HydrusDB.HydrusDB ):
     
+    CONCURRENT_READ_ACTIONS = [ 'autocomplete_predicates', 'file_hashes', 'file_query_ids', 'filter_hashes', 'hash_status', 'known_urls', 'md5_status', 'media_results', 'media_results_from_ids', 'related_tags', 'similar_files_duplicate_pairs', 'url_status' ]
+    GROUP_COMMIT_ACTIONS = [ 'content_updates', 'hydrus_session', 'import_file', 'import_files', 'push_recent_tags', 'serialisable', 'serialisable_simple', 'web_session' ]
     READ_WRITE_ACTIONS = [ 'service_info', 'system_predicates' ]
     
+    # a namespaceless tag's posting list covers all its namespaces, and namespace_id 0 is never a real namespace
+    POSTING_LISTS_ANY_NAMESPACE_ID = 0
+    POSTING_LISTS_MIN_COUNT = 10000
+    
+    STAGED_MAPPINGS_MIN_ROWS = 256
+    
+    def __init__( self, controller, db_dir, db_name, no_wal = False ):
+        
+        self._autocomplete_counts_cache = ClientCaches.AutocompleteCountsCache( 100000 )
+        self._media_result_cache = ClientCaches.MediaResultCache( controller )
+        self._namespace_strings_cache = ClientCaches.IdsToStringsCache( 10000 )
+        self._tag_strings_cache = ClientCaches.IdsToStringsCache( 250000 )
+        
+        # staged mappings use row values, which arrived in 3.15.0
+        
+        if distutils.version.LooseVersion( sqlite3.sqlite_version ) < distutils.version.LooseVersion( '3.15.0' ):
+            
+            self._staged_mappings_ok = False
+            
+        else:
+            
+            self._staged_mappings_ok = True
+            
+        
+        HydrusDB.HydrusDB.__init__( self, controller, db_dir, db_name, no_wal = no_wal )
+        
+    
     def _AddFilesInfo( self, rows, overwrite = False ):
         
         if overwrite:
@@ -1056,6 +1097,8 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.executemany( 'INSERT OR IGNORE INTO current_files VALUES ( ?, ?, ? );', ( ( service_id, hash_id, timestamp ) for ( hash_id, timestamp ) in rows if hash_id in valid_hash_ids ) )
             
+            self._PostingListsAddFiles( service_id, valid_hash_ids )
+            
             splayed_valid_hash_ids = HydrusData.SplayListForDB( valid_hash_ids )
             
             self._c.execute( 'DELETE FROM deleted_files WHERE service_id = ? AND hash_id IN ' + splayed_valid_hash_ids + ';', ( service_id, ) )
@@ -1240,6 +1283,11 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _AddTagTrigrams( self, tag_ids_and_tags ):
+        
+        self._c.executemany( 'INSERT OR IGNORE INTO tag_trigrams ( trigram, tag_id ) VALUES ( ?, ? );', ( ( trigram, tag_id ) for ( tag_id, tag ) in tag_ids_and_tags for trigram in GenerateTrigrams( tag ) ) )
+        
+    
     def _AddWebSession( self, name, cookies, expires ):
         
         self._c.execute( 'REPLACE INTO web_sessions ( name, cookies, expiry ) VALUES ( ?, ?, ? );', ( name, cookies, expires ) )
@@ -1406,11 +1454,15 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'DROP TABLE ' + ac_cache_table_name + ';' )
         
+        self._autocomplete_counts_cache.Clear()
+        
     
     def _CacheCombinedFilesMappingsGenerate( self, service_id ):
         
         ac_cache_table_name = GenerateCombinedFilesMappingsCacheTableName( service_id )
         
+        self._autocomplete_counts_cache.Clear()
+        
         self._c.execute( 'CREATE TABLE ' + ac_cache_table_name + ' ( namespace_id INTEGER, tag_id INTEGER, current_count INTEGER, pending_count INTEGER, PRIMARY KEY( namespace_id, tag_id ) ) WITHOUT ROWID;' )
         
         #
@@ -1512,6 +1564,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'INSERT OR IGNORE INTO ' + files_table_name + ' VALUES ( ? );', ( ( hash_id, ) for hash_id in hash_ids ) )
         
+        self._autocomplete_counts_cache.InvalidateFileService( file_service_id )
+        
         ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
         
         ac_cache_changes = []
@@ -1600,6 +1654,39 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _CacheSpecificMappingsAddStagedMappings( self, file_service_id, tag_service_id ):
+        
+        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        
+        self._StageSpecificMappings( file_service_id, tag_service_id )
+        
+        try:
+            
+            pending_rescinded_counts = self._c.execute( 'SELECT namespace_id, tag_id, COUNT( * ) FROM temp_specific_mappings CROSS JOIN ' + pending_mappings_table_name + ' USING ( hash_id, namespace_id, tag_id ) GROUP BY namespace_id, tag_id;' ).fetchall()
+            
+            if len( pending_rescinded_counts ) > 0:
+                
+                self._c.execute( 'DELETE FROM ' + pending_mappings_table_name + ' WHERE ( hash_id, namespace_id, tag_id ) IN ( SELECT hash_id, namespace_id, tag_id FROM temp_specific_mappings );' )
+                
+            
+            added_counts = self._c.execute( 'SELECT namespace_id, tag_id, COUNT( * ) FROM temp_specific_mappings AS t WHERE NOT EXISTS ( SELECT 1 FROM ' + current_mappings_table_name + ' AS m WHERE m.hash_id = t.hash_id AND m.namespace_id = t.namespace_id AND m.tag_id = t.tag_id ) GROUP BY namespace_id, tag_id;' ).fetchall()
+            
+            if len( added_counts ) > 0:
+                
+                self._c.execute( 'INSERT OR IGNORE INTO ' + current_mappings_table_name + ' ( hash_id, namespace_id, tag_id ) SELECT hash_id, namespace_id, tag_id FROM temp_specific_mappings;' )
+                
+            
+        finally:
+            
+            self._c.execute( 'DROP TABLE temp_specific_mappings;' )
+            
+        
+        count_ids = [ ( namespace_id, tag_id, num_added, 0 ) for ( namespace_id, tag_id, num_added ) in added_counts ]
+        count_ids.extend( ( ( namespace_id, tag_id, 0, - num_pending_rescinded ) for ( namespace_id, tag_id, num_pending_rescinded ) in pending_rescinded_counts ) )
+        
+        self._CacheSpecificMappingsUpdate( file_service_id, tag_service_id, count_ids )
+        
+    
     def _CacheSpecificMappingsDrop( self, file_service_id, tag_service_id ):
         
         ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
@@ -1612,6 +1699,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'DROP TABLE ' + ac_cache_table_name + ';' )
         
+        self._autocomplete_counts_cache.Clear()
+        
     
     def _CacheSpecificMappingsDeleteFiles( self, file_service_id, tag_service_id, hash_ids ):
         
@@ -1619,6 +1708,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'DELETE FROM ' + files_table_name + ' WHERE hash_id = ?;', ( ( hash_id, ) for hash_id in hash_ids ) )
         
+        self._autocomplete_counts_cache.InvalidateFileService( file_service_id )
+        
         ac_cache_changes = []
         
         for group_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, 100 ):
@@ -1692,6 +1783,31 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _CacheSpecificMappingsDeleteStagedMappings( self, file_service_id, tag_service_id ):
+        
+        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        
+        self._StageSpecificMappings( file_service_id, tag_service_id )
+        
+        try:
+            
+            deleted_counts = self._c.execute( 'SELECT namespace_id, tag_id, COUNT( * ) FROM temp_specific_mappings CROSS JOIN ' + current_mappings_table_name + ' USING ( hash_id, namespace_id, tag_id ) GROUP BY namespace_id, tag_id;' ).fetchall()
+            
+            if len( deleted_counts ) > 0:
+                
+                self._c.execute( 'DELETE FROM ' + current_mappings_table_name + ' WHERE ( hash_id, namespace_id, tag_id ) IN ( SELECT hash_id, namespace_id, tag_id FROM temp_specific_mappings );' )
+                
+            
+        finally:
+            
+            self._c.execute( 'DROP TABLE temp_specific_mappings;' )
+            
+        
+        count_ids = [ ( namespace_id, tag_id, - num_deleted, 0 ) for ( namespace_id, tag_id, num_deleted ) in deleted_counts ]
+        
+        self._CacheSpecificMappingsUpdate( file_service_id, tag_service_id, count_ids )
+        
+    
     def _CacheSpecificMappingsFilterHashIds( self, file_service_id, tag_service_id, hash_ids ):
         
         ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
@@ -1784,6 +1900,17 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _CacheSpecificMappingsUpdate( self, file_service_id, tag_service_id, count_ids ):
+        
+        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        
+        self._c.executemany( 'INSERT OR IGNORE INTO ' + ac_cache_table_name + ' ( namespace_id, tag_id, current_count, pending_count ) VALUES ( ?, ?, ?, ? );', ( ( namespace_id, tag_id, 0, 0 ) for ( namespace_id, tag_id, current_delta, pending_delta ) in count_ids ) )
+        
+        self._c.executemany( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ?, pending_count = pending_count + ? WHERE namespace_id = ? AND tag_id = ?;', ( ( current_delta, pending_delta, namespace_id, tag_id ) for ( namespace_id, tag_id, current_delta, pending_delta ) in count_ids ) )
+        
+        self._c.executemany( 'DELETE FROM ' + ac_cache_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND current_count = ? AND pending_count = ?;', ( ( namespace_id, tag_id, 0, 0 ) for ( namespace_id, tag_id, current_delta, pending_delta ) in count_ids ) )
+        
+    
     def _CheckDBIntegrity( self ):
         
         prefix_string = 'checking db integrity: '
@@ -1949,6 +2076,9 @@ class DB( HydrusDB.HydrusDB ):
         self._subscriptions_cache = {}
         self._service_cache = {}
         
+        self._namespace_strings_cache.Clear()
+        self._tag_strings_cache.Clear()
+        
     
     def _CreateDB( self ):
         
@@ -2115,8 +2245,26 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'CREATE VIRTUAL TABLE IF NOT EXISTS external_master.tags_fts4 USING fts4( tag );' )
         
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.tag_trigrams ( trigram TEXT, tag_id INTEGER, PRIMARY KEY ( trigram, tag_id ) ) WITHOUT ROWID;' )
+        
         self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.texts ( text_id INTEGER PRIMARY KEY, text TEXT UNIQUE );' )
         
+        # caches
+        
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.perceptual_hash_vptree ( hash_id INTEGER PRIMARY KEY, parent_id INTEGER, radius INTEGER, inner_id INTEGER, inner_population INTEGER, outer_id INTEGER, outer_population INTEGER );' )
+        self._c.execute( 'CREATE INDEX IF NOT EXISTS external_caches.perceptual_hash_vptree_parent_id_index ON perceptual_hash_vptree ( parent_id );' )
+        
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.perceptual_hash_vptree_regen ( hash_id INTEGER PRIMARY KEY );' )
+        
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.perceptual_hash_pairs ( smaller_hash_id INTEGER, larger_hash_id INTEGER, distance INTEGER, PRIMARY KEY ( smaller_hash_id, larger_hash_id ) );' )
+        self._c.execute( 'CREATE INDEX IF NOT EXISTS external_caches.perceptual_hash_pairs_larger_hash_id_index ON perceptual_hash_pairs ( larger_hash_id );' )
+        
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.perceptual_hash_pairs_searched ( hash_id INTEGER PRIMARY KEY, searched_distance INTEGER );' )
+        
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.file_posting_lists ( service_id INTEGER PRIMARY KEY, posting_list BLOB_BYTES );' )
+        
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.tag_posting_lists ( tag_service_id INTEGER, tag_id INTEGER, namespace_id INTEGER, current_posting_list BLOB_BYTES, pending_posting_list BLOB_BYTES, PRIMARY KEY ( tag_service_id, tag_id, namespace_id ) );' )
+        
         # inserts
         
         location = HydrusPaths.ConvertAbsPathToPortablePath( client_files_default )
@@ -2199,6 +2347,8 @@ class DB( HydrusDB.HydrusDB ):
             self._c.execute( 'DELETE FROM current_files WHERE service_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( service_id, ) )
             self._c.execute( 'DELETE FROM file_petitions WHERE service_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( service_id, ) )
             
+            self._PostingListsDeleteFiles( service_id, valid_hash_ids )
+            
             if service_id == self._local_file_service_id:
                 
                 self._AddFiles( self._trash_service_id, rows )
@@ -2311,6 +2461,15 @@ class DB( HydrusDB.HydrusDB ):
             
             self._controller.CallToThread( client_files_manager.DelayedDeleteFiles, file_hashes )
             
+            self._PHashesDeleteFromTree( deletable_file_hash_ids )
+            
+            splayed_deletable_file_hash_ids = HydrusData.SplayListForDB( deletable_file_hash_ids )
+            
+            self._c.execute( 'DELETE FROM perceptual_hashes WHERE hash_id IN ' + splayed_deletable_file_hash_ids + ';' )
+            
+            self._c.execute( 'DELETE FROM perceptual_hash_pairs WHERE smaller_hash_id IN ' + splayed_deletable_file_hash_ids + ' OR larger_hash_id IN ' + splayed_deletable_file_hash_ids + ';' )
+            self._c.execute( 'DELETE FROM perceptual_hash_pairs_searched WHERE hash_id IN ' + splayed_deletable_file_hash_ids + ';' )
+            
         
         useful_thumbnail_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id != ? AND hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ';', ( self._trash_service_id, ) ) }
         
@@ -2364,6 +2523,8 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
+        self._PostingListsDrop( service_id )
+        
         if service_id in self._service_cache:
             
             del self._service_cache[ service_id ]
@@ -2539,6 +2700,46 @@ class DB( HydrusDB.HydrusDB ):
         return hashes_result
         
     
+    def _FilterOrphans( self, test_type, possible_hashes ):
+        
+        orphan_hashes = []
+        hash_ids_to_hashes = {}
+        
+        for possible_hash in possible_hashes:
+            
+            result = self._c.execute( 'SELECT hash_id FROM hashes WHERE hash = ?;', ( sqlite3.Binary( possible_hash ), ) ).fetchone()
+            
+            if result is None:
+                
+                orphan_hashes.append( possible_hash )
+                
+            else:
+                
+                ( hash_id, ) = result
+                
+                hash_ids_to_hashes[ hash_id ] = possible_hash
+                
+            
+        
+        if len( hash_ids_to_hashes ) > 0:
+            
+            splayed_hash_ids = HydrusData.SplayListForDB( hash_ids_to_hashes.keys() )
+            
+            if test_type == 'file':
+                
+                current_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id IN ( ?, ? ) AND hash_id IN ' + splayed_hash_ids + ';', ( self._local_file_service_id, self._trash_service_id ) ) }
+                
+            elif test_type == 'thumbnail':
+                
+                current_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE hash_id IN ' + splayed_hash_ids + ';' ) }
+                
+            
+            orphan_hashes.extend( ( hash for ( hash_id, hash ) in hash_ids_to_hashes.items() if hash_id not in current_hash_ids ) )
+            
+        
+        return orphan_hashes
+        
+    
     def _GetAutocompleteCounts( self, tag_service_id, file_service_id, namespace_id_tag_ids, there_was_a_namespace, add_namespaceless ):
         
         namespace_ids_to_tag_ids = HydrusData.BuildKeyToListDict( namespace_id_tag_ids )
@@ -2670,7 +2871,7 @@ class DB( HydrusDB.HydrusDB ):
                 
                 # the issue is that the tokenizer for fts4 doesn't like weird characters
                 # a search for '[s' actually only does 's'
-                # so, let's do the old and slower LIKE instead of MATCH in weird cases
+                # so, let's do LIKE on the trigram index instead of MATCH in weird cases
                 
                 # note that queries with '*' are also passed to LIKE, because MATCH only supports appended wildcards 'gun*', and not complex stuff like '*gun*'
                 
@@ -2691,7 +2892,7 @@ class DB( HydrusDB.HydrusDB ):
                         possible_tag_ids_half_complete_tag += '%'
                         
                     
-                    return [ tag_id for ( tag_id, ) in self._c.execute( 'SELECT tag_id FROM tags WHERE tag LIKE ? OR tag LIKE ?;', ( possible_tag_ids_half_complete_tag, '% ' + possible_tag_ids_half_complete_tag ) ) ]
+                    return self._GetTagIdsFromWildcard( possible_tag_ids_half_complete_tag )
                     
                 
             
@@ -2763,6 +2964,10 @@ class DB( HydrusDB.HydrusDB ):
     
     def _GetAutocompletePredicates( self, tag_service_key = CC.COMBINED_TAG_SERVICE_KEY, file_service_key = CC.COMBINED_FILE_SERVICE_KEY, search_text = '', exact_match = False, inclusive = True, include_current = True, include_pending = True, add_namespaceless = False ):
         
+        # get this before we look at the db, so any write that lands while we work stops us caching a stale result
+        
+        cache_generation = self._autocomplete_counts_cache.GetGeneration()
+        
         namespace_id_tag_ids = self._GetAutocompleteNamespaceIdTagIds( search_text, exact_match )
         
         tag_service_id = self._GetServiceId( tag_service_key )
@@ -2770,17 +2975,40 @@ class DB( HydrusDB.HydrusDB ):
         
         there_was_a_namespace = ':' in search_text
         
-        ids_to_count = self._GetAutocompleteCounts( tag_service_id, file_service_id, namespace_id_tag_ids, there_was_a_namespace, add_namespaceless )
+        use_cache = not exact_match and search_text != ''
+        
+        cache_search_key = ( tag_service_id, file_service_id, there_was_a_namespace, add_namespaceless )
+        
+        tags_and_counts = None
+        
+        if use_cache:
+            
+            tags_and_counts = self._autocomplete_counts_cache.GetTagsAndCounts( cache_search_key, search_text, namespace_id_tag_ids, self._null_namespace_id )
+            
+        
+        if tags_and_counts is None:
+            
+            ids_to_count = self._GetAutocompleteCounts( tag_service_id, file_service_id, namespace_id_tag_ids, there_was_a_namespace, add_namespaceless )
+            
+            ids_to_tags_and_counts = { ( namespace_id, tag_id ) : ( self._GetNamespaceTag( namespace_id, tag_id ), counts ) for ( ( namespace_id, tag_id ), counts ) in ids_to_count.items() }
+            
+            if use_cache:
+                
+                self._autocomplete_counts_cache.AddResults( cache_search_key, search_text, namespace_id_tag_ids, ids_to_tags_and_counts, cache_generation )
+                
+            
+            tags_and_counts = ids_to_tags_and_counts.values()
+            
         
         #
         
-        tags_to_ids = { self._GetNamespaceTag( namespace_id, tag_id ) : ( namespace_id, tag_id ) for ( namespace_id, tag_id ) in ids_to_count.keys() }
+        tags_to_counts = dict( tags_and_counts )
         
         tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
         
-        filtered_tags = tag_censorship_manager.FilterTags( tag_service_key, tags_to_ids.keys() )
+        filtered_tags = tag_censorship_manager.FilterTags( tag_service_key, tags_to_counts.keys() )
         
-        filtered_tags_and_counts = [ ( tag, ids_to_count[ tags_to_ids[ tag ] ] ) for tag in filtered_tags ]
+        filtered_tags_and_counts = [ ( tag, tags_to_counts[ tag ] ) for tag in filtered_tags ]
         
         predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, tag, inclusive, min_current_count = min_current_count, min_pending_count = min_pending_count, max_current_count = max_current_count, max_pending_count = max_pending_count ) for ( tag, ( min_current_count, max_current_count, min_pending_count, max_pending_count) ) in filtered_tags_and_counts ]
         
@@ -2796,6 +3024,88 @@ class DB( HydrusDB.HydrusDB ):
     
     def _GetDownloads( self ): return { hash for ( hash, ) in self._c.execute( 'SELECT hash FROM file_transfers, hashes USING ( hash_id ) WHERE service_id = ?;', ( self._local_file_service_id, ) ) }
     
+    def _GetEstimatedNumFiles( self, service_id ):
+        
+        # this is just for the search planner, so it reads service_info directly rather than calculating and writing back anything missing
+        
+        result = self._c.execute( 'SELECT info FROM service_info WHERE service_id = ? AND info_type = ?;', ( service_id, HC.SERVICE_INFO_NUM_FILES ) ).fetchone()
+        
+        if result is None:
+            
+            result = self._c.execute( 'SELECT MAX( hash_id ) FROM hashes;' ).fetchone()
+            
+        
+        ( num_files, ) = result
+        
+        if num_files is None:
+            
+            num_files = 0
+            
+        
+        return num_files
+        
+    
+    def _GetEstimatedTagCount( self, file_service_id, tag_service_id, tag, include_current_tags, include_pending_tags ):
+        
+        file_service_type = self._GetService( file_service_id ).GetServiceType()
+        
+        if file_service_type not in ( HC.COMBINED_FILE, HC.LOCAL_FILE, HC.FILE_REPOSITORY ) or ( file_service_id == self._combined_file_service_id and tag_service_id == self._combined_tag_service_id ):
+            
+            # there are no autocomplete counts for this domain, so assume the worst
+            
+            return self._GetEstimatedNumFiles( file_service_id )
+            
+        
+        siblings_manager = self._controller.GetManager( 'tag_siblings' )
+        
+        tags = siblings_manager.GetAllSiblings( tag )
+        
+        namespace_id_tag_ids = []
+        
+        for tag in tags:
+            
+            if not self._TagExists( tag ):
+                
+                continue
+                
+            
+            try:
+                
+                namespace_id_tag_ids.append( self._GetNamespaceIdTagId( tag ) )
+                
+            except HydrusExceptions.SizeException:
+                
+                continue
+                
+            
+        
+        if len( namespace_id_tag_ids ) == 0:
+            
+            return 0
+            
+        
+        # a namespaceless tag also matches all its namespaced versions, so this undercounts it. it is only for ordering
+        
+        ids_to_count = self._GetAutocompleteCounts( tag_service_id, file_service_id, namespace_id_tag_ids, True, False )
+        
+        estimated_count = 0
+        
+        for ( current_min, current_max, pending_min, pending_max ) in ids_to_count.values():
+            
+            if include_current_tags:
+                
+                estimated_count += current_min
+                
+            
+            if include_pending_tags:
+                
+                estimated_count += pending_min
+                
+            
+        
+        return estimated_count
+        
+    
     def _GetFileHashes( self, given_hashes, given_hash_type, desired_hash_type ):
         
         if given_hash_type == 'sha256':
@@ -2836,6 +3146,60 @@ class DB( HydrusDB.HydrusDB ):
         return desired_hashes
         
     
+    def _GetFileQueryIds( self, search_context, sort_by = None, query_key = None ):
+        
+        # with a query_key, cancelling the query interrupts whatever statement the db is running, rather than letting it finish and throwing the results away
+        
+        if query_key is not None:
+            
+            self._db.set_progress_handler( query_key.IsCancelled, 1000 )
+            
+        
+        try:
+            
+            query_hash_ids = self._GetHashIdsFromQuery( search_context )
+            
+            limit = search_context.GetSystemPredicates().GetLimit()
+            
+            query_hash_ids = self._SortHashIds( search_context.GetFileServiceKey(), query_hash_ids, sort_by = sort_by, limit = limit )
+            
+        except sqlite3.OperationalError:
+            
+            if query_key is not None and query_key.IsCancelled():
+                
+                return []
+                
+            else:
+                
+                raise
+                
+            
+        finally:
+            
+            if query_key is not None:
+                
+                self._db.set_progress_handler( None, 0 )
+                
+                if query_key.IsCancelled():
+                    
+                    # an interrupted select may not have cleaned up after itself
+                    
+                    self._c.execute( 'DROP TABLE IF EXISTS mem.temp_candidate_hash_ids;' )
+                    self._c.execute( 'DROP TABLE IF EXISTS mem.temp_tag_string_tag_ids;' )
+                    
+                
+            
+        
+        if query_key is not None and query_key.IsCancelled():
+            
+            # a small query can finish before the progress handler gets a look in
+            
+            return []
+            
+        
+        return query_hash_ids
+        
+    
     def _GetFileSystemPredicates( self, service_key ):
         
         service_id = self._GetServiceId( service_key )
@@ -2981,14 +3345,9 @@ class DB( HydrusDB.HydrusDB ):
         return hash_ids
         
     
-    def _GetHashIdsFromNamespace( self, file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromMappings( self, file_service_key, tag_service_key, predicate_phrases, include_current_tags, include_pending_tags, candidate_hash_ids = None ):
         
         file_service_id = self._GetServiceId( file_service_key )
-        tag_service_id = self._GetServiceId( tag_service_key )
-        namespace_id = self._GetNamespaceId( namespace )
-        
-        current_selects = []
-        pending_selects = []
         
         if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
             
@@ -2996,54 +3355,101 @@ class DB( HydrusDB.HydrusDB ):
             
         else:
             
-            search_tag_service_ids = [ tag_service_id ]
+            search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
             
         
+        mappings_table_names = []
+        
         for search_tag_service_id in search_tag_service_ids:
             
             ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
             
-            if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+            if include_current_tags:
                 
-                current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE namespace_id = ' + str( namespace_id ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE namespace_id = ' + str( namespace_id ) + ';' )
+                mappings_table_names.append( current_mappings_table_name )
                 
-            else:
+            
+            if include_pending_tags:
                 
-                current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id = ' + str( namespace_id ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id = ' + str( namespace_id ) + ';' )
+                mappings_table_names.append( pending_mappings_table_name )
                 
             
         
-        hash_ids = set()
+        selects = []
         
-        if include_current_tags:
+        for mappings_table_name in mappings_table_names:
             
-            for current_select in current_selects:
+            for predicate_phrase in predicate_phrases:
                 
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
+                if candidate_hash_ids is not None:
+                    
+                    # the candidates are already in the file domain
+                    
+                    selects.append( 'SELECT hash_id FROM mem.temp_candidate_hash_ids CROSS JOIN ' + mappings_table_name + ' USING ( hash_id ) WHERE ' + predicate_phrase + ';' )
+                    
+                elif file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+                    
+                    selects.append( 'SELECT hash_id FROM ' + mappings_table_name + ' WHERE ' + predicate_phrase + ';' )
+                    
+                else:
+                    
+                    selects.append( 'SELECT hash_id FROM ' + mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND ' + predicate_phrase + ';' )
+                    
                 
             
         
-        if include_pending_tags:
+        if candidate_hash_ids is not None:
             
-            for pending_select in pending_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                
+            return { hash_id for ( hash_id, ) in self._SelectFromCandidateHashIds( candidate_hash_ids, selects ) }
+            
+        
+        hash_ids = set()
+        
+        for select in selects:
+            
+            hash_ids.update( ( id for ( id, ) in self._c.execute( select ) ) )
             
         
         return hash_ids
         
     
-    def _GetHashIdsFromQuery( self, search_context ):
+    def _GetHashIdsFromNamespace( self, file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags, candidate_hash_ids = None ):
         
-        self._controller.ResetIdleTimer()
+        namespace_id = self._GetNamespaceId( namespace )
         
-        system_predicates = search_context.GetSystemPredicates()
+        predicate_phrase = 'namespace_id = ' + str( namespace_id )
         
-        file_service_key = search_context.GetFileServiceKey()
-        tag_service_key = search_context.GetTagServiceKey()
+        return self._GetHashIdsFromMappings( file_service_key, tag_service_key, [ predicate_phrase ], include_current_tags, include_pending_tags, candidate_hash_ids = candidate_hash_ids )
+        
+    
+    def _GetHashIdsFromQuery( self, search_context ):
+        
+        # the candidates stay in mem.temp_candidate_hash_ids for the whole query. the first lookup fills it, and later ones just delete what the other predicates have ruled out
+        
+        self._c.execute( 'CREATE TABLE mem.temp_candidate_hash_ids ( hash_id INTEGER PRIMARY KEY );' )
+        
+        self._thread_local.candidate_hash_ids = set()
+        
+        try:
+            
+            return self._GetHashIdsFromQueryPredicates( search_context )
+            
+        finally:
+            
+            self._thread_local.candidate_hash_ids = None
+            
+            self._c.execute( 'DROP TABLE mem.temp_candidate_hash_ids;' )
+            
+        
+    
+    def _GetHashIdsFromQueryPredicates( self, search_context ):
+        
+        self._controller.ResetIdleTimer()
+        
+        system_predicates = search_context.GetSystemPredicates()
+        
+        file_service_key = search_context.GetFileServiceKey()
+        tag_service_key = search_context.GetTagServiceKey()
         
         file_service_id = self._GetServiceId( file_service_key )
         tag_service_id = self._GetServiceId( tag_service_key )
@@ -3158,26 +3564,95 @@ class DB( HydrusDB.HydrusDB ):
             else: files_info_predicates.append( '( duration < ' + str( max_duration ) + ' OR duration IS NULL )' )
             
         
-        if len( tags_to_include ) > 0 or len( namespaces_to_include ) > 0 or len( wildcards_to_include ) > 0:
+        # the most selective include, going by the autocomplete counts, makes the first set of candidates
+        # after that, any predicate that would pull more rows than we have candidates is run as lookups from the candidates instead
+        
+        num_files_estimate = self._GetEstimatedNumFiles( file_service_id )
+        
+        query_hash_ids = None
+        
+        def GetCandidateHashIds( estimated_num_rows ):
+            
+            # a lookup is a b-tree search, so it needs to save a few rows of scanning to be worth it
+            
+            if query_hash_ids is not None and len( query_hash_ids ) * 4 < estimated_num_rows:
+                
+                return query_hash_ids
+                
+            else:
+                
+                return None
+                
+            
+        
+        # with posting lists, the tags are combined in compressed form and only the files that pass all of them become python ints
+        
+        use_posting_lists = False
+        
+        if len( tags_to_include ) > 0 and self._controller.GetNewOptions().GetBoolean( 'tag_posting_lists' ):
+            
+            if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+                
+                file_posting_list = None
+                
+                use_posting_lists = True
+                
+            else:
+                
+                file_posting_list = self._PostingListsGetFilePostingList( file_service_id )
+                
+                use_posting_lists = file_posting_list is not None
+                
             
-            query_hash_ids = None
+        
+        if len( tags_to_include ) > 0 or len( namespaces_to_include ) > 0 or len( wildcards_to_include ) > 0:
             
-            if len( tags_to_include ) > 0:
+            if use_posting_lists:
+                
+                posting_lists = [ self._PostingListsGetTagPostingList( tag_service_key, tag, include_current_tags, include_pending_tags ) for tag in tags_to_include ]
+                
+                if file_posting_list is not None:
+                    
+                    posting_lists.append( file_posting_list )
+                    
+                
+                posting_list = ClientPostingLists.MassIntersect( posting_lists )
+                
+                if len( tags_to_exclude ) > 0:
+                    
+                    posting_list = posting_list.Difference( ClientPostingLists.MassUnion( [ self._PostingListsGetTagPostingList( tag_service_key, tag, include_current_tags, include_pending_tags ) for tag in tags_to_exclude ] ) )
+                    
+                    tags_to_exclude = []
+                    
+                
+                query_hash_ids = set( posting_list.GetHashIds() )
+                
+            else:
+                
+                estimated_tags_to_include = [ ( self._GetEstimatedTagCount( file_service_id, tag_service_id, tag, include_current_tags, include_pending_tags ), tag ) for tag in tags_to_include ]
                 
-                query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) for tag in tags_to_include ) )
+                estimated_tags_to_include.sort()
+                
+                for ( estimated_count, tag ) in estimated_tags_to_include:
+                    
+                    tag_query_hash_ids = self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags, candidate_hash_ids = GetCandidateHashIds( estimated_count ) )
+                    
+                    if query_hash_ids is None: query_hash_ids = tag_query_hash_ids
+                    else: query_hash_ids.intersection_update( tag_query_hash_ids )
+                    
                 
             
-            if len( namespaces_to_include ) > 0:
+            for namespace in namespaces_to_include:
                 
-                namespace_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ) for namespace in namespaces_to_include ) )
+                namespace_query_hash_ids = self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags, candidate_hash_ids = GetCandidateHashIds( num_files_estimate ) )
                 
                 if query_hash_ids is None: query_hash_ids = namespace_query_hash_ids
                 else: query_hash_ids.intersection_update( namespace_query_hash_ids )
                 
             
-            if len( wildcards_to_include ) > 0:
+            for wildcard in wildcards_to_include:
                 
-                wildcard_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ) for wildcard in wildcards_to_include ) )
+                wildcard_query_hash_ids = self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags, candidate_hash_ids = GetCandidateHashIds( num_files_estimate ) )
                 
                 if query_hash_ids is None: query_hash_ids = wildcard_query_hash_ids
                 else: query_hash_ids.intersection_update( wildcard_query_hash_ids )
@@ -3185,7 +3660,24 @@ class DB( HydrusDB.HydrusDB ):
             
             if len( files_info_predicates ) > 0:
                 
-                if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+                candidate_hash_ids = GetCandidateHashIds( num_files_estimate )
+                
+                if candidate_hash_ids is not None:
+                    
+                    if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+                        
+                        select = 'SELECT hash_id FROM mem.temp_candidate_hash_ids CROSS JOIN files_info USING ( hash_id ) WHERE ' + ' AND '.join( files_info_predicates ) + ';'
+                        
+                    else:
+                        
+                        files_info_predicates.insert( 0, 'service_id = ' + str( file_service_id ) )
+                        
+                        select = 'SELECT hash_id FROM mem.temp_candidate_hash_ids CROSS JOIN current_files USING ( hash_id ) CROSS JOIN files_info USING ( hash_id ) WHERE ' + ' AND '.join( files_info_predicates ) + ';'
+                        
+                    
+                    query_hash_ids = { id for ( id, ) in self._SelectFromCandidateHashIds( candidate_hash_ids, [ select ] ) }
+                    
+                elif file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
                     
                     query_hash_ids.intersection_update( [ id for ( id, ) in self._c.execute( 'SELECT hash_id FROM files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) ] )
                     
@@ -3223,7 +3715,7 @@ class DB( HydrusDB.HydrusDB ):
                 
                 if len( result ) == 0:
                     
-                    query_hash_ids = {}
+                    query_hash_ids = set()
                     
                 else:
                     
@@ -3260,7 +3752,7 @@ class DB( HydrusDB.HydrusDB ):
                 
                 ( phash, ) = result
                 
-                similar_hash_ids = [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM perceptual_hashes WHERE hydrus_hamming( phash, ? ) <= ?;', ( sqlite3.Binary( phash ), max_hamming ) ) ]
+                similar_hash_ids = self._PHashesSearch( phash, max_hamming )
                 
                 query_hash_ids.intersection_update( similar_hash_ids )
                 
@@ -3268,15 +3760,16 @@ class DB( HydrusDB.HydrusDB ):
         
         #
         
-        exclude_query_hash_ids = set()
-        
-        for tag in tags_to_exclude: exclude_query_hash_ids.update( self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) )
-        
-        for namespace in namespaces_to_exclude: exclude_query_hash_ids.update( self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ) )
+        for tag in tags_to_exclude:
+            
+            estimated_count = self._GetEstimatedTagCount( file_service_id, tag_service_id, tag, include_current_tags, include_pending_tags )
+            
+            query_hash_ids.difference_update( self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags, candidate_hash_ids = GetCandidateHashIds( estimated_count ) ) )
+            
         
-        for wildcard in wildcards_to_exclude: exclude_query_hash_ids.update( self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ) )
+        for namespace in namespaces_to_exclude: query_hash_ids.difference_update( self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags, candidate_hash_ids = GetCandidateHashIds( num_files_estimate ) ) )
         
-        query_hash_ids.difference_update( exclude_query_hash_ids )
+        for wildcard in wildcards_to_exclude: query_hash_ids.difference_update( self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags, candidate_hash_ids = GetCandidateHashIds( num_files_estimate ) ) )
         
         #
         
@@ -3286,42 +3779,44 @@ class DB( HydrusDB.HydrusDB ):
             
             service_id = self._GetServiceId( service_key )
             
-            query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( service_id, ) ) ] )
+            query_hash_ids.intersection_update( self._GetHashIdsFromServiceTable( 'current_files', service_id, candidate_hash_ids = GetCandidateHashIds( self._GetEstimatedNumFiles( service_id ) ) ) )
             
         
         for service_key in file_services_to_include_pending:
             
             service_id = self._GetServiceId( service_key )
             
-            query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM file_transfers WHERE service_id = ?;', ( service_id, ) ) ] )
+            query_hash_ids.intersection_update( self._GetHashIdsFromServiceTable( 'file_transfers', service_id, candidate_hash_ids = GetCandidateHashIds( num_files_estimate ) ) )
             
         
         for service_key in file_services_to_exclude_current:
             
             service_id = self._GetServiceId( service_key )
             
-            query_hash_ids.difference_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( service_id, ) ) ] )
+            query_hash_ids.difference_update( self._GetHashIdsFromServiceTable( 'current_files', service_id, candidate_hash_ids = GetCandidateHashIds( self._GetEstimatedNumFiles( service_id ) ) ) )
             
         
         for service_key in file_services_to_exclude_pending:
             
             service_id = self._GetServiceId( service_key )
             
-            query_hash_ids.difference_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM file_transfers WHERE service_id = ?;', ( service_id, ) ) ] )
+            query_hash_ids.difference_update( self._GetHashIdsFromServiceTable( 'file_transfers', service_id, candidate_hash_ids = GetCandidateHashIds( num_files_estimate ) ) )
             
         
         for ( operator, value, service_key ) in system_predicates.GetRatingsPredicates():
             
             service_id = self._GetServiceId( service_key )
             
-            if value == 'rated': query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM local_ratings WHERE service_id = ?;', ( service_id, ) ) ] )
-            elif value == 'not rated': query_hash_ids.difference_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM local_ratings WHERE service_id = ?;', ( service_id, ) ) ] )
+            candidate_hash_ids = GetCandidateHashIds( self._GetEstimatedNumFiles( service_id ) )
+            
+            if value == 'rated': query_hash_ids.intersection_update( self._GetHashIdsFromServiceTable( 'local_ratings', service_id, candidate_hash_ids = candidate_hash_ids ) )
+            elif value == 'not rated': query_hash_ids.difference_update( self._GetHashIdsFromServiceTable( 'local_ratings', service_id, candidate_hash_ids = candidate_hash_ids ) )
             else:
                 
                 if operator == u'\u2248': predicate = str( value * 0.95 ) + ' < rating AND rating < ' + str( value * 1.05 )
                 else: predicate = 'rating ' + operator + ' ' + str( value )
                 
-                query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM local_ratings WHERE service_id = ? AND ' + predicate + ';', ( service_id, ) ) ] )
+                query_hash_ids.intersection_update( self._GetHashIdsFromServiceTable( 'local_ratings', service_id, predicate_phrase = predicate, candidate_hash_ids = candidate_hash_ids ) )
                 
             
         
@@ -3341,7 +3836,7 @@ class DB( HydrusDB.HydrusDB ):
             
         elif must_be_local or must_not_be_local:
             
-            local_hash_ids = [ id for ( id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( self._local_file_service_id, ) ) ]
+            local_hash_ids = self._GetHashIdsFromServiceTable( 'current_files', self._local_file_service_id, candidate_hash_ids = GetCandidateHashIds( self._GetEstimatedNumFiles( self._local_file_service_id ) ) )
             
             if must_be_local:
                 
@@ -3416,7 +3911,7 @@ class DB( HydrusDB.HydrusDB ):
         
         if num_tags_zero or num_tags_nonzero or tag_predicates_care_about_zero_counts:
             
-            nonzero_tag_query_hash_ids = self._GetHashIdsThatHaveTags( tag_service_key, include_current_tags, include_pending_tags )
+            nonzero_tag_query_hash_ids = self._GetHashIdsThatHaveTags( tag_service_key, include_current_tags, include_pending_tags, candidate_hash_ids = GetCandidateHashIds( num_files_estimate ) )
             
             if num_tags_zero:
                 
@@ -3430,7 +3925,7 @@ class DB( HydrusDB.HydrusDB ):
         
         if len( tag_predicates ) > 0:
             
-            hash_id_tag_counts = self._GetHashIdsTagCounts( tag_service_key, include_current_tags, include_pending_tags )
+            hash_id_tag_counts = self._GetHashIdsTagCounts( tag_service_key, include_current_tags, include_pending_tags, candidate_hash_ids = GetCandidateHashIds( num_files_estimate ) )
             
             good_tag_count_hash_ids = { id for ( id, count ) in hash_id_tag_counts if False not in ( pred( count ) for pred in tag_predicates ) }
             
@@ -3444,40 +3939,39 @@ class DB( HydrusDB.HydrusDB ):
             query_hash_ids.intersection_update( good_tag_count_hash_ids )
             
         
-        #
+        # system:limit is applied by _SortHashIds, which can pick the top of a system sort without loading the rest
+        
+        return list( query_hash_ids )
+        
+    
+    def _GetHashIdsFromServiceTable( self, table_name, service_id, predicate_phrase = None, candidate_hash_ids = None ):
+        
+        predicate_phrases = [ 'service_id = ' + str( service_id ) ]
         
-        limit = system_predicates.GetLimit()
+        if predicate_phrase is not None:
+            
+            predicate_phrases.append( predicate_phrase )
+            
         
-        if limit is not None and limit <= len( query_hash_ids ):
+        if candidate_hash_ids is None:
             
-            query_hash_ids = random.sample( query_hash_ids, limit )
+            return { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + table_name + ' WHERE ' + ' AND '.join( predicate_phrases ) + ';' ) }
             
         else:
             
-            query_hash_ids = list( query_hash_ids )
+            select = 'SELECT hash_id FROM mem.temp_candidate_hash_ids CROSS JOIN ' + table_name + ' USING ( hash_id ) WHERE ' + ' AND '.join( predicate_phrases ) + ';'
+            
+            return { hash_id for ( hash_id, ) in self._SelectFromCandidateHashIds( candidate_hash_ids, [ select ] ) }
             
-        
-        return query_hash_ids
         
     
-    def _GetHashIdsFromTag( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromTag( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags, candidate_hash_ids = None ):
         
         siblings_manager = self._controller.GetManager( 'tag_siblings' )
         
         tags = siblings_manager.GetAllSiblings( tag )
         
-        file_service_id = self._GetServiceId( file_service_key )
-        
-        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
-            
-            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
-            
-        else:
-            
-            search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
-            
-        
-        hash_ids = set()
+        predicate_phrases = []
         
         for tag in tags:
             
@@ -3486,70 +3980,23 @@ class DB( HydrusDB.HydrusDB ):
                 continue
                 
             
-            current_selects = []
-            pending_selects = []
-            
             try: ( namespace_id, tag_id ) = self._GetNamespaceIdTagId( tag )
             except HydrusExceptions.SizeException: continue
             
             if ':' in tag:
                 
-                for search_tag_service_id in search_tag_service_ids:
-                    
-                    ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
-                    
-                    if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                        
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        
-                    else:
-                        
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        
-                    
+                predicate_phrases.append( 'namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id ) )
                 
             else:
                 
-                for search_tag_service_id in search_tag_service_ids:
-                    
-                    ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
-                    
-                    if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                        
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE tag_id = ' + str( tag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE tag_id = ' + str( tag_id ) + ';' )
-                        
-                    else:
-                        
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        
-                    
-                
-            
-            if include_current_tags:
-                
-                for current_select in current_selects:
-                    
-                    hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                    
-                
-            
-            if include_pending_tags:
-                
-                for pending_select in pending_selects:
-                    
-                    hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                    
+                predicate_phrases.append( 'tag_id = ' + str( tag_id ) )
                 
             
         
-        return hash_ids
+        return self._GetHashIdsFromMappings( file_service_key, tag_service_key, predicate_phrases, include_current_tags, include_pending_tags, candidate_hash_ids = candidate_hash_ids )
         
     
-    def _GetHashIdsFromWildcard( self, file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromWildcard( self, file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags, candidate_hash_ids = None ):
         
         def GetNamespaceIdsFromWildcard( w ):
             
@@ -3573,7 +4020,7 @@ class DB( HydrusDB.HydrusDB ):
                 
                 w = w.replace( '*', '%' )
                 
-                return { tag_id for ( tag_id, ) in self._c.execute( 'SELECT tag_id FROM tags WHERE tag LIKE ? or tag LIKE ?;', ( w, '% ' + w ) ) }
+                return self._GetTagIdsFromWildcard( w )
                 
             else:
                 
@@ -3583,20 +4030,6 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
-        file_service_id = self._GetServiceId( file_service_key )
-        
-        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
-            
-            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
-            
-        else:
-            
-            search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
-            
-        
-        current_selects = []
-        pending_selects = []
-        
         if ':' in wildcard:
             
             ( namespace_wildcard, tag_wildcard ) = wildcard.split( ':', 1 )
@@ -3604,65 +4037,19 @@ class DB( HydrusDB.HydrusDB ):
             possible_namespace_ids = GetNamespaceIdsFromWildcard( namespace_wildcard )
             possible_tag_ids = GetTagIdsFromWildcard( tag_wildcard )
             
-            for search_tag_service_id in search_tag_service_ids:
-                
-                ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
-                
-                if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                    
-                    current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    
-                else:
-                    
-                    current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    
-                
+            predicate_phrase = 'namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids )
             
         else:
             
             possible_tag_ids = GetTagIdsFromWildcard( wildcard )
             
-            for search_tag_service_id in search_tag_service_ids:
-                
-                ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
-                
-                if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                    
-                    current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    
-                else:
-                    
-                    current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    
-                
-            
-        
-        hash_ids = set()
-        
-        if include_current_tags:
-            
-            for current_select in current_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                
+            predicate_phrase = 'tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids )
             
         
-        if include_pending_tags:
-            
-            for pending_select in pending_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                
-            
-        
-        return hash_ids
+        return self._GetHashIdsFromMappings( file_service_key, tag_service_key, [ predicate_phrase ], include_current_tags, include_pending_tags, candidate_hash_ids = candidate_hash_ids )
         
     
-    def _GetHashIdsTagCounts( self, tag_service_key, include_current, include_pending ):
+    def _GetHashIdsTagCounts( self, tag_service_key, include_current, include_pending, candidate_hash_ids = None ):
         
         if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
             
@@ -3673,7 +4060,7 @@ class DB( HydrusDB.HydrusDB ):
             search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
             
         
-        tags_counter = collections.Counter()
+        mappings_table_names = []
         
         for search_tag_service_id in search_tag_service_ids:
             
@@ -3681,25 +4068,41 @@ class DB( HydrusDB.HydrusDB ):
             
             if include_current:
                 
-                for ( id, count ) in self._c.execute( 'SELECT hash_id, COUNT( DISTINCT tag_id ) FROM ' + current_mappings_table_name + ' GROUP BY hash_id;' ):
-                    
-                    tags_counter[ id ] += count
-                    
+                mappings_table_names.append( current_mappings_table_name )
                 
             
             if include_pending:
                 
-                for ( id, count ) in self._c.execute( 'SELECT hash_id, COUNT( DISTINCT tag_id ) FROM ' + pending_mappings_table_name + ' GROUP BY hash_id;' ):
+                mappings_table_names.append( pending_mappings_table_name )
+                
+            
+        
+        tags_counter = collections.Counter()
+        
+        if candidate_hash_ids is None:
+            
+            for mappings_table_name in mappings_table_names:
+                
+                for ( id, count ) in self._c.execute( 'SELECT hash_id, COUNT( DISTINCT tag_id ) FROM ' + mappings_table_name + ' GROUP BY hash_id;' ):
                     
                     tags_counter[ id ] += count
                     
                 
             
+        else:
+            
+            selects = [ 'SELECT hash_id, COUNT( DISTINCT tag_id ) FROM mem.temp_candidate_hash_ids CROSS JOIN ' + mappings_table_name + ' USING ( hash_id ) GROUP BY hash_id;' for mappings_table_name in mappings_table_names ]
+            
+            for ( id, count ) in self._SelectFromCandidateHashIds( candidate_hash_ids, selects ):
+                
+                tags_counter[ id ] += count
+                
+            
         
         return tags_counter.items()
         
     
-    def _GetHashIdsThatHaveTags( self, tag_service_key, include_current, include_pending ):
+    def _GetHashIdsThatHaveTags( self, tag_service_key, include_current, include_pending, candidate_hash_ids = None ):
         
         if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
             
@@ -3710,7 +4113,16 @@ class DB( HydrusDB.HydrusDB ):
             search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
             
         
-        nonzero_tag_hash_ids = set()
+        if candidate_hash_ids is None:
+            
+            hash_ids_table_name = 'hashes'
+            
+        else:
+            
+            hash_ids_table_name = 'mem.temp_candidate_hash_ids'
+            
+        
+        selects = []
         
         for search_tag_service_id in search_tag_service_ids:
             
@@ -3718,17 +4130,31 @@ class DB( HydrusDB.HydrusDB ):
             
             if include_current and include_pending:
                 
-                nonzero_tag_hash_ids.update( ( id for ( id, ) in self._c.execute( 'SELECT hash_id as h FROM hashes WHERE EXISTS ( SELECT 1 FROM ' + current_mappings_table_name + ' WHERE hash_id = h ) OR EXISTS ( SELECT 1 FROM ' + pending_mappings_table_name + ' WHERE hash_id = h );' ) ) )
+                selects.append( 'SELECT hash_id as h FROM ' + hash_ids_table_name + ' WHERE EXISTS ( SELECT 1 FROM ' + current_mappings_table_name + ' WHERE hash_id = h ) OR EXISTS ( SELECT 1 FROM ' + pending_mappings_table_name + ' WHERE hash_id = h );' )
                 
             elif include_current:
                 
-                nonzero_tag_hash_ids.update( ( id for ( id, ) in self._c.execute( 'SELECT hash_id as h FROM hashes WHERE EXISTS ( SELECT 1 FROM ' + current_mappings_table_name + ' WHERE hash_id = h );' ) ) )
+                selects.append( 'SELECT hash_id as h FROM ' + hash_ids_table_name + ' WHERE EXISTS ( SELECT 1 FROM ' + current_mappings_table_name + ' WHERE hash_id = h );' )
                 
             elif include_pending:
                 
-                nonzero_tag_hash_ids.update( ( id for ( id, ) in self._c.execute( 'SELECT hash_id as h FROM hashes WHERE EXISTS ( SELECT 1 FROM ' + pending_mappings_table_name + ' WHERE hash_id = h );' ) ) )
+                selects.append( 'SELECT hash_id as h FROM ' + hash_ids_table_name + ' WHERE EXISTS ( SELECT 1 FROM ' + pending_mappings_table_name + ' WHERE hash_id = h );' )
+                
+            
+        
+        if candidate_hash_ids is None:
+            
+            nonzero_tag_hash_ids = set()
+            
+            for select in selects:
+                
+                nonzero_tag_hash_ids.update( ( id for ( id, ) in self._c.execute( select ) ) )
                 
             
+        else:
+            
+            nonzero_tag_hash_ids = { id for ( id, ) in self._SelectFromCandidateHashIds( candidate_hash_ids, selects ) }
+            
         
         return nonzero_tag_hash_ids
         
@@ -3770,6 +4196,18 @@ class DB( HydrusDB.HydrusDB ):
         return ( CC.STATUS_NEW, None )
         
     
+    def _GetHashStatus( self, hash ):
+        
+        if not self._HashExists( hash ):
+            
+            return ( CC.STATUS_NEW, None )
+            
+        
+        hash_id = self._GetHashId( hash )
+        
+        return self._GetHashIdStatus( hash_id )
+        
+    
     def _GetHydrusSessions( self ):
         
         now = HydrusData.GetNow()
@@ -3877,7 +4315,7 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
-    def _GetMediaResults( self, hash_ids ):
+    def _GenerateMediaResults( self, hash_ids ):
         
         splayed_hash_ids = HydrusData.SplayListForDB( hash_ids )
         
@@ -3907,10 +4345,44 @@ class DB( HydrusDB.HydrusDB ):
         
         tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
         
-        media_results = []
+        hash_ids_to_media_results = {}
         
         tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
         
+        # the mappings for the whole batch come in with a few set-based queries, rather than four per file per tag service
+        
+        hash_ids_to_raw_mappings = collections.defaultdict( list )
+        
+        all_namespace_id_tag_ids = set()
+        
+        self._c.execute( 'CREATE TABLE mem.temp_media_result_hash_ids ( hash_id INTEGER PRIMARY KEY );' )
+        
+        try:
+            
+            self._c.executemany( 'INSERT OR IGNORE INTO mem.temp_media_result_hash_ids ( hash_id ) VALUES ( ? );', ( ( hash_id, ) for hash_id in hash_ids ) )
+            
+            for tag_service_id in tag_service_ids:
+                
+                ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
+                
+                for ( status, mappings_table_name ) in ( ( HC.CURRENT, current_mappings_table_name ), ( HC.DELETED, deleted_mappings_table_name ), ( HC.PENDING, pending_mappings_table_name ), ( HC.PETITIONED, petitioned_mappings_table_name ) ):
+                    
+                    for ( hash_id, namespace_id, tag_id ) in self._c.execute( 'SELECT hash_id, namespace_id, tag_id FROM mem.temp_media_result_hash_ids CROSS JOIN ' + mappings_table_name + ' USING ( hash_id );' ):
+                        
+                        hash_ids_to_raw_mappings[ hash_id ].append( ( tag_service_id, status, ( namespace_id, tag_id ) ) )
+                        
+                        all_namespace_id_tag_ids.add( ( namespace_id, tag_id ) )
+                        
+                    
+                
+            
+        finally:
+            
+            self._c.execute( 'DROP TABLE mem.temp_media_result_hash_ids;' )
+            
+        
+        namespace_id_tag_ids_to_tags = self._GetNamespaceIdsTagIdsToTags( all_namespace_id_tag_ids )
+        
         for hash_id in hash_ids:
             
             hash = hash_ids_to_hashes[ hash_id ]
@@ -3921,20 +4393,7 @@ class DB( HydrusDB.HydrusDB ):
             
             #
             
-            raw_tag_ids = []
-            
-            for tag_service_id in tag_service_ids:
-                
-                ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
-                
-                raw_tag_ids.extend( ( ( tag_service_id, ( HC.CURRENT, HydrusTags.CombineTag( namespace, tag ) ) ) for ( namespace, tag ) in self._c.execute( 'SELECT namespace, tag FROM namespaces, ( tags, ' + current_mappings_table_name + ' USING ( tag_id ) ) USING ( namespace_id ) WHERE hash_id = ?;', ( hash_id, ) ) ) )
-                
-                raw_tag_ids.extend( ( ( tag_service_id, ( HC.DELETED, HydrusTags.CombineTag( namespace, tag ) ) ) for ( namespace, tag ) in self._c.execute( 'SELECT namespace, tag FROM namespaces, ( tags, ' + deleted_mappings_table_name + ' USING ( tag_id ) ) USING ( namespace_id ) WHERE hash_id = ?;', ( hash_id, ) ) ) )
-                
-                raw_tag_ids.extend( ( ( tag_service_id, ( HC.PENDING, HydrusTags.CombineTag( namespace, tag ) ) ) for ( namespace, tag ) in self._c.execute( 'SELECT namespace, tag FROM namespaces, ( tags, ' + pending_mappings_table_name + ' USING ( tag_id ) ) USING ( namespace_id ) WHERE hash_id = ?;', ( hash_id, ) ) ) )
-                
-                raw_tag_ids.extend( ( ( tag_service_id, ( HC.PETITIONED, HydrusTags.CombineTag( namespace, tag ) ) ) for ( namespace, tag ) in self._c.execute( 'SELECT namespace, tag FROM namespaces, ( tags, ' + petitioned_mappings_table_name + ' USING ( tag_id ) ) USING ( namespace_id ) WHERE hash_id = ?;', ( hash_id, ) ) ) )
-                
+            raw_tag_ids = [ ( tag_service_id, ( status, namespace_id_tag_ids_to_tags[ namespace_id_tag_id ] ) ) for ( tag_service_id, status, namespace_id_tag_id ) in hash_ids_to_raw_mappings[ hash_id ] if namespace_id_tag_id in namespace_id_tag_ids_to_tags ]
             
             raw_tag_ids_dict = HydrusData.BuildKeyToListDict( raw_tag_ids )
             
@@ -3983,17 +4442,42 @@ class DB( HydrusDB.HydrusDB ):
                 ( size, mime, width, height, duration, num_frames, num_words ) = ( None, HC.APPLICATION_UNKNOWN, None, None, None, None, None )
                 
             
-            media_results.append( ClientMedia.MediaResult( ( hash, inbox, size, mime, width, height, duration, num_frames, num_words, tags_manager, locations_manager, ratings_manager ) ) )
+            hash_ids_to_media_results[ hash_id ] = ClientMedia.MediaResult( ( hash, inbox, size, mime, width, height, duration, num_frames, num_words, tags_manager, locations_manager, ratings_manager ) )
             
         
-        return media_results
+        return hash_ids_to_media_results
         
     
-    def _GetMediaResultsFromHashes( self, hashes ):
+    def _GetMediaResults( self, hash_ids, cache_generation = None ):
+        
+        # files that are already open somewhere are shared from the cache, so only the rest come from the db
+        
+        if cache_generation is None:
+            
+            cache_generation = self._media_result_cache.GetGeneration()
+            
+        
+        ( hash_ids_to_media_results, missing_hash_ids ) = self._media_result_cache.GetMediaResults( hash_ids )
+        
+        if len( missing_hash_ids ) > 0:
+            
+            new_hash_ids_to_media_results = self._GenerateMediaResults( missing_hash_ids )
+            
+            hash_ids_to_media_results.update( self._media_result_cache.AddMediaResults( cache_generation, new_hash_ids_to_media_results ) )
+            
+        
+        return [ hash_ids_to_media_results[ hash_id ] for hash_id in hash_ids ]
+        
+    
+    def _GetMediaResultsFromHashes( self, hashes ):
+        
+        # the generation has to be read before the db is, or an update committed in between could be cached as current
+        
+        cache_generation = self._media_result_cache.GetGeneration()
         
         query_hash_ids = set( self._GetHashIds( hashes ) )
         
-        return self._GetMediaResults( query_hash_ids )
+        return self._GetMediaResults( query_hash_ids, cache_generation = cache_generation )
         
     
     def _GetMime( self, service_id, hash_id ):
@@ -4020,6 +4504,8 @@ class DB( HydrusDB.HydrusDB ):
             
             namespace_id = self._c.lastrowid
             
+            self._namespace_strings_cache.IdCreated( namespace_id )
+            
         else:
             
             ( namespace_id, ) = result
@@ -4053,8 +4539,12 @@ class DB( HydrusDB.HydrusDB ):
             
             tag_id = self._c.lastrowid
             
+            self._tag_strings_cache.IdCreated( tag_id )
+            
             self._c.execute( 'REPLACE INTO tags_fts4 ( docid, tag ) VALUES ( ?, ? );', ( tag_id, tag ) )
             
+            self._AddTagTrigrams( [ ( tag_id, tag ) ] )
+            
         else:
             
             ( tag_id, ) = result
@@ -4070,6 +4560,49 @@ class DB( HydrusDB.HydrusDB ):
         return ( namespace_id, tag_id )
         
     
+    def _GetNamespaceIdsTagIdsToTags( self, namespace_id_tag_ids ):
+        
+        namespace_ids = { namespace_id for ( namespace_id, tag_id ) in namespace_id_tag_ids }
+        tag_ids = { tag_id for ( namespace_id, tag_id ) in namespace_id_tag_ids }
+        
+        ( namespace_ids_to_namespaces, missing_namespace_ids ) = self._namespace_strings_cache.GetStrings( namespace_ids )
+        
+        if len( missing_namespace_ids ) > 0:
+            
+            fetched_namespace_ids_to_namespaces = { namespace_id : namespace for ( namespace_id, namespace ) in self._c.execute( 'SELECT namespace_id, namespace FROM namespaces WHERE namespace_id IN ' + HydrusData.SplayListForDB( missing_namespace_ids ) + ';' ) }
+            
+            self._namespace_strings_cache.AddStrings( fetched_namespace_ids_to_namespaces )
+            
+            namespace_ids_to_namespaces.update( fetched_namespace_ids_to_namespaces )
+            
+        
+        ( tag_ids_to_tags, missing_tag_ids ) = self._tag_strings_cache.GetStrings( tag_ids )
+        
+        if len( missing_tag_ids ) > 0:
+            
+            self._c.execute( 'CREATE TABLE mem.temp_tag_string_tag_ids ( tag_id INTEGER PRIMARY KEY );' )
+            
+            try:
+                
+                self._c.executemany( 'INSERT INTO mem.temp_tag_string_tag_ids ( tag_id ) VALUES ( ? );', ( ( tag_id, ) for tag_id in missing_tag_ids ) )
+                
+                fetched_tag_ids_to_tags = { tag_id : tag for ( tag_id, tag ) in self._c.execute( 'SELECT tag_id, tag FROM mem.temp_tag_string_tag_ids CROSS JOIN tags USING ( tag_id );' ) }
+                
+            finally:
+                
+                self._c.execute( 'DROP TABLE mem.temp_tag_string_tag_ids;' )
+                
+            
+            self._tag_strings_cache.AddStrings( fetched_tag_ids_to_tags )
+            
+            tag_ids_to_tags.update( fetched_tag_ids_to_tags )
+            
+        
+        # like the old joins, anything missing from the master tables is skipped
+        
+        return { ( namespace_id, tag_id ) : HydrusTags.CombineTag( namespace_ids_to_namespaces[ namespace_id ], tag_ids_to_tags[ tag_id ] ) for ( namespace_id, tag_id ) in namespace_id_tag_ids if namespace_id in namespace_ids_to_namespaces and tag_id in tag_ids_to_tags }
+        
+    
     def _GetNamespaceTag( self, namespace_id, tag_id ):
         
         result = self._c.execute( 'SELECT tag FROM tags WHERE tag_id = ?;', ( tag_id, ) ).fetchone()
@@ -4769,6 +5302,33 @@ class DB( HydrusDB.HydrusDB ):
         return result
         
     
+    def _GetTagIdsFromWildcard( self, wildcard ):
+        
+        # wildcard is a LIKE pattern, which may match the whole tag or the start of any word in it
+        
+        trigrams = set()
+        
+        for segment in wildcard.replace( '_', '%' ).split( '%' ):
+            
+            trigrams.update( GenerateTrigrams( segment ) )
+            
+        
+        if len( trigrams ) == 0:
+            
+            # nothing long enough to look up, so we have to scan
+            
+            return { tag_id for ( tag_id, ) in self._c.execute( 'SELECT tag_id FROM tags WHERE tag LIKE ? OR tag LIKE ?;', ( wildcard, '% ' + wildcard ) ) }
+            
+        
+        # the index narrows it down to tags that have every trigram, and then LIKE checks they are in the right order
+        
+        trigrams = list( trigrams )
+        
+        candidates_select = ' INTERSECT '.join( [ 'SELECT tag_id FROM tag_trigrams WHERE trigram = ?' ] * len( trigrams ) )
+        
+        return { tag_id for ( tag_id, ) in self._c.execute( 'SELECT tag_id FROM tags WHERE tag_id IN ( ' + candidates_select + ' ) AND ( tag LIKE ? OR tag LIKE ? );', trigrams + [ wildcard, '% ' + wildcard ] ) }
+        
+    
     def _GetTagParents( self, service_key = None ):
         
         tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
@@ -4808,6 +5368,32 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _GetTagParentsForChildren( self, service_key, child_tags ):
+        
+        tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
+        
+        service_id = self._GetServiceId( service_key )
+        
+        children_to_parents = {}
+        
+        for child_tag in child_tags:
+            
+            ( child_namespace_id, child_tag_id ) = self._GetNamespaceIdTagId( child_tag )
+            
+            pair_ids = self._c.execute( 'SELECT parent_namespace_id, parent_tag_id FROM tag_parents WHERE service_id = ? AND child_namespace_id = ? AND child_tag_id = ? AND status = ? UNION SELECT parent_namespace_id, parent_tag_id FROM tag_parent_petitions WHERE service_id = ? AND child_namespace_id = ? AND child_tag_id = ? AND status = ?;', ( service_id, child_namespace_id, child_tag_id, HC.CURRENT, service_id, child_namespace_id, child_tag_id, HC.PENDING ) ).fetchall()
+            
+            statuses_to_pairs = HydrusData.default_dict_set()
+            
+            statuses_to_pairs[ HC.CURRENT ] = { ( child_tag, self._GetNamespaceTag( parent_namespace_id, parent_tag_id ) ) for ( parent_namespace_id, parent_tag_id ) in pair_ids }
+            
+            statuses_to_pairs = tag_censorship_manager.FilterStatusesToPairs( service_key, statuses_to_pairs )
+            
+            children_to_parents[ child_tag ] = { parent for ( child, parent ) in statuses_to_pairs[ HC.CURRENT ] }
+            
+        
+        return children_to_parents
+        
+    
     def _GetTagSiblings( self, service_key = None ):
         
         tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
@@ -4847,6 +5433,32 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _GetTagSiblingsForOldTags( self, service_key, old_tags ):
+        
+        tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
+        
+        service_id = self._GetServiceId( service_key )
+        
+        old_tags_to_new_tags = {}
+        
+        for old_tag in old_tags:
+            
+            ( old_namespace_id, old_tag_id ) = self._GetNamespaceIdTagId( old_tag )
+            
+            pair_ids = self._c.execute( 'SELECT new_namespace_id, new_tag_id FROM tag_siblings WHERE service_id = ? AND old_namespace_id = ? AND old_tag_id = ? AND status = ? UNION SELECT new_namespace_id, new_tag_id FROM tag_sibling_petitions WHERE service_id = ? AND old_namespace_id = ? AND old_tag_id = ? AND status = ?;', ( service_id, old_namespace_id, old_tag_id, HC.CURRENT, service_id, old_namespace_id, old_tag_id, HC.PENDING ) ).fetchall()
+            
+            statuses_to_pairs = HydrusData.default_dict_set()
+            
+            statuses_to_pairs[ HC.CURRENT ] = { ( old_tag, self._GetNamespaceTag( new_namespace_id, new_tag_id ) ) for ( new_namespace_id, new_tag_id ) in pair_ids }
+            
+            statuses_to_pairs = tag_censorship_manager.FilterStatusesToPairs( service_key, statuses_to_pairs )
+            
+            old_tags_to_new_tags[ old_tag ] = { new for ( old, new ) in statuses_to_pairs[ HC.CURRENT ] }
+            
+        
+        return old_tags_to_new_tags
+        
+    
     def _GetText( self, text_id ):
         
         result = self._c.execute( 'SELECT text FROM texts WHERE text_id = ?;', ( text_id, ) ).fetchone()
@@ -4995,21 +5607,25 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
-    def _ImportFile( self, temp_path, import_file_options = None, override_deleted = False, url = None ):
+    def _ImportFile( self, file_import_job ):
         
-        if import_file_options is None:
+        # the hash, file info, thumbnail and phash are normally generated by the job beforehand, outside of the transaction
+        
+        if file_import_job.GetHash() is None:
             
-            import_file_options = ClientDefaults.GetDefaultImportFileOptions()
+            file_import_job.GenerateHash()
             
         
-        ( archive, exclude_deleted_files, min_size, min_resolution ) = import_file_options.ToTuple()
+        import_file_options = file_import_job.GetImportFileOptions()
         
-        HydrusImageHandling.ConvertToPngIfBmp( temp_path )
+        ( archive, exclude_deleted_files, min_size, min_resolution ) = import_file_options.ToTuple()
         
-        hash = HydrusFileHandling.GetHashFromPath( temp_path )
+        hash = file_import_job.GetHash()
         
         hash_id = self._GetHashId( hash )
         
+        url = file_import_job.GetURL()
+        
         if url is not None:
             
             self._c.execute( 'INSERT OR IGNORE INTO urls ( url, hash_id ) VALUES ( ?, ? );', ( url, hash_id ) )
@@ -5019,7 +5635,7 @@ class DB( HydrusDB.HydrusDB ):
         
         if status == CC.STATUS_DELETED:
             
-            if override_deleted or not exclude_deleted_files:
+            if file_import_job.OverrideDeleted() or not exclude_deleted_files:
                 
                 status = CC.STATUS_NEW
                 
@@ -5036,46 +5652,32 @@ class DB( HydrusDB.HydrusDB ):
             
         elif status == CC.STATUS_NEW:
             
-            mime = HydrusFileHandling.GetMime( temp_path )
-            
-            ( size, mime, width, height, duration, num_frames, num_words ) = HydrusFileHandling.GetFileInfo( temp_path )
-            
-            if width is not None and height is not None:
+            if not file_import_job.HasInfo():
                 
-                if min_resolution is not None:
-                    
-                    ( min_x, min_y ) = min_resolution
-                    
-                    if width < min_x or height < min_y:
-                        
-                        raise Exception( 'Resolution too small' )
-                        
-                    
+                file_import_job.GenerateInfo()
                 
             
-            if min_size is not None:
-                
-                if size < min_size:
-                    
-                    raise Exception( 'File too small' )
-                    
-                
+            temp_path = file_import_job.GetTempPath()
+            
+            ( size, mime, width, height, duration, num_frames, num_words ) = file_import_job.GetFileInfo()
             
             timestamp = HydrusData.GetNow()
             
             client_files_manager = self._controller.GetClientFilesManager()
             
-            if mime in HC.MIMES_WITH_THUMBNAILS:
-                
-                thumbnail = HydrusFileHandling.GenerateThumbnail( temp_path )
+            thumbnail = file_import_job.GetThumbnail()
+            
+            if thumbnail is not None:
                 
                 # lockless because this db call is made by the locked client files manager
                 client_files_manager.LocklessAddFullSizeThumbnail( hash, thumbnail )
                 
             
-            if mime in ( HC.IMAGE_JPEG, HC.IMAGE_PNG ):
+            phash = file_import_job.GetPHash()
+            
+            if phash is not None:
                 
-                phash = ClientImageHandling.GeneratePerceptualHash( temp_path )
+                self._PHashesAddToTree( hash_id, phash )
                 
                 self._c.execute( 'INSERT OR REPLACE INTO perceptual_hashes ( hash_id, phash ) VALUES ( ?, ? );', ( hash_id, sqlite3.Binary( phash ) ) )
                 
@@ -5091,7 +5693,7 @@ class DB( HydrusDB.HydrusDB ):
             
             self.pub_content_updates_after_commit( { CC.LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
             
-            ( md5, sha1, sha512 ) = HydrusFileHandling.GetExtraHashesFromPath( temp_path )
+            ( md5, sha1, sha512 ) = file_import_job.GetExtraHashes()
             
             self._c.execute( 'INSERT OR IGNORE INTO local_hashes ( hash_id, md5, sha1, sha512 ) VALUES ( ?, ?, ?, ? );', ( hash_id, sqlite3.Binary( md5 ), sqlite3.Binary( sha1 ), sqlite3.Binary( sha512 ) ) )
             
@@ -5130,6 +5732,36 @@ class DB( HydrusDB.HydrusDB ):
         return ( status, hash )
         
     
+    def _ImportFiles( self, file_import_jobs ):
+        
+        # each file gets its own savepoint, so one bad file does not take the rest of the batch down with it
+        
+        for file_import_job in file_import_jobs:
+            
+            num_pubsubs = len( self._pubsubs )
+            
+            self._c.execute( 'SAVEPOINT import_file;' )
+            
+            try:
+                
+                ( status, hash ) = self._ImportFile( file_import_job )
+                
+                self._c.execute( 'RELEASE SAVEPOINT import_file;' )
+                
+                file_import_job.SetResult( status, hash )
+                
+            except Exception:
+                
+                file_import_job.SetExcInfo( sys.exc_info() )
+                
+                self._c.execute( 'ROLLBACK TO SAVEPOINT import_file;' )
+                self._c.execute( 'RELEASE SAVEPOINT import_file;' )
+                
+                del self._pubsubs[ num_pubsubs : ]
+                
+            
+        
+    
     def _InboxFiles( self, hash_ids ):
         
         self._c.executemany( 'INSERT OR IGNORE INTO file_inbox VALUES ( ? );', ( ( hash_id, ) for hash_id in hash_ids ) )
@@ -5163,6 +5795,9 @@ class DB( HydrusDB.HydrusDB ):
             self._LoadIntoDiskCache( stop_time = stop_time )
             
         
+        self._num_read_connections = new_options.GetInteger( 'num_db_read_connections' )
+        self._group_commit = new_options.GetBoolean( 'db_group_commit' )
+        
         HydrusGlobals.client_controller.pub( 'splash_set_status_text', 'preparing db caches' )
         
         self._local_file_service_id = self._GetServiceId( CC.LOCAL_FILE_SERVICE_KEY )
@@ -5174,6 +5809,9 @@ class DB( HydrusDB.HydrusDB ):
         self._subscriptions_cache = {}
         self._service_cache = {}
         
+        self._namespace_strings_cache.Clear()
+        self._tag_strings_cache.Clear()
+        
         ( self._null_namespace_id, ) = self._c.execute( 'SELECT namespace_id FROM namespaces WHERE namespace = ?;', ( '', ) ).fetchone()
         
         self._inbox_hash_ids = { id for ( id, ) in self._c.execute( 'SELECT hash_id FROM file_inbox;' ) }
@@ -5186,47 +5824,16 @@ class DB( HydrusDB.HydrusDB ):
         self._db_filenames[ 'external_master' ] = 'client.master.db'
         
     
-    def _IsAnOrphan( self, test_type, possible_hash ):
+    def _InvalidateCaches( self ):
         
-        if self._HashExists( possible_hash ):
-            
-            hash = possible_hash
-            
-            if test_type == 'file':
-                
-                hash_id = self._GetHashId( hash )
-                
-                result = self._c.execute( 'SELECT 1 FROM current_files WHERE service_id IN ( ?, ? ) AND hash_id = ?;', ( self._local_file_service_id, self._trash_service_id, hash_id ) ).fetchone()
-                
-                if result is None:
-                    
-                    return True
-                    
-                else:
-                    
-                    return False
-                    
-                
-            elif test_type == 'thumbnail':
-                
-                hash_id = self._GetHashId( hash )
-                
-                result = self._c.execute( 'SELECT 1 FROM current_files WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
-                
-                if result is None:
-                    
-                    return True
-                    
-                else:
-                    
-                    return False
-                    
-                
-            
-        else:
-            
-            return True
-            
+        self._autocomplete_counts_cache.Clear()
+        self._media_result_cache.InvalidateAll()
+        self._namespace_strings_cache.Clear()
+        self._tag_strings_cache.Clear()
+        
+        self._service_cache = {}
+        
+        self._inbox_hash_ids = { id for ( id, ) in self._c.execute( 'SELECT hash_id FROM file_inbox;' ) }
         
     
     def _LoadIntoDiskCache( self, stop_time = None, caller_limit = None ):
@@ -5330,53 +5937,922 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
-        # analyze
+        # analyze
+        
+        stale_time_delta = 14 * 86400
+        
+        existing_names_to_timestamps = dict( self._c.execute( 'SELECT name, timestamp FROM analyze_timestamps;' ).fetchall() )
+        
+        db_names = [ name for ( index, name, path ) in self._c.execute( 'PRAGMA database_list;' ) if name not in ( 'mem', 'temp' ) ]
+        
+        all_names = set()
+        
+        for db_name in db_names:
+            
+            all_names.update( ( name for ( name, ) in self._c.execute( 'SELECT name FROM ' + db_name + '.sqlite_master;' ) ) )
+            
+        
+        names_to_analyze = { name for name in all_names if name not in existing_names_to_timestamps or HydrusData.TimeHasPassed( existing_names_to_timestamps[ name ] + stale_time_delta ) }
+        
+        names_to_analyze.discard( 'sqlite_stat1' )
+        
+        if len( names_to_analyze ) > 0:
+            
+            return True
+            
+        
+        # similar files
+        
+        result = self._c.execute( 'SELECT 1 FROM perceptual_hash_vptree_regen;' ).fetchone()
+        
+        if result is not None:
+            
+            return True
+            
+        
+        return False
+        
+    
+    def _ManageDBError( self, job, e ):
+        
+        if isinstance( e, MemoryError ):
+            
+            HydrusData.ShowText( 'The client is running out of memory! Restart it ASAP!' )
+            
+        
+        if job.IsSynchronous():
+            
+            db_traceback = 'Database ' + traceback.format_exc()
+            
+            first_line = HydrusData.ToUnicode( type( e ).__name__ ) + ': ' + HydrusData.ToUnicode( e )
+            
+            new_e = HydrusExceptions.DBException( first_line, db_traceback )
+            
+            job.PutResult( new_e )
+            
+        else:
+            
+            HydrusData.ShowException( e )
+            
+        
+    
+    def _PHashesAddToTree( self, hash_id, phash ):
+        
+        # this is called before the phash is written, so an existing node without a phash is one we deleted but have not yet cleared out
+        
+        result = self._c.execute( 'SELECT phash FROM perceptual_hash_vptree LEFT JOIN perceptual_hashes USING ( hash_id ) WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
+        
+        if result is not None:
+            
+            ( existing_phash, ) = result
+            
+            if existing_phash is None:
+                
+                # the same file always has the same phash, so the old node is still in the right place. count it back in
+                # anything added under it since it was deleted went wherever there was room, so its radius stays cleared until maintenance regenerates the branch
+                
+                self._PHashesUpdateAncestorPopulations( hash_id, 1 )
+                
+            
+            return
+            
+        
+        result = self._c.execute( 'SELECT hash_id FROM perceptual_hash_vptree WHERE parent_id IS NULL;' ).fetchone()
+        
+        if result is None:
+            
+            self._c.execute( 'INSERT INTO perceptual_hash_vptree ( hash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) VALUES ( ?, ?, ?, ?, ?, ?, ? );', ( hash_id, None, 0, None, 0, None, 0 ) )
+            
+            return
+            
+        
+        ( next_ancestor_id, ) = result
+        
+        ancestors_we_are_inside = []
+        ancestors_we_are_outside = []
+        
+        unbalanced_ancestor_id = None
+        
+        while next_ancestor_id is not None:
+            
+            ancestor_id = next_ancestor_id
+            
+            ( ancestor_phash, radius, inner_id, inner_population, outer_id, outer_population ) = self._c.execute( 'SELECT phash, radius, inner_id, inner_population, outer_id, outer_population FROM perceptual_hash_vptree LEFT JOIN perceptual_hashes USING ( hash_id ) WHERE hash_id = ?;', ( ancestor_id, ) ).fetchone()
+            
+            if radius is None:
+                
+                # a deleted node waiting for maintenance. searches go down both sides of it, so either will do
+                
+                we_are_inside = inner_population <= outer_population
+                
+            else:
+                
+                we_are_inside = HydrusData.GetHammingDistance( phash, ancestor_phash ) <= radius
+                
+            
+            if we_are_inside:
+                
+                ancestors_we_are_inside.append( ancestor_id )
+                
+                inner_population += 1
+                
+                next_ancestor_id = inner_id
+                
+                if inner_id is None:
+                    
+                    self._c.execute( 'UPDATE perceptual_hash_vptree SET inner_id = ? WHERE hash_id = ?;', ( hash_id, ancestor_id ) )
+                    
+                
+            else:
+                
+                ancestors_we_are_outside.append( ancestor_id )
+                
+                outer_population += 1
+                
+                next_ancestor_id = outer_id
+                
+                if outer_id is None:
+                    
+                    self._c.execute( 'UPDATE perceptual_hash_vptree SET outer_id = ? WHERE hash_id = ?;', ( hash_id, ancestor_id ) )
+                    
+                
+            
+            if unbalanced_ancestor_id is None and ClientVPTree.BranchIsUnbalanced( inner_population, outer_population ):
+                
+                unbalanced_ancestor_id = ancestor_id
+                
+            
+        
+        self._c.execute( 'INSERT INTO perceptual_hash_vptree ( hash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) VALUES ( ?, ?, ?, ?, ?, ?, ? );', ( hash_id, ancestor_id, 0, None, 0, None, 0 ) )
+        
+        self._c.executemany( 'UPDATE perceptual_hash_vptree SET inner_population = inner_population + 1 WHERE hash_id = ?;', ( ( ancestor_id, ) for ancestor_id in ancestors_we_are_inside ) )
+        self._c.executemany( 'UPDATE perceptual_hash_vptree SET outer_population = outer_population + 1 WHERE hash_id = ?;', ( ( ancestor_id, ) for ancestor_id in ancestors_we_are_outside ) )
+        
+        # rebalancing a big branch is expensive, so it is left for idle maintenance
+        
+        if unbalanced_ancestor_id is not None:
+            
+            self._c.execute( 'INSERT OR IGNORE INTO perceptual_hash_vptree_regen ( hash_id ) VALUES ( ? );', ( unbalanced_ancestor_id, ) )
+            
+        
+    
+    def _PHashesDeleteFromTree( self, hash_ids ):
+        
+        # this is called before the phashes are deleted. regenerating a branch can be expensive, so nodes with children are left in place without a phash and queued for maintenance
+        # their radius is cleared, which tells searches and inserts to go down both sides
+        
+        for hash_id in hash_ids:
+            
+            result = self._c.execute( 'SELECT parent_id, inner_id, outer_id, phash FROM perceptual_hash_vptree LEFT JOIN perceptual_hashes USING ( hash_id ) WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
+            
+            if result is None:
+                
+                continue
+                
+            
+            ( parent_id, inner_id, outer_id, phash ) = result
+            
+            if phash is None:
+                
+                continue
+                
+            
+            self._PHashesUpdateAncestorPopulations( hash_id, -1 )
+            
+            if inner_id is None and outer_id is None:
+                
+                self._c.execute( 'DELETE FROM perceptual_hash_vptree WHERE hash_id = ?;', ( hash_id, ) )
+                self._c.execute( 'DELETE FROM perceptual_hash_vptree_regen WHERE hash_id = ?;', ( hash_id, ) )
+                
+                if parent_id is not None:
+                    
+                    self._c.execute( 'UPDATE perceptual_hash_vptree SET inner_id = NULL WHERE hash_id = ? AND inner_id = ?;', ( parent_id, hash_id ) )
+                    self._c.execute( 'UPDATE perceptual_hash_vptree SET outer_id = NULL WHERE hash_id = ? AND outer_id = ?;', ( parent_id, hash_id ) )
+                    
+                
+            else:
+                
+                self._c.execute( 'UPDATE perceptual_hash_vptree SET radius = NULL WHERE hash_id = ?;', ( hash_id, ) )
+                self._c.execute( 'INSERT OR IGNORE INTO perceptual_hash_vptree_regen ( hash_id ) VALUES ( ? );', ( hash_id, ) )
+                
+            
+        
+    
+    def _PHashesGenerateBranch( self, parent_id, population ):
+        
+        # builds a new branch under parent_id and returns the id of its root, or None if the population is empty
+        
+        if len( population ) == 0:
+            
+            return None
+            
+        
+        nodes = {}
+        
+        branch_root_id = None
+        
+        jobs = [ ( parent_id, None, population ) ]
+        
+        while len( jobs ) > 0:
+            
+            ( job_parent_id, side, job_population ) = jobs.pop()
+            
+            ( ( node_id, node_phash ), radius, inner_population, outer_population ) = ClientVPTree.SplitPopulation( job_population )
+            
+            nodes[ node_id ] = [ job_parent_id, radius, None, len( inner_population ), None, len( outer_population ) ]
+            
+            if side is None:
+                
+                branch_root_id = node_id
+                
+            elif side == 'inner':
+                
+                nodes[ job_parent_id ][2] = node_id
+                
+            elif side == 'outer':
+                
+                nodes[ job_parent_id ][4] = node_id
+                
+            
+            if len( inner_population ) > 0:
+                
+                jobs.append( ( node_id, 'inner', inner_population ) )
+                
+            
+            if len( outer_population ) > 0:
+                
+                jobs.append( ( node_id, 'outer', outer_population ) )
+                
+            
+        
+        self._c.executemany( 'INSERT INTO perceptual_hash_vptree ( hash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) VALUES ( ?, ?, ?, ?, ?, ?, ? );', ( ( node_id, node_parent_id, radius, inner_id, inner_population, outer_id, outer_population ) for ( node_id, ( node_parent_id, radius, inner_id, inner_population, outer_id, outer_population ) ) in nodes.items() ) )
+        
+        return branch_root_id
+        
+    
+    def _PHashesGetBranchPopulation( self, branch_root_id ):
+        
+        # returns every node id in the branch, and the ( hash_id, phash ) pairs of the nodes that still have a phash
+        
+        branch_hash_ids = []
+        population = []
+        
+        next_ids = [ branch_root_id ]
+        
+        while len( next_ids ) > 0:
+            
+            rows = self._c.execute( 'SELECT hash_id, phash, inner_id, outer_id FROM perceptual_hash_vptree LEFT JOIN perceptual_hashes USING ( hash_id ) WHERE hash_id IN ' + HydrusData.SplayListForDB( next_ids ) + ';' ).fetchall()
+            
+            next_ids = []
+            
+            for ( hash_id, phash, inner_id, outer_id ) in rows:
+                
+                branch_hash_ids.append( hash_id )
+                
+                if phash is not None:
+                    
+                    population.append( ( hash_id, phash ) )
+                    
+                
+                if inner_id is not None:
+                    
+                    next_ids.append( inner_id )
+                    
+                
+                if outer_id is not None:
+                    
+                    next_ids.append( outer_id )
+                    
+                
+            
+        
+        return ( branch_hash_ids, population )
+        
+    
+    def _PHashesGetDuplicatePairs( self, max_hamming ):
+        
+        pairs = self._c.execute( 'SELECT smaller_hash_id, larger_hash_id, distance FROM perceptual_hash_pairs WHERE distance <= ?;', ( max_hamming, ) ).fetchall()
+        
+        hash_ids = set()
+        
+        for ( smaller_hash_id, larger_hash_id, distance ) in pairs:
+            
+            hash_ids.add( smaller_hash_id )
+            hash_ids.add( larger_hash_id )
+            
+        
+        hash_ids_to_hashes = self._GetHashIdsToHashes( hash_ids )
+        
+        return [ ( hash_ids_to_hashes[ smaller_hash_id ], hash_ids_to_hashes[ larger_hash_id ], distance ) for ( smaller_hash_id, larger_hash_id, distance ) in pairs ]
+        
+    
+    def _PHashesMaintainDuplicatePairs( self, search_distance, stop_time = None ):
+        
+        hash_ids_to_search = [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM perceptual_hashes WHERE hash_id NOT IN ( SELECT hash_id FROM perceptual_hash_pairs_searched WHERE searched_distance >= ? );', ( search_distance, ) ) ]
+        
+        if len( hash_ids_to_search ) == 0:
+            
+            return
+            
+        
+        job_key = ClientThreading.JobKey( cancellable = True )
+        
+        job_key.SetVariable( 'popup_title', 'similar files duplicate pair search' )
+        
+        self._controller.pub( 'message', job_key )
+        
+        # we compare blocks of the files to search against everything at once, so hold all the phashes in memory as packed uint64s
+        
+        rows = self._c.execute( 'SELECT hash_id, phash FROM perceptual_hashes;' ).fetchall()
+        
+        all_hash_ids = [ hash_id for ( hash_id, phash ) in rows ]
+        all_packed_phashes = HydrusData.ConvertPHashesToUInt64Array( ( phash for ( hash_id, phash ) in rows ) )
+        
+        hash_ids_to_indices = { hash_id : index for ( index, hash_id ) in enumerate( all_hash_ids ) }
+        
+        num_to_do = len( hash_ids_to_search )
+        num_done = 0
+        
+        last_checkpoint = HydrusData.GetNow()
+        
+        # a 64 x 4096 uint64 xor matrix is 2MB, and the popcount holds a few of those at once, so this keeps each pass to under 10MB
+        
+        block_size = 64
+        column_chunk_size = 4096
+        
+        for block_hash_ids in HydrusData.SplitListIntoChunks( hash_ids_to_search, block_size ):
+            
+            ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+            
+            if should_quit or ( stop_time is not None and HydrusData.TimeHasPassed( stop_time ) ):
+                
+                break
+                
+            
+            text = 'searching for duplicate pairs - ' + HydrusData.ConvertValueRangeToPrettyString( num_done, num_to_do )
+            
+            self._controller.pub( 'splash_set_status_text', text, print_to_log = False )
+            job_key.SetVariable( 'popup_text_1', text )
+            job_key.SetVariable( 'popup_gauge_1', ( num_done, num_to_do ) )
+            
+            packed_block = all_packed_phashes[ [ hash_ids_to_indices[ hash_id ] for hash_id in block_hash_ids ] ]
+            
+            pairs = []
+            
+            for column_offset in range( 0, len( all_hash_ids ), column_chunk_size ):
+                
+                distances = HydrusData.GetHammingDistancesBlock( packed_block, all_packed_phashes[ column_offset : column_offset + column_chunk_size ] )
+                
+                ( block_indices, column_indices ) = numpy.nonzero( distances <= search_distance )
+                
+                for ( block_index, column_index ) in zip( block_indices, column_indices ):
+                    
+                    hash_id = block_hash_ids[ block_index ]
+                    other_hash_id = all_hash_ids[ column_offset + column_index ]
+                    
+                    if hash_id == other_hash_id:
+                        
+                        continue
+                        
+                    
+                    distance = int( distances[ block_index, column_index ] )
+                    
+                    pairs.append( ( min( hash_id, other_hash_id ), max( hash_id, other_hash_id ), distance ) )
+                    
+                
+            
+            self._c.executemany( 'INSERT OR IGNORE INTO perceptual_hash_pairs ( smaller_hash_id, larger_hash_id, distance ) VALUES ( ?, ?, ? );', pairs )
+            
+            self._c.executemany( 'INSERT OR REPLACE INTO perceptual_hash_pairs_searched ( hash_id, searched_distance ) VALUES ( ?, ? );', ( ( hash_id, search_distance ) for hash_id in block_hash_ids ) )
+            
+            num_done += len( block_hash_ids )
+            
+            # checkpoint, so a crash or a cancel does not lose everything
+            
+            if HydrusData.TimeHasPassed( last_checkpoint + 30 ):
+                
+                self._c.execute( 'COMMIT;' )
+                
+                self._c.execute( 'BEGIN IMMEDIATE;' )
+                
+                last_checkpoint = HydrusData.GetNow()
+                
+            
+        
+        ( num_pairs, ) = self._c.execute( 'SELECT COUNT( * ) FROM perceptual_hash_pairs WHERE distance <= ?;', ( search_distance, ) ).fetchone()
+        
+        job_key.DeleteVariable( 'popup_gauge_1' )
+        
+        job_key.SetVariable( 'popup_text_1', 'searched ' + HydrusData.ConvertValueRangeToPrettyString( num_done, num_to_do ) + ' files, ' + HydrusData.ConvertIntToPrettyString( num_pairs ) + ' duplicate pairs found so far' )
+        
+        job_key.Finish()
+        
+        job_key.Delete( 5 )
+        
+    
+    def _PHashesMaintainTree( self, stop_time = None ):
+        
+        result = self._c.execute( 'SELECT 1 FROM perceptual_hash_vptree_regen;' ).fetchone()
+        
+        if result is None:
+            
+            return
+            
+        
+        job_key = ClientThreading.JobKey( cancellable = True )
+        
+        job_key.SetVariable( 'popup_title', 'similar files metadata maintenance' )
+        
+        self._controller.pub( 'message', job_key )
+        
+        num_done = 0
+        
+        while True:
+            
+            ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+            
+            if should_quit or ( stop_time is not None and HydrusData.TimeHasPassed( stop_time ) ):
+                
+                break
+                
+            
+            # biggest first, as they will often contain smaller ones
+            
+            result = self._c.execute( 'SELECT hash_id FROM perceptual_hash_vptree_regen, perceptual_hash_vptree USING ( hash_id ) ORDER BY inner_population + outer_population DESC;' ).fetchone()
+            
+            if result is None:
+                
+                break
+                
+            
+            ( branch_id, ) = result
+            
+            text = 'rebalancing similar file metadata - ' + HydrusData.ConvertIntToPrettyString( num_done ) + ' branches done'
+            
+            self._controller.pub( 'splash_set_status_text', text )
+            job_key.SetVariable( 'popup_text_1', text )
+            
+            self._PHashesRegenerateBranch( branch_id )
+            
+            num_done += 1
+            
+        
+        job_key.SetVariable( 'popup_text_1', 'done!' )
+        
+        job_key.Finish()
+        
+        job_key.Delete( 5 )
+        
+    
+    def _PHashesRegenerateBranch( self, branch_root_id ):
+        
+        result = self._c.execute( 'SELECT parent_id FROM perceptual_hash_vptree WHERE hash_id = ?;', ( branch_root_id, ) ).fetchone()
+        
+        if result is None:
+            
+            return
+            
+        
+        ( parent_id, ) = result
+        
+        ( branch_hash_ids, population ) = self._PHashesGetBranchPopulation( branch_root_id )
+        
+        splayed_branch_hash_ids = HydrusData.SplayListForDB( branch_hash_ids )
+        
+        self._c.execute( 'DELETE FROM perceptual_hash_vptree WHERE hash_id IN ' + splayed_branch_hash_ids + ';' )
+        self._c.execute( 'DELETE FROM perceptual_hash_vptree_regen WHERE hash_id IN ' + splayed_branch_hash_ids + ';' )
+        
+        new_branch_root_id = self._PHashesGenerateBranch( parent_id, population )
+        
+        if parent_id is not None:
+            
+            self._c.execute( 'UPDATE perceptual_hash_vptree SET inner_id = ? WHERE hash_id = ? AND inner_id = ?;', ( new_branch_root_id, parent_id, branch_root_id ) )
+            self._c.execute( 'UPDATE perceptual_hash_vptree SET outer_id = ? WHERE hash_id = ? AND outer_id = ?;', ( new_branch_root_id, parent_id, branch_root_id ) )
+            
+        
+    
+    def _PHashesRegenerateTree( self ):
+        
+        job_key = ClientThreading.JobKey()
+        
+        job_key.SetVariable( 'popup_title', 'regenerating similar file metadata' )
+        
+        self._controller.pub( 'message', job_key )
+        
+        job_key.SetVariable( 'popup_text_1', 'gathering all leaves' )
+        
+        self._c.execute( 'DELETE FROM perceptual_hash_vptree;' )
+        self._c.execute( 'DELETE FROM perceptual_hash_vptree_regen;' )
+        
+        population = self._c.execute( 'SELECT hash_id, phash FROM perceptual_hashes;' ).fetchall()
+        
+        job_key.SetVariable( 'popup_text_1', HydrusData.ConvertIntToPrettyString( len( population ) ) + ' leaves found, now regenerating' )
+        
+        self._PHashesGenerateBranch( None, population )
+        
+        job_key.SetVariable( 'popup_text_1', 'done!' )
+        
+        job_key.Finish()
+        
+    
+    def _PHashesSearch( self, search_phash, max_hamming ):
+        
+        similar_hash_ids = []
+        
+        result = self._c.execute( 'SELECT hash_id FROM perceptual_hash_vptree WHERE parent_id IS NULL;' ).fetchone()
+        
+        if result is None:
+            
+            return similar_hash_ids
+            
+        
+        ( root_id, ) = result
+        
+        next_potentials = [ root_id ]
+        
+        while len( next_potentials ) > 0:
+            
+            rows = self._c.execute( 'SELECT hash_id, phash, radius, inner_id, outer_id FROM perceptual_hash_vptree LEFT JOIN perceptual_hashes USING ( hash_id ) WHERE hash_id IN ' + HydrusData.SplayListForDB( next_potentials ) + ';' ).fetchall()
+            
+            next_potentials = []
+            
+            # deleted nodes waiting for maintenance have no radius, so a match could be on either side
+            
+            for ( node_hash_id, node_phash, radius, inner_id, outer_id ) in rows:
+                
+                if radius is None:
+                    
+                    next_potentials.extend( ( child_id for child_id in ( inner_id, outer_id ) if child_id is not None ) )
+                    
+                
+            
+            rows = [ ( node_hash_id, node_phash, radius, inner_id, outer_id ) for ( node_hash_id, node_phash, radius, inner_id, outer_id ) in rows if node_phash is not None ]
+            
+            # do the whole level in one numpy pass
+            
+            distances = HydrusData.GetHammingDistances( search_phash, HydrusData.ConvertPHashesToUInt64Array( ( node_phash for ( node_hash_id, node_phash, radius, inner_id, outer_id ) in rows ) ) )
+            
+            for ( ( node_hash_id, node_phash, radius, inner_id, outer_id ), distance_to_node ) in zip( rows, distances.tolist() ):
+                
+                if distance_to_node <= max_hamming:
+                    
+                    similar_hash_ids.append( node_hash_id )
+                    
+                
+                if radius is None:
+                    
+                    continue
+                    
+                
+                if inner_id is not None and distance_to_node <= radius + max_hamming: # i.e. result could be in inner
+                    
+                    next_potentials.append( inner_id )
+                    
+                
+                if outer_id is not None and distance_to_node >= radius - max_hamming: # i.e. result could be in outer
+                    
+                    next_potentials.append( outer_id )
+                    
+                
+            
+        
+        return similar_hash_ids
+        
+    
+    def _PHashesUpdateAncestorPopulations( self, hash_id, population_delta ):
+        
+        child_id = hash_id
+        
+        ( ancestor_id, ) = self._c.execute( 'SELECT parent_id FROM perceptual_hash_vptree WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
+        
+        while ancestor_id is not None:
+            
+            ( next_ancestor_id, inner_id ) = self._c.execute( 'SELECT parent_id, inner_id FROM perceptual_hash_vptree WHERE hash_id = ?;', ( ancestor_id, ) ).fetchone()
+            
+            if inner_id == child_id:
+                
+                self._c.execute( 'UPDATE perceptual_hash_vptree SET inner_population = inner_population + ? WHERE hash_id = ?;', ( population_delta, ancestor_id ) )
+                
+            else:
+                
+                self._c.execute( 'UPDATE perceptual_hash_vptree SET outer_population = outer_population + ? WHERE hash_id = ?;', ( population_delta, ancestor_id ) )
+                
+            
+            child_id = ancestor_id
+            ancestor_id = next_ancestor_id
+            
+        
+    
+    def _PostingListsAddFiles( self, service_id, hash_ids ):
+        
+        result = self._c.execute( 'SELECT posting_list FROM file_posting_lists WHERE service_id = ?;', ( service_id, ) ).fetchone()
+        
+        if result is not None:
+            
+            ( posting_list, ) = result
+            
+            posting_list = ClientPostingLists.FromBytes( posting_list ).Union( ClientPostingLists.FromHashIds( hash_ids ) )
+            
+            self._c.execute( 'UPDATE file_posting_lists SET posting_list = ? WHERE service_id = ?;', ( sqlite3.Binary( posting_list.ToBytes() ), service_id ) )
+            
+        
+    
+    def _PostingListsDeleteFiles( self, service_id, hash_ids ):
+        
+        result = self._c.execute( 'SELECT posting_list FROM file_posting_lists WHERE service_id = ?;', ( service_id, ) ).fetchone()
+        
+        if result is not None:
+            
+            ( posting_list, ) = result
+            
+            posting_list = ClientPostingLists.FromBytes( posting_list ).Difference( ClientPostingLists.FromHashIds( hash_ids ) )
+            
+            self._c.execute( 'UPDATE file_posting_lists SET posting_list = ? WHERE service_id = ?;', ( sqlite3.Binary( posting_list.ToBytes() ), service_id ) )
+            
+        
+    
+    def _PostingListsDrop( self, service_id ):
+        
+        self._c.execute( 'DELETE FROM file_posting_lists WHERE service_id = ?;', ( service_id, ) )
+        self._c.execute( 'DELETE FROM tag_posting_lists WHERE tag_service_id = ?;', ( service_id, ) )
+        
+    
+    def _PostingListsGenerateTag( self, tag_service_id, namespace_id, tag_id ):
+        
+        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
+        
+        if namespace_id == self.POSTING_LISTS_ANY_NAMESPACE_ID:
+            
+            predicate_phrase = 'tag_id = ' + str( tag_id )
+            
+        else:
+            
+            predicate_phrase = 'namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id )
+            
+        
+        current_posting_list = ClientPostingLists.FromHashIds( ( hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE ' + predicate_phrase + ';' ) ) )
+        pending_posting_list = ClientPostingLists.FromHashIds( ( hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE ' + predicate_phrase + ';' ) ) )
+        
+        self._c.execute( 'REPLACE INTO tag_posting_lists ( tag_service_id, tag_id, namespace_id, current_posting_list, pending_posting_list ) VALUES ( ?, ?, ?, ?, ? );', ( tag_service_id, tag_id, namespace_id, sqlite3.Binary( current_posting_list.ToBytes() ), sqlite3.Binary( pending_posting_list.ToBytes() ) ) )
+        
+    
+    def _PostingListsGetBigTags( self, tag_service_id ):
+        
+        # only big tags are worth a posting list. small ones are quick enough to fetch from their index every time
+        
+        ac_cache_table_name = GenerateCombinedFilesMappingsCacheTableName( tag_service_id )
+        
+        counts_and_ids = [ ( count, namespace_id, tag_id ) for ( namespace_id, tag_id, count ) in self._c.execute( 'SELECT namespace_id, tag_id, current_count + pending_count FROM ' + ac_cache_table_name + ' WHERE namespace_id != ? AND current_count + pending_count >= ?;', ( self._null_namespace_id, self.POSTING_LISTS_MIN_COUNT ) ) ]
+        
+        # a namespaceless search matches every namespace, so it gets its own list
+        
+        counts_and_ids.extend( ( ( count, self.POSTING_LISTS_ANY_NAMESPACE_ID, tag_id ) for ( tag_id, count ) in self._c.execute( 'SELECT tag_id, SUM( current_count + pending_count ) FROM ' + ac_cache_table_name + ' GROUP BY tag_id HAVING SUM( current_count + pending_count ) >= ?;', ( self.POSTING_LISTS_MIN_COUNT, ) ) ) )
+        
+        return counts_and_ids
+        
+    
+    def _PostingListsGetFilePostingList( self, file_service_id ):
+        
+        result = self._c.execute( 'SELECT posting_list FROM file_posting_lists WHERE service_id = ?;', ( file_service_id, ) ).fetchone()
+        
+        if result is None:
+            
+            return None
+            
+        
+        ( posting_list, ) = result
+        
+        return ClientPostingLists.FromBytes( posting_list )
+        
+    
+    def _PostingListsGetMissingTags( self, tag_service_id ):
+        
+        counts_and_ids = self._PostingListsGetBigTags( tag_service_id )
+        
+        existing_ids = { ( namespace_id, tag_id ) for ( namespace_id, tag_id ) in self._c.execute( 'SELECT namespace_id, tag_id FROM tag_posting_lists WHERE tag_service_id = ?;', ( tag_service_id, ) ) }
+        
+        counts_and_ids = [ ( count, namespace_id, tag_id ) for ( count, namespace_id, tag_id ) in counts_and_ids if ( namespace_id, tag_id ) not in existing_ids ]
+        
+        # biggest first, as they save the most
+        
+        counts_and_ids.sort( reverse = True )
+        
+        return [ ( namespace_id, tag_id ) for ( count, namespace_id, tag_id ) in counts_and_ids ]
+        
+    
+    def _PostingListsGetTagPostingList( self, tag_service_key, tag, include_current_tags, include_pending_tags ):
+        
+        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
+            
+            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            
+        else:
+            
+            search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
+            
+        
+        siblings_manager = self._controller.GetManager( 'tag_siblings' )
+        
+        tags = siblings_manager.GetAllSiblings( tag )
+        
+        posting_lists = []
+        
+        for tag in tags:
+            
+            if not self._TagExists( tag ):
+                
+                continue
+                
+            
+            try: ( namespace_id, tag_id ) = self._GetNamespaceIdTagId( tag )
+            except HydrusExceptions.SizeException: continue
+            
+            if ':' in tag:
+                
+                predicate_phrase = 'namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id )
+                
+            else:
+                
+                namespace_id = self.POSTING_LISTS_ANY_NAMESPACE_ID
+                
+                predicate_phrase = 'tag_id = ' + str( tag_id )
+                
+            
+            for search_tag_service_id in search_tag_service_ids:
+                
+                result = self._c.execute( 'SELECT current_posting_list, pending_posting_list FROM tag_posting_lists WHERE tag_service_id = ? AND tag_id = ? AND namespace_id = ?;', ( search_tag_service_id, tag_id, namespace_id ) ).fetchone()
+                
+                if result is None:
+                    
+                    ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
+                    
+                    if include_current_tags:
+                        
+                        posting_lists.append( ClientPostingLists.FromHashIds( ( hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE ' + predicate_phrase + ';' ) ) ) )
+                        
+                    
+                    if include_pending_tags:
+                        
+                        posting_lists.append( ClientPostingLists.FromHashIds( ( hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE ' + predicate_phrase + ';' ) ) ) )
+                        
+                    
+                else:
+                    
+                    ( current_posting_list, pending_posting_list ) = result
+                    
+                    if include_current_tags:
+                        
+                        posting_lists.append( ClientPostingLists.FromBytes( current_posting_list ) )
+                        
+                    
+                    if include_pending_tags:
+                        
+                        posting_lists.append( ClientPostingLists.FromBytes( pending_posting_list ) )
+                        
+                    
+                
+            
+        
+        return ClientPostingLists.MassUnion( posting_lists )
+        
+    
+    def _PostingListsMaintain( self, stop_time = None ):
+        
+        new_options = self._controller.GetNewOptions()
+        
+        if not new_options.GetBoolean( 'tag_posting_lists' ):
+            
+            # stale lists would cost every mappings update for nothing
+            
+            self._c.execute( 'DELETE FROM file_posting_lists;' )
+            self._c.execute( 'DELETE FROM tag_posting_lists;' )
+            
+            return
+            
+        
+        existing_file_service_ids = { service_id for ( service_id, ) in self._c.execute( 'SELECT service_id FROM file_posting_lists;' ) }
+        
+        for file_service_id in self._GetServiceIds( ( HC.LOCAL_FILE, HC.FILE_REPOSITORY, HC.IPFS ) ):
+            
+            if file_service_id not in existing_file_service_ids:
+                
+                posting_list = ClientPostingLists.FromHashIds( ( hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( file_service_id, ) ) ) )
+                
+                self._c.execute( 'INSERT INTO file_posting_lists ( service_id, posting_list ) VALUES ( ?, ? );', ( file_service_id, sqlite3.Binary( posting_list.ToBytes() ) ) )
+                
+            
+        
+        missing_ids = []
+        
+        for tag_service_id in self._GetServiceIds( HC.TAG_SERVICES ):
+            
+            self._PostingListsPruneTags( tag_service_id )
+            
+            missing_ids.extend( ( ( tag_service_id, namespace_id, tag_id ) for ( namespace_id, tag_id ) in self._PostingListsGetMissingTags( tag_service_id ) ) )
+            
+        
+        if len( missing_ids ) == 0:
+            
+            return
+            
         
-        stale_time_delta = 14 * 86400
+        job_key = ClientThreading.JobKey( cancellable = True )
         
-        existing_names_to_timestamps = dict( self._c.execute( 'SELECT name, timestamp FROM analyze_timestamps;' ).fetchall() )
+        job_key.SetVariable( 'popup_title', 'tag posting lists maintenance' )
         
-        db_names = [ name for ( index, name, path ) in self._c.execute( 'PRAGMA database_list;' ) if name not in ( 'mem', 'temp' ) ]
+        self._controller.pub( 'message', job_key )
         
-        all_names = set()
+        num_done = 0
         
-        for db_name in db_names:
+        for ( tag_service_id, namespace_id, tag_id ) in missing_ids:
             
-            all_names.update( ( name for ( name, ) in self._c.execute( 'SELECT name FROM ' + db_name + '.sqlite_master;' ) ) )
+            ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+            
+            if should_quit or ( stop_time is not None and HydrusData.TimeHasPassed( stop_time ) ):
+                
+                break
+                
+            
+            text = 'generating tag posting lists - ' + HydrusData.ConvertValueRangeToPrettyString( num_done, len( missing_ids ) ) + ' tags done'
+            
+            self._controller.pub( 'splash_set_status_text', text )
+            job_key.SetVariable( 'popup_text_1', text )
+            
+            self._PostingListsGenerateTag( tag_service_id, namespace_id, tag_id )
+            
+            num_done += 1
             
         
-        names_to_analyze = { name for name in all_names if name not in existing_names_to_timestamps or HydrusData.TimeHasPassed( existing_names_to_timestamps[ name ] + stale_time_delta ) }
+        job_key.SetVariable( 'popup_text_1', 'done!' )
         
-        names_to_analyze.discard( 'sqlite_stat1' )
+        job_key.Finish()
         
-        if len( names_to_analyze ) > 0:
-            
-            return True
-            
+        job_key.Delete( 5 )
         
-        return False
+    
+    def _PostingListsPruneTags( self, tag_service_id ):
+        
+        # a tag that has shrunk below the minimum is quick to fetch from its index again, so its list would only slow down its updates
+        
+        big_ids = { ( namespace_id, tag_id ) for ( count, namespace_id, tag_id ) in self._PostingListsGetBigTags( tag_service_id ) }
+        
+        existing_ids = { ( namespace_id, tag_id ) for ( namespace_id, tag_id ) in self._c.execute( 'SELECT namespace_id, tag_id FROM tag_posting_lists WHERE tag_service_id = ?;', ( tag_service_id, ) ) }
+        
+        small_ids = existing_ids.difference( big_ids )
+        
+        self._c.executemany( 'DELETE FROM tag_posting_lists WHERE tag_service_id = ? AND tag_id = ? AND namespace_id = ?;', ( ( tag_service_id, tag_id, namespace_id ) for ( namespace_id, tag_id ) in small_ids ) )
         
     
-    def _ManageDBError( self, job, e ):
+    def _PostingListsUpdateMappings( self, tag_service_id, mappings_ids ):
         
-        if isinstance( e, MemoryError ):
+        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
+        
+        existing_ids = { ( namespace_id, tag_id ) for ( namespace_id, tag_id ) in self._c.execute( 'SELECT namespace_id, tag_id FROM tag_posting_lists WHERE tag_service_id = ?;', ( tag_service_id, ) ) }
+        
+        if len( existing_ids ) == 0:
             
-            HydrusData.ShowText( 'The client is running out of memory! Restart it ASAP!' )
+            return
             
         
-        if job.IsSynchronous():
+        ids_to_hash_ids = collections.defaultdict( set )
+        
+        for ( namespace_id, tag_id, hash_ids ) in mappings_ids:
             
-            db_traceback = 'Database ' + traceback.format_exc()
+            for ids in ( ( namespace_id, tag_id ), ( self.POSTING_LISTS_ANY_NAMESPACE_ID, tag_id ) ):
+                
+                if ids in existing_ids:
+                    
+                    ids_to_hash_ids[ ids ].update( hash_ids )
+                    
+                
             
-            first_line = HydrusData.ToUnicode( type( e ).__name__ ) + ': ' + HydrusData.ToUnicode( e )
+        
+        # rather than replaying adds, deletes and pends, just read back what the changed rows now say
+        
+        for ( ( namespace_id, tag_id ), hash_ids ) in ids_to_hash_ids.items():
             
-            new_e = HydrusExceptions.DBException( first_line, db_traceback )
+            if namespace_id == self.POSTING_LISTS_ANY_NAMESPACE_ID:
+                
+                predicate_phrase = 'tag_id = ' + str( tag_id )
+                
+            else:
+                
+                predicate_phrase = 'namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id )
+                
             
-            job.PutResult( new_e )
+            splayed_hash_ids = HydrusData.SplayListForDB( hash_ids )
             
-        else:
+            changed_posting_list = ClientPostingLists.FromHashIds( hash_ids )
             
-            HydrusData.ShowException( e )
+            current_posting_list = ClientPostingLists.FromHashIds( ( hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE ' + predicate_phrase + ' AND hash_id IN ' + splayed_hash_ids + ';' ) ) )
+            pending_posting_list = ClientPostingLists.FromHashIds( ( hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE ' + predicate_phrase + ' AND hash_id IN ' + splayed_hash_ids + ';' ) ) )
+            
+            ( old_current_posting_list, old_pending_posting_list ) = self._c.execute( 'SELECT current_posting_list, pending_posting_list FROM tag_posting_lists WHERE tag_service_id = ? AND tag_id = ? AND namespace_id = ?;', ( tag_service_id, tag_id, namespace_id ) ).fetchone()
+            
+            current_posting_list = ClientPostingLists.FromBytes( old_current_posting_list ).Difference( changed_posting_list ).Union( current_posting_list )
+            pending_posting_list = ClientPostingLists.FromBytes( old_pending_posting_list ).Difference( changed_posting_list ).Union( pending_posting_list )
+            
+            self._c.execute( 'UPDATE tag_posting_lists SET current_posting_list = ?, pending_posting_list = ? WHERE tag_service_id = ? AND tag_id = ? AND namespace_id = ?;', ( sqlite3.Binary( current_posting_list.ToBytes() ), sqlite3.Binary( pending_posting_list.ToBytes() ), tag_service_id, tag_id, namespace_id ) )
             
         
     
@@ -5496,6 +6972,9 @@ class DB( HydrusDB.HydrusDB ):
         notify_new_parents = False
         notify_new_siblings = False
         
+        service_keys_to_changed_sibling_old_tags = collections.defaultdict( set )
+        service_keys_to_changed_parent_child_tags = collections.defaultdict( set )
+        
         for ( service_key, content_updates ) in service_keys_to_content_updates.items():
             
             try:
@@ -5866,6 +7345,8 @@ class DB( HydrusDB.HydrusDB ):
                             notify_new_pending = True
                             
                         
+                        service_keys_to_changed_sibling_old_tags[ service_key ].add( old_tag )
+                        
                         notify_new_siblings = True
                         
                     elif data_type == HC.CONTENT_TYPE_TAG_PARENTS:
@@ -5950,6 +7431,8 @@ class DB( HydrusDB.HydrusDB ):
                             notify_new_pending = True
                             
                         
+                        service_keys_to_changed_parent_child_tags[ service_key ].add( child_tag )
+                        
                         notify_new_parents = True
                         
                     
@@ -5994,23 +7477,34 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
+        # the tag managers apply just the pairs that changed, rather than rereading all of them, so they hear about repository processing too
+        
+        if notify_new_siblings:
+            
+            service_keys_to_old_tags_to_new_tags = { service_key : self._GetTagSiblingsForOldTags( service_key, old_tags ) for ( service_key, old_tags ) in service_keys_to_changed_sibling_old_tags.items() }
+            
+            self.pub_after_commit( 'notify_new_siblings_delta', service_keys_to_old_tags_to_new_tags )
+            
+        
+        if notify_new_parents:
+            
+            service_keys_to_children_to_parents = { service_key : self._GetTagParentsForChildren( service_key, child_tags ) for ( service_key, child_tags ) in service_keys_to_changed_parent_child_tags.items() }
+            
+            self.pub_after_commit( 'notify_new_parents_delta', service_keys_to_children_to_parents )
+            
+        
         if do_pubsubs:
             
             if notify_new_downloads: self.pub_after_commit( 'notify_new_downloads' )
             if notify_new_pending: self.pub_after_commit( 'notify_new_pending' )
-            if notify_new_siblings:
-                
-                self.pub_after_commit( 'notify_new_siblings_data' )
-                self.pub_after_commit( 'notify_new_siblings_gui' )
-                self.pub_after_commit( 'notify_new_parents' )
-                
-            elif notify_new_parents:
-                
-                self.pub_after_commit( 'notify_new_parents' )
-                
+            if notify_new_siblings: self.pub_after_commit( 'notify_new_siblings_gui' )
             
             self.pub_content_updates_after_commit( service_keys_to_content_updates )
             
+        else:
+            
+            self._media_result_cache.ContentUpdated( service_keys_to_content_updates )
+            
         
     
     def _ProcessServiceUpdates( self, service_keys_to_service_updates ):
@@ -6174,12 +7668,13 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'client_files_locations': result = self._GetClientFilesLocations( *args, **kwargs )
         elif action == 'downloads': result = self._GetDownloads( *args, **kwargs )
         elif action == 'file_hashes': result = self._GetFileHashes( *args, **kwargs )
-        elif action == 'file_query_ids': result = self._GetHashIdsFromQuery( *args, **kwargs )
+        elif action == 'file_query_ids': result = self._GetFileQueryIds( *args, **kwargs )
         elif action == 'file_system_predicates': result = self._GetFileSystemPredicates( *args, **kwargs )
         elif action == 'filter_hashes': result = self._FilterHashes( *args, **kwargs )
+        elif action == 'filter_orphans': result = self._FilterOrphans( *args, **kwargs )
+        elif action == 'hash_status': result = self._GetHashStatus( *args, **kwargs )
         elif action == 'hydrus_sessions': result = self._GetHydrusSessions( *args, **kwargs )
         elif action == 'imageboards': result = self._GetYAMLDump( YAML_DUMP_ID_IMAGEBOARD, *args, **kwargs )
-        elif action == 'is_an_orphan': result = self._IsAnOrphan( *args, **kwargs )
         elif action == 'known_urls': result = self._GetKnownURLs( *args, **kwargs )
         elif action == 'load_into_disk_cache': result = self._LoadIntoDiskCache( *args, **kwargs )
         elif action == 'local_booru_share_keys': result = self._GetYAMLDumpNames( YAML_DUMP_ID_LOCAL_BOORU )
@@ -6206,6 +7701,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'service_filenames': result = self._GetServiceFilenames( *args, **kwargs )
         elif action == 'service_info': result = self._GetServiceInfo( *args, **kwargs )
         elif action == 'services': result = self._GetServices( *args, **kwargs )
+        elif action == 'similar_files_duplicate_pairs': result = self._PHashesGetDuplicatePairs( *args, **kwargs )
         elif action == 'related_tags': result = self._GetRelatedTags( *args, **kwargs )
         elif action == 'tag_censorship': result = self._GetTagCensorship( *args, **kwargs )
         elif action == 'tag_parents': result = self._GetTagParents( *args, **kwargs )
@@ -6372,6 +7868,58 @@ class DB( HydrusDB.HydrusDB ):
         self.pub_after_commit( 'notify_new_options' )
         
     
+    def _SelectFromCandidateHashIds( self, candidate_hash_ids, selects ):
+        
+        # the selects join from mem.temp_candidate_hash_ids, so they cost time in proportion to the candidates rather than the tables they look up
+        
+        hash_ids_in_table = getattr( self._thread_local, 'candidate_hash_ids', None )
+        
+        if hash_ids_in_table is None:
+            
+            self._c.execute( 'CREATE TABLE mem.temp_candidate_hash_ids ( hash_id INTEGER PRIMARY KEY );' )
+            
+            try:
+                
+                self._c.executemany( 'INSERT OR IGNORE INTO mem.temp_candidate_hash_ids ( hash_id ) VALUES ( ? );', ( ( hash_id, ) for hash_id in candidate_hash_ids ) )
+                
+                results = []
+                
+                for select in selects:
+                    
+                    results.extend( self._c.execute( select ) )
+                    
+                
+            finally:
+                
+                self._c.execute( 'DROP TABLE mem.temp_candidate_hash_ids;' )
+                
+            
+            return results
+            
+        
+        # we are in a query, so the table already holds the last predicate's candidates. they only ever narrow, so this is normally just deletes
+        
+        candidate_hash_ids = set( candidate_hash_ids )
+        
+        stale_hash_ids = hash_ids_in_table.difference( candidate_hash_ids )
+        new_hash_ids = candidate_hash_ids.difference( hash_ids_in_table )
+        
+        self._c.executemany( 'DELETE FROM mem.temp_candidate_hash_ids WHERE hash_id = ?;', ( ( hash_id, ) for hash_id in stale_hash_ids ) )
+        self._c.executemany( 'INSERT OR IGNORE INTO mem.temp_candidate_hash_ids ( hash_id ) VALUES ( ? );', ( ( hash_id, ) for hash_id in new_hash_ids ) )
+        
+        hash_ids_in_table.difference_update( stale_hash_ids )
+        hash_ids_in_table.update( new_hash_ids )
+        
+        results = []
+        
+        for select in selects:
+            
+            results.extend( self._c.execute( select ) )
+            
+        
+        return results
+        
+    
     def _SetJSONDump( self, obj ):
         
         if isinstance( obj, HydrusSerialisable.SerialisableBaseNamed ):
@@ -6483,6 +8031,8 @@ class DB( HydrusDB.HydrusDB ):
             self._c.execute( 'INSERT OR IGNORE INTO tag_censorship ( service_id, blacklist, tags ) VALUES ( ?, ?, ? );', ( service_id, blacklist, tags ) )
             
         
+        self._media_result_cache.InvalidateAll()
+        
         self.pub_after_commit( 'notify_new_tag_censorship' )
         
     
@@ -6512,6 +8062,108 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _StageMappings( self, mappings_ids ):
+        
+        # the rows go in sorted, so the temp table builds by appending and every later join walks the big mappings tables in index order
+        
+        self._c.execute( 'CREATE TABLE mem.temp_mappings ( namespace_id INTEGER, tag_id INTEGER, hash_id INTEGER, PRIMARY KEY( namespace_id, tag_id, hash_id ) ) WITHOUT ROWID;' )
+        
+        mappings_ids = sorted( mappings_ids, key = lambda ( namespace_id, tag_id, hash_ids ): ( namespace_id, tag_id ) )
+        
+        self._c.executemany( 'INSERT OR IGNORE INTO temp_mappings ( namespace_id, tag_id, hash_id ) VALUES ( ?, ?, ? );', ( ( namespace_id, tag_id, hash_id ) for ( namespace_id, tag_id, hash_ids ) in mappings_ids for hash_id in sorted( hash_ids ) ) )
+        
+    
+    def _StageSpecificMappings( self, file_service_id, tag_service_id ):
+        
+        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        
+        self._c.execute( 'CREATE TABLE mem.temp_specific_mappings ( hash_id INTEGER, namespace_id INTEGER, tag_id INTEGER, PRIMARY KEY( hash_id, namespace_id, tag_id ) ) WITHOUT ROWID;' )
+        
+        self._c.execute( 'INSERT INTO temp_specific_mappings ( hash_id, namespace_id, tag_id ) SELECT hash_id, namespace_id, tag_id FROM temp_mappings CROSS JOIN ' + files_table_name + ' USING ( hash_id );' )
+        
+    
+    def _SortHashIds( self, file_service_key, hash_ids, sort_by = None, limit = None ):
+        
+        hash_ids = list( hash_ids )
+        
+        if sort_by is None:
+            
+            ( sort_by_type, sort_by_data ) = ( None, None )
+            
+        else:
+            
+            ( sort_by_type, sort_by_data ) = sort_by
+            
+        
+        sort_is_random = sort_by_type == 'system' and sort_by_data == CC.SORT_BY_RANDOM
+        
+        if sort_by_type != 'system' or sort_is_random:
+            
+            # the db cannot do these sorts, so a limit takes a random sample, which also serves for random order
+            
+            if limit is not None and limit <= len( hash_ids ):
+                
+                hash_ids = random.sample( hash_ids, limit )
+                
+            elif sort_is_random:
+                
+                random.shuffle( hash_ids )
+                
+            
+            return hash_ids
+            
+        
+        # these match ClientMedia's sort functions, which count a missing value as -1
+        
+        order_by_lookup = {}
+        
+        order_by_lookup[ CC.SORT_BY_SMALLEST ] = 'IFNULL( size, -1 ) ASC'
+        order_by_lookup[ CC.SORT_BY_LARGEST ] = 'IFNULL( size, -1 ) DESC'
+        order_by_lookup[ CC.SORT_BY_SHORTEST ] = 'IFNULL( duration, -1 ) ASC'
+        order_by_lookup[ CC.SORT_BY_LONGEST ] = 'IFNULL( duration, -1 ) DESC'
+        order_by_lookup[ CC.SORT_BY_OLDEST ] = 'IFNULL( timestamp, -1 ) ASC'
+        order_by_lookup[ CC.SORT_BY_NEWEST ] = 'IFNULL( timestamp, -1 ) DESC'
+        order_by_lookup[ CC.SORT_BY_MIME ] = 'mime ASC'
+        
+        sort_datas = [ sort_by_data ]
+        
+        # the media list sorts by the fallback and then stable sorts by the primary, so the fallback breaks ties
+        
+        if HC.options[ 'sort_fallback' ] < len( CC.SORT_CHOICES ):
+            
+            ( fallback_sort_by_type, fallback_sort_by_data ) = CC.SORT_CHOICES[ HC.options[ 'sort_fallback' ] ]
+            
+            if fallback_sort_by_data != CC.SORT_BY_RANDOM:
+                
+                sort_datas.append( fallback_sort_by_data )
+                
+            
+        
+        order_bys = [ order_by_lookup[ sort_data ] for sort_data in sort_datas ]
+        
+        select = 'SELECT temp_candidate_hash_ids.hash_id FROM mem.temp_candidate_hash_ids LEFT JOIN files_info USING ( hash_id )'
+        
+        if CC.SORT_BY_OLDEST in sort_datas or CC.SORT_BY_NEWEST in sort_datas:
+            
+            file_service_id = self._GetServiceId( file_service_key )
+            
+            select += ' LEFT JOIN current_files ON ( current_files.hash_id = temp_candidate_hash_ids.hash_id AND current_files.service_id = ' + str( file_service_id ) + ' )'
+            
+        
+        select += ' ORDER BY ' + ', '.join( order_bys )
+        
+        if limit is not None:
+            
+            # sqlite keeps just the top rows as it goes, so this is cheap even over a big result
+            
+            select += ' LIMIT ' + str( limit )
+            
+        
+        select += ';'
+        
+        return [ hash_id for ( hash_id, ) in self._SelectFromCandidateHashIds( hash_ids, [ select ] ) ]
+        
+    
     def _SyncHashesToTagArchive( self, hashes, hta_path, tag_service_key, adding, namespaces ):
         
         hta = HydrusTagArchive.HydrusTagArchive( hta_path )
@@ -6597,6 +8249,14 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _TransactionFinished( self ):
+        
+        self._autocomplete_counts_cache.TransactionFinished()
+        self._media_result_cache.TransactionFinished()
+        self._namespace_strings_cache.TransactionFinished()
+        self._tag_strings_cache.TransactionFinished()
+        
+    
     def _UndeleteFiles( self, hash_ids ):
         
         splayed_hash_ids = HydrusData.SplayListForDB( hash_ids )
@@ -7983,6 +9643,39 @@ class DB( HydrusDB.HydrusDB ):
             self._c.execute( 'CREATE TABLE recent_tags ( service_id INTEGER REFERENCES services ON DELETE CASCADE, namespace_id INTEGER, tag_id INTEGER, timestamp INTEGER, PRIMARY KEY ( service_id, namespace_id, tag_id ) );' )
             
         
+        if version == 222:
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.perceptual_hash_vptree ( hash_id INTEGER PRIMARY KEY, parent_id INTEGER, radius INTEGER, inner_id INTEGER, inner_population INTEGER, outer_id INTEGER, outer_population INTEGER );' )
+            self._c.execute( 'CREATE INDEX IF NOT EXISTS external_caches.perceptual_hash_vptree_parent_id_index ON perceptual_hash_vptree ( parent_id );' )
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.perceptual_hash_vptree_regen ( hash_id INTEGER PRIMARY KEY );' )
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.perceptual_hash_pairs ( smaller_hash_id INTEGER, larger_hash_id INTEGER, distance INTEGER, PRIMARY KEY ( smaller_hash_id, larger_hash_id ) );' )
+            self._c.execute( 'CREATE INDEX IF NOT EXISTS external_caches.perceptual_hash_pairs_larger_hash_id_index ON perceptual_hash_pairs ( larger_hash_id );' )
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.perceptual_hash_pairs_searched ( hash_id INTEGER PRIMARY KEY, searched_distance INTEGER );' )
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.file_posting_lists ( service_id INTEGER PRIMARY KEY, posting_list BLOB_BYTES );' )
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.tag_posting_lists ( tag_service_id INTEGER, tag_id INTEGER, namespace_id INTEGER, current_posting_list BLOB_BYTES, pending_posting_list BLOB_BYTES, PRIMARY KEY ( tag_service_id, tag_id, namespace_id ) );' )
+            
+            self._controller.pub( 'splash_set_status_text', 'generating similar file metadata' )
+            
+            population = self._c.execute( 'SELECT hash_id, phash FROM perceptual_hashes;' ).fetchall()
+            
+            self._PHashesGenerateBranch( None, population )
+            
+            #
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.tag_trigrams ( trigram TEXT, tag_id INTEGER, PRIMARY KEY ( trigram, tag_id ) ) WITHOUT ROWID;' )
+            
+            self._controller.pub( 'splash_set_status_text', 'generating tag trigram index' )
+            
+            tag_ids_and_tags = self._c.execute( 'SELECT tag_id, tag FROM tags;' ).fetchall()
+            
+            self._AddTagTrigrams( tag_ids_and_tags )
+            
+        
         self._controller.pub( 'splash_set_title_text', 'updated db to v' + str( version + 1 ) )
         
         self._c.execute( 'UPDATE version SET version = ?;', ( version + 1, ) )
@@ -8087,6 +9780,8 @@ class DB( HydrusDB.HydrusDB ):
         tag_ids_to_search_for = tag_ids_being_added.union( tag_ids_being_removed )
         hash_ids_to_search_for = hash_ids_being_added.union( hash_ids_being_removed )
         
+        self._autocomplete_counts_cache.InvalidateTagIds( tag_ids_to_search_for )
+        
         self._c.execute( 'CREATE TABLE mem.temp_tag_ids ( tag_id INTEGER );' )
         self._c.execute( 'CREATE TABLE mem.temp_hash_ids ( hash_id INTEGER );' )
         
@@ -8105,7 +9800,61 @@ class DB( HydrusDB.HydrusDB ):
         combined_files_current_counter = collections.Counter()
         combined_files_pending_counter = collections.Counter()
         
-        if len( mappings_ids ) > 0:
+        # big repository chunks are staged in a temp table and applied with a handful of set-based statements, rather than several statements per tag
+        
+        num_rows = sum( ( len( hash_ids ) for ( namespace_id, tag_id, hash_ids ) in itertools.chain( mappings_ids, deleted_mappings_ids ) ) )
+        
+        use_staged_mappings = self._staged_mappings_ok and num_rows >= self.STAGED_MAPPINGS_MIN_ROWS
+        
+        if len( mappings_ids ) > 0 and use_staged_mappings:
+            
+            self._StageMappings( mappings_ids )
+            
+            try:
+                
+                self._c.execute( 'DELETE FROM ' + deleted_mappings_table_name + ' WHERE ( namespace_id, tag_id, hash_id ) IN ( SELECT namespace_id, tag_id, hash_id FROM temp_mappings );' )
+                
+                change_in_num_deleted_mappings -= self._GetRowCount()
+                
+                pending_deleted_counts = self._c.execute( 'SELECT namespace_id, tag_id, COUNT( * ) FROM temp_mappings CROSS JOIN ' + pending_mappings_table_name + ' USING ( namespace_id, tag_id, hash_id ) GROUP BY namespace_id, tag_id;' ).fetchall()
+                
+                if len( pending_deleted_counts ) > 0:
+                    
+                    self._c.execute( 'DELETE FROM ' + pending_mappings_table_name + ' WHERE ( namespace_id, tag_id, hash_id ) IN ( SELECT namespace_id, tag_id, hash_id FROM temp_mappings );' )
+                    
+                
+                current_inserted_counts = self._c.execute( 'SELECT namespace_id, tag_id, COUNT( * ) FROM temp_mappings AS t WHERE NOT EXISTS ( SELECT 1 FROM ' + current_mappings_table_name + ' AS m WHERE m.namespace_id = t.namespace_id AND m.tag_id = t.tag_id AND m.hash_id = t.hash_id ) GROUP BY namespace_id, tag_id;' ).fetchall()
+                
+                if len( current_inserted_counts ) > 0:
+                    
+                    self._c.execute( 'INSERT OR IGNORE INTO ' + current_mappings_table_name + ' ( namespace_id, tag_id, hash_id ) SELECT namespace_id, tag_id, hash_id FROM temp_mappings;' )
+                    
+                
+                for ( namespace_id, tag_id, num_pending_deleted ) in pending_deleted_counts:
+                    
+                    change_in_num_pending_mappings -= num_pending_deleted
+                    
+                    combined_files_pending_counter[ ( namespace_id, tag_id ) ] -= num_pending_deleted
+                    
+                
+                for ( namespace_id, tag_id, num_current_inserted ) in current_inserted_counts:
+                    
+                    change_in_num_mappings += num_current_inserted
+                    
+                    combined_files_current_counter[ ( namespace_id, tag_id ) ] += num_current_inserted
+                    
+                
+                for file_service_id in file_service_ids:
+                    
+                    self._CacheSpecificMappingsAddStagedMappings( file_service_id, tag_service_id )
+                    
+                
+            finally:
+                
+                self._c.execute( 'DROP TABLE temp_mappings;' )
+                
+            
+        elif len( mappings_ids ) > 0:
             
             for ( namespace_id, tag_id, hash_ids ) in mappings_ids:
                 
@@ -8137,7 +9886,45 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
-        if len( deleted_mappings_ids ) > 0:
+        if len( deleted_mappings_ids ) > 0 and use_staged_mappings:
+            
+            self._StageMappings( deleted_mappings_ids )
+            
+            try:
+                
+                current_deleted_counts = self._c.execute( 'SELECT namespace_id, tag_id, COUNT( * ) FROM temp_mappings CROSS JOIN ' + current_mappings_table_name + ' USING ( namespace_id, tag_id, hash_id ) GROUP BY namespace_id, tag_id;' ).fetchall()
+                
+                if len( current_deleted_counts ) > 0:
+                    
+                    self._c.execute( 'DELETE FROM ' + current_mappings_table_name + ' WHERE ( namespace_id, tag_id, hash_id ) IN ( SELECT namespace_id, tag_id, hash_id FROM temp_mappings );' )
+                    
+                
+                self._c.execute( 'DELETE FROM ' + petitioned_mappings_table_name + ' WHERE ( namespace_id, tag_id, hash_id ) IN ( SELECT namespace_id, tag_id, hash_id FROM temp_mappings );' )
+                
+                change_in_num_petitioned_mappings -= self._GetRowCount()
+                
+                self._c.execute( 'INSERT OR IGNORE INTO ' + deleted_mappings_table_name + ' ( namespace_id, tag_id, hash_id ) SELECT namespace_id, tag_id, hash_id FROM temp_mappings;' )
+                
+                change_in_num_deleted_mappings += self._GetRowCount()
+                
+                for ( namespace_id, tag_id, num_current_deleted ) in current_deleted_counts:
+                    
+                    change_in_num_mappings -= num_current_deleted
+                    
+                    combined_files_current_counter[ ( namespace_id, tag_id ) ] -= num_current_deleted
+                    
+                
+                for file_service_id in file_service_ids:
+                    
+                    self._CacheSpecificMappingsDeleteStagedMappings( file_service_id, tag_service_id )
+                    
+                
+            finally:
+                
+                self._c.execute( 'DROP TABLE temp_mappings;' )
+                
+            
+        elif len( deleted_mappings_ids ) > 0:
             
             for ( namespace_id, tag_id, hash_ids ) in deleted_mappings_ids:
                 
@@ -8225,6 +10012,8 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
+        self._PostingListsUpdateMappings( tag_service_id, itertools.chain( mappings_ids, deleted_mappings_ids, pending_mappings_ids, pending_rescinded_mappings_ids ) )
+        
         combined_files_seen_ids = set( ( key for ( key, value ) in combined_files_current_counter.items() if value != 0 ) )
         combined_files_seen_ids.update( ( key for ( key, value ) in combined_files_pending_counter.items() if value != 0 ) )
         
@@ -8634,9 +10423,14 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'hydrus_session': result = self._AddHydrusSession( *args, **kwargs )
         elif action == 'imageboard': result = self._SetYAMLDump( YAML_DUMP_ID_IMAGEBOARD, *args, **kwargs )
         elif action == 'import_file': result = self._ImportFile( *args, **kwargs )
+        elif action == 'import_files': result = self._ImportFiles( *args, **kwargs )
         elif action == 'local_booru_share': result = self._SetYAMLDump( YAML_DUMP_ID_LOCAL_BOORU, *args, **kwargs )
+        elif action == 'maintain_similar_files_duplicate_pairs': result = self._PHashesMaintainDuplicatePairs( *args, **kwargs )
+        elif action == 'maintain_similar_files_tree': result = self._PHashesMaintainTree( *args, **kwargs )
+        elif action == 'maintain_tag_posting_lists': result = self._PostingListsMaintain( *args, **kwargs )
         elif action == 'push_recent_tags': result = self._PushRecentTags( *args, **kwargs )
         elif action == 'regenerate_ac_cache': result = self._RegenerateACCache( *args, **kwargs )        
+        elif action == 'regenerate_similar_files_tree': result = self._PHashesRegenerateTree( *args, **kwargs )
         elif action == 'relocate_client_files': result = self._RelocateClientFiles( *args, **kwargs )
         elif action == 'remote_booru': result = self._SetYAMLDump( YAML_DUMP_ID_REMOTE_BOORU, *args, **kwargs )
         elif action == 'reset_service': result = self._ResetService( *args, **kwargs )
@@ -8658,12 +10452,16 @@ class DB( HydrusDB.HydrusDB ):
     
     def pub_content_updates_after_commit( self, service_keys_to_content_updates ):
         
+        self._media_result_cache.ContentUpdated( service_keys_to_content_updates, will_be_published = True )
+        
         self.pub_after_commit( 'content_updates_data', service_keys_to_content_updates )
         self.pub_after_commit( 'content_updates_gui', service_keys_to_content_updates )
         
     
     def pub_service_updates_after_commit( self, service_keys_to_service_updates ):
         
+        self._media_result_cache.InvalidateAll()
+        
         self.pub_after_commit( 'service_updates_data', service_keys_to_service_updates )
         self.pub_after_commit( 'service_updates_gui', service_keys_to_service_updates )
         
@@ -127,7 +127,9 @@ def DAEMONDownloadFiles( controller ):
                             
                             controller.WaitUntilPubSubsEmpty()
                             
-                            client_files_manager.ImportFile( temp_path, override_deleted = True )
+                            file_import_job = ClientFiles.FileImportJob( temp_path, override_deleted = True )
+                            
+                            client_files_manager.ImportFile( file_import_job )
                             
                             successful_hashes.add( hash )
                             
@@ -245,7 +247,11 @@ def DAEMONRebalanceClientFiles( controller ):
     
     if controller.CurrentlyIdle():
         
-        controller.GetClientFilesManager().Rebalance()
+        client_files_manager = controller.GetClientFilesManager()
+        
+        client_files_manager.Rebalance()
+        
+        client_files_manager.MaintainResizedThumbnails()
         
     
 def DAEMONSynchroniseAccounts( controller ):
@@ -12,6 +12,7 @@ import HydrusFileHandling
 import HydrusPaths
 import HydrusSerialisable
 import HydrusTags
+import Queue
 import threading
 import traceback
 import os
@@ -515,12 +516,22 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'booleans' ][ 'show_related_tags' ] = False
         
+        self._dictionary[ 'booleans' ][ 'db_group_commit' ] = False
+        
+        self._dictionary[ 'booleans' ][ 'tag_posting_lists' ] = False
+        
+        self._dictionary[ 'booleans' ][ 'segmented_media_caches' ] = False
+        
+        self._dictionary[ 'booleans' ][ 'pack_resized_thumbnails' ] = False
+        
         #
         
         self._dictionary[ 'integers' ] = {}
         
         self._dictionary[ 'integers' ][ 'video_buffer_size_mb' ] = 96
         
+        self._dictionary[ 'integers' ][ 'num_db_read_connections' ] = 2
+        
         self._dictionary[ 'integers' ][ 'related_tags_width' ] = 150
         self._dictionary[ 'integers' ][ 'related_tags_search_1_duration_ms' ] = 250
         self._dictionary[ 'integers' ][ 'related_tags_search_2_duration_ms' ] = 2000
@@ -539,6 +550,8 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'noneable_integers' ][ 'num_recent_tags' ] = None
         
+        self._dictionary[ 'noneable_integers' ][ 'similar_files_duplicate_pairs_search_distance' ] = None
+        
         #
         
         client_files_default = os.path.join( HC.DB_DIR, 'client_files' )
@@ -1621,6 +1634,61 @@ class ServiceRestricted( ServiceRemote ):
     
 class ServiceRepository( ServiceRestricted ):
     
+    NUM_CONCURRENT_UPDATE_DOWNLOADS = 4
+    
+    def _DownloadContentUpdatePackage( self, begin, subindex ):
+        
+        path = ClientFiles.GetExpectedContentUpdatePackagePath( self._service_key, begin, subindex )
+        
+        # the response goes straight to disk as it came, and only gets its real name once it is complete
+        
+        temp_path = path + '.downloading'
+        
+        try:
+            
+            self.Request( HC.GET, 'content_update_package', { 'begin' : begin, 'subindex' : subindex, 'binary' : 1 }, temp_path = temp_path )
+            
+            os.rename( temp_path, path )
+            
+        finally:
+            
+            HydrusPaths.DeletePath( temp_path )
+            
+        
+    
+    def _DownloadContentUpdatePackages( self, job_key, begin, subindices ):
+        
+        subindices_queue = Queue.Queue()
+        
+        for subindex in subindices:
+            
+            subindices_queue.put( subindex )
+            
+        
+        errors = []
+        
+        num_threads = min( len( subindices ), self.NUM_CONCURRENT_UPDATE_DOWNLOADS )
+        
+        threads = [ threading.Thread( target = self._THREADDownloadContentUpdatePackages, args = ( job_key, begin, subindices_queue, errors ) ) for i in range( num_threads ) ]
+        
+        for thread in threads:
+            
+            thread.daemon = True
+            
+            thread.start()
+            
+        
+        for thread in threads:
+            
+            thread.join()
+            
+        
+        if len( errors ) > 0:
+            
+            raise errors[ 0 ]
+            
+        
+    
     def _ProcessServiceUpdate( self, service_update ):
         
         ServiceRestricted._ProcessServiceUpdate( self, service_update )
@@ -1679,6 +1747,157 @@ class ServiceRepository( ServiceRestricted ):
         HydrusGlobals.client_controller.Write( 'service_updates', service_keys_to_service_updates )
         
     
+    def _THREADDownloadContentUpdatePackages( self, job_key, begin, subindices_queue, errors ):
+        
+        options = HydrusGlobals.client_controller.GetOptions()
+        
+        while len( errors ) == 0:
+            
+            if options[ 'pause_repo_sync' ] or HydrusGlobals.model_shutdown:
+                
+                return
+                
+            
+            ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+            
+            if should_quit:
+                
+                return
+                
+            
+            try:
+                
+                subindex = subindices_queue.get_nowait()
+                
+            except Queue.Empty:
+                
+                return
+                
+            
+            try:
+                
+                self._DownloadContentUpdatePackage( begin, subindex )
+                
+            except Exception as e:
+                
+                errors.append( e )
+                
+            
+        
+    
+    def _THREADDownloadUpdates( self, job_key, download_info ):
+        
+        options = HydrusGlobals.client_controller.GetOptions()
+        
+        try:
+            
+            while self.CanDownloadUpdate():
+                
+                if options[ 'pause_repo_sync' ] or HydrusGlobals.model_shutdown:
+                    
+                    break
+                    
+                
+                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                
+                if should_quit:
+                    
+                    break
+                    
+                
+                if self._info[ 'first_timestamp' ] is None:
+                    
+                    update_index_string = 'initial update'
+                    
+                else:
+                    
+                    gauge_range = ( HydrusData.GetNow() - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION
+                    gauge_value = ( ( self._info[ 'next_download_timestamp' ] - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION ) + 1
+                    
+                    update_index_string = 'update ' + HydrusData.ConvertValueRangeToPrettyString( gauge_value, gauge_range )
+                    
+                
+                # the popup's text lines belong to processing, so download progress goes in the title
+                
+                job_key.SetVariable( 'popup_title', 'repository synchronisation - ' + self._name + ' - downloading ' + update_index_string )
+                
+                service_update_package = self.Request( HC.GET, 'service_update_package', { 'begin' : self._info[ 'next_download_timestamp' ] } )
+                
+                begin = service_update_package.GetBegin()
+                
+                subindex_count = service_update_package.GetSubindexCount()
+                
+                subindices_to_download = []
+                
+                for subindex in range( subindex_count ):
+                    
+                    path = ClientFiles.GetExpectedContentUpdatePackagePath( self._service_key, begin, subindex )
+                    
+                    if os.path.exists( path ):
+                        
+                        size = os.path.getsize( path )
+                        
+                        if size == 0:
+                            
+                            os.remove( path )
+                            
+                        
+                    
+                    if not os.path.exists( path ):
+                        
+                        subindices_to_download.append( subindex )
+                        
+                    
+                
+                self._DownloadContentUpdatePackages( job_key, begin, subindices_to_download )
+                
+                all_downloaded = True not in ( not os.path.exists( ClientFiles.GetExpectedContentUpdatePackagePath( self._service_key, begin, subindex ) ) for subindex in range( subindex_count ) )
+                
+                if not all_downloaded:
+                    
+                    # we were paused or cancelled partway through, so this update is not ready to be committed
+                    
+                    break
+                    
+                
+                path = ClientFiles.GetExpectedServiceUpdatePackagePath( self._service_key, begin )
+                
+                obj_string = service_update_package.DumpToNetworkString()
+                
+                with open( path, 'wb' ) as f: f.write( obj_string )
+                
+                service_updates = [ HydrusData.ServiceUpdate( HC.SERVICE_UPDATE_NEXT_DOWNLOAD_TIMESTAMP, service_update_package.GetNextBegin() ) ]
+                
+                service_keys_to_service_updates = { self._service_key : service_updates }
+                
+                self.ProcessServiceUpdates( service_keys_to_service_updates )
+                
+                HydrusGlobals.client_controller.Write( 'service_updates', service_keys_to_service_updates )
+                
+                HydrusGlobals.client_controller.WaitUntilPubSubsEmpty()
+                
+                download_info[ 'num_updates_downloaded' ] += 1
+                
+            
+        except HydrusExceptions.ServerBusyException:
+            
+            HydrusData.Print( 'While synchronising ' + self._name + ', the server was too busy to respond for now, so processing will continue with what has been downloaded.' )
+            
+        except Exception as e:
+            
+            if 'Could not connect' in str( e ):
+                
+                HydrusData.Print( 'While synchronising ' + self._name + ', the client could not connect to the service, so processing will continue with what has been downloaded.' )
+                
+            else:
+                
+                HydrusData.Print( traceback.format_exc() )
+                
+                download_info[ 'error' ] = e
+                
+            
+        
+    
     def CanDownloadUpdate( self ):
         
         work_to_do = self.IsUpdateDueForDownload()
@@ -1780,7 +1999,6 @@ class ServiceRepository( ServiceRestricted ):
             return
             
         
-        num_updates_downloaded = 0
         num_updates_processed = 0
         total_content_weight_processed = 0
         
@@ -1793,9 +2011,37 @@ class ServiceRepository( ServiceRestricted ):
             
             HydrusGlobals.client_controller.pub( 'message', job_key )
             
+            # downloading runs in its own thread, so processing can start on the first update while the rest are still coming in
+            
+            download_info = { 'num_updates_downloaded' : 0, 'error' : None }
+            
+            if self.CanDownloadUpdate() and not options[ 'pause_repo_sync' ]:
+                
+                download_thread = threading.Thread( target = self._THREADDownloadUpdates, args = ( job_key, download_info ), name = 'Repository Update Download' )
+                
+                download_thread.daemon = True
+                
+                download_thread.start()
+                
+            else:
+                
+                download_thread = None
+                
+            
+            loaded_into_disk_cache = False
+            
+            # the downloader writes the files and info the next sync will use, so however we leave, it has to be stopped or finished first
+            
+            processing_finished = False
+            
             try:
                 
-                while self.CanDownloadUpdate():
+                while True:
+                    
+                    if download_info[ 'error' ] is not None:
+                        
+                        raise download_info[ 'error' ]
+                        
                     
                     if options[ 'pause_repo_sync' ]:
                         
@@ -1809,298 +2055,231 @@ class ServiceRepository( ServiceRestricted ):
                         break
                         
                     
-                    if self._info[ 'first_timestamp' ] is None:
+                    if not self.CanProcessUpdate():
                         
-                        gauge_range = None
-                        gauge_value = 0
+                        if download_thread is not None and download_thread.is_alive():
+                            
+                            HydrusGlobals.client_controller.pub( 'splash_set_status_text', 'downloading' )
+                            job_key.SetVariable( 'popup_text_1', 'waiting for the next update to download' )
+                            
+                            download_thread.join( 1 )
+                            
+                            continue
+                            
+                        else:
+                            
+                            break
+                            
                         
-                        update_index_string = 'initial update: '
+                    
+                    if self._service_type == HC.TAG_REPOSITORY and not loaded_into_disk_cache:
                         
-                    else:
+                        HydrusGlobals.client_controller.pub( 'splash_set_status_text', 'preparing disk cache' )
+                        job_key.SetVariable( 'popup_text_1', 'preparing disk cache' )
+                        
+                        while not loaded_into_disk_cache:
+                            
+                            if options[ 'pause_repo_sync' ]:
+                                
+                                break
+                                
+                            
+                            ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                            
+                            if should_quit:
+                                
+                                break
+                                
+                            
+                            disk_cache_stop_time = HydrusData.GetNow() + 15
+                            
+                            loaded_into_disk_cache = HydrusGlobals.client_controller.Read( 'load_into_disk_cache', stop_time = disk_cache_stop_time )
+                            
                         
-                        gauge_range = ( HydrusData.GetNow() - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION
-                        gauge_value = ( ( self._info[ 'next_download_timestamp' ] - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION ) + 1
+                        loaded_into_disk_cache = True
                         
-                        update_index_string = 'update ' + HydrusData.ConvertValueRangeToPrettyString( gauge_value, gauge_range ) + ': '
+                        continue
                         
                     
+                    gauge_range = ( ( HydrusData.GetNow() - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION )
+                    
+                    gauge_value = ( ( self._info[ 'next_processing_timestamp' ] - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION ) + 1
+                    
+                    update_index_string = 'update ' + HydrusData.ConvertValueRangeToPrettyString( gauge_value, gauge_range ) + ': '
+                    
                     subupdate_index_string = 'service update: '
                     
                     HydrusGlobals.client_controller.pub( 'splash_set_title_text', self._name + ' - ' + update_index_string + subupdate_index_string )
-                    HydrusGlobals.client_controller.pub( 'splash_set_status_text', 'downloading' )
-                    job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'downloading and parsing' )
+                    HydrusGlobals.client_controller.pub( 'splash_set_status_text', 'processing' )
+                    job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'loading from disk' )
                     job_key.SetVariable( 'popup_gauge_1', ( gauge_value, gauge_range ) )
                     
-                    service_update_package = self.Request( HC.GET, 'service_update_package', { 'begin' : self._info[ 'next_download_timestamp' ] } )
+                    path = ClientFiles.GetExpectedServiceUpdatePackagePath( self._service_key, self._info[ 'next_processing_timestamp' ] )
+                    
+                    if not os.path.exists( path ):
+                        
+                        self._ReportSyncProcessingError( path, 'was missing' )
+                        
+                        return
+                        
                     
-                    begin = service_update_package.GetBegin()
+                    with open( path, 'rb' ) as f: obj_string = f.read()
+                    
+                    try:
+                        
+                        service_update_package = HydrusSerialisable.CreateFromNetworkString( obj_string )
+                        
+                        if not isinstance( service_update_package, HydrusData.ServerToClientServiceUpdatePackage ):
+                            
+                            raise Exception()
+                            
+                        
+                    except:
+                        
+                        self._ReportSyncProcessingError( path, 'did not parse' )
+                        
+                        return
+                        
                     
                     subindex_count = service_update_package.GetSubindexCount()
                     
+                    processing_went_ok = True
+                    
                     for subindex in range( subindex_count ):
                         
-                        path = ClientFiles.GetExpectedContentUpdatePackagePath( self._service_key, begin, subindex )
+                        should_break = False
                         
-                        if os.path.exists( path ):
+                        if options[ 'pause_repo_sync' ]:
                             
-                            size = os.path.getsize( path )
+                            should_break = True
                             
-                            if size == 0:
-                                
-                                os.remove( path )
-                                
+                        
+                        ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                        
+                        if should_quit or should_break:
+                            
+                            processing_went_ok = False
+                            
+                            break
                             
                         
+                        subupdate_index_string = 'content update ' + HydrusData.ConvertValueRangeToPrettyString( subindex + 1, subindex_count ) + ': '
+                        
+                        path = ClientFiles.GetExpectedContentUpdatePackagePath( self._service_key, self._info[ 'next_processing_timestamp' ], subindex )
+                        
                         if not os.path.exists( path ):
                             
-                            subupdate_index_string = 'content update ' + HydrusData.ConvertValueRangeToPrettyString( subindex + 1, subindex_count ) + ': '
+                            self._ReportSyncProcessingError( path, 'was missing' )
                             
-                            HydrusGlobals.client_controller.pub( 'splash_set_title_text', self._name + ' - ' + update_index_string + subupdate_index_string )
-                            job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'downloading and parsing' )
+                            return
                             
-                            content_update_package = self.Request( HC.GET, 'content_update_package', { 'begin' : begin, 'subindex' : subindex } )
+                        
+                        job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'loading from disk' )
+                        
+                        with open( path, 'rb' ) as f: obj_string = f.read()
+                        
+                        job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'parsing' )
+                        
+                        try:
                             
-                            obj_string = content_update_package.DumpToNetworkString()
+                            content_update_package = HydrusSerialisable.CreateFromNetworkString( obj_string )
                             
-                            job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'saving to disk' )
+                            if not isinstance( content_update_package, HydrusData.ServerToClientContentUpdatePackage ):
+                                
+                                raise Exception()
+                                
                             
-                            with open( path, 'wb' ) as f: f.write( obj_string )
+                        except:
+                            
+                            self._ReportSyncProcessingError( path, 'did not parse' )
+                            
+                            return
                             
                         
-                    
-                    job_key.SetVariable( 'popup_text_1', update_index_string + 'committing' )
-                    
-                    path = ClientFiles.GetExpectedServiceUpdatePackagePath( self._service_key, begin )
-                    
-                    obj_string = service_update_package.DumpToNetworkString()
-                    
-                    with open( path, 'wb' ) as f: f.write( obj_string )
-                    
-                    service_updates = [ HydrusData.ServiceUpdate( HC.SERVICE_UPDATE_NEXT_DOWNLOAD_TIMESTAMP, service_update_package.GetNextBegin() ) ]
-                    
-                    service_keys_to_service_updates = { self._service_key : service_updates }
-                    
-                    self.ProcessServiceUpdates( service_keys_to_service_updates )
-                    
-                    HydrusGlobals.client_controller.Write( 'service_updates', service_keys_to_service_updates )
-                    
-                    HydrusGlobals.client_controller.WaitUntilPubSubsEmpty()
-                    
-                    num_updates_downloaded += 1
-                    
-                
-            except HydrusExceptions.ServerBusyException:
-                
-                job_key.SetVariable( 'popup_text_1', 'Server was too busy to respond for now, will continue with processing.' )
-                
-                time.sleep( 3 )
-                
-            except Exception as e:
-                
-                if 'Could not connect' in str( e ):
-                    
-                    job_key.SetVariable( 'popup_text_1', 'Could not connect to service, will continue with processing.' )
-                    
-                    time.sleep( 5 )
-                    
-                else:
-                    
-                    raise
-                    
-                
-            
-            if self._service_type == HC.TAG_REPOSITORY and self.CanProcessUpdate():
-                
-                HydrusGlobals.client_controller.pub( 'splash_set_status_text', 'preparing disk cache' )
-                job_key.SetVariable( 'popup_text_1', 'preparing disk cache' )
-                
-                loaded_into_disk_cache = False
-                
-                while not loaded_into_disk_cache:
-                    
-                    if options[ 'pause_repo_sync' ]:
+                        HydrusGlobals.client_controller.pub( 'splash_set_title_text', self._name + ' - ' + update_index_string + subupdate_index_string )
+                        job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'processing' )
                         
-                        break
+                        ( did_it_all, c_u_p_weight_processed ) = HydrusGlobals.client_controller.WriteSynchronous( 'content_update_package', self._service_key, content_update_package, job_key )
                         
-                    
-                    ( i_paused, should_quit ) = job_key.WaitIfNeeded()
-                    
-                    if should_quit:
+                        total_content_weight_processed += c_u_p_weight_processed
                         
-                        break
+                        if not did_it_all:
+                            
+                            processing_went_ok = False
+                            
+                            break
+                            
                         
-                    
-                    stop_time = HydrusData.GetNow() + 15
-                    
-                    loaded_into_disk_cache = HydrusGlobals.client_controller.Read( 'load_into_disk_cache', stop_time = stop_time )
-                    
-                
-            
-            while self.CanProcessUpdate():
-                
-                if options[ 'pause_repo_sync' ]:
-                    
-                    break
-                    
-                
-                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
-                
-                if should_quit:
-                    
-                    break
-                    
-                
-                gauge_range = ( ( HydrusData.GetNow() - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION )
-                
-                gauge_value = ( ( self._info[ 'next_processing_timestamp' ] - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION ) + 1
-                
-                update_index_string = 'update ' + HydrusData.ConvertValueRangeToPrettyString( gauge_value, gauge_range ) + ': '
-                
-                subupdate_index_string = 'service update: '
-                
-                HydrusGlobals.client_controller.pub( 'splash_set_title_text', self._name + ' - ' + update_index_string + subupdate_index_string )
-                HydrusGlobals.client_controller.pub( 'splash_set_status_text', 'processing' )
-                job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'loading from disk' )
-                job_key.SetVariable( 'popup_gauge_1', ( gauge_value, gauge_range ) )
-                
-                path = ClientFiles.GetExpectedServiceUpdatePackagePath( self._service_key, self._info[ 'next_processing_timestamp' ] )
-                
-                if not os.path.exists( path ):
-                    
-                    self._ReportSyncProcessingError( path, 'was missing' )
-                    
-                    return
-                    
-                
-                with open( path, 'rb' ) as f: obj_string = f.read()
-                
-                try:
-                    
-                    service_update_package = HydrusSerialisable.CreateFromNetworkString( obj_string )
-                    
-                    if not isinstance( service_update_package, HydrusData.ServerToClientServiceUpdatePackage ):
+                        HydrusGlobals.client_controller.WaitUntilPubSubsEmpty()
                         
-                        raise Exception()
+                        time.sleep( 1 )
                         
                     
-                except:
-                    
-                    self._ReportSyncProcessingError( path, 'did not parse' )
-                    
-                    return
-                    
-                
-                subindex_count = service_update_package.GetSubindexCount()
-                
-                processing_went_ok = True
-                
-                for subindex in range( subindex_count ):
-                    
-                    should_break = False
-                    
                     if options[ 'pause_repo_sync' ]:
                         
-                        should_break = True
+                        break
                         
                     
                     ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                     
-                    if should_quit or should_break:
-                        
-                        processing_went_ok = False
+                    if should_quit:
                         
                         break
                         
                     
-                    subupdate_index_string = 'content update ' + HydrusData.ConvertValueRangeToPrettyString( subindex + 1, subindex_count ) + ': '
-                    
-                    path = ClientFiles.GetExpectedContentUpdatePackagePath( self._service_key, self._info[ 'next_processing_timestamp' ], subindex )
-                    
-                    if not os.path.exists( path ):
-                        
-                        self._ReportSyncProcessingError( path, 'was missing' )
-                        
-                        return
-                        
-                    
-                    job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'loading from disk' )
-                    
-                    with open( path, 'rb' ) as f: obj_string = f.read()
-                    
-                    job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'parsing' )
-                    
-                    try:
-                        
-                        content_update_package = HydrusSerialisable.CreateFromNetworkString( obj_string )
+                    if processing_went_ok:
                         
-                        if not isinstance( content_update_package, HydrusData.ServerToClientContentUpdatePackage ):
-                            
-                            raise Exception()
-                            
+                        job_key.SetVariable( 'popup_text_2', 'committing service updates' )
                         
-                    except:
+                        service_updates = [ service_update for service_update in service_update_package.IterateServiceUpdates() ]
                         
-                        self._ReportSyncProcessingError( path, 'did not parse' )
+                        service_updates.append( HydrusData.ServiceUpdate( HC.SERVICE_UPDATE_NEXT_PROCESSING_TIMESTAMP, service_update_package.GetNextBegin() ) )
                         
-                        return
+                        service_keys_to_service_updates = { self._service_key : service_updates }
                         
-                    
-                    HydrusGlobals.client_controller.pub( 'splash_set_title_text', self._name + ' - ' + update_index_string + subupdate_index_string )
-                    job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'processing' )
-                    
-                    ( did_it_all, c_u_p_weight_processed ) = HydrusGlobals.client_controller.WriteSynchronous( 'content_update_package', self._service_key, content_update_package, job_key )
-                    
-                    total_content_weight_processed += c_u_p_weight_processed
-                    
-                    if not did_it_all:
+                        self.ProcessServiceUpdates( service_keys_to_service_updates )
                         
-                        processing_went_ok = False
+                        HydrusGlobals.client_controller.Write( 'service_updates', service_keys_to_service_updates )
                         
-                        break
+                        HydrusGlobals.client_controller.WaitUntilPubSubsEmpty()
                         
                     
-                    HydrusGlobals.client_controller.WaitUntilPubSubsEmpty()
-                    
-                    time.sleep( 1 )
+                    job_key.SetVariable( 'popup_gauge_2', ( 0, 1 ) )
+                    job_key.SetVariable( 'popup_text_2', '' )
                     
-                
-                if options[ 'pause_repo_sync' ]:
+                    num_updates_processed += 1
                     
-                    break
+                    time.sleep( 0.1 )
                     
                 
-                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                processing_finished = True
                 
-                if should_quit:
-                    
-                    break
-                    
+            finally:
                 
-                if processing_went_ok:
-                    
-                    job_key.SetVariable( 'popup_text_2', 'committing service updates' )
-                    
-                    service_updates = [ service_update for service_update in service_update_package.IterateServiceUpdates() ]
-                    
-                    service_updates.append( HydrusData.ServiceUpdate( HC.SERVICE_UPDATE_NEXT_PROCESSING_TIMESTAMP, service_update_package.GetNextBegin() ) )
-                    
-                    service_keys_to_service_updates = { self._service_key : service_updates }
+                if download_thread is not None:
                     
-                    self.ProcessServiceUpdates( service_keys_to_service_updates )
-                    
-                    HydrusGlobals.client_controller.Write( 'service_updates', service_keys_to_service_updates )
+                    if processing_finished:
+                        
+                        job_key.SetVariable( 'popup_text_1', 'finishing downloads' )
+                        
+                    else:
+                        
+                        job_key.Cancel()
+                        
                     
-                    HydrusGlobals.client_controller.WaitUntilPubSubsEmpty()
+                    download_thread.join()
                     
                 
-                job_key.SetVariable( 'popup_gauge_2', ( 0, 1 ) )
-                job_key.SetVariable( 'popup_text_2', '' )
-                
-                num_updates_processed += 1
+            
+            if download_info[ 'error' ] is not None:
                 
-                time.sleep( 0.1 )
+                raise download_info[ 'error' ]
                 
             
+            num_updates_downloaded = download_info[ 'num_updates_downloaded' ]
+            
+            job_key.SetVariable( 'popup_title', 'repository synchronisation - ' + self._name )
+            
             job_key.DeleteVariable( 'popup_gauge_1' )
             job_key.DeleteVariable( 'popup_text_2' )
             job_key.DeleteVariable( 'popup_gauge_2' )
@@ -2139,9 +2318,7 @@ class ServiceRepository( ServiceRestricted ):
         finally:
             
             HydrusGlobals.client_controller.pub( 'notify_new_pending' )
-            HydrusGlobals.client_controller.pub( 'notify_new_siblings_data' )
             HydrusGlobals.client_controller.pub( 'notify_new_siblings_gui' )
-            HydrusGlobals.client_controller.pub( 'notify_new_parents' )
             
         
     
@@ -1,4 +1,5 @@
 import bs4
+import ClientFiles
 import ClientNetworking
 import collections
 import httplib
@@ -278,9 +279,11 @@ def THREADDownloadURL( job_key, url, url_string ):
         job_key.DeleteVariable( 'popup_gauge_1' )
         job_key.SetVariable( 'popup_text_1', 'importing ' + url_string )
         
+        file_import_job = ClientFiles.FileImportJob( temp_path )
+        
         client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
         
-        ( result, hash ) = client_files_manager.ImportFile( temp_path )
+        ( result, hash ) = client_files_manager.ImportFile( file_import_job )
         
     except HydrusExceptions.NetworkException:
         
@@ -378,9 +381,11 @@ def THREADDownloadURLs( job_key, urls, title ):
             
             job_key.SetVariable( 'popup_text_2', 'importing' )
             
+            file_import_job = ClientFiles.FileImportJob( temp_path )
+            
             client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
             
-            ( result, hash ) = client_files_manager.ImportFile( temp_path )
+            ( result, hash ) = client_files_manager.ImportFile( file_import_job )
             
         except HydrusExceptions.NetworkException:
             
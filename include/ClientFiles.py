@@ -1,19 +1,29 @@
 import ClientConstants as CC
 import ClientData
+import ClientDefaults
+import ClientImageHandling
+import collections
 import gc
 import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
 import HydrusFileHandling
 import HydrusGlobals
+import HydrusImageHandling
 import HydrusPaths
 import HydrusSerialisable
 import itertools
+import mmap
 import os
+import psutil
+import Queue
 import random
 import re
 import shutil
 import stat
+import struct
+import sys
+import threading
 import wx
 
 def GenerateExportFilename( media, terms ):
@@ -223,6 +233,59 @@ def ParseExportPhrase( phrase ):
     
     return terms
     
+def PrepareFileImportJobs( file_import_jobs ):
+    
+    # hashing, decoding and ffmpeg all do their heavy lifting with the gil released, so plain threads get us the extra cores
+    
+    num_threads = min( len( file_import_jobs ), max( 1, psutil.cpu_count() - 1 ) )
+    
+    if num_threads <= 1:
+        
+        for file_import_job in file_import_jobs:
+            
+            file_import_job.Prepare()
+            
+        
+        return
+        
+    
+    file_import_jobs_queue = Queue.Queue()
+    
+    for file_import_job in file_import_jobs:
+        
+        file_import_jobs_queue.put( file_import_job )
+        
+    
+    threads = [ threading.Thread( target = THREADPrepareFileImportJobs, args = ( file_import_jobs_queue, ) ) for i in range( num_threads ) ]
+    
+    for thread in threads:
+        
+        thread.daemon = True
+        
+        thread.start()
+        
+    
+    for thread in threads:
+        
+        thread.join()
+        
+    
+def THREADPrepareFileImportJobs( file_import_jobs_queue ):
+    
+    while True:
+        
+        try:
+            
+            file_import_job = file_import_jobs_queue.get_nowait()
+            
+        except Queue.Empty:
+            
+            return
+            
+        
+        file_import_job.Prepare()
+        
+    
 class ExportFolder( HydrusSerialisable.SerialisableBaseNamed ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_EXPORT_FOLDER
@@ -369,4 +432,629 @@ class ExportFolder( HydrusSerialisable.SerialisableBaseNamed ):
         self._phrase = phrase
         
     
-HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_EXPORT_FOLDER ] = ExportFolder
\ No newline at end of file
+HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_EXPORT_FOLDER ] = ExportFolder
+
+class FileImportJob( object ):
+    
+    def __init__( self, temp_path, import_file_options = None, override_deleted = False, url = None, source_path = None ):
+        
+        if import_file_options is None:
+            
+            import_file_options = ClientDefaults.GetDefaultImportFileOptions()
+            
+        
+        self._temp_path = temp_path
+        self._import_file_options = import_file_options
+        self._override_deleted = override_deleted
+        self._url = url
+        self._source_path = source_path
+        
+        self._hash = None
+        self._extra_hashes = None
+        self._file_header = None
+        self._file_info = None
+        self._thumbnail = None
+        self._phash = None
+        
+        self._result = None
+        self._exc_info = None
+        
+    
+    def _IsWorthGeneratingInfo( self, status ):
+        
+        if status == CC.STATUS_NEW:
+            
+            return True
+            
+        
+        if status == CC.STATUS_DELETED:
+            
+            ( archive, exclude_deleted_files, min_size, min_resolution ) = self._import_file_options.ToTuple()
+            
+            return self._override_deleted or not exclude_deleted_files
+            
+        
+        return False
+        
+    
+    def Failed( self ):
+        
+        return self._exc_info is not None
+        
+    
+    def GenerateHash( self ):
+        
+        # the file is read once here, copying it from the source as we go if there is one, and the later stages work from the page cache
+        
+        if self._source_path is None:
+            
+            ( self._hash, self._extra_hashes, self._file_header ) = HydrusFileHandling.GetHashesAndHeaderFromPath( self._temp_path )
+            
+        else:
+            
+            ( self._hash, self._extra_hashes, self._file_header ) = HydrusFileHandling.GetHashesAndHeaderFromPath( self._source_path, copy_to_path = self._temp_path )
+            
+        
+        if self._file_header.startswith( 'BM' ):
+            
+            HydrusImageHandling.ConvertToPngIfBmp( self._temp_path )
+            
+            ( self._hash, self._extra_hashes, self._file_header ) = HydrusFileHandling.GetHashesAndHeaderFromPath( self._temp_path )
+            
+        
+    
+    def GenerateInfo( self ):
+        
+        mime = HydrusFileHandling.GetMime( self._temp_path, file_header = self._file_header )
+        
+        self._file_info = HydrusFileHandling.GetFileInfo( self._temp_path, mime = mime )
+        
+        ( size, mime, width, height, duration, num_frames, num_words ) = self._file_info
+        
+        ( archive, exclude_deleted_files, min_size, min_resolution ) = self._import_file_options.ToTuple()
+        
+        if width is not None and height is not None:
+            
+            if min_resolution is not None:
+                
+                ( min_x, min_y ) = min_resolution
+                
+                if width < min_x or height < min_y:
+                    
+                    raise Exception( 'Resolution too small' )
+                    
+                
+            
+        
+        if min_size is not None:
+            
+            if size < min_size:
+                
+                raise Exception( 'File too small' )
+                
+            
+        
+        if mime in HC.MIMES_WITH_THUMBNAILS:
+            
+            self._thumbnail = HydrusFileHandling.GenerateThumbnail( self._temp_path, file_info = self._file_info )
+            
+        
+        if mime in ( HC.IMAGE_JPEG, HC.IMAGE_PNG ):
+            
+            self._phash = ClientImageHandling.GeneratePerceptualHash( self._temp_path )
+            
+        
+    
+    def GetExtraHashes( self ):
+        
+        return self._extra_hashes
+        
+    
+    def GetFileInfo( self ):
+        
+        return self._file_info
+        
+    
+    def GetHash( self ):
+        
+        return self._hash
+        
+    
+    def GetImportFileOptions( self ):
+        
+        return self._import_file_options
+        
+    
+    def GetPHash( self ):
+        
+        return self._phash
+        
+    
+    def GetResult( self ):
+        
+        if self._exc_info is not None:
+            
+            ( exc_type, exc_value, exc_traceback ) = self._exc_info
+            
+            raise exc_type, exc_value, exc_traceback
+            
+        
+        return self._result
+        
+    
+    def GetTempPath( self ):
+        
+        return self._temp_path
+        
+    
+    def GetThumbnail( self ):
+        
+        return self._thumbnail
+        
+    
+    def GetURL( self ):
+        
+        return self._url
+        
+    
+    def HasInfo( self ):
+        
+        return self._file_info is not None
+        
+    
+    def OverrideDeleted( self ):
+        
+        return self._override_deleted
+        
+    
+    def Prepare( self ):
+        
+        # everything cpu-heavy about an import, done before the db gets involved
+        # the db checks the status again under its write lock, so the status here is only a guide to whether the file info is worth generating
+        
+        try:
+            
+            self.GenerateHash()
+            
+            ( status, hash ) = HydrusGlobals.client_controller.Read( 'hash_status', self._hash )
+            
+            if self._IsWorthGeneratingInfo( status ):
+                
+                self.GenerateInfo()
+                
+            
+        except Exception:
+            
+            self.SetExcInfo( sys.exc_info() )
+            
+        
+    
+    def SetExcInfo( self, exc_info ):
+        
+        self._exc_info = exc_info
+        
+    
+    def SetResult( self, status, hash ):
+        
+        self._result = ( status, hash )
+        
+    
+class PackedThumbnailStore( object ):
+    
+    # keeps a prefix directory's resized thumbnails in a few big append-only pack files rather than one tiny file each
+    # each pack has an index file of ( hash, offset, length ) entries, appended to as thumbnails are added and deleted, with a length of 0 meaning deleted
+    # resized thumbnails can always be regenerated from the full size ones, so if a crash leaves something missing or doubled up, it just gets made again
+    # this does not lock, so callers have to serialise access to it
+    
+    DATA_EXT = '.thumbnail_pack'
+    INDEX_EXT = '.thumbnail_pack_index'
+    
+    INDEX_ENTRY_FORMAT = '>32sQI'
+    INDEX_ENTRY_SIZE = struct.calcsize( INDEX_ENTRY_FORMAT )
+    
+    MAX_PACK_SIZE = 64 * 1048576
+    
+    def __init__( self, directory ):
+        
+        self._directory = directory
+        
+        self._hashes_to_locations = {}
+        self._pack_ids_to_live_sizes = collections.Counter()
+        self._pack_ids_to_mmaps = {}
+        
+        self._active_pack_id = None
+        
+        self._Load()
+        
+    
+    def _AppendIndexEntries( self, pack_id, entries ):
+        
+        with open( self._GetIndexPath( pack_id ), 'ab' ) as f:
+            
+            f.write( ''.join( ( struct.pack( self.INDEX_ENTRY_FORMAT, hash, offset, length ) for ( hash, offset, length ) in entries ) ) )
+            
+        
+    
+    def _CloseMmap( self, pack_id ):
+        
+        if pack_id in self._pack_ids_to_mmaps:
+            
+            self._pack_ids_to_mmaps[ pack_id ].close()
+            
+            del self._pack_ids_to_mmaps[ pack_id ]
+            
+        
+    
+    def _CreatePack( self ):
+        
+        pack_id = os.urandom( 8 ).encode( 'hex' )
+        
+        # the index goes first, so a data file with no index is always junk from an interrupted creation
+        
+        open( self._GetIndexPath( pack_id ), 'wb' ).close()
+        open( self._GetDataPath( pack_id ), 'wb' ).close()
+        
+        return pack_id
+        
+    
+    def _DeletePack( self, pack_id ):
+        
+        self._CloseMmap( pack_id )
+        
+        HydrusPaths.DeletePath( self._GetDataPath( pack_id ) )
+        HydrusPaths.DeletePath( self._GetIndexPath( pack_id ) )
+        
+        if pack_id in self._pack_ids_to_live_sizes:
+            
+            del self._pack_ids_to_live_sizes[ pack_id ]
+            
+        
+        if pack_id == self._active_pack_id:
+            
+            self._active_pack_id = None
+            
+        
+    
+    def _GetDataPath( self, pack_id ):
+        
+        return os.path.join( self._directory, pack_id + self.DATA_EXT )
+        
+    
+    def _GetIndexPath( self, pack_id ):
+        
+        return os.path.join( self._directory, pack_id + self.INDEX_EXT )
+        
+    
+    def _GetMmap( self, pack_id, end ):
+        
+        # appends do not grow an existing map, so it is remade whenever a read goes past its end
+        
+        if pack_id in self._pack_ids_to_mmaps and len( self._pack_ids_to_mmaps[ pack_id ] ) >= end:
+            
+            return self._pack_ids_to_mmaps[ pack_id ]
+            
+        
+        self._CloseMmap( pack_id )
+        
+        with open( self._GetDataPath( pack_id ), 'rb' ) as f:
+            
+            data_mmap = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ )
+            
+        
+        self._pack_ids_to_mmaps[ pack_id ] = data_mmap
+        
+        return data_mmap
+        
+    
+    def _GetPackIds( self ):
+        
+        pack_ids = set()
+        
+        if os.path.exists( self._directory ):
+            
+            for filename in os.listdir( self._directory ):
+                
+                if filename.endswith( self.INDEX_EXT ):
+                    
+                    pack_ids.add( filename[ : - len( self.INDEX_EXT ) ] )
+                    
+                
+            
+        
+        return pack_ids
+        
+    
+    def _Load( self ):
+        
+        HydrusPaths.MakeSureDirectoryExists( self._directory )
+        
+        pack_ids = self._GetPackIds()
+        
+        for filename in os.listdir( self._directory ):
+            
+            if filename.endswith( self.DATA_EXT ) and filename[ : - len( self.DATA_EXT ) ] not in pack_ids:
+                
+                HydrusPaths.DeletePath( os.path.join( self._directory, filename ) )
+                
+            
+        
+        for pack_id in pack_ids:
+            
+            data_path = self._GetDataPath( pack_id )
+            
+            if not os.path.exists( data_path ):
+                
+                HydrusPaths.DeletePath( self._GetIndexPath( pack_id ) )
+                
+                continue
+                
+            
+            data_size = os.path.getsize( data_path )
+            
+            with open( self._GetIndexPath( pack_id ), 'rb' ) as f:
+                
+                index_data = f.read()
+                
+            
+            # a torn final entry from a crash is ignored
+            
+            num_entries = len( index_data ) // self.INDEX_ENTRY_SIZE
+            
+            pack_hashes_to_locations = {}
+            
+            for i in range( num_entries ):
+                
+                ( hash, offset, length ) = struct.unpack_from( self.INDEX_ENTRY_FORMAT, index_data, i * self.INDEX_ENTRY_SIZE )
+                
+                if length == 0:
+                    
+                    if hash in pack_hashes_to_locations:
+                        
+                        del pack_hashes_to_locations[ hash ]
+                        
+                    
+                elif offset + length <= data_size:
+                    
+                    pack_hashes_to_locations[ hash ] = ( pack_id, offset, length )
+                    
+                
+            
+            for ( hash, ( pack_id, offset, length ) ) in pack_hashes_to_locations.items():
+                
+                if hash in self._hashes_to_locations:
+                    
+                    continue
+                    
+                
+                self._hashes_to_locations[ hash ] = ( pack_id, offset, length )
+                
+                self._pack_ids_to_live_sizes[ pack_id ] += length
+                
+            
+            if self._active_pack_id is None and data_size < self.MAX_PACK_SIZE:
+                
+                self._active_pack_id = pack_id
+                
+            
+        
+    
+    def AddThumbnails( self, hashes_and_thumbnails ):
+        
+        if len( hashes_and_thumbnails ) == 0:
+            
+            return
+            
+        
+        if self._active_pack_id is None or os.path.getsize( self._GetDataPath( self._active_pack_id ) ) >= self.MAX_PACK_SIZE:
+            
+            self._active_pack_id = self._CreatePack()
+            
+        
+        pack_id = self._active_pack_id
+        
+        entries = []
+        
+        with open( self._GetDataPath( pack_id ), 'ab' ) as f:
+            
+            f.seek( 0, os.SEEK_END )
+            
+            offset = f.tell()
+            
+            for ( hash, thumbnail ) in hashes_and_thumbnails:
+                
+                f.write( thumbnail )
+                
+                entries.append( ( hash, offset, len( thumbnail ) ) )
+                
+                offset += len( thumbnail )
+                
+            
+        
+        self._AppendIndexEntries( pack_id, entries )
+        
+        # old copies in other packs are only marked deleted once the new ones are safely written
+        # an old copy in this pack is superseded by the later index entry, so it needs no mark
+        
+        old_pack_ids_to_entries = collections.defaultdict( list )
+        
+        for ( hash, offset, length ) in entries:
+            
+            if hash in self._hashes_to_locations:
+                
+                ( old_pack_id, old_offset, old_length ) = self._hashes_to_locations[ hash ]
+                
+                self._pack_ids_to_live_sizes[ old_pack_id ] -= old_length
+                
+                if old_pack_id != pack_id:
+                    
+                    old_pack_ids_to_entries[ old_pack_id ].append( ( hash, 0, 0 ) )
+                    
+                
+            
+            self._hashes_to_locations[ hash ] = ( pack_id, offset, length )
+            
+            self._pack_ids_to_live_sizes[ pack_id ] += length
+            
+        
+        for ( old_pack_id, old_entries ) in old_pack_ids_to_entries.items():
+            
+            self._AppendIndexEntries( old_pack_id, old_entries )
+            
+        
+    
+    def Close( self ):
+        
+        for pack_id in list( self._pack_ids_to_mmaps.keys() ):
+            
+            self._CloseMmap( pack_id )
+            
+        
+    
+    def Compact( self ):
+        
+        # packs that are mostly dead space have their live thumbnails copied to the active pack and are then deleted
+        
+        for pack_id in self._GetPackIds():
+            
+            if not self.PackIsWasteful( pack_id ):
+                
+                continue
+                
+            
+            if pack_id == self._active_pack_id:
+                
+                self._active_pack_id = None
+                
+            
+            hashes = [ hash for ( hash, ( location_pack_id, offset, length ) ) in self._hashes_to_locations.items() if location_pack_id == pack_id ]
+            
+            hashes_to_thumbnails = self.GetThumbnails( hashes )
+            
+            self.AddThumbnails( hashes_to_thumbnails.items() )
+            
+            for hash in hashes:
+                
+                if hash in self._hashes_to_locations and self._hashes_to_locations[ hash ][ 0 ] == pack_id:
+                    
+                    del self._hashes_to_locations[ hash ]
+                    
+                
+            
+            self._DeletePack( pack_id )
+            
+        
+    
+    def DeleteStore( self ):
+        
+        for pack_id in self._GetPackIds():
+            
+            self._DeletePack( pack_id )
+            
+        
+        self._hashes_to_locations = {}
+        
+    
+    def DeleteThumbnails( self, hashes ):
+        
+        pack_ids_to_entries = collections.defaultdict( list )
+        
+        for hash in hashes:
+            
+            if hash in self._hashes_to_locations:
+                
+                ( pack_id, offset, length ) = self._hashes_to_locations[ hash ]
+                
+                del self._hashes_to_locations[ hash ]
+                
+                self._pack_ids_to_live_sizes[ pack_id ] -= length
+                
+                pack_ids_to_entries[ pack_id ].append( ( hash, 0, 0 ) )
+                
+            
+        
+        for ( pack_id, entries ) in pack_ids_to_entries.items():
+            
+            self._AppendIndexEntries( pack_id, entries )
+            
+        
+    
+    def GetHashes( self ):
+        
+        return self._hashes_to_locations.keys()
+        
+    
+    def GetThumbnail( self, hash ):
+        
+        hashes_to_thumbnails = self.GetThumbnails( ( hash, ) )
+        
+        if hash in hashes_to_thumbnails:
+            
+            return hashes_to_thumbnails[ hash ]
+            
+        else:
+            
+            return None
+            
+        
+    
+    def GetThumbnails( self, hashes ):
+        
+        # sorting by where they sit in the packs turns a page of random reads into one sweep through the disk
+        
+        locations_and_hashes = [ ( self._hashes_to_locations[ hash ], hash ) for hash in hashes if hash in self._hashes_to_locations ]
+        
+        locations_and_hashes.sort()
+        
+        hashes_to_thumbnails = {}
+        
+        broken_hashes = []
+        
+        for ( ( pack_id, offset, length ), hash ) in locations_and_hashes:
+            
+            try:
+                
+                data_mmap = self._GetMmap( pack_id, offset + length )
+                
+                thumbnail = data_mmap[ offset : offset + length ]
+                
+            except ( EnvironmentError, ValueError ):
+                
+                thumbnail = ''
+                
+            
+            if len( thumbnail ) == length:
+                
+                hashes_to_thumbnails[ hash ] = thumbnail
+                
+            else:
+                
+                broken_hashes.append( hash )
+                
+            
+        
+        if len( broken_hashes ) > 0:
+            
+            self.DeleteThumbnails( broken_hashes )
+            
+        
+        return hashes_to_thumbnails
+        
+    
+    def HasThumbnail( self, hash ):
+        
+        return hash in self._hashes_to_locations
+        
+    
+    def NeedsCompaction( self ):
+        
+        return True in ( self.PackIsWasteful( pack_id ) for pack_id in self._GetPackIds() )
+        
+    
+    def PackIsWasteful( self, pack_id ):
+        
+        data_size = os.path.getsize( self._GetDataPath( pack_id ) )
+        
+        live_size = self._pack_ids_to_live_sizes[ pack_id ]
+        
+        return data_size > 0 and live_size < data_size / 2
+        
\ No newline at end of file
@@ -2678,6 +2678,10 @@ class ManagementPanelQuery( ManagementPanel ):
         
         self._query_key = ClientThreading.JobKey( cancellable = True )
         
+        # the sort the current query's results are streaming into the page in, or None if they are being loaded all at once
+        
+        self._query_sort_by = None
+        
         initial_predicates = file_search_context.GetPredicates()
         
         if self._search_enabled:
@@ -2724,6 +2728,8 @@ class ManagementPanelQuery( ManagementPanel ):
         
         self._query_key = ClientThreading.JobKey()
         
+        self._query_sort_by = None
+        
         if self._management_controller.GetVariable( 'search_enabled' ) and self._management_controller.GetVariable( 'synchronised' ):
             
             try:
@@ -2738,19 +2744,45 @@ class ManagementPanelQuery( ManagementPanel ):
                 
                 file_service_key = file_search_context.GetFileServiceKey()
                 
+                sort_by = self._sort_by.GetChoice()
+                
                 if len( current_predicates ) > 0:
                     
-                    self._controller.StartFileQuery( self._query_key, file_search_context )
+                    ( sort_by_type, sort_by_data ) = sort_by
+                    
+                    # the db can only sort by the system sorts, and collections have to see everything before they can be made
                     
-                    panel = ClientGUIMedia.MediaPanelLoading( self._page, self._page_key, file_service_key )
+                    sort_fallback_is_system = HC.options[ 'sort_fallback' ] < len( CC.SORT_CHOICES )
+                    
+                    if sort_by_type == 'system' and sort_fallback_is_system and self._collect_by.GetChoice() is None:
+                        
+                        self._query_sort_by = sort_by
+                        
+                        panel = ClientGUIMedia.MediaPanelThumbnails( self._page, self._page_key, file_service_key, [] )
+                        
+                        panel.Sort( self._page_key, sort_by )
+                        
+                    else:
+                        
+                        panel = ClientGUIMedia.MediaPanelLoading( self._page, self._page_key, file_service_key )
+                        
                     
                 else:
                     
                     panel = ClientGUIMedia.MediaPanelThumbnails( self._page, self._page_key, file_service_key, [] )
                     
                 
+                # swap the panel in first, so the first batch of results cannot arrive before it
+                
                 self._controller.pub( 'swap_media_panel', self._page_key, panel )
                 
+                if len( current_predicates ) > 0:
+                    
+                    # the db uses the sort to pick which files a system:limit keeps, even when it cannot stream them
+                    
+                    self._controller.StartFileQuery( self._query_key, file_search_context, sort_by = sort_by )
+                    
+                
             except: wx.MessageBox( traceback.format_exc() )
             
         
@@ -2781,7 +2813,14 @@ class ManagementPanelQuery( ManagementPanel ):
     
     def AddMediaResultsFromQuery( self, query_key, media_results ):
         
-        if query_key == self._query_key: self._controller.pub( 'add_media_results', self._page_key, media_results, append = False )
+        if query_key == self._query_key and self._query_sort_by is not None:
+            
+            # the batches come in sorted, so they can go straight on the end unless the user has changed the sort or collect since
+            
+            append = self._sort_by.GetChoice() == self._query_sort_by and self._collect_by.GetChoice() is None
+            
+            self._controller.pub( 'add_media_results', self._page_key, media_results, append = append )
+            
         
     
     def ChangeFileServicePubsub( self, page_key, service_key ):
@@ -2840,7 +2879,7 @@ class ManagementPanelQuery( ManagementPanel ):
     
     def ShowQuery( self, query_key, media_results ):
         
-        if query_key == self._query_key:
+        if query_key == self._query_key and self._query_sort_by is None:
             
             current_predicates = self._current_predicates_box.GetPredicates()
             
@@ -1340,6 +1340,7 @@ class MediaPanelThumbnails( MediaPanel ):
         self._client_bmp = wx.EmptyBitmap( 20, 20, 24 )
         self._clean_canvas_pages = {}
         self._dirty_canvas_pages = []
+        self._prefetch_canvas_pages = set()
         self._num_rows_per_canvas_page = 1
         
         self._timer_animation = wx.Timer( self, ID_TIMER_ANIMATION )
@@ -1419,6 +1420,8 @@ class MediaPanelThumbnails( MediaPanel ):
         
         del self._clean_canvas_pages[ clean_index ]
         
+        self._prefetch_canvas_pages.discard( clean_index )
+        
         thumbnails = [ thumbnail for ( thumbnail_index, thumbnail ) in self._GetThumbnailsFromPageIndex( clean_index ) ]
         
         HydrusGlobals.client_controller.GetCache( 'thumbnail' ).CancelWaterfall( self._page_key, thumbnails )
@@ -1426,7 +1429,7 @@ class MediaPanelThumbnails( MediaPanel ):
         self._dirty_canvas_pages.append( bmp )
         
     
-    def _DrawCanvasPage( self, page_index, bmp ):
+    def _DrawCanvasPage( self, page_index, bmp, priority = CC.WATERFALL_PRIORITY_VISIBLE ):
         
         ( bmp_width, bmp_height ) = bmp.GetSize()
         
@@ -1472,7 +1475,12 @@ class MediaPanelThumbnails( MediaPanel ):
                 
             
         
-        HydrusGlobals.client_controller.GetCache( 'thumbnail' ).Waterfall( self._page_key, thumbnails_to_render_later )
+        if priority == CC.WATERFALL_PRIORITY_PREFETCH:
+            
+            self._prefetch_canvas_pages.add( page_index )
+            
+        
+        HydrusGlobals.client_controller.GetCache( 'thumbnail' ).Waterfall( self._page_key, thumbnails_to_render_later, priority = priority )
         
     
     def _ExportFiles( self ):
@@ -1702,6 +1710,21 @@ class MediaPanelThumbnails( MediaPanel ):
             self._ScrollToMedia( media_to_use )
             
         
+    
+    def _PrioritiseCanvasPage( self, page_index ):
+        
+        # this page was drawn ahead of being scrolled to, so anything it is still waiting on now jumps the queue
+        
+        self._prefetch_canvas_pages.discard( page_index )
+        
+        thumbnail_cache = HydrusGlobals.client_controller.GetCache( 'thumbnail' )
+        
+        thumbnails = [ thumbnail for ( thumbnail_index, thumbnail ) in self._GetThumbnailsFromPageIndex( page_index ) if not thumbnail_cache.HasThumbnailCached( thumbnail ) ]
+        
+        if len( thumbnails ) > 0:
+            
+            thumbnail_cache.Waterfall( self._page_key, thumbnails, priority = CC.WATERFALL_PRIORITY_VISIBLE )
+            
         
     
     def _RecalculateVirtualSize( self ):
@@ -2187,10 +2210,23 @@ class MediaPanelThumbnails( MediaPanel ):
                 
                 bmp = self._dirty_canvas_pages.pop( 0 )
                 
-                self._DrawCanvasPage( page_index, bmp )
+                if page_index in page_indices_to_display:
+                    
+                    priority = CC.WATERFALL_PRIORITY_VISIBLE
+                    
+                else:
+                    
+                    priority = CC.WATERFALL_PRIORITY_PREFETCH
+                    
+                
+                self._DrawCanvasPage( page_index, bmp, priority = priority )
                 
                 self._clean_canvas_pages[ page_index ] = bmp
                 
+            elif page_index in page_indices_to_display and page_index in self._prefetch_canvas_pages:
+                
+                self._PrioritiseCanvasPage( page_index )
+                
             
             if page_index in page_indices_to_display:
                 
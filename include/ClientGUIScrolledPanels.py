@@ -2343,6 +2343,14 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._estimated_number_fullscreens = wx.StaticText( media_panel, label = '' )
             
+            self._segmented_media_caches = wx.CheckBox( media_panel )
+            self._segmented_media_caches.SetToolTipString( 'If checked, thumbnails and images you have looked at more than once are kept in a protected part of their cache, so scrolling through a lot of new files will not push them out. Changes take effect on the next restart.' )
+            
+            self._pack_resized_thumbnails = wx.CheckBox( media_panel )
+            self._pack_resized_thumbnails.SetToolTipString( 'If checked, resized thumbnails are stored together in a few large files rather than one small file each. This makes scrolling through thumbnails that are not yet in memory much faster on big collections. Existing thumbnails are moved over during idle maintenance, and moved back if you uncheck this. Changes take effect on the next restart.' )
+            
+            self._media_cache_stats = wx.StaticText( media_panel, label = '' )
+            
             #
             
             buffer_panel = ClientGUICommon.StaticBox( self, 'video buffer' )
@@ -2377,6 +2385,18 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._forced_search_limit = ClientGUICommon.NoneableSpinCtrl( misc_panel, '', min = 1, max = 100000 )
             
+            self._num_db_read_connections = wx.SpinCtrl( misc_panel, min = 0, max = 16 )
+            self._num_db_read_connections.SetToolTipString( 'How many extra database connections the client will use to run searches and other reads while it is busy writing. 0 runs everything one job at a time. Changes take effect on the next restart.' )
+            
+            self._db_group_commit = wx.CheckBox( misc_panel )
+            self._db_group_commit.SetToolTipString( 'If checked, bursts of small database writes, such as tagging, archiving and file imports, will be committed to disk together rather than one at a time. This is faster, but a crash may lose up to half a second more work. Changes take effect on the next restart.' )
+            
+            self._tag_posting_lists = wx.CheckBox( misc_panel )
+            self._tag_posting_lists.SetToolTipString( 'If checked, the client will build compressed lists of the files of your biggest tags during idle maintenance and use them to speed up tag searches. They take some disk space and make each tag update a little slower. Unchecking this deletes them at the next maintenance.' )
+            
+            self._similar_files_duplicate_pairs_search_distance = ClientGUICommon.NoneableSpinCtrl( misc_panel, '', none_phrase = 'do not search', min = 0, max = 64 )
+            self._similar_files_duplicate_pairs_search_distance.SetToolTipString( 'During idle maintenance, the client can compare every file\'s perceptual hash against every other to find all the similar pairs in your collection. This sets the max hamming distance it will search for. 0-4 is usually good. Large values take much longer and produce many false positives.' )
+            
             #
             
             self._disk_cache_init_period.SetValue( self._new_options.GetNoneableInteger( 'disk_cache_init_period' ) )
@@ -2392,6 +2412,12 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._fullscreen_cache_size.SetValue( int( HC.options[ 'fullscreen_cache_size' ] / 1048576 ) )
             
+            self._segmented_media_caches.SetValue( self._new_options.GetBoolean( 'segmented_media_caches' ) )
+            
+            self._pack_resized_thumbnails.SetValue( self._new_options.GetBoolean( 'pack_resized_thumbnails' ) )
+            
+            self._media_cache_stats.SetLabelText( self._GetMediaCacheStatsText() )
+            
             self._video_buffer_size_mb.SetValue( self._new_options.GetInteger( 'video_buffer_size_mb' ) )
             
             self._num_autocomplete_chars.SetValue( HC.options[ 'num_autocomplete_chars' ] )
@@ -2408,6 +2434,14 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._forced_search_limit.SetValue( self._new_options.GetNoneableInteger( 'forced_search_limit' ) )
             
+            self._num_db_read_connections.SetValue( self._new_options.GetInteger( 'num_db_read_connections' ) )
+            
+            self._db_group_commit.SetValue( self._new_options.GetBoolean( 'db_group_commit' ) )
+            
+            self._tag_posting_lists.SetValue( self._new_options.GetBoolean( 'tag_posting_lists' ) )
+            
+            self._similar_files_duplicate_pairs_search_distance.SetValue( self._new_options.GetNoneableInteger( 'similar_files_duplicate_pairs_search_distance' ) )
+            
             #
             
             vbox = wx.BoxSizer( wx.VERTICAL )
@@ -2440,10 +2474,13 @@ class ManageOptionsPanel( ManagePanel ):
             rows.append( ( 'Thumbnail height: ', self._thumbnail_height ) )
             rows.append( ( 'MB memory reserved for thumbnail cache: ', thumbnails_sizer ) )
             rows.append( ( 'MB memory reserved for media viewer cache: ', fullscreens_sizer ) )
+            rows.append( ( 'Protect often viewed media from being pushed out of the caches: ', self._segmented_media_caches ) )
+            rows.append( ( 'Store resized thumbnails in packed files: ', self._pack_resized_thumbnails ) )
             
             gridbox = ClientGUICommon.WrapInGrid( media_panel, rows )
             
             media_panel.AddF( gridbox, CC.FLAGS_EXPAND_PERPENDICULAR )
+            media_panel.AddF( self._media_cache_stats, CC.FLAGS_EXPAND_PERPENDICULAR )
             
             vbox.AddF( media_panel, CC.FLAGS_EXPAND_PERPENDICULAR )
             
@@ -2492,6 +2529,10 @@ class ManageOptionsPanel( ManagePanel ):
             rows = []
             
             rows.append( ( 'Forced system:limit for all searches: ', self._forced_search_limit ) )
+            rows.append( ( 'Concurrent database read connections: ', self._num_db_read_connections ) )
+            rows.append( ( 'Commit bursts of database writes together: ', self._db_group_commit ) )
+            rows.append( ( 'Keep compressed file lists for big tags: ', self._tag_posting_lists ) )
+            rows.append( ( 'Idle similar files duplicate pair search distance: ', self._similar_files_duplicate_pairs_search_distance ) )
             
             gridbox = ClientGUICommon.WrapInGrid( misc_panel, rows )
             
@@ -2513,6 +2554,31 @@ class ManageOptionsPanel( ManagePanel ):
             wx.CallAfter( self.Layout ) # draws the static texts correctly
             
         
+        def _GetMediaCacheStatsText( self ):
+            
+            lines = []
+            
+            for ( name, cache_name ) in ( ( 'thumbnail cache', 'thumbnail' ), ( 'media viewer cache', 'images' ) ):
+                
+                ( num_items, total_size, hits, misses, evictions ) = HydrusGlobals.client_controller.GetCache( cache_name ).GetStats()
+                
+                num_lookups = hits + misses
+                
+                if num_lookups == 0:
+                    
+                    hit_rate_string = 'no lookups yet'
+                    
+                else:
+                    
+                    hit_rate_string = '%.1f' % ( 100.0 * hits / num_lookups ) + '% of ' + HydrusData.ConvertIntToPrettyString( num_lookups ) + ' lookups hit'
+                    
+                
+                lines.append( name + ': ' + HydrusData.ConvertIntToPrettyString( num_items ) + ' items using ' + HydrusData.ConvertIntToBytes( total_size ) + ', ' + hit_rate_string + ', ' + HydrusData.ConvertIntToPrettyString( evictions ) + ' evicted' )
+                
+            
+            return os.linesep.join( lines )
+            
+        
         def EventFetchAuto( self, event ):
             
             if self._fetch_ac_results_automatically.GetValue() == True:
@@ -2568,6 +2634,18 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._new_options.SetNoneableInteger( 'forced_search_limit', self._forced_search_limit.GetValue() )
             
+            self._new_options.SetInteger( 'num_db_read_connections', self._num_db_read_connections.GetValue() )
+            
+            self._new_options.SetBoolean( 'db_group_commit', self._db_group_commit.GetValue() )
+            
+            self._new_options.SetBoolean( 'tag_posting_lists', self._tag_posting_lists.GetValue() )
+            
+            self._new_options.SetBoolean( 'segmented_media_caches', self._segmented_media_caches.GetValue() )
+            
+            self._new_options.SetBoolean( 'pack_resized_thumbnails', self._pack_resized_thumbnails.GetValue() )
+            
+            self._new_options.SetNoneableInteger( 'similar_files_duplicate_pairs_search_distance', self._similar_files_duplicate_pairs_search_distance.GetValue() )
+            
             HC.options[ 'num_autocomplete_chars' ] = self._num_autocomplete_chars.GetValue()
             
             HC.options[ 'fetch_ac_results_automatically' ] = self._fetch_ac_results_automatically.GetValue()
@@ -43,6 +43,14 @@ def GenerateNumpyImage( path ):
     
     return numpy_image
     
+def GenerateNumpyImageFromBytes( data ):
+    
+    pil_image = HydrusImageHandling.GeneratePILImageFromBytes( data )
+    
+    numpy_image = GenerateNumPyImageFromPILImage( pil_image )
+    
+    return numpy_image
+    
 def GenerateNumPyImageFromPILImage( pil_image ):
     
     pil_image = HydrusImageHandling.Dequantize( pil_image )
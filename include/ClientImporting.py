@@ -25,6 +25,9 @@ import urlparse
 import wx
 import HydrusThreading
 
+# how many files the hdd and import folder importers hand to the client files manager at once
+FILE_IMPORT_BATCH_SIZE = 16
+
 class GalleryImport( HydrusSerialisable.SerialisableBase ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_GALLERY_IMPORT
@@ -212,9 +215,11 @@ class GalleryImport( HydrusSerialisable.SerialisableBase ):
                         gallery.GetFile( temp_path, url, report_hooks = [ self._file_download_hook ] )
                         
                     
+                    file_import_job = ClientFiles.FileImportJob( temp_path, import_file_options = self._import_file_options, url = url )
+                    
                     client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
                     
-                    ( status, hash ) = client_files_manager.ImportFile( temp_path, import_file_options = self._import_file_options, url = url )
+                    ( status, hash ) = client_files_manager.ImportFile( file_import_job )
                     
                 finally:
                     
@@ -660,85 +665,114 @@ class HDDImport( HydrusSerialisable.SerialisableBase ):
         
     
     def _WorkOnFiles( self, page_key ):
-
-        path = self._paths_cache.GetNextSeed( CC.STATUS_UNKNOWN )
         
-        if path is None:
+        paths = self._paths_cache.GetNextSeeds( CC.STATUS_UNKNOWN, FILE_IMPORT_BATCH_SIZE )
+        
+        if len( paths ) == 0:
             
             time.sleep( 1 )
             
             return
             
         
-        with self._lock:
+        paths_and_file_import_jobs = []
+        temp_paths = []
+        
+        try:
             
-            if path in self._paths_to_tags:
+            for path in paths:
                 
-                service_keys_to_tags = self._paths_to_tags[ path ]
+                ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
                 
-            else:
+                temp_paths.append( ( os_file_handle, temp_path ) )
+                
+                file_import_job = ClientFiles.FileImportJob( temp_path, import_file_options = self._import_file_options, source_path = path )
                 
-                service_keys_to_tags = {}
+                paths_and_file_import_jobs.append( ( path, file_import_job ) )
                 
             
-        
-        try:
+            client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
             
-            ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+            client_files_manager.ImportFiles( [ file_import_job for ( path, file_import_job ) in paths_and_file_import_jobs ] )
             
-            try:
-                
-                HydrusPaths.MirrorFile( path, temp_path )
-                
-                client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
+        except Exception as e:
+            
+            # the whole batch failed, so fail its paths rather than trying them again forever
+            
+            for path in paths:
                 
-                ( status, hash ) = client_files_manager.ImportFile( temp_path, import_file_options = self._import_file_options )
+                self._paths_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
                 
-            finally:
+            
+            paths_and_file_import_jobs = []
+            
+        finally:
+            
+            for ( os_file_handle, temp_path ) in temp_paths:
                 
                 HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
                 
             
-            self._paths_cache.UpdateSeedStatus( path, status )
+        
+        for ( path, file_import_job ) in paths_and_file_import_jobs:
             
-            if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
-                
-                service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags )
+            with self._lock:
                 
-                if len( service_keys_to_content_updates ) > 0:
+                if path in self._paths_to_tags:
                     
-                    HydrusGlobals.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
+                    service_keys_to_tags = self._paths_to_tags[ path ]
+                    
+                else:
+                    
+                    service_keys_to_tags = {}
                     
                 
-                ( media_result, ) = HydrusGlobals.client_controller.Read( 'media_results', ( hash, ) )
+            
+            try:
                 
-                HydrusGlobals.client_controller.pub( 'add_media_results', page_key, ( media_result, ) )
+                ( status, hash ) = file_import_job.GetResult()
                 
-                if self._delete_after_success:
+                self._paths_cache.UpdateSeedStatus( path, status )
+                
+                if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
                     
-                    try:
+                    service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags )
+                    
+                    if len( service_keys_to_content_updates ) > 0:
                         
-                        ClientData.DeletePath( path )
+                        HydrusGlobals.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
                         
-                    except Exception as e:
+                    
+                    ( media_result, ) = HydrusGlobals.client_controller.Read( 'media_results', ( hash, ) )
+                    
+                    HydrusGlobals.client_controller.pub( 'add_media_results', page_key, ( media_result, ) )
+                    
+                    if self._delete_after_success:
                         
-                        HydrusData.ShowText( 'While attempting to delete ' + path + ', the following error occured:' )
-                        HydrusData.ShowException( e )
+                        try:
+                            
+                            ClientData.DeletePath( path )
+                            
+                        except Exception as e:
+                            
+                            HydrusData.ShowText( 'While attempting to delete ' + path + ', the following error occured:' )
+                            HydrusData.ShowException( e )
+                            
                         
                     
                 
-            
-        except HydrusExceptions.MimeException as e:
-            
-            status = CC.STATUS_UNINTERESTING_MIME
-            
-            self._paths_cache.UpdateSeedStatus( path, status )
-            
-        except Exception as e:
-            
-            status = CC.STATUS_FAILED
-            
-            self._paths_cache.UpdateSeedStatus( path, status, exception = e )
+            except HydrusExceptions.MimeException as e:
+                
+                status = CC.STATUS_UNINTERESTING_MIME
+                
+                self._paths_cache.UpdateSeedStatus( path, status )
+                
+            except Exception as e:
+                
+                status = CC.STATUS_FAILED
+                
+                self._paths_cache.UpdateSeedStatus( path, status, exception = e )
+                
             
         
         with self._lock:
@@ -1079,34 +1113,76 @@ class ImportFolder( HydrusSerialisable.SerialisableBaseNamed ):
                 
                 while True:
                     
-                    path = self._path_cache.GetNextSeed( CC.STATUS_UNKNOWN )
+                    paths = self._path_cache.GetNextSeeds( CC.STATUS_UNKNOWN, FILE_IMPORT_BATCH_SIZE )
                     
-                    if path is None or HydrusGlobals.view_shutdown:
+                    if len( paths ) == 0 or HydrusGlobals.view_shutdown:
                         
                         break
                         
                     
+                    paths_and_file_import_jobs = []
+                    temp_paths = []
+                    
                     try:
                         
-                        mime = HydrusFileHandling.GetMime( path )
-                        
-                        if mime in self._mimes:
-                            
-                            ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+                        for path in paths:
                             
                             try:
                                 
-                                HydrusPaths.MirrorFile( path, temp_path )
+                                mime = HydrusFileHandling.GetMime( path )
                                 
-                                client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
+                                if mime in self._mimes:
+                                    
+                                    ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+                                    
+                                    temp_paths.append( ( os_file_handle, temp_path ) )
+                                    
+                                    file_import_job = ClientFiles.FileImportJob( temp_path, import_file_options = self._import_file_options, source_path = path )
+                                    
+                                    paths_and_file_import_jobs.append( ( path, file_import_job ) )
+                                    
+                                else:
+                                    
+                                    self._path_cache.UpdateSeedStatus( path, CC.STATUS_UNINTERESTING_MIME )
+                                    
                                 
-                                ( status, hash ) = client_files_manager.ImportFile( temp_path, import_file_options = self._import_file_options )
+                            except Exception as e:
                                 
-                            finally:
+                                HydrusData.Print( 'A file failed to import from import folder ' + self._name + ':' )
                                 
-                                HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+                                self._path_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
                                 
                             
+                        
+                        client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
+                        
+                        client_files_manager.ImportFiles( [ file_import_job for ( path, file_import_job ) in paths_and_file_import_jobs ] )
+                        
+                    except Exception as e:
+                        
+                        HydrusData.Print( 'A batch of files failed to import from import folder ' + self._name + ':' )
+                        
+                        for ( path, file_import_job ) in paths_and_file_import_jobs:
+                            
+                            self._path_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
+                            
+                        
+                        paths_and_file_import_jobs = []
+                        
+                    finally:
+                        
+                        for ( os_file_handle, temp_path ) in temp_paths:
+                            
+                            HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+                            
+                        
+                    
+                    for ( path, file_import_job ) in paths_and_file_import_jobs:
+                        
+                        try:
+                            
+                            ( status, hash ) = file_import_job.GetResult()
+                            
                             self._path_cache.UpdateSeedStatus( path, status )
                             
                             if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
@@ -1156,18 +1232,12 @@ class ImportFolder( HydrusSerialisable.SerialisableBaseNamed ):
                                 successful_hashes.add( hash )
                                 
                             
-                        else:
+                        except Exception as e:
                             
-                            self._path_cache.UpdateSeedStatus( path, CC.STATUS_UNINTERESTING_MIME )
+                            HydrusData.Print( 'A file failed to import from import folder ' + self._name + ':' )
+                            
+                            self._path_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
                             
-                        
-                    except Exception as e:
-                        
-                        error_text = traceback.format_exc()
-                        
-                        HydrusData.Print( 'A file failed to import from import folder ' + self._name + ':' )
-                        
-                        self._path_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
                         
                     
                 
@@ -1346,9 +1416,11 @@ class PageOfImagesImport( HydrusSerialisable.SerialisableBase ):
                     
                     HydrusGlobals.client_controller.DoHTTP( HC.GET, file_url, report_hooks = report_hooks, temp_path = temp_path )
                     
+                    file_import_job = ClientFiles.FileImportJob( temp_path, import_file_options = self._import_file_options, url = file_url )
+                    
                     client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
                     
-                    ( status, hash ) = client_files_manager.ImportFile( temp_path, import_file_options = self._import_file_options, url = file_url )
+                    ( status, hash ) = client_files_manager.ImportFile( file_import_job )
                     
                 finally:
                     
@@ -1843,6 +1915,31 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         return None
         
     
+    def GetNextSeeds( self, status, num_seeds ):
+        
+        seeds = []
+        
+        with self._lock:
+            
+            for seed in self._seeds_ordered:
+                
+                seed_info = self._seeds_to_info[ seed ]
+                
+                if seed_info[ 'status' ] == status:
+                    
+                    seeds.append( seed )
+                    
+                    if len( seeds ) == num_seeds:
+                        
+                        break
+                        
+                    
+                
+            
+        
+        return seeds
+        
+    
     def GetSeedCount( self, status = None ):
         
         result = 0
@@ -2185,9 +2282,11 @@ class Subscription( HydrusSerialisable.SerialisableBaseNamed ):
                         
                         job_key.SetVariable( 'popup_text_1', x_out_of_y + 'importing file' )
                         
+                        file_import_job = ClientFiles.FileImportJob( temp_path, import_file_options = self._import_file_options, url = url )
+                        
                         client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
                         
-                        ( status, hash ) = client_files_manager.ImportFile( temp_path, import_file_options = self._import_file_options, url = url )
+                        ( status, hash ) = client_files_manager.ImportFile( file_import_job )
                         
                         if status == CC.STATUS_SUCCESSFUL:
                             
@@ -2669,9 +2768,11 @@ class ThreadWatcherImport( HydrusSerialisable.SerialisableBase ):
                     
                     HydrusGlobals.client_controller.DoHTTP( HC.GET, file_url, report_hooks = report_hooks, temp_path = temp_path )
                     
+                    file_import_job = ClientFiles.FileImportJob( temp_path, import_file_options = self._import_file_options, url = file_url )
+                    
                     client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
                     
-                    ( status, hash ) = client_files_manager.ImportFile( temp_path, import_file_options = self._import_file_options, url = file_url )
+                    ( status, hash ) = client_files_manager.ImportFile( file_import_job )
                     
                 finally:
                     
@@ -3089,9 +3190,11 @@ class URLsImport( HydrusSerialisable.SerialisableBase ):
                     
                     HydrusGlobals.client_controller.DoHTTP( HC.GET, file_url, report_hooks = report_hooks, temp_path = temp_path )
                     
+                    file_import_job = ClientFiles.FileImportJob( temp_path, import_file_options = self._import_file_options, url = file_url )
+                    
                     client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
                     
-                    ( status, hash ) = client_files_manager.ImportFile( temp_path, import_file_options = self._import_file_options, url = file_url )
+                    ( status, hash ) = client_files_manager.ImportFile( file_import_job )
                     
                 finally:
                     
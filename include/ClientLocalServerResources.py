@@ -52,7 +52,7 @@ class HydrusResourceCommandBooruFile( HydrusResourceCommandBooru ):
         
         path = client_files_manager.GetFilePath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -255,7 +255,7 @@ class HydrusResourceCommandBooruThumbnail( HydrusResourceCommandBooru ):
         elif mime == HC.APPLICATION_PDF: path = os.path.join( HC.STATIC_DIR, 'pdf.png' )
         else: path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
         
-        response_context = HydrusServerResources.ResponseContext( 200, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -270,7 +270,7 @@ class HydrusResourceCommandLocalFile( HydrusServerResources.HydrusResourceComman
         
         path = client_files_manager.GetFilePath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -285,7 +285,7 @@ class HydrusResourceCommandLocalThumbnail( HydrusServerResources.HydrusResourceC
         
         path = client_files_manager.GetFullSizeThumbnailPath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -1463,6 +1463,11 @@ class MediaResult( object ):
             
         
     
+    def Refresh( self, media_result ):
+        
+        self._tuple = media_result.ToTuple()
+        
+    
     def ResetService( self, service_key ):
         
         ( hash, inbox, size, mime, width, height, duration, num_frames, num_words, tags_manager, locations_manager, ratings_manager ) = self._tuple
@@ -5,6 +5,7 @@ import HydrusSerialisable
 import errno
 import httplib
 import os
+import random
 import requests
 import socket
 import socks
@@ -218,6 +219,8 @@ def SetProxy( proxytype, host, port, username = None, password = None ):
     
 class HTTPConnectionManager( object ):
     
+    MAX_CONNECTIONS_PER_LOCATION = 4
+    
     def __init__( self ):
         
         self._connections = {}
@@ -231,8 +234,6 @@ class HTTPConnectionManager( object ):
         
         if report_hooks is None: report_hooks = []
         
-        connection = self._GetConnection( location )
-        
         try:
             
             if query == '':
@@ -244,10 +245,16 @@ class HTTPConnectionManager( object ):
                 path_and_query = path + '?' + query
                 
             
-            with connection.lock:
+            connection = self._GetConnection( location )
+            
+            try:
                 
                 ( parsed_response, redirect_info, size_of_response, response_headers, cookies ) = connection.Request( method, path_and_query, request_headers, body, report_hooks = report_hooks, temp_path = temp_path )
                 
+            finally:
+                
+                connection.lock.release()
+                
             
             if redirect_info is None or not follow_redirects:
                 
@@ -276,18 +283,44 @@ class HTTPConnectionManager( object ):
     
     def _GetConnection( self, location ):
         
+        # each location gets a small pool, so several requests to the same server can be in flight at once
+        # the connection is returned with its lock held, and the caller has to release it
+        
         with self._lock:
             
             if location not in self._connections:
                 
+                self._connections[ location ] = []
+                
+            
+            connections = self._connections[ location ]
+            
+            for connection in connections:
+                
+                if connection.lock.acquire( False ):
+                    
+                    return connection
+                    
+                
+            
+            if len( connections ) < self.MAX_CONNECTIONS_PER_LOCATION:
+                
                 connection = HTTPConnection( location )
                 
-                self._connections[ location ] = connection
+                connection.lock.acquire()
+                
+                connections.append( connection )
+                
+                return connection
                 
             
-            return self._connections[ location ]
+            connection = random.choice( connections )
             
         
+        connection.lock.acquire()
+        
+        return connection
+        
     
     def Request( self, method, url, request_headers = None, body = '', return_everything = False, return_cookies = False, report_hooks = None, temp_path = None ):
         
@@ -328,15 +361,31 @@ class HTTPConnectionManager( object ):
                 
                 with self._lock:
                     
-                    connections_copy = dict( self._connections )
-                    
-                    for ( location, connection ) in connections_copy.items():
+                    for ( location, connections ) in self._connections.items():
                         
-                        with connection.lock:
+                        for connection in list( connections ):
+                            
+                            # a connection in use is not stale
                             
-                            if connection.IsStale():
+                            if connection.lock.acquire( False ):
+                                
+                                try:
+                                    
+                                    if connection.IsStale():
+                                        
+                                        connections.remove( connection )
+                                        
+                                    
+                                finally:
+                                    
+                                    connection.lock.release()
+                                    
                                 
-                                del self._connections[ location ]
+                            
+                        
+                        if len( connections ) == 0:
+                            
+                            del self._connections[ location ]
                             
                         
                     
@@ -565,6 +614,10 @@ class HTTPConnection( object ):
                     parsed_response = data
                     
                 
+            elif content_type == 'application/octet-stream' and hydrus_service and HydrusSerialisable.NetworkStringIsBinary( data ):
+                
+                parsed_response = HydrusSerialisable.CreateFromNetworkString( data )
+                
             elif content_type == 'text/html':
                 
                 try: parsed_response = data.decode( 'utf-8' )
@@ -631,6 +684,11 @@ class HTTPConnection( object ):
                 
             
         
+        if content_length is not None and size_of_response < content_length:
+            
+            raise HydrusExceptions.NetworkException( 'Response was shorter than suggested!' )
+            
+        
         return size_of_response
         
     
@@ -0,0 +1,313 @@
+import numpy
+
+# a posting list is a sorted set of hash_ids, split like a roaring bitmap into containers of 65536 ids keyed by their high 16 bits
+# a sparse container is a sorted uint16 array of its low 16 bits, a dense one is an 8KB bitmap, whichever is smaller
+
+ARRAY_CONTAINER_MAX_CARDINALITY = 4096
+BITMAP_CONTAINER_NUM_BYTES = 8192
+
+POPCOUNTS = numpy.array( [ bin( i ).count( '1' ) for i in range( 256 ) ], dtype = numpy.uint32 )
+
+def ContainerIsBitmap( container ):
+    
+    return container.dtype == numpy.uint8
+    
+def ContainerToArray( container ):
+    
+    if ContainerIsBitmap( container ):
+        
+        return numpy.flatnonzero( numpy.unpackbits( container ) ).astype( numpy.uint16 )
+        
+    else:
+        
+        return container
+        
+    
+def ContainerToBitmap( container ):
+    
+    if ContainerIsBitmap( container ):
+        
+        return container
+        
+    else:
+        
+        bits = numpy.zeros( 65536, dtype = numpy.bool_ )
+        
+        bits[ container ] = True
+        
+        return numpy.packbits( bits )
+        
+    
+def ContainerToBits( container ):
+    
+    if ContainerIsBitmap( container ):
+        
+        return numpy.unpackbits( container ).astype( numpy.bool_ )
+        
+    else:
+        
+        bits = numpy.zeros( 65536, dtype = numpy.bool_ )
+        
+        bits[ container ] = True
+        
+        return bits
+        
+    
+def GetContainerCardinality( container ):
+    
+    if ContainerIsBitmap( container ):
+        
+        return int( POPCOUNTS[ container ].sum() )
+        
+    else:
+        
+        return len( container )
+        
+    
+def IntersectContainers( container_1, container_2 ):
+    
+    if ContainerIsBitmap( container_1 ) and ContainerIsBitmap( container_2 ):
+        
+        return NormaliseContainer( container_1 & container_2 )
+        
+    elif ContainerIsBitmap( container_1 ):
+        
+        return NormaliseContainer( container_2[ ContainerToBits( container_1 )[ container_2 ] ] )
+        
+    elif ContainerIsBitmap( container_2 ):
+        
+        return NormaliseContainer( container_1[ ContainerToBits( container_2 )[ container_1 ] ] )
+        
+    else:
+        
+        return NormaliseContainer( numpy.intersect1d( container_1, container_2, assume_unique = True ) )
+        
+    
+def NormaliseContainer( container ):
+    
+    cardinality = GetContainerCardinality( container )
+    
+    if cardinality == 0:
+        
+        return None
+        
+    elif cardinality > ARRAY_CONTAINER_MAX_CARDINALITY:
+        
+        return ContainerToBitmap( container )
+        
+    else:
+        
+        return ContainerToArray( container )
+        
+    
+def SubtractContainers( container_1, container_2 ):
+    
+    if ContainerIsBitmap( container_1 ):
+        
+        return NormaliseContainer( container_1 & ~ContainerToBitmap( container_2 ) )
+        
+    elif ContainerIsBitmap( container_2 ):
+        
+        return NormaliseContainer( container_1[ ~ContainerToBits( container_2 )[ container_1 ] ] )
+        
+    else:
+        
+        return NormaliseContainer( numpy.setdiff1d( container_1, container_2, assume_unique = True ) )
+        
+    
+def UnionContainers( container_1, container_2 ):
+    
+    if ContainerIsBitmap( container_1 ) or ContainerIsBitmap( container_2 ):
+        
+        return NormaliseContainer( ContainerToBitmap( container_1 ) | ContainerToBitmap( container_2 ) )
+        
+    else:
+        
+        return NormaliseContainer( numpy.union1d( container_1, container_2 ) )
+        
+    
+def FromBytes( data ):
+    
+    data = bytes( data )
+    
+    num_containers = int( numpy.frombuffer( data, dtype = '<u4', count = 1 )[0] )
+    
+    offset = 4
+    
+    keys = numpy.frombuffer( data, dtype = '<u2', count = num_containers, offset = offset )
+    
+    offset += 2 * num_containers
+    
+    cardinalities = numpy.frombuffer( data, dtype = '<u4', count = num_containers, offset = offset )
+    
+    offset += 4 * num_containers
+    
+    containers = {}
+    
+    for ( key, cardinality ) in zip( keys.tolist(), cardinalities.tolist() ):
+        
+        if cardinality > ARRAY_CONTAINER_MAX_CARDINALITY:
+            
+            container = numpy.frombuffer( data, dtype = numpy.uint8, count = BITMAP_CONTAINER_NUM_BYTES, offset = offset )
+            
+            offset += BITMAP_CONTAINER_NUM_BYTES
+            
+        else:
+            
+            container = numpy.frombuffer( data, dtype = '<u2', count = cardinality, offset = offset ).astype( numpy.uint16 )
+            
+            offset += 2 * cardinality
+            
+        
+        containers[ key ] = container
+        
+    
+    return PostingList( containers )
+    
+def FromHashIds( hash_ids ):
+    
+    hash_ids = numpy.unique( numpy.fromiter( hash_ids, dtype = numpy.uint32 ) )
+    
+    containers = {}
+    
+    if len( hash_ids ) > 0:
+        
+        ( keys, starts ) = numpy.unique( hash_ids >> 16, return_index = True )
+        
+        ends = list( starts[ 1 : ] ) + [ len( hash_ids ) ]
+        
+        for ( key, start, end ) in zip( keys, starts, ends ):
+            
+            containers[ int( key ) ] = NormaliseContainer( ( hash_ids[ start : end ] & 0xFFFF ).astype( numpy.uint16 ) )
+            
+        
+    
+    return PostingList( containers )
+    
+def MassIntersect( posting_lists ):
+    
+    # smallest first, so the working list shrinks as fast as it can
+    
+    posting_lists = sorted( posting_lists, key = len )
+    
+    result = posting_lists[0]
+    
+    for posting_list in posting_lists[ 1 : ]:
+        
+        if len( result ) == 0:
+            
+            break
+            
+        
+        result = result.Intersection( posting_list )
+        
+    
+    return result
+    
+def MassUnion( posting_lists ):
+    
+    result = PostingList()
+    
+    for posting_list in posting_lists:
+        
+        result = result.Union( posting_list )
+        
+    
+    return result
+    
+class PostingList( object ):
+    
+    def __init__( self, containers = None ):
+        
+        if containers is None:
+            
+            containers = {}
+            
+        
+        self._containers = containers
+        
+    
+    def __len__( self ):
+        
+        return sum( ( GetContainerCardinality( container ) for container in self._containers.values() ) )
+        
+    
+    def _Merge( self, other, container_merge, keep_my_orphans, keep_other_orphans ):
+        
+        containers = {}
+        
+        for ( key, container ) in self._containers.items():
+            
+            if key in other._containers:
+                
+                merged_container = container_merge( container, other._containers[ key ] )
+                
+                if merged_container is not None:
+                    
+                    containers[ key ] = merged_container
+                    
+                
+            elif keep_my_orphans:
+                
+                containers[ key ] = container
+                
+            
+        
+        if keep_other_orphans:
+            
+            for ( key, container ) in other._containers.items():
+                
+                if key not in self._containers:
+                    
+                    containers[ key ] = container
+                    
+                
+            
+        
+        return PostingList( containers )
+        
+    
+    def Difference( self, other ):
+        
+        return self._Merge( other, SubtractContainers, True, False )
+        
+    
+    def GetHashIds( self ):
+        
+        # this is the only place the ids are turned back into python ints, so do it once, for the final result
+        
+        arrays = [ ContainerToArray( self._containers[ key ] ).astype( numpy.uint32 ) | numpy.uint32( key << 16 ) for key in sorted( self._containers.keys() ) ]
+        
+        if len( arrays ) == 0:
+            
+            return []
+            
+        
+        return numpy.concatenate( arrays ).tolist()
+        
+    
+    def Intersection( self, other ):
+        
+        return self._Merge( other, IntersectContainers, False, False )
+        
+    
+    def ToBytes( self ):
+        
+        keys = sorted( self._containers.keys() )
+        
+        containers = [ self._containers[ key ] for key in keys ]
+        
+        cardinalities = [ GetContainerCardinality( container ) for container in containers ]
+        
+        header = numpy.array( [ len( keys ) ], dtype = '<u4' ).tobytes() + numpy.array( keys, dtype = '<u2' ).tobytes() + numpy.array( cardinalities, dtype = '<u4' ).tobytes()
+        
+        body = ''.join( ( container.tobytes() if ContainerIsBitmap( container ) else container.astype( '<u2' ).tobytes() for container in containers ) )
+        
+        return header + body
+        
+    
+    def Union( self, other ):
+        
+        return self._Merge( other, UnionContainers, True, True )
+        
+    
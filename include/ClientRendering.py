@@ -19,6 +19,12 @@ def GenerateHydrusBitmap( path, compressed = True ):
     
     return GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = compressed )
     
+def GenerateHydrusBitmapFromBytes( data, compressed = True ):
+    
+    numpy_image = ClientImageHandling.GenerateNumpyImageFromBytes( data )
+    
+    return GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = compressed )
+    
 def GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = True ):
     
     ( y, x, depth ) = numpy_image.shape
@@ -117,15 +117,14 @@ def SortPredicates( predicates ):
 
 class FileQueryResult( object ):
     
+    # the media results are shared with every other page, and the db's media result cache keeps them up to date
+    
     def __init__( self, media_results ):
         
         self._hashes_to_media_results = { media_result.GetHash() : media_result for media_result in media_results }
         self._hashes_ordered = [ media_result.GetHash() for media_result in media_results ]
         self._hashes = set( self._hashes_ordered )
         
-        HydrusGlobals.client_controller.sub( self, 'ProcessContentUpdates', 'content_updates_data' )
-        HydrusGlobals.client_controller.sub( self, 'ProcessServiceUpdates', 'service_updates_data' )
-        
     
     def __iter__( self ):
         
@@ -177,47 +176,6 @@ class FileQueryResult( object ):
     
     def GetMediaResults( self ): return [ self._hashes_to_media_results[ hash ] for hash in self._hashes_ordered ]
     
-    def ProcessContentUpdates( self, service_keys_to_content_updates ):
-        
-        for ( service_key, content_updates ) in service_keys_to_content_updates.items():
-            
-            for content_update in content_updates:
-                
-                hashes = content_update.GetHashes()
-                
-                if len( hashes ) > 0:
-                    
-                    for hash in self._hashes.intersection( hashes ):
-                        
-                        media_result = self._hashes_to_media_results[ hash ]
-                        
-                        media_result.ProcessContentUpdate( service_key, content_update )
-                        
-                    
-                
-            
-        
-    
-    def ProcessServiceUpdates( self, service_keys_to_service_updates ):
-        
-        for ( service_key, service_updates ) in service_keys_to_service_updates.items():
-            
-            for service_update in service_updates:
-                
-                ( action, row ) = service_update.ToTuple()
-                
-                if action == HC.SERVICE_UPDATE_DELETE_PENDING:
-                    
-                    for media_result in self._hashes_to_media_results.values(): media_result.DeletePending( service_key )
-                    
-                elif action == HC.SERVICE_UPDATE_RESET:
-                    
-                    for media_result in self._hashes_to_media_results.values(): media_result.ResetService( service_key )
-                    
-                
-            
-        
-    
 class FileSearchContext( HydrusSerialisable.SerialisableBase ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_FILE_SEARCH_CONTEXT
@@ -1,63 +1,88 @@
 import random
 import HydrusData
+import numpy
 
+def BranchIsUnbalanced( inner_population, outer_population ):
+    
+    # small branches are cheap to search however they are arranged
+    
+    total_population = inner_population + outer_population
+    
+    if total_population < 16:
+        
+        return False
+        
+    
+    smaller_population = min( inner_population, outer_population )
+    larger_population = max( inner_population, outer_population )
+    
+    return larger_population > 4 * ( smaller_population + 1 )
+    
+def SplitPopulation( population ):
+    
+    # population is a list of ( id, phash ) pairs
+    # returns ( ( vp_id, vp_phash ), radius, inner_population, outer_population )
+    
+    if len( population ) == 1:
+        
+        ( vantage_point, ) = population
+        
+        return ( vantage_point, 0, [], [] )
+        
+    
+    packed_phashes = HydrusData.ConvertPHashesToUInt64Array( ( phash for ( id, phash ) in population ) )
+    
+    # we want to choose a good node.
+    # a good node is one that doesn't overlap with other circles much
+    
+    # get a random sample with big lists, to keep cpu costs down
+    if len( population ) > 50: sample_indices = random.sample( xrange( len( population ) ), 50 )
+    else: sample_indices = range( len( population ) )
+    
+    sample_distances = HydrusData.GetHammingDistancesBlock( packed_phashes[ sample_indices ], packed_phashes[ sample_indices ] )
+    
+    sample_distances.sort( axis = 1 )
+    
+    # the median of the sorted hamming distances makes a decent radius
+    # the first column is each node's distance to itself, so skip it
+    
+    predicted_radii = sample_distances[ :, 1 + ( len( sample_indices ) - 1 ) / 2 ]
+    
+    # let's make our node the phash with the smallest predicted radius
+    
+    vp_index = sample_indices[ predicted_radii.argmin() ]
+    
+    vantage_point = population[ vp_index ]
+    
+    ( vp_id, vp_phash ) = vantage_point
+    
+    distances = HydrusData.GetHammingDistances( vp_phash, packed_phashes )
+    
+    other_distances = numpy.delete( distances, vp_index )
+    
+    other_distances.sort()
+    
+    radius = int( other_distances[ len( other_distances ) / 2 ] )
+    
+    # now separate my phashes into inside and outside that radius. everything on the radius goes inside
+    
+    is_inner = distances <= radius
+    
+    inner_population = [ population[ index ] for index in numpy.flatnonzero( is_inner ) if index != vp_index ]
+    outer_population = [ population[ index ] for index in numpy.flatnonzero( ~is_inner ) ]
+    
+    return ( vantage_point, radius, inner_population, outer_population )
+    
 class VPTreeNode( object ):
     
     def __init__( self, phashes ):
         
-        ghd = HydrusData.GetHammingDistance
-        
-        if len( phashes ) == 1:
-            
-            ( self._phash, ) = phashes
-            self._radius = 0
-            
-            inner_phashes = []
-            outer_phashes = []
-            
-        else:
-            
-            # we want to choose a good node.
-            # a good node is one that doesn't overlap with other circles much
-            
-            # get a random sample with big lists, to keep cpu costs down
-            if len( phashes ) > 50: phashes_sample = random.sample( phashes, 50 )
-            else: phashes_sample = phashes
-            
-            all_nodes_comparisons = { phash1 : [ ( ghd( phash1, phash2 ), phash2 ) for phash2 in phashes_sample if phash2 != phash1 ] for phash1 in phashes_sample }
-            
-            for comparisons in all_nodes_comparisons.values(): comparisons.sort()
-            
-            # the median of the sorted hamming distances makes a decent radius
-            
-            all_nodes_radii = [ ( comparisons[ len( comparisons ) / 2 ], phash ) for ( phash, comparisons ) in all_nodes_comparisons.items() ]
-            
-            all_nodes_radii.sort()
-            
-            # let's make our node the phash with the smallest predicted radius
-            
-            ( ( predicted_radius, whatever ), self._phash ) = all_nodes_radii[ 0 ]
-            
-            if len( phashes ) > 50:
-                
-                my_hammings = [ ( ghd( self._phash, phash ), phash ) for phash in phashes if phash != self._phash ]
-                
-                my_hammings.sort()
-                
-            else: my_hammings = all_nodes_comparisons[ self._phash ]
-            
-            median_index = len( my_hammings ) / 2
-            
-            ( self._radius, whatever ) = my_hammings[ median_index ]
-            
-            # lets bump our index up until we actually get outside the radius
-            while median_index + 1 < len( my_hammings ) and my_hammings[ median_index + 1 ][0] == self._radius: median_index += 1
-            
-            # now separate my phashes into inside and outside that radius
-            
-            inner_phashes = [ phash for ( hamming, phash ) in my_hammings[ : median_index + 1 ] ]
-            outer_phashes = [ phash for ( hamming, phash ) in my_hammings[ median_index + 1 : ] ]
-            
+        population = list( enumerate( phashes ) )
+        
+        ( ( vp_id, self._phash ), self._radius, inner_population, outer_population ) = SplitPopulation( population )
+        
+        inner_phashes = [ phash for ( id, phash ) in inner_population ]
+        outer_phashes = [ phash for ( id, phash ) in outer_population ]
         
         if len( inner_phashes ) == 0: self._inner_node = VPTreeNodeEmpty()
         else: self._inner_node = VPTreeNode( inner_phashes )
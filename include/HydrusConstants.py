@@ -48,7 +48,7 @@ options = {}
 # Misc
 
 NETWORK_VERSION = 17
-SOFTWARE_VERSION = 222
+SOFTWARE_VERSION = 223
 
 UNSCALED_THUMBNAIL_DIMENSIONS = ( 200, 200 )
 
@@ -19,6 +19,8 @@ import time
 
 CONNECTION_REFRESH_TIME = 60 * 30
 
+WRITE_ACTION_CODES = { sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE, sqlite3.SQLITE_CREATE_TABLE, sqlite3.SQLITE_CREATE_INDEX, sqlite3.SQLITE_CREATE_TRIGGER, sqlite3.SQLITE_CREATE_VIEW, sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_DROP_INDEX, sqlite3.SQLITE_DROP_TRIGGER, sqlite3.SQLITE_DROP_VIEW, sqlite3.SQLITE_ALTER_TABLE, sqlite3.SQLITE_REINDEX, sqlite3.SQLITE_ANALYZE }
+
 def CanVacuum( db_path, stop_time = None ):
     
     try:
@@ -145,18 +147,24 @@ def VacuumDB( db_path ):
     
 class HydrusDB( object ):
     
+    CONCURRENT_READ_ACTIONS = []
+    GROUP_COMMIT_ACTIONS = []
+    GROUP_COMMIT_MAX_JOBS = 100
+    GROUP_COMMIT_MAX_TIME = 0.5
     READ_WRITE_ACTIONS = []
     UPDATE_WAIT = 2
     
     def __init__( self, controller, db_dir, db_name, no_wal = False ):
         
+        # every thread that talks to the db gets its own connection, cursor and pending pubsubs
+        
+        self._thread_local = threading.local()
+        
         self._controller = controller
         self._db_dir = db_dir
         self._db_name = db_name
         self._no_wal = no_wal
         
-        self._connection_timestamp = 0
-        
         main_db_filename = db_name
         
         if not main_db_filename.endswith( '.db' ):
@@ -187,7 +195,12 @@ class HydrusDB( object ):
         self._could_not_initialise = False
         
         self._jobs = Queue.PriorityQueue()
-        self._pubsubs = []
+        self._read_jobs = Queue.PriorityQueue()
+        
+        self._num_read_connections = 0
+        self._read_threads = []
+        
+        self._group_commit = False
         
         self._currently_doing_job = False
         
@@ -262,6 +275,56 @@ class HydrusDB( object ):
             
         
     
+    def _GetConnection( self ):
+        
+        return getattr( self._thread_local, 'db', None )
+        
+    
+    def _GetConnectionTimestamp( self ):
+        
+        return getattr( self._thread_local, 'connection_timestamp', 0 )
+        
+    
+    def _GetCursor( self ):
+        
+        return getattr( self._thread_local, 'c', None )
+        
+    
+    def _GetPubsubs( self ):
+        
+        if not hasattr( self._thread_local, 'pubsubs' ):
+            
+            self._thread_local.pubsubs = []
+            
+        
+        return self._thread_local.pubsubs
+        
+    
+    def _SetConnection( self, db ):
+        
+        self._thread_local.db = db
+        
+    
+    def _SetConnectionTimestamp( self, connection_timestamp ):
+        
+        self._thread_local.connection_timestamp = connection_timestamp
+        
+    
+    def _SetCursor( self, c ):
+        
+        self._thread_local.c = c
+        
+    
+    def _SetPubsubs( self, pubsubs ):
+        
+        self._thread_local.pubsubs = pubsubs
+        
+    
+    _db = property( _GetConnection, _SetConnection )
+    _c = property( _GetCursor, _SetCursor )
+    _connection_timestamp = property( _GetConnectionTimestamp, _SetConnectionTimestamp )
+    _pubsubs = property( _GetPubsubs, _SetPubsubs )
+    
     def _AttachExternalDatabases( self ):
         
         for ( name, filename ) in self._db_filenames.items():
@@ -301,9 +364,6 @@ class HydrusDB( object ):
             self._c.close()
             self._db.close()
             
-            del self._c
-            del self._db
-            
             self._db = None
             self._c = None
             
@@ -414,8 +474,8 @@ class HydrusDB( object ):
                     
                     if db_just_created:
                         
-                        del self._c
-                        del self._db
+                        self._c = None
+                        self._db = None
                         
                         os.remove( db_path )
                         
@@ -443,13 +503,234 @@ class HydrusDB( object ):
         pass
         
     
+    def _InvalidateCaches( self ):
+        
+        # called on the main db thread when a write is rolled back, for any in-memory state that may now be ahead of the db
+        
+        pass
+        
+    
+    def _JobCanGroupCommit( self, job ):
+        
+        if not self._group_commit or job.GetType() != 'write':
+            
+            return False
+            
+        
+        ( action, args, kwargs ) = job.GetCallableTuple()
+        
+        return action in self.GROUP_COMMIT_ACTIONS
+        
+    
     def _ManageDBError( self, job, e ):
         
         raise NotImplementedError()
         
     
+    def _ProcessConcurrentReadJob( self, priority, job ):
+        
+        ( action, args, kwargs ) = job.GetCallableTuple()
+        
+        self._thread_local.write_attempted = False
+        
+        self._pubsubs = []
+        
+        in_transaction = False
+        
+        try:
+            
+            # a deferred transaction gives the whole read one consistent snapshot of the db
+            
+            self._c.execute( 'BEGIN DEFERRED;' )
+            
+            in_transaction = True
+            
+            result = self._Read( action, *args, **kwargs )
+            
+            self._c.execute( 'COMMIT;' )
+            
+            in_transaction = False
+            
+            for ( topic, args, kwargs ) in self._pubsubs:
+                
+                self._controller.pub( topic, *args, **kwargs )
+                
+            
+            job.PutResult( result )
+            
+        except Exception as e:
+            
+            if in_transaction:
+                
+                try:
+                    
+                    self._c.execute( 'ROLLBACK;' )
+                    
+                except Exception as rollback_e:
+                    
+                    HydrusData.Print( 'When the read failed, attempting to rollback the database failed.' )
+                    
+                    HydrusData.PrintException( rollback_e )
+                    
+                
+            
+            if self._thread_local.write_attempted:
+                
+                # this read needs to write something after all, so hand it to the main loop
+                
+                self._jobs.put( ( priority + 1, job ) )
+                
+            else:
+                
+                self._ManageDBError( job, e )
+                
+            
+        
+    
+    def _ProcessGroupCommitJobs( self, job ):
+        
+        # merge this write and any groupable writes queued behind it into one transaction
+        # each job gets its own savepoint, so one failing does not take the others down with it
+        
+        group_started = HydrusData.GetNowPrecise()
+        
+        done_jobs = []
+        
+        try:
+            
+            self._c.execute( 'BEGIN IMMEDIATE;' )
+            
+        except Exception as e:
+            
+            self._ManageDBError( job, e )
+            
+            return
+            
+        
+        while True:
+            
+            ( action, args, kwargs ) = job.GetCallableTuple()
+            
+            self._pubsubs = []
+            
+            in_savepoint = False
+            
+            try:
+                
+                self._c.execute( 'SAVEPOINT group_commit_job;' )
+                
+                in_savepoint = True
+                
+                result = self._Write( action, *args, **kwargs )
+                
+                self._c.execute( 'RELEASE SAVEPOINT group_commit_job;' )
+                
+                in_savepoint = False
+                
+                done_jobs.append( ( job, result, self._pubsubs ) )
+                
+            except Exception as e:
+                
+                if in_savepoint:
+                    
+                    try:
+                        
+                        self._c.execute( 'ROLLBACK TO SAVEPOINT group_commit_job;' )
+                        self._c.execute( 'RELEASE SAVEPOINT group_commit_job;' )
+                        
+                    except Exception as rollback_e:
+                        
+                        HydrusData.Print( 'When the grouped job failed, attempting to rollback its savepoint failed.' )
+                        
+                        HydrusData.PrintException( rollback_e )
+                        
+                    
+                
+                # the rollback only undoes the sql, so anything the job changed in memory has to go too
+                
+                self._InvalidateCaches()
+                
+                self._ManageDBError( job, e )
+                
+            
+            if len( done_jobs ) >= self.GROUP_COMMIT_MAX_JOBS or HydrusData.TimeHasPassed( group_started + self.GROUP_COMMIT_MAX_TIME ):
+                
+                break
+                
+            
+            try:
+                
+                ( priority, next_job ) = self._jobs.get_nowait()
+                
+            except Queue.Empty:
+                
+                break
+                
+            
+            if not self._JobCanGroupCommit( next_job ):
+                
+                self._jobs.put( ( priority, next_job ) )
+                
+                break
+                
+            
+            job = next_job
+            
+        
+        try:
+            
+            self._c.execute( 'COMMIT;' )
+            
+        except Exception as e:
+            
+            try:
+                
+                self._c.execute( 'ROLLBACK;' )
+                
+            except Exception as rollback_e:
+                
+                HydrusData.Print( 'When the group commit failed, attempting to rollback the database failed.' )
+                
+                HydrusData.PrintException( rollback_e )
+                
+            
+            self._InvalidateCaches()
+            
+            for ( job, result, pubsubs ) in done_jobs:
+                
+                self._ManageDBError( job, e )
+                
+            
+            self._TransactionFinished()
+            
+            return
+            
+        
+        self._TransactionFinished()
+        
+        for ( job, result, pubsubs ) in done_jobs:
+            
+            for ( topic, args, kwargs ) in pubsubs:
+                
+                self._controller.pub( topic, *args, **kwargs )
+                
+            
+            if job.IsSynchronous():
+                
+                job.PutResult( result )
+                
+            
+        
+    
     def _ProcessJob( self, job ):
         
+        if self._JobCanGroupCommit( job ):
+            
+            self._ProcessGroupCommitJobs( job )
+            
+            return
+            
+        
         job_type = job.GetType()
         
         ( action, args, kwargs ) = job.GetCallableTuple()
@@ -500,21 +781,49 @@ class HydrusDB( object ):
                     HydrusData.PrintException( rollback_e )
                     
                 
+                self._InvalidateCaches()
+                
             
             self._ManageDBError( job, e )
             
         
+        if job_type in ( 'read_write', 'write' ):
+            
+            self._TransactionFinished()
+            
+        
     
     def _Read( self, action, *args, **kwargs ):
         
         raise NotImplementedError()
         
     
+    def _ReadOnlyAuthoriser( self, action_code, arg_1, arg_2, db_name, trigger_name ):
+        
+        # the read connections may do anything to the scratch dbs, but nothing to the real files
+        
+        if action_code in WRITE_ACTION_CODES and db_name not in ( 'mem', 'temp' ):
+            
+            self._thread_local.write_attempted = True
+            
+            return sqlite3.SQLITE_DENY
+            
+        
+        return sqlite3.SQLITE_OK
+        
+    
     def _ReportStatus( self, text ):
         
         HydrusData.Print( text )
         
     
+    def _TransactionFinished( self ):
+        
+        # called on the main db thread whenever a write transaction commits or rolls back
+        
+        pass
+        
+    
     def _UpdateDB( self, version ):
         
         raise NotImplementedError()
@@ -557,7 +866,7 @@ class HydrusDB( object ):
     
     def JobsQueueEmpty( self ):
         
-        return self._jobs.empty()
+        return self._jobs.empty() and self._read_jobs.empty()
         
     
     def MainLoop( self ):
@@ -577,6 +886,24 @@ class HydrusDB( object ):
             return
             
         
+        # read connections need wal so they do not block the writer. old sqlite also flips the journal mode during big writes, which they would block
+        
+        if not self._no_wal and self._fast_big_transaction_wal:
+            
+            # a read thread only joins _read_threads once its connection is up, so we wait to hear how it went
+            
+            for i in range( self._num_read_connections ):
+                
+                initialised = threading.Event()
+                
+                thread = threading.Thread( target = self.ReadLoop, args = ( initialised, ), name = 'Database Read Loop ' + str( i + 1 ) )
+                
+                thread.start()
+                
+                initialised.wait()
+                
+            
+        
         self._ready_to_serve_requests = True
         
         error_count = 0
@@ -634,6 +961,11 @@ class HydrusDB( object ):
                 
             
         
+        for thread in self._read_threads:
+            
+            thread.join()
+            
+        
         self._CleanUpCaches()
         
         self._CloseDBCursor()
@@ -655,11 +987,62 @@ class HydrusDB( object ):
             raise HydrusExceptions.ShutdownException( 'Application has shut down!' )
             
         
-        self._jobs.put( ( priority + 1, job ) ) # +1 so all writes of equal priority can clear out first
+        if job_type == 'read' and action in self.CONCURRENT_READ_ACTIONS and True in ( thread.is_alive() for thread in self._read_threads ):
+            
+            # these reads see the last committed state of the db, so they do not need to wait for the writes ahead of them
+            
+            self._read_jobs.put( ( priority, job ) )
+            
+        else:
+            
+            self._jobs.put( ( priority + 1, job ) ) # +1 so all writes of equal priority can clear out first
+            
         
         return job.GetResult()
         
     
+    def ReadLoop( self, initialised ):
+        
+        try:
+            
+            self._InitDBCursor()
+            
+            self._db.set_authorizer( self._ReadOnlyAuthoriser )
+            
+        except Exception as e:
+            
+            HydrusData.Print( 'A database read connection could not be initialised:' )
+            
+            HydrusData.PrintException( e )
+            
+            return
+            
+        else:
+            
+            self._read_threads.append( threading.current_thread() )
+            
+        finally:
+            
+            initialised.set()
+            
+        
+        while not ( ( self._local_shutdown or self._controller.ModelIsShutdown() ) and self._read_jobs.empty() ):
+            
+            try:
+                
+                ( priority, job ) = self._read_jobs.get( timeout = 0.5 )
+                
+                self._ProcessConcurrentReadJob( priority, job )
+                
+            except Queue.Empty:
+                
+                pass
+                
+            
+        
+        self._CloseDBCursor()
+        
+    
     def ReadyToServeRequests( self ):
         
         return self._ready_to_serve_requests
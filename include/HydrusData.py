@@ -6,7 +6,9 @@ import HydrusConstants as HC
 import HydrusExceptions
 import HydrusGlobals
 import HydrusSerialisable
+import json
 import locale
+import numpy
 import os
 import pstats
 import psutil
@@ -264,6 +266,12 @@ def ConvertNumericalRatingToPrettyString( lower, upper, rating, rounded_result =
     
     return s
     
+def ConvertPHashesToUInt64Array( phashes ):
+    
+    # phashes are always eight bytes, so they pack neatly into one uint64 each
+    
+    return numpy.fromstring( ''.join( ( str( phash ) for phash in phashes ) ), dtype = numpy.uint64 )
+    
 def ConvertPixelsToInt( unit ):
     
     if unit == 'pixels': return 1
@@ -647,6 +655,22 @@ def GetHammingDistance( phash1, phash2 ):
     
     return distance
     
+def GetHammingDistances( phash, packed_phashes ):
+    
+    # returns an array of the hamming distances from phash to each of packed_phashes
+    
+    ( packed_phash, ) = ConvertPHashesToUInt64Array( ( phash, ) )
+    
+    return PopCountUInt64Array( numpy.bitwise_xor( packed_phashes, packed_phash ) )
+    
+def GetHammingDistancesBlock( packed_phashes_block, packed_phashes ):
+    
+    # returns a len( block ) x len( packed_phashes ) array of hamming distances
+    
+    xors = numpy.bitwise_xor( packed_phashes_block[ :, numpy.newaxis ], packed_phashes[ numpy.newaxis, : ] )
+    
+    return PopCountUInt64Array( xors )
+    
 def GetNow(): return int( time.time() )
 
 def GetNowPrecise():
@@ -833,6 +857,21 @@ def MergeKeyToListDicts( key_to_list_dicts ):
     
     return result
     
+def PopCountUInt64Array( array ):
+    
+    m1 = numpy.uint64( 0x5555555555555555 )
+    m2 = numpy.uint64( 0x3333333333333333 )
+    m4 = numpy.uint64( 0x0f0f0f0f0f0f0f0f )
+    h01 = numpy.uint64( 0x0101010101010101 )
+    
+    # bit-sliced popcount--sum adjacent bits into 2-bit fields, then 4-bit, then bytes, and then add all the bytes up into the top byte with one multiply
+    
+    array = array - ( ( array >> numpy.uint64( 1 ) ) & m1 )
+    array = ( array & m2 ) + ( ( array >> numpy.uint64( 2 ) ) & m2 )
+    array = ( array + ( array >> numpy.uint64( 4 ) ) ) & m4
+    
+    return ( ( array * h01 ) >> numpy.uint64( 56 ) ).astype( numpy.uint8 )
+    
 def Print( text ):
     
     print( ToByteString( text ) )
@@ -1887,6 +1926,7 @@ class ServerToClientContentUpdatePackage( HydrusSerialisable.SerialisableBase ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_SERVER_TO_CLIENT_CONTENT_UPDATE_PACKAGE
     SERIALISABLE_VERSION = 1
+    SERIALISABLE_BINARY_VERSION = 1
     
     def __init__( self ):
         
@@ -1896,9 +1936,148 @@ class ServerToClientContentUpdatePackage( HydrusSerialisable.SerialisableBase ):
         
         self._hash_ids_to_hashes = {}
         
+        # a package read from the binary format is only indexed up front. its rows are decoded a section at a time as they are iterated
+        
+        self._packed_data = None
+        self._packed_body_position = 0
+        self._packed_hash_ids = None
+        self._packed_hashes = None
+        self._packed_hash_length = 0
+        self._packed_tags = []
+        self._packed_sections = {}
+        
+    
+    def _GetHashes( self, hash_ids ):
+        
+        if self._packed_data is None:
+            
+            return [ self._hash_ids_to_hashes[ hash_id ] for hash_id in hash_ids ]
+            
+        
+        if len( hash_ids ) == 0:
+            
+            return []
+            
+        
+        hash_ids = numpy.asarray( hash_ids, dtype = numpy.int64 )
+        
+        indices = numpy.searchsorted( self._packed_hash_ids, hash_ids )
+        
+        if indices.max() >= len( self._packed_hash_ids ) or ( self._packed_hash_ids[ indices ] != hash_ids ).any():
+            
+            raise HydrusExceptions.DataMissing( 'Content update package was missing a hash!' )
+            
+        
+        hash_length = self._packed_hash_length
+        
+        return [ self._packed_hashes[ index * hash_length : ( index + 1 ) * hash_length ] for index in indices.tolist() ]
+        
+    
+    def _GetSerialisableBinary( self, writer ):
+        
+        if self._packed_data is not None:
+            
+            # we have not been changed since we were read, so our body can go straight back out
+            
+            writer.WriteRaw( self._packed_data[ self._packed_body_position : ] )
+            
+            return
+            
+        
+        # hashes are packed raw rather than hexed, id lists are delta encoded, and each tag is written once in a table
+        
+        hash_ids = sorted( self._hash_ids_to_hashes.keys() )
+        hashes = [ str( self._hash_ids_to_hashes[ hash_id ] ) for hash_id in hash_ids ]
+        
+        hash_lengths = { len( hash ) for hash in hashes }
+        
+        if len( hash_lengths ) > 1:
+            
+            raise Exception( 'Content update package had hashes of different lengths!' )
+            
+        
+        writer.WriteIntList( hash_ids )
+        
+        if len( hashes ) > 0:
+            
+            ( hash_length, ) = hash_lengths
+            
+            writer.WriteVarInt( hash_length )
+            writer.WriteRaw( ''.join( hashes ) )
+            
+        
+        tags = []
+        tags_to_indices = {}
+        
+        def GetTagIndex( tag ):
+            
+            if tag not in tags_to_indices:
+                
+                tags_to_indices[ tag ] = len( tags )
+                
+                tags.append( tag )
+                
+            
+            return tags_to_indices[ tag ]
+            
+        
+        content_writer = HydrusSerialisable.BinaryWriter()
+        
+        sections = [ ( data_type, action, rows ) for ( data_type, actions_dict ) in self._content_data.items() for ( action, rows ) in actions_dict.items() ]
+        
+        content_writer.WriteVarInt( len( sections ) )
+        
+        for ( data_type, action, rows ) in sections:
+            
+            content_writer.WriteVarInt( data_type )
+            content_writer.WriteVarInt( action )
+            content_writer.WriteVarInt( len( rows ) )
+            
+            if data_type == HC.CONTENT_TYPE_FILES:
+                
+                if action == HC.CONTENT_UPDATE_ADD:
+                    
+                    # ( hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words ), written a column at a time
+                    
+                    for i in range( 9 ):
+                        
+                        content_writer.WriteNoneableIntList( [ row[ i ] for row in rows ] )
+                        
+                    
+                else:
+                    
+                    content_writer.WriteIntList( rows )
+                    
+                
+            elif data_type == HC.CONTENT_TYPE_MAPPINGS:
+                
+                content_writer.WriteIntList( [ GetTagIndex( tag ) for ( tag, hash_ids ) in rows ] )
+                content_writer.WriteIntList( [ len( hash_ids ) for ( tag, hash_ids ) in rows ] )
+                content_writer.WriteIntListSegments( [ hash_ids for ( tag, hash_ids ) in rows ] )
+                
+            elif data_type in ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_TYPE_TAG_PARENTS ):
+                
+                content_writer.WriteIntList( [ GetTagIndex( old_tag ) for ( old_tag, new_tag ) in rows ] )
+                content_writer.WriteIntList( [ GetTagIndex( new_tag ) for ( old_tag, new_tag ) in rows ] )
+                
+            else:
+                
+                content_writer.WriteBytes( json.dumps( rows ) )
+                
+            
+        
+        encoded_tags = [ tag.encode( 'utf-8' ) for tag in tags ]
+        
+        writer.WriteIntList( [ len( encoded_tag ) for encoded_tag in encoded_tags ] )
+        writer.WriteRaw( ''.join( encoded_tags ) )
+        
+        writer.WriteRaw( content_writer.GetData() )
+        
     
     def _GetSerialisableInfo( self ):
         
+        self._MaterialiseBinary()
+        
         serialisable_content_data = []
         
         for ( data_type, actions_dict ) in self._content_data.items():
@@ -1918,6 +2097,91 @@ class ServerToClientContentUpdatePackage( HydrusSerialisable.SerialisableBase ):
         return ( serialisable_content_data, serialisable_hashes )
         
     
+    def _InitialiseFromSerialisableBinary( self, version, reader ):
+        
+        self._content_data = {}
+        self._hash_ids_to_hashes = {}
+        
+        self._packed_body_position = reader.GetPosition()
+        
+        self._packed_hash_ids = reader.ReadIntArray()
+        
+        if len( self._packed_hash_ids ) > 0:
+            
+            self._packed_hash_length = reader.ReadVarInt()
+            
+            self._packed_hashes = reader.ReadRaw( self._packed_hash_length * len( self._packed_hash_ids ) )
+            
+        
+        tag_lengths = reader.ReadIntList()
+        
+        packed_tags = reader.ReadRaw( sum( tag_lengths ) )
+        
+        self._packed_tags = []
+        
+        position = 0
+        
+        for tag_length in tag_lengths:
+            
+            self._packed_tags.append( packed_tags[ position : position + tag_length ].decode( 'utf-8' ) )
+            
+            position += tag_length
+            
+        
+        # note where each section starts and how big it is, skipping over the rows themselves
+        
+        self._packed_sections = {}
+        
+        num_sections = reader.ReadVarInt()
+        
+        for i in range( num_sections ):
+            
+            data_type = reader.ReadVarInt()
+            action = reader.ReadVarInt()
+            num_rows = reader.ReadVarInt()
+            
+            section_position = reader.GetPosition()
+            
+            num_content_rows = num_rows
+            
+            if data_type == HC.CONTENT_TYPE_FILES:
+                
+                if action == HC.CONTENT_UPDATE_ADD:
+                    
+                    for j in range( 9 ):
+                        
+                        reader.SkipIntList()
+                        
+                    
+                else:
+                    
+                    reader.SkipIntList()
+                    
+                
+            elif data_type == HC.CONTENT_TYPE_MAPPINGS:
+                
+                reader.SkipIntList()
+                
+                num_content_rows = int( reader.ReadIntArray().sum() )
+                
+                reader.SkipIntListSegments()
+                
+            elif data_type in ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_TYPE_TAG_PARENTS ):
+                
+                reader.SkipIntList()
+                reader.SkipIntList()
+                
+            else:
+                
+                reader.SkipBytes()
+                
+            
+            self._packed_sections[ ( data_type, action ) ] = ( section_position, num_rows, num_content_rows )
+            
+        
+        self._packed_data = reader.GetData()
+        
+    
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
         
         ( serialisable_content_data, serialisable_hashes ) = serialisable_info
@@ -1939,8 +2203,98 @@ class ServerToClientContentUpdatePackage( HydrusSerialisable.SerialisableBase ):
         self._hash_ids_to_hashes = { hash_id : hash.decode( 'hex' ) for ( hash_id, hash ) in serialisable_hashes }
         
     
+    def _IteratePackedRows( self, data_type, action ):
+        
+        ( section_position, num_rows, num_content_rows ) = self._packed_sections[ ( data_type, action ) ]
+        
+        reader = HydrusSerialisable.BinaryReader( self._packed_data, section_position )
+        
+        if data_type == HC.CONTENT_TYPE_FILES:
+            
+            if action == HC.CONTENT_UPDATE_ADD:
+                
+                columns = [ reader.ReadNoneableIntList() for i in range( 9 ) ]
+                
+                for row in itertools.izip( *columns ):
+                    
+                    yield row
+                    
+                
+            else:
+                
+                for hash_id in reader.ReadIntList():
+                    
+                    yield hash_id
+                    
+                
+            
+        elif data_type == HC.CONTENT_TYPE_MAPPINGS:
+            
+            tag_indices = reader.ReadIntList()
+            counts = reader.ReadIntList()
+            hash_id_lists = reader.ReadIntListSegments( counts )
+            
+            for ( tag_index, hash_ids ) in zip( tag_indices, hash_id_lists ):
+                
+                yield ( self._packed_tags[ tag_index ], hash_ids )
+                
+            
+        elif data_type in ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_TYPE_TAG_PARENTS ):
+            
+            old_tag_indices = reader.ReadIntList()
+            new_tag_indices = reader.ReadIntList()
+            
+            for ( old_tag_index, new_tag_index ) in zip( old_tag_indices, new_tag_indices ):
+                
+                yield ( self._packed_tags[ old_tag_index ], self._packed_tags[ new_tag_index ] )
+                
+            
+        else:
+            
+            for row in json.loads( reader.ReadBytes() ):
+                
+                yield row
+                
+            
+        
+    
+    def _MaterialiseBinary( self ):
+        
+        if self._packed_data is None:
+            
+            return
+            
+        
+        content_data = {}
+        
+        for ( data_type, action ) in self._packed_sections.keys():
+            
+            if data_type not in content_data:
+                
+                content_data[ data_type ] = {}
+                
+            
+            content_data[ data_type ][ action ] = list( self._IteratePackedRows( data_type, action ) )
+            
+        
+        hash_ids_to_hashes = dict( zip( self._packed_hash_ids.tolist(), self._GetHashes( self._packed_hash_ids ) ) )
+        
+        self._content_data = content_data
+        self._hash_ids_to_hashes = hash_ids_to_hashes
+        
+        self._packed_data = None
+        self._packed_body_position = 0
+        self._packed_hash_ids = None
+        self._packed_hashes = None
+        self._packed_hash_length = 0
+        self._packed_tags = []
+        self._packed_sections = {}
+        
+    
     def AddContentData( self, data_type, action, rows, hash_ids_to_hashes ):
         
+        self._MaterialiseBinary()
+        
         if data_type not in self._content_data:
             
             self._content_data[ data_type ] = {}
@@ -1958,21 +2312,35 @@ class ServerToClientContentUpdatePackage( HydrusSerialisable.SerialisableBase ):
     
     def GetContentDataIterator( self, data_type, action ):
         
-        if data_type not in self._content_data or action not in self._content_data[ data_type ]: return ()
-        
-        data = self._content_data[ data_type ][ action ]
+        if self._packed_data is None:
+            
+            if data_type not in self._content_data or action not in self._content_data[ data_type ]: return ()
+            
+            data = self._content_data[ data_type ][ action ]
+            
+        else:
+            
+            if ( data_type, action ) not in self._packed_sections: return ()
+            
+            data = self._IteratePackedRows( data_type, action )
+            
         
         if data_type == HC.CONTENT_TYPE_FILES:
             
-            if action == HC.CONTENT_UPDATE_ADD: return ( ( self._hash_ids_to_hashes[ hash_id ], size, mime, timestamp, width, height, duration, num_frames, num_words ) for ( hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words ) in data )
-            else: return ( ( self._hash_ids_to_hashes[ hash_id ], ) for hash_id in data )
+            if action == HC.CONTENT_UPDATE_ADD: return ( tuple( self._GetHashes( ( hash_id, ) ) ) + ( size, mime, timestamp, width, height, duration, num_frames, num_words ) for ( hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words ) in data )
+            else: return ( tuple( self._GetHashes( ( hash_id, ) ) ) for hash_id in data )
             
-        elif data_type == HC.CONTENT_TYPE_MAPPINGS: return ( ( tag, [ self._hash_ids_to_hashes[ hash_id ] for hash_id in hash_ids ] ) for ( tag, hash_ids ) in data )
+        elif data_type == HC.CONTENT_TYPE_MAPPINGS: return ( ( tag, self._GetHashes( hash_ids ) ) for ( tag, hash_ids ) in data )
         else: return data.__iter__()
         
     
     def GetNumContentUpdates( self ):
         
+        if self._packed_data is not None:
+            
+            return sum( ( num_rows for ( section_position, num_rows, num_content_rows ) in self._packed_sections.values() ) )
+            
+        
         num = 0
         
         for data_type in self._content_data:
@@ -1988,6 +2356,11 @@ class ServerToClientContentUpdatePackage( HydrusSerialisable.SerialisableBase ):
     
     def GetNumRows( self ):
         
+        if self._packed_data is not None:
+            
+            return sum( ( num_content_rows for ( section_position, num_rows, num_content_rows ) in self._packed_sections.values() ) )
+            
+        
         num = 0
         
         for data_type in self._content_data:
@@ -2043,7 +2416,15 @@ class ServerToClientContentUpdatePackage( HydrusSerialisable.SerialisableBase ):
             
         
     
-    def GetHashes( self ): return set( self._hash_ids_to_hashes.values() )
+    def GetHashes( self ):
+        
+        if self._packed_data is not None:
+            
+            return set( self._GetHashes( self._packed_hash_ids ) )
+            
+        
+        return set( self._hash_ids_to_hashes.values() )
+        
     
     def GetTags( self ):
         
@@ -22,6 +22,8 @@ import HydrusData
 
 # Mime
 
+MIME_HEADER_SIZE = 256
+
 header_and_mime = [
     ( 0, '\xff\xd8', HC.IMAGE_JPEG ),
     ( 0, 'GIF87a', HC.IMAGE_GIF ),
@@ -61,9 +63,16 @@ def SaveThumbnailToStream( pil_image, dimensions, f ):
         pil_image.save( f, 'JPEG', quality = 92 )
         
     
-def GenerateThumbnail( path, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS ):
+def GenerateThumbnail( path, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS, file_info = None ):
     
-    mime = GetMime( path )
+    if file_info is None:
+        
+        mime = GetMime( path )
+        
+    else:
+        
+        ( size, mime, width, height, duration, num_frames, num_words ) = file_info
+        
     
     f = cStringIO.StringIO()
     
@@ -102,7 +111,12 @@ def GenerateThumbnail( path, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS ):
         
     else:
         
-        ( size, mime, width, height, duration, num_frames, num_words ) = GetFileInfo( path )
+        if file_info is None:
+            
+            file_info = GetFileInfo( path, mime = mime )
+            
+        
+        ( size, mime, width, height, duration, num_frames, num_words ) = file_info
         
         cropped_dimensions = HydrusImageHandling.GetThumbnailResolution( ( width, height ), dimensions )
         
@@ -145,13 +159,16 @@ def GetExtraHashesFromPath( path ):
     
     return ( md5, sha1, sha512 )
     
-def GetFileInfo( path ):
+def GetFileInfo( path, mime = None ):
     
     size = os.path.getsize( path )
     
     if size == 0: raise HydrusExceptions.SizeException( 'File is of zero length!' )
     
-    mime = GetMime( path )
+    if mime is None:
+        
+        mime = GetMime( path )
+        
     
     if mime not in HC.ALLOWED_MIMES: raise HydrusExceptions.MimeException( 'Filetype is not permitted!' )
     
@@ -192,18 +209,68 @@ def GetHashFromPath( path ):
     
     return h.digest()
     
-def GetMime( path ):
+def GetHashesAndHeaderFromPath( path, copy_to_path = None ):
     
-    with open( path, 'rb' ) as f:
+    # one read of the file feeds all four digests, the mime header and, if asked, a copy
+    
+    hashers = ( hashlib.sha256(), hashlib.md5(), hashlib.sha1(), hashlib.sha512() )
+    
+    file_header = ''
+    
+    if copy_to_path is None:
+        
+        f_dest = None
         
-        f.seek( 0 )
+    else:
         
-        bit_to_check = f.read( 256 )
+        f_dest = open( copy_to_path, 'wb' )
+        
+    
+    try:
+        
+        for block in HydrusPaths.ReadPathAsBlocks( path ):
+            
+            if len( file_header ) < MIME_HEADER_SIZE:
+                
+                file_header += block[ : MIME_HEADER_SIZE - len( file_header ) ]
+                
+            
+            for h in hashers:
+                
+                h.update( block )
+                
+            
+            if f_dest is not None:
+                
+                f_dest.write( block )
+                
+            
+        
+    finally:
+        
+        if f_dest is not None:
+            
+            f_dest.close()
+            
+        
+    
+    ( sha256, md5, sha1, sha512 ) = [ h.digest() for h in hashers ]
+    
+    return ( sha256, ( md5, sha1, sha512 ), file_header )
+    
+def GetMime( path, file_header = None ):
+    
+    if file_header is None:
+        
+        with open( path, 'rb' ) as f:
+            
+            file_header = f.read( MIME_HEADER_SIZE )
+            
         
     
     for ( offset, header, mime ) in header_and_mime:
         
-        offset_bit_to_check = bit_to_check[ offset: ]
+        offset_bit_to_check = file_header[ offset: ]
         
         if offset_bit_to_check.startswith( header ):
             
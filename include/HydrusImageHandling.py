@@ -110,6 +110,17 @@ def GeneratePILImage( path ):
     
     return pil_image
     
+def GeneratePILImageFromBytes( data ):
+    
+    pil_image = PILImage.open( cStringIO.StringIO( data ) )
+    
+    if pil_image is None:
+        
+        raise Exception( 'The image data could not be rendered!' )
+        
+    
+    return pil_image
+    
 def GeneratePILImageFromNumpyImage( numpy_image ):
     
     ( h, w, depth ) = numpy_image.shape
@@ -1,6 +1,7 @@
 import gc
 import HydrusConstants as HC
 import HydrusData
+import mmap
 import os
 import psutil
 import send2trash
@@ -489,6 +490,41 @@ def ReadFileLikeAsBlocks( f ):
         next_block = f.read( HC.READ_BLOCK_SIZE )
         
     
+def ReadPathAsBlocks( path ):
+    
+    with open( path, 'rb' ) as f:
+        
+        try:
+            
+            # mapping the file lets the os read it in big sequential runs, and we never hold more than a block of it
+            
+            m = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ )
+            
+        except ( ValueError, EnvironmentError ):
+            
+            # empty files and some network filesystems cannot be mapped
+            
+            for block in ReadFileLikeAsBlocks( f ):
+                
+                yield block
+                
+            
+            return
+            
+        
+        try:
+            
+            for offset in xrange( 0, len( m ), HC.READ_BLOCK_SIZE ):
+                
+                yield m[ offset : offset + HC.READ_BLOCK_SIZE ]
+                
+            
+        finally:
+            
+            m.close()
+            
+        
+    
 def RecyclePath( path ):
     
     original_path = path
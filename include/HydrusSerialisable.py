@@ -1,5 +1,6 @@
 import json
 import lz4
+import numpy
 
 SERIALISABLE_TYPE_BASE = 0
 SERIALISABLE_TYPE_BASE_NAMED = 1
@@ -33,8 +34,34 @@ SERIALISABLE_TYPE_URLS_IMPORT = 28
 
 SERIALISABLE_TYPES_TO_OBJECT_TYPES = {}
 
+# a json network string starts with lz4's four byte length header. this prefix would be a length of over a gigabyte, so the two can never be confused
+
+BINARY_NETWORK_STRING_PREFIX = 'HYDRUSBIN'
+
+INT_LIST_DTYPES = { 1 : numpy.dtype( '<i1' ), 2 : numpy.dtype( '<i2' ), 4 : numpy.dtype( '<i4' ), 8 : numpy.dtype( '<i8' ) }
+
+def CreateFromBinaryNetworkString( network_string ):
+    
+    obj_binary = lz4.loads( network_string[ len( BINARY_NETWORK_STRING_PREFIX ) : ] )
+    
+    reader = BinaryReader( obj_binary )
+    
+    serialisable_type = reader.ReadVarInt()
+    version = reader.ReadVarInt()
+    
+    obj = SERIALISABLE_TYPES_TO_OBJECT_TYPES[ serialisable_type ]()
+    
+    obj.InitialiseFromSerialisableBinary( version, reader )
+    
+    return obj
+    
 def CreateFromNetworkString( network_string ):
     
+    if NetworkStringIsBinary( network_string ):
+        
+        return CreateFromBinaryNetworkString( network_string )
+        
+    
     obj_string = lz4.loads( network_string )
     
     return CreateFromString( obj_string )
@@ -64,16 +91,282 @@ def CreateFromSerialisableTuple( obj_tuple ):
     
     return obj
     
+def NetworkStringIsBinary( network_string ):
+    
+    return network_string.startswith( BINARY_NETWORK_STRING_PREFIX )
+    
+class BinaryReader( object ):
+    
+    def __init__( self, data, position = 0 ):
+        
+        self._data = data
+        self._position = position
+        
+    
+    def GetData( self ):
+        
+        return self._data
+        
+    
+    def GetPosition( self ):
+        
+        return self._position
+        
+    
+    def ReadBytes( self ):
+        
+        num_bytes = self.ReadVarInt()
+        
+        return self.ReadRaw( num_bytes )
+        
+    
+    def _ReadFixedWidthInts( self ):
+        
+        num_ints = self.ReadVarInt()
+        
+        if num_ints == 0:
+            
+            return numpy.zeros( 0, dtype = numpy.int64 )
+            
+        
+        width = ord( self.ReadRaw( 1 ) )
+        
+        return numpy.frombuffer( self.ReadRaw( num_ints * width ), dtype = INT_LIST_DTYPES[ width ] ).astype( numpy.int64 )
+        
+    
+    def ReadIntArray( self ):
+        
+        return self._ReadFixedWidthInts().cumsum()
+        
+    
+    def ReadIntList( self ):
+        
+        return self.ReadIntArray().tolist()
+        
+    
+    def ReadIntListSegments( self, lengths ):
+        
+        firsts = self.ReadIntList()
+        inner_deltas = self._ReadFixedWidthInts()
+        
+        int_lists = []
+        
+        i = 0
+        position = 0
+        
+        for length in lengths:
+            
+            if length == 0:
+                
+                int_lists.append( [] )
+                
+                continue
+                
+            
+            segment = numpy.empty( length, dtype = numpy.int64 )
+            
+            segment[0] = firsts[ i ]
+            segment[1:] = inner_deltas[ position : position + length - 1 ]
+            
+            int_lists.append( segment.cumsum().tolist() )
+            
+            i += 1
+            position += length - 1
+            
+        
+        return int_lists
+        
+    
+    def ReadNoneableIntList( self ):
+        
+        return [ None if value == 0 else value - 1 for value in self.ReadIntList() ]
+        
+    
+    def ReadRaw( self, num_bytes ):
+        
+        end = self._position + num_bytes
+        
+        if end > len( self._data ):
+            
+            raise Exception( 'Binary data ended unexpectedly!' )
+            
+        
+        raw = self._data[ self._position : end ]
+        
+        self._position = end
+        
+        return raw
+        
+    
+    def ReadVarInt( self ):
+        
+        value = 0
+        shift = 0
+        
+        while True:
+            
+            byte = ord( self.ReadRaw( 1 ) )
+            
+            value |= ( byte & 0x7f ) << shift
+            
+            if byte < 0x80:
+                
+                return value
+                
+            
+            shift += 7
+            
+        
+    
+    def SkipBytes( self ):
+        
+        num_bytes = self.ReadVarInt()
+        
+        self.ReadRaw( num_bytes )
+        
+    
+    def SkipIntList( self ):
+        
+        num_ints = self.ReadVarInt()
+        
+        if num_ints > 0:
+            
+            width = ord( self.ReadRaw( 1 ) )
+            
+            self.ReadRaw( num_ints * width )
+            
+        
+    
+    def SkipIntListSegments( self ):
+        
+        self.SkipIntList()
+        self.SkipIntList()
+        
+    
+class BinaryWriter( object ):
+    
+    def __init__( self ):
+        
+        self._chunks = []
+        
+    
+    def _WriteFixedWidthInts( self, values ):
+        
+        self.WriteVarInt( len( values ) )
+        
+        if len( values ) == 0:
+            
+            return
+            
+        
+        largest = max( abs( int( values.min() ) ), abs( int( values.max() ) ) )
+        
+        if largest < 2 ** 7: width = 1
+        elif largest < 2 ** 15: width = 2
+        elif largest < 2 ** 31: width = 4
+        else: width = 8
+        
+        self.WriteRaw( chr( width ) )
+        self.WriteRaw( values.astype( INT_LIST_DTYPES[ width ] ).tostring() )
+        
+    
+    def GetData( self ):
+        
+        return ''.join( self._chunks )
+        
+    
+    def WriteBytes( self, data ):
+        
+        self.WriteVarInt( len( data ) )
+        self.WriteRaw( data )
+        
+    
+    def WriteIntList( self, ints ):
+        
+        # ids are mostly written in sorted runs, so the deltas between them pack into a byte or two each
+        
+        values = numpy.array( ints, dtype = numpy.int64 )
+        
+        deltas = numpy.empty_like( values )
+        
+        if len( values ) > 0:
+            
+            deltas[0] = values[0]
+            deltas[1:] = numpy.diff( values )
+            
+        
+        self._WriteFixedWidthInts( deltas )
+        
+    
+    def WriteIntListSegments( self, int_lists ):
+        
+        # each list is delta encoded on its own, its first value going in a separate list
+        # otherwise the jump from the end of one sorted list to the start of the next would set the width for all of them
+        # the caller records the lengths
+        
+        self.WriteIntList( [ ints[0] for ints in int_lists if len( ints ) > 0 ] )
+        
+        inner_deltas = [ numpy.diff( numpy.array( ints, dtype = numpy.int64 ) ) for ints in int_lists if len( ints ) > 1 ]
+        
+        if len( inner_deltas ) == 0:
+            
+            self._WriteFixedWidthInts( numpy.zeros( 0, dtype = numpy.int64 ) )
+            
+        else:
+            
+            self._WriteFixedWidthInts( numpy.concatenate( inner_deltas ) )
+            
+        
+    
+    def WriteNoneableIntList( self, ints ):
+        
+        self.WriteIntList( [ 0 if value is None else value + 1 for value in ints ] )
+        
+    
+    def WriteRaw( self, data ):
+        
+        self._chunks.append( data )
+        
+    
+    def WriteVarInt( self, value ):
+        
+        byte_chars = []
+        
+        while value >= 0x80:
+            
+            byte_chars.append( chr( ( value & 0x7f ) | 0x80 ) )
+            
+            value >>= 7
+            
+        
+        byte_chars.append( chr( value ) )
+        
+        self._chunks.append( ''.join( byte_chars ) )
+        
+    
 class SerialisableBase( object ):
     
     SERIALISABLE_TYPE = SERIALISABLE_TYPE_BASE
     SERIALISABLE_VERSION = 1
     
+    # objects that support the compact binary network format override this and the binary methods
+    SERIALISABLE_BINARY_VERSION = None
+    
+    def _GetSerialisableBinary( self, writer ):
+        
+        raise NotImplementedError()
+        
+    
     def _GetSerialisableInfo( self ):
         
         raise NotImplementedError()
         
     
+    def _InitialiseFromSerialisableBinary( self, version, reader ):
+        
+        raise NotImplementedError()
+        
+    
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
         
         raise NotImplementedError()
@@ -84,6 +377,23 @@ class SerialisableBase( object ):
         return old_serialisable_info
         
     
+    def DumpToBinaryNetworkString( self ):
+        
+        if self.SERIALISABLE_BINARY_VERSION is None:
+            
+            return self.DumpToNetworkString()
+            
+        
+        writer = BinaryWriter()
+        
+        writer.WriteVarInt( self.SERIALISABLE_TYPE )
+        writer.WriteVarInt( self.SERIALISABLE_BINARY_VERSION )
+        
+        self._GetSerialisableBinary( writer )
+        
+        return BINARY_NETWORK_STRING_PREFIX + lz4.dumps( writer.GetData() )
+        
+    
     def DumpToNetworkString( self ):
         
         obj_string = self.DumpToString()
@@ -103,6 +413,16 @@ class SerialisableBase( object ):
         return ( self.SERIALISABLE_TYPE, self.SERIALISABLE_VERSION, self._GetSerialisableInfo() )
         
     
+    def InitialiseFromSerialisableBinary( self, version, reader ):
+        
+        if self.SERIALISABLE_BINARY_VERSION is None or version > self.SERIALISABLE_BINARY_VERSION:
+            
+            raise Exception( 'Could not parse binary version ' + str( version ) + ' of serialisable type ' + str( self.SERIALISABLE_TYPE ) + '!' )
+            
+        
+        self._InitialiseFromSerialisableBinary( version, reader )
+        
+    
     def InitialiseFromSerialisableInfo( self, version, serialisable_info ):
         
         while version < self.SERIALISABLE_VERSION:
@@ -12,7 +12,8 @@ from twisted.internet import reactor, defer
 from twisted.internet.threads import deferToThread
 from twisted.web.server import NOT_DONE_YET
 from twisted.web.resource import Resource
-from twisted.web.static import File as FileResource, NoRangeStaticProducer
+from twisted.web.static import File as FileResource
+from twisted.web import http
 import HydrusData
 import HydrusGlobals
 
@@ -38,6 +39,24 @@ ROOT_MESSAGE_END = '''</p>
     </body>
 </html>'''
 
+# served files are named by their content hash, so a path's mime never changes and does not need to be sniffed every request
+
+paths_to_mimes_cache = {}
+
+def GetMimeForServing( path ):
+    
+    if path not in paths_to_mimes_cache:
+        
+        if len( paths_to_mimes_cache ) > 10000:
+            
+            paths_to_mimes_cache.clear()
+            
+        
+        paths_to_mimes_cache[ path ] = HydrusFileHandling.GetMime( path )
+        
+    
+    return paths_to_mimes_cache[ path ]
+    
 def ParseFileArguments( path ):
     
     HydrusImageHandling.ConvertToPngIfBmp( path )
@@ -171,7 +190,7 @@ class HydrusResourceCommand( Resource ):
             
             value = values[0]
             
-            if name in ( 'begin', 'expires', 'lifetime', 'num', 'service_type', 'service_port', 'since', 'subindex', 'timespan' ):
+            if name in ( 'begin', 'binary', 'expires', 'lifetime', 'num', 'service_type', 'service_port', 'since', 'subindex', 'timespan' ):
                 
                 try: hydrus_args[ name ] = int( value )
                 except: raise HydrusExceptions.ForbiddenException( 'I was expecting to parse \'' + name + '\' as an integer, but it failed.' )
@@ -300,8 +319,6 @@ class HydrusResourceCommand( Resource ):
             
             path = response_context.GetPath()
             
-            size = os.path.getsize( path )
-            
             if response_context.IsJSON():
                 
                 mime = HC.APPLICATION_JSON
@@ -312,7 +329,14 @@ class HydrusResourceCommand( Resource ):
                 
             else:
                 
-                mime = HydrusFileHandling.GetMime( path )
+                # a path response only needs a mime if the file's own header cannot tell us
+                
+                mime = response_context.GetMime()
+                
+                if mime is None:
+                    
+                    mime = GetMimeForServing( path )
+                    
                 
                 ( base, filename ) = os.path.split( path )
                 
@@ -321,23 +345,55 @@ class HydrusResourceCommand( Resource ):
                 content_disposition = 'inline; filename="' + filename + '"'
                 
             
-            content_length = size
-            
             # can't be unicode!
-            request.setHeader( 'Content-Type', str( content_type ) )
-            request.setHeader( 'Content-Length', str( content_length ) )
             request.setHeader( 'Content-Disposition', str( content_disposition ) )
+            request.setHeader( 'Accept-Ranges', 'bytes' )
             
             request.setHeader( 'Expires', time.strftime( '%a, %d %b %Y %H:%M:%S GMT', time.gmtime( time.time() + 86400 * 365 ) ) )
             request.setHeader( 'Cache-Control', str( 86400 * 365  ) )
             
-            fileObject = open( path, 'rb' )
+            # if the client has it already, we can send a 304 and skip the body
+            # an etag match takes precedence over a date, as http says it should
             
-            producer = NoRangeStaticProducer( request, fileObject )
+            etag = response_context.GetETag()
             
-            producer.start()
+            if etag is not None:
+                
+                cached = request.setETag( '"' + etag + '"' )
+                
+            else:
+                
+                cached = None
+                
             
-            do_finish = False
+            if request.getHeader( 'if-none-match' ) is None:
+                
+                cached = request.setLastModified( os.path.getmtime( path ) )
+                
+            
+            if cached == http.CACHED:
+                
+                content_length = 0
+                
+            else:
+                
+                # twisted's static file resource does the range parsing, and sets the 200, 206 or 416 and the content headers to match
+                
+                file_resource = FileResource( path )
+                
+                file_resource.type = str( content_type )
+                file_resource.encoding = None
+                
+                fileObject = open( path, 'rb' )
+                
+                producer = file_resource.makeProducer( request, fileObject )
+                
+                content_length = int( request.responseHeaders.getRawHeaders( 'content-length', [ '0' ] )[ 0 ] )
+                
+                producer.start()
+                
+                do_finish = False
+                
             
         else:
             
@@ -577,8 +633,9 @@ class HydrusResourceCommand( Resource ):
     
 class ResponseContext( object ):
     
-    def __init__( self, status_code, mime = HC.APPLICATION_YAML, body = None, path = None, is_json = False, cookies = None ):
+    def __init__( self, status_code, mime = None, body = None, path = None, is_json = False, cookies = None, etag = None ):
         
+        if mime is None and path is None: mime = HC.APPLICATION_YAML
         if cookies is None: cookies = []
         
         self._status_code = status_code
@@ -587,12 +644,17 @@ class ResponseContext( object ):
         self._path = path
         self._is_json = is_json
         self._cookies = cookies
+        self._etag = etag
         
     
     def GetCookies( self ): return self._cookies
     
+    def GetETag( self ): return self._etag
+    
     def GetLength( self ): return len( self._body )
     
+    def GetMime( self ): return self._mime
+    
     def GetMimeBody( self ): return ( self._mime, self._body )
     
     def GetPath( self ): return self._path
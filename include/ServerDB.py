@@ -12,6 +12,7 @@ import itertools
 import json
 import lz4
 import os
+import psutil
 import Queue
 import random
 import ServerFiles
@@ -98,6 +99,41 @@ class MessageDB( object ):
         return public_key
         
     '''
+def THREADWriteUpdatePackages( packages_to_write, errors ):
+    
+    # the lz4 compression and the disk write release the GIL, so they overlap with the db thread reading the next rows
+    
+    while True:
+        
+        item = packages_to_write.get()
+        
+        if item is None:
+            
+            return
+            
+        
+        if len( errors ) > 0:
+            
+            continue
+            
+        
+        ( path, update_package ) = item
+        
+        try:
+            
+            network_string = update_package.DumpToBinaryNetworkString()
+            
+            with open( path, 'wb' ) as f:
+                
+                f.write( network_string )
+                
+            
+        except Exception as e:
+            
+            errors.append( e )
+            
+        
+    
 class DB( HydrusDB.HydrusDB ):
     
     READ_WRITE_ACTIONS = [ 'access_key', 'immediate_content_update', 'init', 'registration_keys' ]
@@ -938,20 +974,31 @@ class DB( HydrusDB.HydrusDB ):
             iterator = self._IterateTagUpdateContentData
             
         
-        subindex = 0
-        weight = 0
+        # the db thread gathers rows while the writers save the packages it has finished. the queue is bounded so we never hold too many in memory
+        # we wait for the writers before the service update package goes out, so a client never sees a subindex that is not on disk yet
         
-        content_update_package = HydrusData.ServerToClientContentUpdatePackage()
+        num_writers = max( 1, min( psutil.cpu_count() - 1, 4 ) )
         
-        smaller_time_step = ( end - begin ) / 100
+        packages_to_write = Queue.Queue( num_writers * 2 )
+        errors = []
         
-        sub_begin = begin
+        writers = [ threading.Thread( target = THREADWriteUpdatePackages, args = ( packages_to_write, errors ), name = 'Update Package Writer' ) for i in range( num_writers ) ]
         
-        while sub_begin <= end:
+        for writer in writers:
             
-            sub_end = min( ( sub_begin + smaller_time_step ) - 1, end )
+            writer.daemon = True
             
-            for ( data_type, action, rows, hash_ids_to_hashes, rows_weight ) in iterator( service_id, sub_begin, sub_end ):
+            writer.start()
+            
+        
+        try:
+            
+            subindex = 0
+            weight = 0
+            
+            content_update_package = HydrusData.ServerToClientContentUpdatePackage()
+            
+            for ( data_type, action, rows, hash_ids_to_hashes, rows_weight ) in iterator( service_id, begin, end ):
                 
                 content_update_package.AddContentData( data_type, action, rows, hash_ids_to_hashes )
                 
@@ -961,12 +1008,7 @@ class DB( HydrusDB.HydrusDB ):
                     
                     path = ServerFiles.GetExpectedContentUpdatePackagePath( service_key, begin, subindex )
                     
-                    network_string = content_update_package.DumpToNetworkString()
-                    
-                    with open( path, 'wb' ) as f:
-                        
-                        f.write( network_string )
-                        
+                    packages_to_write.put( ( path, content_update_package ) )
                     
                     subindex += 1
                     weight = 0
@@ -974,22 +1016,37 @@ class DB( HydrusDB.HydrusDB ):
                     content_update_package = HydrusData.ServerToClientContentUpdatePackage()
                     
                 
+                if len( errors ) > 0:
+                    
+                    break
+                    
+                
             
-            sub_begin += smaller_time_step
-            
-        
-        if weight > 0:
+            if weight > 0:
+                
+                path = ServerFiles.GetExpectedContentUpdatePackagePath( service_key, begin, subindex )
+                
+                packages_to_write.put( ( path, content_update_package ) )
+                
+                subindex += 1
+                
             
-            path = ServerFiles.GetExpectedContentUpdatePackagePath( service_key, begin, subindex )
+        finally:
             
-            network_string = content_update_package.DumpToNetworkString()
+            for writer in writers:
+                
+                packages_to_write.put( None )
+                
             
-            with open( path, 'wb' ) as f:
+            for writer in writers:
                 
-                f.write( network_string )
+                writer.join()
                 
             
-            subindex += 1
+        
+        if len( errors ) > 0:
+            
+            raise errors[0]
             
         
         subindex_count = subindex
@@ -1719,9 +1776,13 @@ class DB( HydrusDB.HydrusDB ):
         
         #
         
-        files_info = [ ( hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words ) for ( hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words ) in self._c.execute( 'SELECT hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words FROM file_map, files_info USING ( hash_id ) WHERE service_id = ? AND timestamp BETWEEN ? AND ?;', ( service_id, begin, end ) ) ]
+        # we look up hashes on self._c as we go, so the rows stream from a cursor of their own
         
-        for block_of_files_info in HydrusData.SplitListIntoChunks( files_info, 10000 ):
+        files_info_cursor = self._db.cursor()
+        
+        files_info = files_info_cursor.execute( 'SELECT hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words FROM file_map, files_info USING ( hash_id ) WHERE service_id = ? AND timestamp BETWEEN ? AND ?;', ( service_id, begin, end ) )
+        
+        for block_of_files_info in HydrusData.SplitIteratorIntoChunks( files_info, 10000 ):
             
             hash_ids = { file_info[0] for file_info in block_of_files_info }
             
@@ -1744,34 +1805,54 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
-    def _IterateTagUpdateContentData( self, service_id, begin, end ):
+    def _IterateMappingsBlocks( self, table_name, service_id, begin, end ):
         
-        # mappings
+        # the rows come in ( tag_id, hash_id ) order, so we only ever hold one block of them
+        # several small tags can share a block, and a big tag is split over several
+        
+        mappings_cursor = self._db.cursor()
         
-        mappings_dict = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT tag, hash_id FROM tags, mappings USING ( tag_id ) WHERE service_id = ? AND timestamp BETWEEN ? AND ?;', ( service_id, begin, end ) ) )
+        mappings = mappings_cursor.execute( 'SELECT tag_id, tag, hash_id FROM tags, ' + table_name + ' USING ( tag_id ) WHERE service_id = ? AND timestamp BETWEEN ? AND ? ORDER BY tag_id, hash_id;', ( service_id, begin, end ) )
         
-        for ( tag, hash_ids ) in mappings_dict.items():
+        for block_of_mappings in HydrusData.SplitIteratorIntoChunks( mappings, 10000 ):
             
-            for block_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, 10000 ):
+            rows = []
+            
+            for ( tag_id, group ) in itertools.groupby( block_of_mappings, lambda ( tag_id, tag, hash_id ): tag_id ):
+                
+                group = list( group )
                 
-                hash_ids_to_hashes = self._GetHashIdsToHashes( block_of_hash_ids )
+                ( tag_id, tag, hash_id ) = group[0]
                 
-                yield ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, [ ( tag, block_of_hash_ids ) ], hash_ids_to_hashes, len( block_of_hash_ids ) )
+                rows.append( ( tag, [ hash_id for ( tag_id, tag, hash_id ) in group ] ) )
                 
             
+            hash_ids = { hash_id for ( tag_id, tag, hash_id ) in block_of_mappings }
+            
+            hash_ids_to_hashes = self._GetHashIdsToHashes( hash_ids )
+            
+            yield ( rows, hash_ids_to_hashes, len( block_of_mappings ) )
+            
         
-        #
+    
+    def _IterateTagUpdateContentData( self, service_id, begin, end ):
+        
+        # mappings
+        
+        for block_of_mappings in self._IterateMappingsBlocks( 'mappings', service_id, begin, end ):
+            
+            ( rows, hash_ids_to_hashes, weight ) = block_of_mappings
+            
+            yield ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, rows, hash_ids_to_hashes, weight )
+            
         
-        deleted_mappings_dict = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT tag, hash_id FROM tags, deleted_mappings USING ( tag_id ) WHERE service_id = ? AND timestamp BETWEEN ? AND ?;', ( service_id, begin, end ) ) )
+        #
         
-        for ( tag, hash_ids ) in deleted_mappings_dict.items():
+        for block_of_mappings in self._IterateMappingsBlocks( 'deleted_mappings', service_id, begin, end ):
             
-            for block_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, 10000 ):
-                
-                hash_ids_to_hashes = self._GetHashIdsToHashes( block_of_hash_ids )
-                
-                yield ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, [ ( tag, block_of_hash_ids ) ], hash_ids_to_hashes, len( block_of_hash_ids ) )
-                
+            ( rows, hash_ids_to_hashes, weight ) = block_of_mappings
+            
+            yield ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, rows, hash_ids_to_hashes, weight )
             
         
         # tag siblings
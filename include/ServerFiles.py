@@ -34,6 +34,10 @@ def GetExpectedContentUpdatePackagePath( service_key, begin, subindex ):
     
     return path
     
+def GetExpectedContentUpdatePackageJSONPath( service_key, begin, subindex ):
+    
+    return GetExpectedContentUpdatePackagePath( service_key, begin, subindex ) + '.json'
+    
 def GetExpectedServiceUpdatePackagePath( service_key, begin ):
     
     path = os.path.join( GetExpectedUpdateDir( service_key ), str( int( begin ) ) + '_metadata' )
@@ -3,7 +3,10 @@ import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
 import HydrusGlobals
+import HydrusPaths
+import HydrusSerialisable
 import HydrusServerResources
+import os
 import ServerFiles
 import yaml
 
@@ -394,7 +397,7 @@ class HydrusResourceCommandRestrictedRepositoryFile( HydrusResourceCommandRestri
         
         path = ServerFiles.GetFilePath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -428,7 +431,7 @@ class HydrusResourceCommandRestrictedRepositoryThumbnail( HydrusResourceCommandR
         
         path = ServerFiles.GetThumbnailPath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -498,7 +501,76 @@ class HydrusResourceCommandRestrictedContentUpdate( HydrusResourceCommandRestric
         
         path = ServerFiles.GetContentUpdatePackagePath( self._service_key, begin, subindex )
         
-        response_context = HydrusServerResources.ResponseContext( 200, path = path, is_json = True )
+        # newer clients ask for the compact binary format. older ones do not know it, so they always get json
+        
+        wants_binary = 'binary' in request.hydrus_args and request.hydrus_args[ 'binary' ] == 1
+        
+        with open( path, 'rb' ) as f:
+            
+            prefix = f.read( len( HydrusSerialisable.BINARY_NETWORK_STRING_PREFIX ) )
+            
+        
+        is_binary = HydrusSerialisable.NetworkStringIsBinary( prefix )
+        
+        if is_binary and wants_binary:
+            
+            response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = path )
+            
+        elif is_binary:
+            
+            # packages never change once written, so the json for older clients only has to be made once
+            
+            json_path = ServerFiles.GetExpectedContentUpdatePackageJSONPath( self._service_key, begin, subindex )
+            
+            if not os.path.exists( json_path ):
+                
+                with open( path, 'rb' ) as f:
+                    
+                    network_string = f.read()
+                    
+                
+                content_update_package = HydrusSerialisable.CreateFromNetworkString( network_string )
+                
+                # written under a temp name first, so another request never serves it half done
+                
+                temp_path = json_path + '.' + HydrusData.GenerateKey().encode( 'hex' )
+                
+                with open( temp_path, 'wb' ) as f:
+                    
+                    f.write( content_update_package.DumpToNetworkString() )
+                    
+                
+                try:
+                    
+                    os.rename( temp_path, json_path )
+                    
+                except OSError:
+                    
+                    # another request got there first
+                    
+                    HydrusPaths.DeletePath( temp_path )
+                    
+                
+            
+            response_context = HydrusServerResources.ResponseContext( 200, path = json_path, is_json = True )
+            
+        elif wants_binary:
+            
+            with open( path, 'rb' ) as f:
+                
+                network_string = f.read()
+                
+            
+            content_update_package = HydrusSerialisable.CreateFromNetworkString( network_string )
+            
+            network_string = content_update_package.DumpToBinaryNetworkString()
+            
+            response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, body = network_string )
+            
+        else:
+            
+            response_context = HydrusServerResources.ResponseContext( 200, path = path, is_json = True )
+            
         
         return response_context
         
@@ -1,11 +1,14 @@
 import ClientConstants as CC
 import ClientData
+import ClientFiles
 import ClientGUIManagement
 import ClientGUIDialogsManage
 import ClientCaches
 import collections
 import HydrusConstants as HC
 import os
+import shutil
+import tempfile
 import TestConstants
 import unittest
 import HydrusData
@@ -52,6 +55,91 @@ class TestFunctions( unittest.TestCase ):
     
 class TestManagers( unittest.TestCase ):
     
+    def test_data_cache( self ):
+        
+        class FakeData( object ):
+            
+            def GetEstimatedMemoryFootprint( self ): return 10
+            
+        
+        data_cache = ClientCaches.DataCache( HydrusGlobals.test_controller, 30 )
+        
+        for key in ( 'a', 'b', 'c' ): data_cache.AddData( key, FakeData() )
+        
+        data_cache.GetData( 'a' )
+        
+        data_cache.AddData( 'd', FakeData() )
+        
+        self.assertTrue( data_cache.HasData( 'a' ) )
+        self.assertFalse( data_cache.HasData( 'b' ) )
+        self.assertEqual( data_cache.GetIfHasData( 'b' ), None )
+        
+        self.assertEqual( data_cache.GetStats(), ( 3, 30, 1, 1, 1 ) )
+        
+        # a file seen twice survives a scroll through new ones
+        
+        data_cache = ClientCaches.DataCache( HydrusGlobals.test_controller, 30, segmented = True )
+        
+        data_cache.AddData( 'a', FakeData() )
+        
+        data_cache.GetData( 'a' )
+        
+        for key in ( 'b', 'c', 'd', 'e' ): data_cache.AddData( key, FakeData() )
+        
+        self.assertTrue( data_cache.HasData( 'a' ) )
+        self.assertFalse( data_cache.HasData( 'b' ) )
+        self.assertFalse( data_cache.HasData( 'c' ) )
+        
+        self.assertEqual( data_cache.GetStats(), ( 3, 30, 1, 0, 2 ) )
+        
+    
+    def test_packed_thumbnail_store( self ):
+        
+        test_dir = tempfile.mkdtemp()
+        
+        try:
+            
+            hashes = [ os.urandom( 32 ) for i in range( 10 ) ]
+            
+            store = ClientFiles.PackedThumbnailStore( test_dir )
+            
+            store.AddThumbnails( [ ( hash, 'thumb' + hash ) for hash in hashes ] )
+            
+            self.assertEqual( store.GetThumbnail( hashes[ 0 ] ), 'thumb' + hashes[ 0 ] )
+            
+            store.AddThumbnails( [ ( hashes[ 0 ], 'new thumb' ) ] )
+            
+            store.DeleteThumbnails( hashes[ 1 : 8 ] )
+            
+            store.Close()
+            
+            # reload from the index
+            
+            store = ClientFiles.PackedThumbnailStore( test_dir )
+            
+            self.assertEqual( set( store.GetHashes() ), { hashes[ 0 ], hashes[ 8 ], hashes[ 9 ] } )
+            
+            self.assertEqual( store.GetThumbnail( hashes[ 0 ] ), 'new thumb' )
+            self.assertEqual( store.GetThumbnail( hashes[ 1 ] ), None )
+            
+            self.assertTrue( store.NeedsCompaction() )
+            
+            store.Compact()
+            
+            self.assertFalse( store.NeedsCompaction() )
+            
+            self.assertEqual( store.GetThumbnails( hashes ), { hashes[ 0 ] : 'new thumb', hashes[ 8 ] : 'thumb' + hashes[ 8 ], hashes[ 9 ] : 'thumb' + hashes[ 9 ] } )
+            
+            store.DeleteStore()
+            
+            self.assertEqual( os.listdir( test_dir ), [] )
+            
+        finally:
+            
+            shutil.rmtree( test_dir )
+            
+        
+    
     def test_services( self ):
         
         def test_service( service, key, service_type, name, info ):
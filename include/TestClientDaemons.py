@@ -34,6 +34,7 @@ class TestDaemons( unittest.TestCase ):
             import_folder = ClientImporting.ImportFolder( 'imp', path = test_dir )
             
             HydrusGlobals.test_controller.SetRead( 'serialisable_named', [ import_folder ] )
+            HydrusGlobals.test_controller.SetRead( 'hash_status', ( CC.STATUS_NEW, None ) )
             
             ClientDaemons.DAEMONCheckImportFolders( HydrusGlobals.test_controller )
             
@@ -41,9 +42,9 @@ class TestDaemons( unittest.TestCase ):
             #(('C:\\code\\Hydrus\\temp\\e0dbdcb1a13c0565ffb73f2f497528adbe1703ca1dfc69680202487187b9fcfa',), {'service_keys_to_tags': {HC.LOCAL_TAG_SERVICE_KEY: set(['local tag'])}})
             #(('C:\\code\\Hydrus\\temp\\182c4eecf2a5b4dfc8b74813bcff5d967ed53d92a982d8ae18520e1504fa5902',), {'service_keys_to_tags': {HC.LOCAL_TAG_SERVICE_KEY: set(['local tag'])}})
             
-            import_file = HydrusGlobals.test_controller.GetWrite( 'import_file' )
+            [ ( ( file_import_jobs, ), empty_dict ) ] = HydrusGlobals.test_controller.GetWrite( 'import_files' )
             
-            self.assertEqual( len( import_file ), 3 )
+            self.assertEqual( len( file_import_jobs ), 3 )
             
             # I need to expand tests here with the new file system
             
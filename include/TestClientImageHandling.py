@@ -1,6 +1,8 @@
 import ClientImageHandling
+import ClientVPTree
 import collections
 import HydrusConstants as HC
+import HydrusData
 import os
 import TestConstants
 import unittest
@@ -13,3 +15,66 @@ class TestImageHandling( unittest.TestCase ):
         
         self.assertEqual( phash, '\xb0\x08\x83\xb2\x08\x0b8\x08' )
         
+    
+    def test_hamming_distances( self ):
+        
+        phashes = [ os.urandom( 8 ) for i in range( 20 ) ]
+        
+        packed_phashes = HydrusData.ConvertPHashesToUInt64Array( phashes )
+        
+        distances = HydrusData.GetHammingDistances( phashes[ 0 ], packed_phashes )
+        
+        self.assertEqual( distances.tolist(), [ HydrusData.GetHammingDistance( phashes[ 0 ], phash ) for phash in phashes ] )
+        
+        distances = HydrusData.GetHammingDistancesBlock( packed_phashes[ : 5 ], packed_phashes )
+        
+        self.assertEqual( distances.shape, ( 5, 20 ) )
+        
+        for i in range( 5 ):
+            
+            for j in range( 20 ):
+                
+                self.assertEqual( distances[ i, j ], HydrusData.GetHammingDistance( phashes[ i ], phashes[ j ] ) )
+                
+            
+        
+    
+    def test_vptree( self ):
+        
+        phashes = [ os.urandom( 8 ) for i in range( 200 ) ]
+        
+        population = list( enumerate( phashes ) )
+        
+        ( ( vp_id, vp_phash ), radius, inner_population, outer_population ) = ClientVPTree.SplitPopulation( population )
+        
+        self.assertEqual( sorted( [ id for ( id, phash ) in inner_population + outer_population ] + [ vp_id ] ), range( 200 ) )
+        
+        for ( id, phash ) in inner_population:
+            
+            self.assertTrue( HydrusData.GetHammingDistance( vp_phash, phash ) <= radius )
+            
+        
+        for ( id, phash ) in outer_population:
+            
+            self.assertTrue( HydrusData.GetHammingDistance( vp_phash, phash ) > radius )
+            
+        
+        tree = ClientVPTree.VPTreeNode( phashes )
+        
+        self.assertEqual( len( tree ), 200 )
+        
+        for search_phash in phashes[ : 20 ]:
+            
+            for max_hamming in ( 0, 16, 28 ):
+                
+                expected = [ phash for phash in phashes if HydrusData.GetHammingDistance( search_phash, phash ) <= max_hamming ]
+                
+                self.assertItemsEqual( tree.GetMatches( search_phash, max_hamming ), expected )
+                
+            
+        
+        self.assertFalse( ClientVPTree.BranchIsUnbalanced( 1, 10 ) )
+        self.assertFalse( ClientVPTree.BranchIsUnbalanced( 50, 60 ) )
+        self.assertTrue( ClientVPTree.BranchIsUnbalanced( 5, 100 ) )
+        
+    
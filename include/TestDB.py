@@ -6,18 +6,24 @@ import ClientDownloading
 import ClientFiles
 import ClientGUIManagement
 import ClientGUIPages
+import ClientImageHandling
 import ClientImporting
+import ClientMedia
 import ClientRatings
 import ClientSearch
+import ClientThreading
 import collections
 import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
 import HydrusGlobals
+import HydrusPaths
 import HydrusSerialisable
 import itertools
 import os
+from PIL import Image as PILImage
 import ServerDB
+import ServerFiles
 import shutil
 import sqlite3
 import stat
@@ -59,6 +65,26 @@ class TestClientDB( unittest.TestCase ):
             
         
     
+    def _get_hash_ids_to_hashes( self, hashes ):
+        
+        master_db_path = os.path.join( self._db._db_dir, self._db._db_filenames[ 'external_master' ] )
+        
+        db = sqlite3.connect( master_db_path, isolation_level = None, detect_types = sqlite3.PARSE_DECLTYPES )
+        
+        c = db.cursor()
+        
+        hash_ids_to_hashes = {}
+        
+        for hash in hashes:
+            
+            ( hash_id, ) = c.execute( 'SELECT hash_id FROM hashes WHERE hash = ?;', ( sqlite3.Binary( hash ), ) ).fetchone()
+            
+            hash_ids_to_hashes[ hash_id ] = hash
+            
+        
+        return hash_ids_to_hashes
+        
+    
     def _read( self, action, *args, **kwargs ): return self._db.Read( action, HC.HIGH_PRIORITY, *args, **kwargs )
     def _write( self, action, *args, **kwargs ): return self._db.Write( action, HC.HIGH_PRIORITY, True, *args, **kwargs )
     
@@ -99,7 +125,7 @@ class TestClientDB( unittest.TestCase ):
         
         path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
         
-        self._write( 'import_file', path )
+        self._write( 'import_file', ClientFiles.FileImportJob( path ) )
         
         #
         
@@ -224,6 +250,105 @@ class TestClientDB( unittest.TestCase ):
             
         
     
+    def test_candidate_hash_ids( self ):
+        
+        self._clear_db()
+        
+        hashes = [ HydrusData.GenerateKey() for i in range( 40 ) ]
+        
+        tags_to_hashes = {}
+        
+        tags_to_hashes[ 'candidates rare' ] = hashes[ 0 : 40 : 8 ]
+        tags_to_hashes[ 'candidates common' ] = hashes[ : 32 ]
+        tags_to_hashes[ 'candidates excluded' ] = hashes[ 8 : 28 ]
+        tags_to_hashes[ 'candidates:namespaced' ] = hashes[ : 24 ]
+        
+        content_updates = [ HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( tag, tag_hashes ) ) for ( tag, tag_hashes ) in tags_to_hashes.items() ]
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+        
+        hash_ids_to_hashes = self._get_hash_ids_to_hashes( set( itertools.chain.from_iterable( tags_to_hashes.values() ) ) )
+        
+        # we note what the planner estimated and how many lookups went through the candidates
+        
+        estimated_counts = {}
+        candidate_selects = []
+        
+        GetEstimatedTagCount = self._db._GetEstimatedTagCount
+        SelectFromCandidateHashIds = self._db._SelectFromCandidateHashIds
+        
+        def get_estimated_tag_count( file_service_id, tag_service_id, tag, include_current_tags, include_pending_tags ):
+            
+            estimated_count = GetEstimatedTagCount( file_service_id, tag_service_id, tag, include_current_tags, include_pending_tags )
+            
+            estimated_counts[ tag ] = estimated_count
+            
+            return estimated_count
+            
+        
+        def select_from_candidate_hash_ids( candidate_hash_ids, selects ):
+            
+            candidate_selects.append( len( candidate_hash_ids ) )
+            
+            return SelectFromCandidateHashIds( candidate_hash_ids, selects )
+            
+        
+        self._db._GetEstimatedTagCount = get_estimated_tag_count
+        self._db._SelectFromCandidateHashIds = select_from_candidate_hash_ids
+        
+        try:
+            
+            tests = []
+            
+            tests.append( ( [ 'candidates common' ], [], [], 0 ) )
+            tests.append( ( [ 'candidates rare', 'candidates common' ], [], [], 1 ) )
+            tests.append( ( [ 'candidates rare', 'candidates common' ], [ 'candidates excluded' ], [], 2 ) )
+            tests.append( ( [ 'candidates rare', 'candidates common' ], [ 'candidates excluded' ], [ 'candidates' ], 3 ) )
+            tests.append( ( [ 'candidates rare', 'candidates:namespaced' ], [], [], 1 ) )
+            tests.append( ( [ 'candidates rare', 'candidates nonexistent' ], [], [], 1 ) )
+            
+            for ( tags_to_include, tags_to_exclude, namespaces_to_include, expected_num_candidate_selects ) in tests:
+                
+                expected_hashes = set( hashes )
+                
+                for tag in tags_to_include: expected_hashes.intersection_update( tags_to_hashes.get( tag, [] ) )
+                for tag in tags_to_exclude: expected_hashes.difference_update( tags_to_hashes[ tag ] )
+                for namespace in namespaces_to_include: expected_hashes.intersection_update( tags_to_hashes[ namespace + ':namespaced' ] )
+                
+                predicates = []
+                
+                predicates.extend( ( ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, tag ) for tag in tags_to_include ) )
+                predicates.extend( ( ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, tag, inclusive = False ) for tag in tags_to_exclude ) )
+                predicates.extend( ( ClientSearch.Predicate( HC.PREDICATE_TYPE_NAMESPACE, namespace ) for namespace in namespaces_to_include ) )
+                
+                search_context = ClientSearch.FileSearchContext( file_service_key = CC.COMBINED_FILE_SERVICE_KEY, tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, predicates = predicates )
+                
+                estimated_counts.clear()
+                del candidate_selects[:]
+                
+                file_query_ids = self._read( 'file_query_ids', search_context )
+                
+                self.assertEqual( { hash_ids_to_hashes[ hash_id ] for hash_id in file_query_ids }, expected_hashes )
+                
+                for tag in tags_to_include + tags_to_exclude:
+                    
+                    self.assertEqual( estimated_counts[ tag ], len( tags_to_hashes.get( tag, [] ) ) )
+                    
+                
+                self.assertEqual( len( candidate_selects ), expected_num_candidate_selects )
+                
+                # each lookup only sees what the lookups before it left
+                
+                self.assertEqual( candidate_selects, sorted( candidate_selects, reverse = True ) )
+                
+            
+        finally:
+            
+            self._db._GetEstimatedTagCount = GetEstimatedTagCount
+            self._db._SelectFromCandidateHashIds = SelectFromCandidateHashIds
+            
+        
+    
     def test_export_folders( self ):
         
         file_search_context = ClientSearch.FileSearchContext(file_service_key = HydrusData.GenerateKey(), tag_service_key = HydrusData.GenerateKey(), predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'test' ) ] )
@@ -303,7 +428,7 @@ class TestClientDB( unittest.TestCase ):
         
         path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
         
-        ( written_result, written_hash ) = self._write( 'import_file', path )
+        ( written_result, written_hash ) = self._write( 'import_file', ClientFiles.FileImportJob( path ) )
         
         self.assertEqual( written_result, CC.STATUS_SUCCESSFUL )
         self.assertEqual( written_hash, hash )
@@ -525,6 +650,172 @@ class TestClientDB( unittest.TestCase ):
         run_system_predicate_tests( tests )
         
     
+    def test_file_query_limit( self ):
+        
+        self._clear_db()
+        
+        # new files whose size order is not their import order, a second apart so their import times differ
+        
+        test_dir = tempfile.mkdtemp()
+        
+        try:
+            
+            hashes = []
+            
+            for ( i, side ) in enumerate( ( 48, 32, 64 ) ):
+                
+                if i > 0:
+                    
+                    time.sleep( 1 )
+                    
+                
+                path = os.path.join( test_dir, str( i ) + '.png' )
+                
+                PILImage.frombytes( 'L', ( side, side ), os.urandom( side * side ) ).save( path )
+                
+                ( result, hash ) = self._write( 'import_file', ClientFiles.FileImportJob( path ) )
+                
+                hashes.append( hash )
+                
+            
+        finally:
+            
+            shutil.rmtree( test_dir )
+            
+        
+        hashes_to_hash_ids = { hash : hash_id for ( hash_id, hash ) in self._get_hash_ids_to_hashes( hashes ).items() }
+        
+        ( medium_hash_id, small_hash_id, large_hash_id ) = [ hashes_to_hash_ids[ hash ] for hash in hashes ]
+        
+        tests = []
+        
+        tests.append( ( ( 'system', CC.SORT_BY_SMALLEST ), 2, [ small_hash_id, medium_hash_id ] ) )
+        tests.append( ( ( 'system', CC.SORT_BY_LARGEST ), 2, [ large_hash_id, medium_hash_id ] ) )
+        tests.append( ( ( 'system', CC.SORT_BY_NEWEST ), 2, [ large_hash_id, small_hash_id ] ) )
+        tests.append( ( ( 'system', CC.SORT_BY_OLDEST ), 2, [ medium_hash_id, small_hash_id ] ) )
+        tests.append( ( ( 'system', CC.SORT_BY_SMALLEST ), 100, [ small_hash_id, medium_hash_id, large_hash_id ] ) )
+        tests.append( ( ( 'system', CC.SORT_BY_NEWEST ), 1, [ large_hash_id ] ) )
+        tests.append( ( ( 'system', CC.SORT_BY_NEWEST ), 0, [] ) )
+        
+        for ( sort_by, limit, result ) in tests:
+            
+            predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_LIMIT, limit ) ]
+            
+            search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+            
+            file_query_ids = self._read( 'file_query_ids', search_context, sort_by = sort_by )
+            
+            self.assertEqual( file_query_ids, result )
+            
+        
+        # the db cannot do these sorts, so a limit takes a sample
+        
+        for sort_by in ( ( 'system', CC.SORT_BY_RANDOM ), ( 'namespaces', [ 'series' ] ) ):
+            
+            for ( limit, result ) in ( ( 100, 3 ), ( 2, 2 ), ( 0, 0 ) ):
+                
+                predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_LIMIT, limit ) ]
+                
+                search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+                
+                file_query_ids = self._read( 'file_query_ids', search_context, sort_by = sort_by )
+                
+                self.assertEqual( len( file_query_ids ), result )
+                self.assertTrue( set( file_query_ids ).issubset( hashes_to_hash_ids.values() ) )
+                
+            
+        
+    
+    def test_file_query_sort( self ):
+        
+        self._clear_db()
+        
+        # new files of different sizes and mimes. they may share an import time, so the sort fallback has to break those ties
+        
+        test_dir = tempfile.mkdtemp()
+        
+        try:
+            
+            hashes = []
+            
+            for ( i, ( side, extension ) ) in enumerate( ( ( 32, 'png' ), ( 40, 'jpg' ), ( 48, 'png' ), ( 56, 'jpg' ), ( 64, 'png' ) ) ):
+                
+                path = os.path.join( test_dir, str( i ) + '.' + extension )
+                
+                PILImage.frombytes( 'L', ( side, side ), os.urandom( side * side ) ).save( path )
+                
+                ( result, hash ) = self._write( 'import_file', ClientFiles.FileImportJob( path ) )
+                
+                hashes.append( hash )
+                
+            
+        finally:
+            
+            shutil.rmtree( test_dir )
+            
+        
+        hash_ids_to_hashes = self._get_hash_ids_to_hashes( hashes )
+        
+        media_results = self._read( 'media_results_from_ids', hash_ids_to_hashes.keys() )
+        
+        self.assertEqual( len( { media_result.GetSize() for media_result in media_results } ), len( hashes ) )
+        
+        sort_fallback = HC.options[ 'sort_fallback' ]
+        
+        try:
+            
+            for fallback_sort_by in ( ( 'system', CC.SORT_BY_SMALLEST ), ( 'system', CC.SORT_BY_LARGEST ) ):
+                
+                HC.options[ 'sort_fallback' ] = CC.SORT_CHOICES.index( fallback_sort_by )
+                
+                for sort_by in [ sort_choice for sort_choice in CC.SORT_CHOICES if sort_choice != ( 'system', CC.SORT_BY_RANDOM ) ]:
+                    
+                    media_list = ClientMedia.MediaList( CC.LOCAL_FILE_SERVICE_KEY, media_results )
+                    
+                    media_list.Sort( sort_by )
+                    
+                    expected_hashes = [ media.GetHash() for media in media_list.GetSortedMedia() ]
+                    
+                    for limit in ( None, 2 ):
+                        
+                        predicates = []
+                        
+                        if limit is not None:
+                            
+                            predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_LIMIT, limit ) )
+                            
+                        
+                        search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+                        
+                        file_query_ids = self._read( 'file_query_ids', search_context, sort_by = sort_by )
+                        
+                        self.assertEqual( [ hash_ids_to_hashes[ hash_id ] for hash_id in file_query_ids ], expected_hashes[ : limit ] )
+                        
+                    
+                
+            
+        finally:
+            
+            HC.options[ 'sort_fallback' ] = sort_fallback
+            
+        
+        # a cancelled query gives nothing back and cleans up after itself, so the next query can make its candidate table again
+        
+        query_key = ClientThreading.JobKey( cancellable = True )
+        
+        query_key.Cancel()
+        
+        predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_SIZE, ( '>', 0, 1 ) ) ]
+        
+        search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+        
+        self.assertEqual( self._read( 'file_query_ids', search_context, sort_by = ( 'system', CC.SORT_BY_SMALLEST ), query_key = query_key ), [] )
+        
+        file_query_ids = self._read( 'file_query_ids', search_context, sort_by = ( 'system', CC.SORT_BY_SMALLEST ) )
+        
+        self.assertEqual( len( file_query_ids ), len( hashes ) )
+        
+    
     def test_file_system_predicates( self ):
         
         self._clear_db()
@@ -533,7 +824,7 @@ class TestClientDB( unittest.TestCase ):
         
         path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
         
-        self._write( 'import_file', path )
+        self._write( 'import_file', ClientFiles.FileImportJob( path ) )
         
         #
         
@@ -551,6 +842,162 @@ class TestClientDB( unittest.TestCase ):
         for i in range( len( predicates ) ): self.assertEqual( result[i].GetCount(), predicates[i].GetCount() )
         
     
+    def test_filter_orphans( self ):
+        
+        self._clear_db()
+        
+        # a new file, so deleting it does not leave the shared test files in deleted_files
+        
+        test_dir = tempfile.mkdtemp()
+        
+        try:
+            
+            path = os.path.join( test_dir, 'orphan.png' )
+            
+            PILImage.frombytes( 'L', ( 32, 32 ), os.urandom( 32 * 32 ) ).save( path )
+            
+            ( result, hash ) = self._write( 'import_file', ClientFiles.FileImportJob( path ) )
+            
+        finally:
+            
+            shutil.rmtree( test_dir )
+            
+        
+        unknown_hash = HydrusData.GenerateKey()
+        
+        self.assertItemsEqual( self._read( 'filter_orphans', 'file', [ hash, unknown_hash ] ), [ unknown_hash ] )
+        self.assertItemsEqual( self._read( 'filter_orphans', 'thumbnail', [ hash, unknown_hash ] ), [ unknown_hash ] )
+        
+        content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, ( hash, ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
+        
+        self.assertItemsEqual( self._read( 'filter_orphans', 'file', [ hash, unknown_hash ] ), [ unknown_hash ] )
+        
+        self._write( 'content_updates', { CC.TRASH_SERVICE_KEY : [ content_update ] } )
+        
+        self.assertItemsEqual( self._read( 'filter_orphans', 'file', [ hash, unknown_hash ] ), [ hash, unknown_hash ] )
+        self.assertItemsEqual( self._read( 'filter_orphans', 'thumbnail', [ hash, unknown_hash ] ), [ hash, unknown_hash ] )
+        
+        self.assertEqual( self._read( 'filter_orphans', 'file', [] ), [] )
+        
+    
+    def test_group_commit( self ):
+        
+        # the db is held up on a first write while the grouped ones queue behind it, and the middle one of those fails after writing
+        
+        block_started = threading.Event()
+        block_released = threading.Event()
+        
+        groups_processed = []
+        
+        Write = self._db._Write
+        ProcessGroupCommitJobs = self._db._ProcessGroupCommitJobs
+        
+        def write( action, *args, **kwargs ):
+            
+            if action == 'block':
+                
+                block_started.set()
+                
+                block_released.wait( 30 )
+                
+                return
+                
+            
+            result = Write( action, *args, **kwargs )
+            
+            if action == 'serialisable_simple' and args[0] == 'group commit fail':
+                
+                raise Exception( 'This grouped write was made to fail!' )
+                
+            
+            return result
+            
+        
+        def process_group_commit_jobs( job ):
+            
+            groups_processed.append( job )
+            
+            ProcessGroupCommitJobs( job )
+            
+        
+        names = [ 'group commit a', 'group commit fail', 'group commit b' ]
+        
+        results = {}
+        
+        def do_write( name ):
+            
+            try:
+                
+                self._write( 'serialisable_simple', name, 5 )
+                
+                results[ name ] = None
+                
+            except Exception as e:
+                
+                results[ name ] = e
+                
+            
+        
+        self._db._Write = write
+        self._db._ProcessGroupCommitJobs = process_group_commit_jobs
+        self._db._group_commit = True
+        
+        try:
+            
+            self._db.Write( 'block', HC.HIGH_PRIORITY, False )
+            
+            block_started.wait( 30 )
+            
+            threads = []
+            
+            for ( i, name ) in enumerate( names ):
+                
+                thread = threading.Thread( target = do_write, args = ( name, ) )
+                
+                thread.daemon = True
+                
+                thread.start()
+                
+                threads.append( thread )
+                
+                # wait for each job to be queued, so they go in in order
+                
+                while self._db._jobs.qsize() < i + 1:
+                    
+                    time.sleep( 0.01 )
+                    
+                
+            
+            block_released.set()
+            
+            for thread in threads:
+                
+                thread.join( 30 )
+                
+            
+        finally:
+            
+            block_released.set()
+            
+            del self._db._Write
+            del self._db._ProcessGroupCommitJobs
+            
+            self._db._group_commit = False
+            
+        
+        self.assertEqual( len( groups_processed ), 1 )
+        
+        self.assertEqual( results[ 'group commit a' ], None )
+        self.assertEqual( results[ 'group commit b' ], None )
+        self.assertTrue( isinstance( results[ 'group commit fail' ], HydrusExceptions.DBException ) )
+        
+        self.assertEqual( self._read( 'serialisable_simple', 'group commit a' ), 5 )
+        self.assertEqual( self._read( 'serialisable_simple', 'group commit fail' ), None )
+        self.assertEqual( self._read( 'serialisable_simple', 'group commit b' ), 5 )
+        
+    
     def test_gui_sessions( self ):
         
         session = ClientGUIPages.GUISession( 'test_session' )
@@ -643,12 +1090,12 @@ class TestClientDB( unittest.TestCase ):
             
             hash = hex_hash.decode( 'hex' )
             
-            ( written_result, written_hash ) = self._write( 'import_file', path )
+            ( written_result, written_hash ) = self._write( 'import_file', ClientFiles.FileImportJob( path ) )
             
             self.assertEqual( written_result, CC.STATUS_SUCCESSFUL )
             self.assertEqual( written_hash, hash )
             
-            ( written_result, written_hash ) = self._write( 'import_file', path )
+            ( written_result, written_hash ) = self._write( 'import_file', ClientFiles.FileImportJob( path ) )
             
             self.assertEqual( written_result, CC.STATUS_REDUNDANT )
             self.assertEqual( written_hash, hash )
@@ -679,6 +1126,34 @@ class TestClientDB( unittest.TestCase ):
             self.assertEqual( mr_num_words, num_words )
             
         
+        # a batch that includes a bad file
+        
+        file_import_jobs = [ ClientFiles.FileImportJob( os.path.join( HC.STATIC_DIR, 'testing', filename ) ) for ( filename, hex_hash, size, mime, width, height, duration, num_frames, num_words ) in test_files ]
+        
+        ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+        
+        try:
+            
+            with open( temp_path, 'wb' ) as f: f.write( 'blarg' )
+            
+            file_import_jobs.insert( 1, ClientFiles.FileImportJob( temp_path ) )
+            
+            self._write( 'import_files', file_import_jobs )
+            
+        finally:
+            
+            HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+            
+        
+        self.assertRaises( HydrusExceptions.MimeException, file_import_jobs[1].GetResult )
+        
+        del file_import_jobs[1]
+        
+        for ( file_import_job, ( filename, hex_hash, size, mime, width, height, duration, num_frames, num_words ) ) in zip( file_import_jobs, test_files ):
+            
+            self.assertEqual( file_import_job.GetResult(), ( CC.STATUS_REDUNDANT, hex_hash.decode( 'hex' ) ) )
+            
+        
     
     def test_import_folders( self ):
         
@@ -753,7 +1228,7 @@ class TestClientDB( unittest.TestCase ):
         
         #
         
-        self._write( 'import_file', path )
+        self._write( 'import_file', ClientFiles.FileImportJob( path ) )
         
         #
         
@@ -786,7 +1261,7 @@ class TestClientDB( unittest.TestCase ):
         
         HC.options[ 'exclude_deleted_files' ] = False
         
-        ( result, hash ) = self._write( 'import_file', path )
+        ( result, hash ) = self._write( 'import_file', ClientFiles.FileImportJob( path ) )
         
         #
         
@@ -824,6 +1299,27 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( mr_num_frames, None )
         self.assertEqual( mr_num_words, None )
         
+        #
+        
+        ( shared_media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertIs( shared_media_result, media_result )
+        
+        content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ARCHIVE, ( hash, ) )
+        
+        service_keys_to_content_updates = { CC.LOCAL_FILE_SERVICE_KEY : ( content_update, ) }
+        
+        self._write( 'content_updates', service_keys_to_content_updates )
+        
+        # the test controller drops pubs, so deliver the update to the cache the way the client's pubsub would
+        
+        HydrusGlobals.test_controller.pubimmediate( 'content_updates_data', service_keys_to_content_updates )
+        
+        ( archived_media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertIs( archived_media_result, media_result )
+        self.assertEqual( media_result.GetInbox(), False )
+        
     
     def test_tag_censorship( self ):
         
@@ -855,15 +1351,86 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( result, ( False, [ ':', 'series:' ] ) )
         
     
-    def test_news( self ):
+    def test_tag_trigrams( self ):
         
-        result = self._read( 'news', CC.LOCAL_TAG_SERVICE_KEY )
-        
-        self.assertEqual( result, [] )
+        self.assertEqual( ClientDB.GenerateTrigrams( 'Cars' ), { 'car', 'ars' } )
+        self.assertEqual( ClientDB.GenerateTrigrams( 'ab' ), set() )
+        self.assertEqual( ClientDB.GenerateTrigrams( u'\u65e5\u672c\u8a9e\u3067' ), { u'\u65e5\u672c\u8a9e', u'\u672c\u8a9e\u3067' } )
         
         #
         
-        news = []
+        self._clear_db()
+        
+        hash = '\xadm5\x99\xa6\xc4\x89\xa5u\xeb\x19\xc0&\xfa\xce\x97\xa9\xcdey\xe7G(\xb0\xce\x94\xa6\x01\xd22\xf3\xc3'
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        self._write( 'import_file', ClientFiles.FileImportJob( path ) )
+        
+        tags = [ 'c++ programming', 'under_score', '100% orange juice', u'\u65e5\u672c\u8a9e', 'blue sky', 'skyblue', 'series:sky high' ]
+        
+        content_updates = [ HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( tag, ( hash, ) ) ) for tag in tags ]
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+        
+        tests = []
+        
+        tests.append( ( 'c++', { 'c++ programming' } ) )
+        tests.append( ( 'c+', { 'c++ programming' } ) )
+        tests.append( ( 'under_', { 'under_score' } ) )
+        tests.append( ( '100%', { '100% orange juice' } ) )
+        tests.append( ( 'orange jui', { '100% orange juice' } ) )
+        tests.append( ( u'\u65e5\u672c', { u'\u65e5\u672c\u8a9e' } ) )
+        tests.append( ( u'\u65e5\u672c\u8a9e', { u'\u65e5\u672c\u8a9e' } ) )
+        tests.append( ( u'\u672c\u8a9e', set() ) )
+        tests.append( ( '*sky', { 'blue sky' } ) )
+        tests.append( ( 'sky*', { 'blue sky', 'skyblue', 'series:sky high' } ) )
+        tests.append( ( '*ue*', { 'blue sky', 'skyblue' } ) )
+        tests.append( ( '*ange*', { '100% orange juice' } ) )
+        tests.append( ( '*ange', set() ) )
+        tests.append( ( 'series:*hig*', { 'series:sky high' } ) )
+        tests.append( ( 'blue s*y', { 'blue sky' } ) )
+        
+        for ( search_text, expected_tags ) in tests:
+            
+            result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = search_text, add_namespaceless = False )
+            
+            self.assertEqual( { predicate.GetValue() for predicate in result }, expected_tags )
+            
+        
+        # and the same lookups through a file search
+        
+        tests = []
+        
+        tests.append( ( 'sky*', 1 ) )
+        tests.append( ( '*++*', 1 ) )
+        tests.append( ( u'\u65e5*', 1 ) )
+        tests.append( ( 'series:sky*', 1 ) )
+        tests.append( ( '*sky', 1 ) )
+        tests.append( ( 'blue sky*s', 0 ) )
+        tests.append( ( 'zzz*', 0 ) )
+        
+        for ( wildcard, result ) in tests:
+            
+            predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_WILDCARD, wildcard ) ]
+            
+            search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+            
+            file_query_ids = self._read( 'file_query_ids', search_context )
+            
+            self.assertEqual( len( file_query_ids ), result )
+            
+        
+    
+    def test_news( self ):
+        
+        result = self._read( 'news', CC.LOCAL_TAG_SERVICE_KEY )
+        
+        self.assertEqual( result, [] )
+        
+        #
+        
+        news = []
         
         news.append( ( 'hello', HydrusData.GetNow() - 30000 ) )
         news.append( ( 'hello again', HydrusData.GetNow() - 20000 ) )
@@ -945,6 +1512,274 @@ class TestClientDB( unittest.TestCase ):
         self.assertTrue( result, ( pixiv_id, password ) )
         
     
+    def test_posting_lists( self ):
+        
+        self._clear_db()
+        
+        new_options = HydrusGlobals.test_controller.GetNewOptions()
+        
+        def get_num_tag_posting_lists():
+            
+            # the earlier tests leave counts behind in the autocomplete cache, so we only count lists for our own tags
+            
+            master_db_path = os.path.join( self._db._db_dir, self._db._db_filenames[ 'external_master' ] )
+            caches_db_path = os.path.join( self._db._db_dir, self._db._db_filenames[ 'external_caches' ] )
+            
+            db = sqlite3.connect( master_db_path, isolation_level = None, detect_types = sqlite3.PARSE_DECLTYPES )
+            
+            c = db.cursor()
+            
+            tag_ids = [ tag_id for ( tag_id, ) in c.execute( 'SELECT tag_id FROM tags WHERE tag IN ( ?, ? );', ( 'posting big', 'posting small' ) ) ]
+            
+            del c
+            del db
+            
+            db = sqlite3.connect( caches_db_path, isolation_level = None, detect_types = sqlite3.PARSE_DECLTYPES )
+            
+            c = db.cursor()
+            
+            ( num_tag_posting_lists, ) = c.execute( 'SELECT COUNT( * ) FROM tag_posting_lists WHERE tag_id IN ' + HydrusData.SplayListForDB( tag_ids ) + ';' ).fetchone()
+            
+            del c
+            del db
+            
+            return num_tag_posting_lists
+            
+        
+        def run_searches():
+            
+            results = []
+            
+            for file_service_key in ( CC.LOCAL_FILE_SERVICE_KEY, CC.COMBINED_FILE_SERVICE_KEY ):
+                
+                for ( tags_to_include, tags_to_exclude ) in searches:
+                    
+                    predicates = []
+                    
+                    predicates.extend( ( ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, tag ) for tag in tags_to_include ) )
+                    predicates.extend( ( ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, tag, inclusive = False ) for tag in tags_to_exclude ) )
+                    
+                    search_context = ClientSearch.FileSearchContext( file_service_key = file_service_key, tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, predicates = predicates )
+                    
+                    results.append( set( self._read( 'file_query_ids', search_context ) ) )
+                    
+                
+            
+            return results
+            
+        
+        def check_searches():
+            
+            # the posting lists have to give the same results as the plain sql lookups
+            
+            posting_lists_results = run_searches()
+            
+            new_options.SetBoolean( 'tag_posting_lists', False )
+            
+            try:
+                
+                sql_results = run_searches()
+                
+            finally:
+                
+                new_options.SetBoolean( 'tag_posting_lists', True )
+                
+            
+            self.assertEqual( posting_lists_results, sql_results )
+            
+            return sql_results
+            
+        
+        searches = []
+        
+        searches.append( ( [ 'posting big' ], [] ) )
+        searches.append( ( [ 'series:posting big' ], [] ) )
+        searches.append( ( [ 'posting big', 'posting small' ], [] ) )
+        searches.append( ( [ 'posting big' ], [ 'posting small' ] ) )
+        searches.append( ( [ 'series:posting big' ], [ 'posting big' ] ) )
+        
+        # new files, so deleting them does not leave the shared test files in deleted_files
+        
+        test_dir = tempfile.mkdtemp()
+        
+        try:
+            
+            hashes = []
+            
+            for i in range( 13 ):
+                
+                path = os.path.join( test_dir, str( i ) + '.png' )
+                
+                PILImage.frombytes( 'L', ( 32, 32 ), os.urandom( 32 * 32 ) ).save( path )
+                
+                ( result, hash ) = self._write( 'import_file', ClientFiles.FileImportJob( path ) )
+                
+                hashes.append( hash )
+                
+            
+        finally:
+            
+            shutil.rmtree( test_dir )
+            
+        
+        new_hash = hashes.pop()
+        
+        content_updates = []
+        
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'posting big', hashes[ : 10 ] ) ) )
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'series:posting big', hashes[ 5 : 12 ] ) ) )
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'posting small', hashes[ : 3 ] ) ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+        
+        POSTING_LISTS_MIN_COUNT = ClientDB.DB.POSTING_LISTS_MIN_COUNT
+        
+        ClientDB.DB.POSTING_LISTS_MIN_COUNT = 5
+        
+        new_options.SetBoolean( 'tag_posting_lists', True )
+        
+        try:
+            
+            self._write( 'maintain_tag_posting_lists' )
+            
+            # 'posting big' in any namespace and 'series:posting big' get lists, 'posting small' is too small
+            
+            self.assertEqual( get_num_tag_posting_lists(), 2 )
+            
+            results = check_searches()
+            
+            self.assertEqual( len( results[0] ), 12 )
+            self.assertEqual( len( results[1] ), 7 )
+            
+            # mappings changes update the lists in place
+            
+            content_updates = []
+            
+            content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( 'posting big', hashes[ : 2 ] ) ) )
+            content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'posting big', hashes[ 10 : 12 ] ) ) )
+            content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( 'series:posting big', hashes[ 5 : 6 ] ) ) )
+            
+            self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+            
+            results = check_searches()
+            
+            self.assertEqual( len( results[0] ), 10 )
+            self.assertEqual( len( results[1] ), 6 )
+            
+            # and so do file changes
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, hashes[ 2 : 4 ] )
+            
+            self._write( 'content_updates', { CC.LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'posting big', ( new_hash, ) ) )
+            
+            self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+            
+            results = check_searches()
+            
+            self.assertEqual( len( results[0] ), 9 )
+            self.assertEqual( len( results[5] ), 11 )
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_UNDELETE, hashes[ 2 : 4 ] )
+            
+            self._write( 'content_updates', { CC.LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
+            
+            results = check_searches()
+            
+            self.assertEqual( len( results[0] ), 11 )
+            
+            # a tag that drops below the minimum loses its list at the next maintenance
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( 'series:posting big', hashes[ 6 : 10 ] ) )
+            
+            self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+            
+            self._write( 'maintain_tag_posting_lists' )
+            
+            self.assertEqual( get_num_tag_posting_lists(), 1 )
+            
+            results = check_searches()
+            
+            self.assertEqual( len( results[1] ), 2 )
+            
+        finally:
+            
+            ClientDB.DB.POSTING_LISTS_MIN_COUNT = POSTING_LISTS_MIN_COUNT
+            
+            new_options.SetBoolean( 'tag_posting_lists', False )
+            
+            self._write( 'maintain_tag_posting_lists' )
+            
+        
+        self.assertEqual( get_num_tag_posting_lists(), 0 )
+        
+    
+    def test_read_connection_failure( self ):
+        
+        # if the read connections cannot open, the concurrent reads have to go through the main loop instead
+        
+        InitDBCursor = ClientDB.DB._InitDBCursor
+        
+        def init_db_cursor( db ):
+            
+            if threading.current_thread().name.startswith( 'Database Read Loop' ):
+                
+                raise Exception( 'This read connection was made to fail!' )
+                
+            
+            InitDBCursor( db )
+            
+        
+        db_dir = tempfile.mkdtemp()
+        
+        try:
+            
+            ClientDB.DB._InitDBCursor = init_db_cursor
+            
+            try:
+                
+                db = ClientDB.DB( HydrusGlobals.test_controller, db_dir, 'client' )
+                
+            finally:
+                
+                ClientDB.DB._InitDBCursor = InitDBCursor
+                
+            
+            try:
+                
+                self.assertEqual( db._read_threads, [] )
+                
+                results = []
+                
+                search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY )
+                
+                read_thread = threading.Thread( target = lambda: results.append( db.Read( 'file_query_ids', HC.HIGH_PRIORITY, search_context ) ) )
+                
+                read_thread.daemon = True
+                
+                read_thread.start()
+                
+                read_thread.join( 30 )
+                
+                self.assertEqual( results, [ [] ] )
+                
+            finally:
+                
+                db.Shutdown()
+                
+                while not db.LoopIsFinished():
+                    
+                    time.sleep( 0.1 )
+                    
+                
+            
+        finally:
+            
+            shutil.rmtree( db_dir )
+            
+        
+    
     def test_repo_downloads( self ):
         
         result = self._read( 'downloads' )
@@ -1174,6 +2009,134 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( result, [] )
         
     
+    def test_similar_files( self ):
+        
+        self._clear_db()
+        
+        def run_similar_files_tests( hashes_to_phashes ):
+            
+            for ( hash, phash ) in hashes_to_phashes.items()[ : 10 ]:
+                
+                for max_hamming in ( 0, 16, 28 ):
+                    
+                    predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_SIMILAR_TO, ( hash, max_hamming ) ) ]
+                    
+                    search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+                    
+                    file_query_ids = self._read( 'file_query_ids', search_context )
+                    
+                    media_results = self._read( 'media_results_from_ids', file_query_ids )
+                    
+                    expected_hashes = [ other_hash for ( other_hash, other_phash ) in hashes_to_phashes.items() if HydrusData.GetHammingDistance( phash, other_phash ) <= max_hamming ]
+                    
+                    self.assertItemsEqual( [ media_result.GetHash() for media_result in media_results ], expected_hashes )
+                    
+                
+            
+        
+        def delete_files( hashes ):
+            
+            for service_key in ( CC.LOCAL_FILE_SERVICE_KEY, CC.TRASH_SERVICE_KEY ):
+                
+                content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, hashes )
+                
+                self._write( 'content_updates', { service_key : [ content_update ] } )
+                
+            
+        
+        test_dir = tempfile.mkdtemp()
+        
+        try:
+            
+            hashes_to_phashes = {}
+            hashes_to_paths = {}
+            
+            for i in range( 40 ):
+                
+                path = os.path.join( test_dir, str( i ) + '.png' )
+                
+                PILImage.frombytes( 'L', ( 32, 32 ), os.urandom( 32 * 32 ) ).save( path )
+                
+                ( written_result, written_hash ) = self._write( 'import_file', ClientFiles.FileImportJob( path ) )
+                
+                self.assertEqual( written_result, CC.STATUS_SUCCESSFUL )
+                
+                hashes_to_phashes[ written_hash ] = ClientImageHandling.GeneratePerceptualHash( path )
+                hashes_to_paths[ written_hash ] = path
+                
+            
+            run_similar_files_tests( hashes_to_phashes )
+            
+            # deleted files with children in the tree stay behind until maintenance, and searches have to route around them
+            
+            deletee_hashes = hashes_to_phashes.keys()[ : 20 ]
+            
+            delete_files( deletee_hashes )
+            
+            remaining_hashes_to_phashes = { hash : phash for ( hash, phash ) in hashes_to_phashes.items() if hash not in deletee_hashes }
+            
+            run_similar_files_tests( remaining_hashes_to_phashes )
+            
+            for hash in deletee_hashes[ : 10 ]:
+                
+                ( written_result, written_hash ) = self._write( 'import_file', ClientFiles.FileImportJob( hashes_to_paths[ hash ], override_deleted = True ) )
+                
+                self.assertEqual( written_result, CC.STATUS_SUCCESSFUL )
+                
+                remaining_hashes_to_phashes[ hash ] = hashes_to_phashes[ hash ]
+                
+            
+            run_similar_files_tests( remaining_hashes_to_phashes )
+            
+            self._write( 'maintain_similar_files_tree' )
+            
+            run_similar_files_tests( remaining_hashes_to_phashes )
+            
+        finally:
+            
+            shutil.rmtree( test_dir )
+            
+        
+    
+    def test_staged_mappings( self ):
+        
+        self._clear_db()
+        
+        def get_current_count( tag ):
+            
+            # a namespaceless search also matches namespaced tags, so pick ours out
+            
+            result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = tag, exact_match = True )
+            
+            ( read_pred, ) = [ pred for pred in result if pred.GetValue() == tag ]
+            
+            return read_pred.GetCount( HC.CURRENT )
+            
+        
+        hashes = [ HydrusData.GenerateKey() for i in range( ClientDB.DB.STAGED_MAPPINGS_MIN_ROWS * 2 ) ]
+        
+        content_updates = []
+        
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'staged', hashes ) ) )
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'series:staged', hashes[ : 10 ] ) ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+        
+        self.assertEqual( get_current_count( 'staged' ), len( hashes ) )
+        
+        #
+        
+        content_updates = []
+        
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( 'staged', hashes[ : ClientDB.DB.STAGED_MAPPINGS_MIN_ROWS ] ) ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+        
+        self.assertEqual( get_current_count( 'staged' ), len( hashes ) - ClientDB.DB.STAGED_MAPPINGS_MIN_ROWS )
+        
+        self.assertEqual( get_current_count( 'series:staged' ), 10 )
+        
+    
 class TestServerDB( unittest.TestCase ):
     
     def _read( self, action, *args, **kwargs ): return self._db.Read( action, HC.HIGH_PRIORITY, *args, **kwargs )
@@ -1358,6 +2321,112 @@ class TestServerDB( unittest.TestCase ):
         self.assertEqual( services_info[ self._file_service_key ], ( HC.FILE_REPOSITORY, f_options_modified ) )
         
     
+    def _test_update_creation( self ):
+        
+        account_key = self._read( 'account_key_from_access_key', self._tag_service_key, self._tag_service_admin_access_key )
+        
+        def read_content_update_package( begin ):
+            
+            path = ServerFiles.GetServiceUpdatePackagePath( self._tag_service_key, begin )
+            
+            with open( path, 'rb' ) as f:
+                
+                service_update_package = HydrusSerialisable.CreateFromNetworkString( f.read() )
+                
+            
+            self.assertEqual( service_update_package.GetSubindexCount(), 1 )
+            
+            path = ServerFiles.GetContentUpdatePackagePath( self._tag_service_key, begin, 0 )
+            
+            with open( path, 'rb' ) as f:
+                
+                content_update_package = HydrusSerialisable.CreateFromNetworkString( f.read() )
+                
+            
+            return content_update_package
+            
+        
+        def get_mappings( content_update_package, action ):
+            
+            result = collections.defaultdict( set )
+            
+            for ( tag, hashes ) in content_update_package.GetContentDataIterator( HC.CONTENT_TYPE_MAPPINGS, action ):
+                
+                self.assertEqual( len( hashes ), len( set( hashes ) ) )
+                
+                result[ tag ].update( hashes )
+                
+            
+            return dict( result )
+            
+        
+        # the middle tag straddles the 10,000 row block boundary and the last tag starts in the second block
+        
+        tags = [ 'first tag', 'second tag', 'third tag' ]
+        tag_sizes = [ 4000, 7000, 3000 ]
+        
+        hash_ids_to_hashes = {}
+        pends = []
+        
+        for ( tag, tag_size ) in zip( tags, tag_sizes ):
+            
+            hash_ids = range( len( hash_ids_to_hashes ), len( hash_ids_to_hashes ) + tag_size )
+            
+            hash_ids_to_hashes.update( { hash_id : HydrusData.GenerateKey() for hash_id in hash_ids } )
+            
+            pends.append( ( tag, hash_ids ) )
+            
+        
+        # an admin petition of mappings newer than the last update just removes them, so the pends go out in an update first
+        
+        begin = self._read( 'update_ends' )[ self._tag_service_key ] + 1
+        
+        time.sleep( 1 )
+        
+        content_data = { HC.CONTENT_TYPE_MAPPINGS : { HC.CONTENT_UPDATE_PEND : pends } }
+        
+        update = HydrusData.ClientToServerContentUpdatePackage( content_data, hash_ids_to_hashes )
+        
+        self._write( 'update', self._tag_service_key, account_key, update )
+        
+        end = HydrusData.GetNow()
+        
+        self._write( 'create_update', self._tag_service_key, begin, end )
+        
+        content_update_package = read_content_update_package( begin )
+        
+        expected_adds = { tag : { hash_ids_to_hashes[ hash_id ] for hash_id in hash_ids } for ( tag, hash_ids ) in pends }
+        
+        self.assertEqual( get_mappings( content_update_package, HC.CONTENT_UPDATE_ADD ), expected_adds )
+        self.assertEqual( get_mappings( content_update_package, HC.CONTENT_UPDATE_DELETE ), {} )
+        
+        #
+        
+        ( tag, hash_ids ) = pends[0]
+        
+        petitions = [ ( tag, hash_ids[:500], 'bad tag' ) ]
+        
+        time.sleep( 1 )
+        
+        content_data = { HC.CONTENT_TYPE_MAPPINGS : { HC.CONTENT_UPDATE_PETITION : petitions } }
+        
+        update = HydrusData.ClientToServerContentUpdatePackage( content_data, hash_ids_to_hashes )
+        
+        self._write( 'update', self._tag_service_key, account_key, update )
+        
+        begin = end + 1
+        end = HydrusData.GetNow() + 1
+        
+        self._write( 'create_update', self._tag_service_key, begin, end )
+        
+        content_update_package = read_content_update_package( begin )
+        
+        expected_deletes = { tag : { hash_ids_to_hashes[ hash_id ] for hash_id in hash_ids } for ( tag, hash_ids, reason ) in petitions }
+        
+        self.assertEqual( get_mappings( content_update_package, HC.CONTENT_UPDATE_ADD ), {} )
+        self.assertEqual( get_mappings( content_update_package, HC.CONTENT_UPDATE_DELETE ), expected_deletes )
+        
+    
     def test_server( self ):
         
         self._test_init_server_admin()
@@ -1368,3 +2437,5 @@ class TestServerDB( unittest.TestCase ):
         
         self._test_content_creation()
         
+        self._test_update_creation()
+        
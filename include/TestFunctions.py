@@ -1,10 +1,17 @@
 import collections
 import HydrusConstants as HC
 import ClientData
+import ClientFiles
+import ClientNetworking
+import ClientPostingLists
+import ClientThreading
+import HydrusGlobals
+import HydrusPaths
 import os
 import TestConstants
 import unittest
 import HydrusData
+import HydrusSerialisable
 import ClientConstants as CC
 
 class TestClientDownloadingFunctions( unittest.TestCase ):
@@ -81,4 +88,195 @@ class TestClientDownloadingFunctions( unittest.TestCase ):
         
         self.assertEqual( type( pretty_num ), unicode )
         
+    
+class TestContentUpdatePackages( unittest.TestCase ):
+    
+    def test_content_update_package_binary( self ):
+        
+        hash_ids_to_hashes = { hash_id : HydrusData.GenerateKey() for hash_id in range( 1, 21 ) }
+        
+        update = HydrusData.ServerToClientContentUpdatePackage()
+        
+        update.AddContentData( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, [ ( 1, 1024, HC.IMAGE_JPEG, 1000000, 640, 480, None, None, None ) ], hash_ids_to_hashes )
+        update.AddContentData( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, [ 3, 2 ], {} )
+        update.AddContentData( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, [ ( u'series:blah', range( 1, 21 ) ), ( u'\u76f4', [ 20, 5, 7 ] ) ], {} )
+        update.AddContentData( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, [ ( u'character:samus aran', [ 4 ] ) ], {} )
+        update.AddContentData( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD, [ ( u'samus', u'character:samus aran' ) ], {} )
+        update.AddContentData( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_DELETE, [ ( u'character:samus aran', u'series:metroid' ) ], {} )
+        
+        network_string = update.DumpToBinaryNetworkString()
+        
+        self.assertTrue( HydrusSerialisable.NetworkStringIsBinary( network_string ) )
+        self.assertFalse( HydrusSerialisable.NetworkStringIsBinary( update.DumpToNetworkString() ) )
+        
+        def get_content_updates( package ):
+            
+            return [ content_update for ( content_updates, weight ) in package.IterateContentUpdateChunks() for content_update in content_updates ]
+            
+        
+        binary_update = HydrusSerialisable.CreateFromNetworkString( network_string )
+        
+        self.assertEqual( binary_update.GetNumContentUpdates(), update.GetNumContentUpdates() )
+        self.assertEqual( binary_update.GetNumRows(), update.GetNumRows() )
+        self.assertEqual( binary_update.GetHashes(), update.GetHashes() )
+        self.assertEqual( get_content_updates( binary_update ), get_content_updates( update ) )
+        
+        # an untouched binary update dumps back to the same thing, and adding to one works as normal
+        
+        self.assertEqual( HydrusSerialisable.CreateFromNetworkString( binary_update.DumpToBinaryNetworkString() ).GetNumRows(), update.GetNumRows() )
+        
+        binary_update.AddContentData( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, [ 4 ], {} )
+        
+        self.assertEqual( binary_update.GetNumContentUpdates(), update.GetNumContentUpdates() + 1 )
+        
+        # each tag's hash ids are delta encoded on their own, so the jump down to the next tag's ids does not widen them all
+        
+        int_lists = [ range( 1000000, 1000100 ), range( 5, 105 ), [], [ 7 ] ]
+        
+        writer = HydrusSerialisable.BinaryWriter()
+        
+        writer.WriteIntListSegments( int_lists )
+        
+        data = writer.GetData()
+        
+        self.assertLess( len( data ), 250 )
+        
+        reader = HydrusSerialisable.BinaryReader( data )
+        
+        self.assertEqual( reader.ReadIntListSegments( [ len( ints ) for ints in int_lists ] ), int_lists )
+        
+    
+    def test_content_update_package_downloads( self ):
+        
+        old_http = HydrusGlobals.test_controller.GetHTTP()
+        
+        http = TestConstants.FakeHTTPConnectionManager()
+        
+        HydrusGlobals.test_controller.SetHTTP( http )
+        
+        try:
+            
+            service_key = HydrusData.GenerateKey()
+            
+            account_type = HydrusData.AccountType( 'account', [ HC.GET_DATA ], ( None, None ) )
+            
+            account = HydrusData.Account( HydrusData.GenerateKey(), account_type, HydrusData.GetNow() - 100000, None, 0, 0 )
+            
+            info = { 'host' : '127.0.0.1', 'port' : HC.DEFAULT_SERVICE_PORT, 'access_key' : HydrusData.GenerateKey(), 'account' : account, 'last_error' : 0, 'paused' : False, 'first_timestamp' : None, 'next_download_timestamp' : 0, 'next_processing_timestamp' : 0 }
+            
+            service = ClientData.GenerateService( service_key, HC.TAG_REPOSITORY, 'tag repo', info )
+            
+            HydrusGlobals.test_controller.GetServicesManager()._keys_to_services[ service_key ] = service
+            
+            HydrusPaths.MakeSureDirectoryExists( ClientFiles.GetExpectedUpdateDir( service_key ) )
+            
+            url = 'http://127.0.0.1:' + str( HC.DEFAULT_SERVICE_PORT ) + '/'
+            
+            response_headers = { 'server' : HC.service_string_lookup[ HC.TAG_REPOSITORY ] + '/' + str( HC.NETWORK_VERSION ) }
+            
+            http.SetResponse( HC.GET, url + 'session_key', '', response_headers = response_headers, cookies = { 'session_key' : HydrusData.GenerateKey().encode( 'hex' ) } )
+            
+            begin = 0
+            
+            updates = {}
+            
+            for subindex in range( 3 ):
+                
+                update = HydrusData.ServerToClientContentUpdatePackage()
+                
+                update.AddContentData( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, [ ( u'series:' + str( subindex ), [ 1, 2, 3 ] ) ], {} )
+                
+                updates[ subindex ] = update.DumpToBinaryNetworkString()
+                
+                query = ClientNetworking.ConvertHydrusGETArgsToQuery( { 'begin' : begin, 'subindex' : subindex, 'binary' : 1 } )
+                
+                http.SetResponse( HC.GET, url + 'content_update_package?' + query, updates[ subindex ], response_headers = response_headers )
+                
+            
+            def get_downloading_paths():
+                
+                return [ filename for filename in os.listdir( ClientFiles.GetExpectedUpdateDir( service_key ) ) if filename.endswith( '.downloading' ) ]
+                
+            
+            job_key = ClientThreading.JobKey()
+            
+            service._DownloadContentUpdatePackages( job_key, begin, [ 0, 1, 2 ] )
+            
+            for subindex in range( 3 ):
+                
+                with open( ClientFiles.GetExpectedContentUpdatePackagePath( service_key, begin, subindex ), 'rb' ) as f:
+                    
+                    self.assertEqual( f.read(), updates[ subindex ] )
+                    
+                
+            
+            self.assertEqual( get_downloading_paths(), [] )
+            
+            # a package the server cannot give us fails the whole update, and the download thread hands the error back to sync
+            
+            service_update_package = HydrusData.ServerToClientServiceUpdatePackage()
+            
+            service_update_package.SetBeginEnd( begin, begin + HC.UPDATE_DURATION - 1 )
+            service_update_package.SetSubindexCount( 4 )
+            
+            query = ClientNetworking.ConvertHydrusGETArgsToQuery( { 'begin' : begin } )
+            
+            http.SetResponse( HC.GET, url + 'service_update_package?' + query, service_update_package, response_headers = response_headers )
+            
+            download_info = { 'num_updates_downloaded' : 0, 'error' : None }
+            
+            service._THREADDownloadUpdates( job_key, download_info )
+            
+            self.assertNotEqual( download_info[ 'error' ], None )
+            self.assertEqual( download_info[ 'num_updates_downloaded' ], 0 )
+            
+            self.assertFalse( os.path.exists( ClientFiles.GetExpectedContentUpdatePackagePath( service_key, begin, 3 ) ) )
+            self.assertFalse( os.path.exists( ClientFiles.GetExpectedServiceUpdatePackagePath( service_key, begin ) ) )
+            
+            self.assertEqual( get_downloading_paths(), [] )
+            
+            self.assertEqual( service.GetTimestamps(), ( None, 0, 0 ) )
+            
+        finally:
+            
+            HydrusGlobals.test_controller.SetHTTP( old_http )
+            
+        
+    
+class TestPostingListFunctions( unittest.TestCase ):
+    
+    def test_posting_lists( self ):
+        
+        # the sparse ids make array containers, the dense run makes a bitmap container, and the big ones sit in a different container altogether
+        
+        sparse_hash_ids = set( range( 1, 200000, 97 ) )
+        dense_hash_ids = set( range( 60000, 70000 ) )
+        big_hash_ids = { 2 ** 31 + 5, 2 ** 31 + 6 }
+        
+        a = sparse_hash_ids.union( big_hash_ids )
+        b = dense_hash_ids.union( { 2 ** 31 + 6 } )
+        
+        posting_list_a = ClientPostingLists.FromHashIds( a )
+        posting_list_b = ClientPostingLists.FromHashIds( b )
+        
+        self.assertEqual( len( posting_list_a ), len( a ) )
+        self.assertEqual( posting_list_a.GetHashIds(), sorted( a ) )
+        self.assertEqual( posting_list_b.GetHashIds(), sorted( b ) )
+        
+        self.assertEqual( ClientPostingLists.FromBytes( buffer( posting_list_a.ToBytes() ) ).GetHashIds(), sorted( a ) )
+        self.assertEqual( ClientPostingLists.FromBytes( buffer( posting_list_b.ToBytes() ) ).GetHashIds(), sorted( b ) )
+        
+        self.assertEqual( posting_list_a.Intersection( posting_list_b ).GetHashIds(), sorted( a.intersection( b ) ) )
+        self.assertEqual( posting_list_a.Union( posting_list_b ).GetHashIds(), sorted( a.union( b ) ) )
+        self.assertEqual( posting_list_a.Difference( posting_list_b ).GetHashIds(), sorted( a.difference( b ) ) )
+        self.assertEqual( posting_list_b.Difference( posting_list_a ).GetHashIds(), sorted( b.difference( a ) ) )
+        
+        posting_list_c = ClientPostingLists.FromHashIds( range( 65000, 66000 ) )
+        
+        self.assertEqual( ClientPostingLists.MassIntersect( [ posting_list_a, posting_list_b, posting_list_c ] ).GetHashIds(), sorted( a.intersection( b ).intersection( range( 65000, 66000 ) ) ) )
+        self.assertEqual( ClientPostingLists.MassUnion( [ posting_list_a, posting_list_b, posting_list_c ] ).GetHashIds(), sorted( a.union( b ).union( range( 65000, 66000 ) ) ) )
+        
+        self.assertEqual( ClientPostingLists.FromHashIds( [] ).GetHashIds(), [] )
+        self.assertEqual( len( posting_list_a.Difference( posting_list_a ) ), 0 )
+        
     
\ No newline at end of file
@@ -135,6 +135,29 @@ class TestServer( unittest.TestCase ):
         
         self.assertEqual( data, 'file' )
         
+        etag = response.getheader( 'ETag' )
+        
+        self.assertEqual( etag, '"' + hash_encoded + '"' )
+        
+        connection.request( 'GET', '/file?hash=' + self._file_hash.encode( 'hex' ), headers = { 'Range' : 'bytes=1-2' } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 206 )
+        self.assertEqual( data, 'il' )
+        self.assertEqual( response.getheader( 'Content-Range' ), 'bytes 1-2/4' )
+        
+        connection.request( 'GET', '/file?hash=' + self._file_hash.encode( 'hex' ), headers = { 'If-None-Match' : etag } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 304 )
+        self.assertEqual( data, '' )
+        
         try: os.remove( path )
         except: pass
         
@@ -408,8 +431,37 @@ class TestServer( unittest.TestCase ):
         
         self.assertEqual( response.GetNumContentUpdates(), update.GetNumContentUpdates() )
         
-        try: os.remove( path )
-        except: pass
+        response = service.Request( HC.GET, 'content_update_package', { 'begin' : begin, 'subindex' : subindex, 'binary' : 1 } )
+        
+        self.assertEqual( response.GetNumContentUpdates(), update.GetNumContentUpdates() )
+        self.assertEqual( response.GetHashes(), update.GetHashes() )
+        
+        with open( path, 'wb' ) as f: f.write( update.DumpToBinaryNetworkString() )
+        
+        response = service.Request( HC.GET, 'content_update_package', { 'begin' : begin, 'subindex' : subindex } )
+        
+        self.assertEqual( response.GetNumContentUpdates(), update.GetNumContentUpdates() )
+        self.assertEqual( response.GetTags(), update.GetTags() )
+        
+        # the json for older clients is made once and then served from disk
+        
+        json_path = ServerFiles.GetExpectedContentUpdatePackageJSONPath( service_key, begin, subindex )
+        
+        with open( json_path, 'rb' ) as f: self.assertFalse( HydrusSerialisable.NetworkStringIsBinary( f.read() ) )
+        
+        response = service.Request( HC.GET, 'content_update_package', { 'begin' : begin, 'subindex' : subindex } )
+        
+        self.assertEqual( response.GetTags(), update.GetTags() )
+        
+        response = service.Request( HC.GET, 'content_update_package', { 'begin' : begin, 'subindex' : subindex, 'binary' : 1 } )
+        
+        self.assertEqual( response.GetTags(), update.GetTags() )
+        
+        for path_to_remove in ( path, json_path ):
+            
+            try: os.remove( path_to_remove )
+            except: pass
+            
         
         update = HydrusData.ClientToServerContentUpdatePackage( {}, hash_ids_to_hashes )
         
@@ -643,6 +643,32 @@ class TestTagParents( unittest.TestCase ):
         self.assertEqual( self._tag_parents_manager.ExpandTags( CC.COMBINED_TAG_SERVICE_KEY, tags ), results )
         
     
+    def test_delta( self ):
+        
+        HydrusGlobals.test_controller.SetRead( 'tag_parents', {} )
+        
+        tag_parents_manager = ClientCaches.TagParentsManager( HydrusGlobals.client_controller )
+        
+        tag_parents_manager.ApplyParentsDelta( { self._first_key : { 'delta_child' : { 'delta_mother' } } } )
+        
+        self.assertEqual( tag_parents_manager.GetParents( CC.COMBINED_TAG_SERVICE_KEY, 'delta_child' ), [ 'delta_mother' ] )
+        
+        tag_parents_manager.ApplyParentsDelta( { self._second_key : { 'delta_mother' : { 'delta_grandmother' } } } )
+        
+        self.assertEqual( set( tag_parents_manager.GetParents( CC.COMBINED_TAG_SERVICE_KEY, 'delta_child' ) ), { 'delta_mother', 'delta_grandmother' } )
+        self.assertEqual( tag_parents_manager.GetParents( self._first_key, 'delta_child' ), [ 'delta_mother' ] )
+        
+        tag_parents_manager.ApplyParentsDelta( { self._second_key : { 'delta_grandmother' : { 'delta_child' } } } )
+        
+        self.assertEqual( set( tag_parents_manager.GetParents( CC.COMBINED_TAG_SERVICE_KEY, 'delta_child' ) ), { 'delta_mother', 'delta_grandmother' } )
+        self.assertEqual( tag_parents_manager.GetParents( CC.COMBINED_TAG_SERVICE_KEY, 'delta_grandmother' ), [] )
+        
+        tag_parents_manager.ApplyParentsDelta( { self._first_key : { 'delta_child' : set() } } )
+        
+        self.assertEqual( tag_parents_manager.GetParents( CC.COMBINED_TAG_SERVICE_KEY, 'delta_child' ), [] )
+        self.assertEqual( tag_parents_manager.GetParents( CC.COMBINED_TAG_SERVICE_KEY, 'delta_grandmother' ), [ 'delta_child' ] )
+        
+    
     def test_grandparents( self ):
         
         self.assertEqual( set( self._tag_parents_manager.GetParents( CC.COMBINED_TAG_SERVICE_KEY, 'child' ) ), { 'mother', 'father', 'grandmother', 'grandfather' } )
@@ -801,6 +827,32 @@ class TestTagSiblings( unittest.TestCase ):
         self.assertEqual( self._tag_siblings_manager.CollapseTagsToCount( { 'chain_a' : 10, 'chain_b' : 5, 'chain_c' : 20 } ), { 'chain_c' : 35 } )
         
     
+    def test_delta( self ):
+        
+        HydrusGlobals.test_controller.SetRead( 'tag_siblings', {} )
+        
+        tag_siblings_manager = ClientCaches.TagSiblingsManager( HydrusGlobals.client_controller )
+        
+        tag_siblings_manager.ApplySiblingsDelta( { self._first_key : { 'delta_a' : { 'delta_b' } } } )
+        tag_siblings_manager.ApplySiblingsDelta( { self._second_key : { 'delta_b' : { 'delta_c' } } } )
+        
+        self.assertEqual( tag_siblings_manager.GetSibling( 'delta_a' ), 'delta_c' )
+        self.assertEqual( tag_siblings_manager.GetSibling( 'delta_b' ), 'delta_c' )
+        self.assertEqual( tag_siblings_manager.GetSibling( 'delta_c' ), None )
+        
+        self.assertEqual( set( tag_siblings_manager.GetAllSiblings( 'delta_a' ) ), set( [ 'delta_a', 'delta_b', 'delta_c' ] ) )
+        
+        tag_siblings_manager.ApplySiblingsDelta( { self._second_key : { 'delta_b' : set() } } )
+        
+        self.assertEqual( tag_siblings_manager.GetSibling( 'delta_a' ), 'delta_b' )
+        self.assertEqual( tag_siblings_manager.GetSibling( 'delta_b' ), None )
+        self.assertEqual( tag_siblings_manager.GetSibling( 'delta_c' ), None )
+        
+        self.assertEqual( set( tag_siblings_manager.GetAllSiblings( 'delta_c' ) ), set( [ 'delta_c' ] ) )
+        
+        self.assertEqual( tag_siblings_manager.CollapseTagsToCount( { 'delta_a' : 10, 'delta_b' : 5, 'delta_c' : 1 } ), { 'delta_b' : 15, 'delta_c' : 1 } )
+        
+    
     def test_deleted( self ):
         
         self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( 'dele' ) ), set() )
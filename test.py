@@ -286,13 +286,22 @@ class Controller( object ):
         
         if name == 'import_file':
             
-            ( path, ) = args
+            ( file_import_job, ) = args
             
-            with open( path, 'rb' ) as f: file = f.read()
+            with open( file_import_job.GetTempPath(), 'rb' ) as f: file = f.read()
             
             if file == 'blarg': raise Exception( 'File failed to import for some reason!' )
             else: return ( CC.STATUS_SUCCESSFUL, '0123456789abcdef'.decode( 'hex' ) )
             
+        elif name == 'import_files':
+            
+            ( file_import_jobs, ) = args
+            
+            for file_import_job in file_import_jobs:
+                
+                file_import_job.SetResult( CC.STATUS_SUCCESSFUL, '0123456789abcdef'.decode( 'hex' ) )
+                
+            
         
     
 if __name__ == '__main__':